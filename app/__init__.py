@@ -14,7 +14,16 @@ from app.database import db
 from app.models import User, Role, BusinessConfig
 from app.modules.cache import cache, init_cache, cached_business_config, cache_warmup
 from app.modules.performance import init_request_timing, setup_query_logging
+from app.modules.cpu_profiler import init_cpu_profiler
 from app.modules.logging_config import setup_structured_logging, init_correlation_id, init_request_logging
+from app.modules.task_wakeup import init_task_wakeup
+from app.modules.analytics_ingest import init_analytics_ingest
+from app.modules.message_broker import init_message_broker
+from app.modules.slot_cache import init_slot_cache
+from app.modules.blob_store import init_blob_store
+from app.modules.image_variants import init_image_variants
+from app.modules.search_index import init_search_index
+from app.modules.product_search import init_product_search
 from dotenv import load_dotenv
 import os
 import logging
@@ -69,6 +78,182 @@ def seed_business_config_command():
     db.session.commit()
     click.echo('Default business configuration seeded.')
 
+@click.command('seed-cron-tasks')
+@with_appcontext
+def seed_cron_tasks_command():
+    """Seed default scheduled tasks."""
+    from app.models import CronTask
+    default_crons = [
+        {
+            'name': 'Refresh analytics rollups',
+            'handler': 'refresh_analytics_rollups',
+            'schedule': '@every 15m',
+            'description': 'Aggregate closed hours of traffic into the analytics rollup tables'
+        },
+        {
+            'name': 'Purge stale uploads',
+            'handler': 'purge_stale_uploads',
+            'schedule': '@every 1h',
+            'description': 'Discard resumable uploads that stopped receiving chunks'
+        }
+    ]
+    for cron in default_crons:
+        if not CronTask.query.filter_by(name=cron['name']).first():
+            db.session.add(CronTask(**cron))
+    db.session.commit()
+    click.echo('Default cron tasks seeded.')
+
+@click.command('migrate-blobs')
+@click.option('--batch-size', default=100, show_default=True, help='Rows loaded and committed at a time.')
+@with_appcontext
+def migrate_blobs_command(batch_size):
+    """Move media and post image BLOBs from the database into the blob store."""
+    from app.modules.file_manager import migrate_blobs_to_store
+    counts = migrate_blobs_to_store(batch_size=batch_size, echo=click.echo)
+    click.echo(f"Moved {counts['media']} media file(s) and {counts['post_images']} post image(s).")
+
+@click.command('search-index')
+@click.argument('action', type=click.Choice(['rebuild']))
+@click.option('--index', 'names', multiple=True, help='Index to rebuild (default: all).')
+@click.option('--batch-size', default=500, show_default=True, help='Rows indexed and committed at a time.')
+@with_appcontext
+def search_index_command(action, names, batch_size):
+    """Create full-text search indexes and reindex existing rows."""
+    from app.modules.search_index import get_index, index_names
+    for name in names or index_names():
+        count = get_index(name).rebuild(batch_size=batch_size, echo=click.echo)
+        click.echo(f'Indexed {count} row(s) into {name}.')
+
+@click.command('refresh-product-stats')
+@click.option('--batch-size', default=500, show_default=True, help='Products refreshed and committed at a time.')
+@with_appcontext
+def refresh_product_stats_command(batch_size):
+    """Recompute product ratings, sales counts and attribute facets."""
+    from app.modules.product_search import refresh_all_products
+    count = refresh_all_products(batch_size=batch_size, echo=click.echo)
+    click.echo(f'Refreshed {count} product(s).')
+
+# CLI group for the performance benchmarks
+bench_cli = AppGroup('bench', help='Seed benchmark data and time hot paths against it.')
+
+@bench_cli.command('seed')
+@click.option('--scale', type=click.Choice(['small', 'medium', 'large']), default='small', show_default=True)
+@click.option('--seed', default=42, show_default=True, help='Random seed; the same seed gives the same rows.')
+@click.option('--count', 'counts', multiple=True, metavar='TABLE=N', help='Override a row count, e.g. page_views=50000.')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows inserted and committed at a time.')
+@click.option('--reset', is_flag=True, help='Drop and recreate every table first (benchmark databases only).')
+def bench_seed_command(scale, seed, counts, chunk_size, reset):
+    """Fill an empty database with a deterministic benchmark dataset."""
+    from app.modules.benchmark_data import current_dataset, seed_dataset
+    overrides = {}
+    for item in counts:
+        name, _, value = item.partition('=')
+        if not value.isdigit():
+            raise click.BadParameter(f"expected TABLE=N, got '{item}'", param_hint='--count')
+        overrides[name] = int(value)
+    if reset:
+        seeded = db.inspect(db.engine).has_table('user') and User.query.first() is not None
+        if seeded and current_dataset() is None:
+            raise click.ClickException('Refusing to reset a database that was not seeded by `flask bench seed`.')
+        db.drop_all()
+        db.create_all()
+    try:
+        dataset = seed_dataset(scale, seed, chunk_size=chunk_size, echo=click.echo, **overrides)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Seeded {dataset['scale']} dataset (seed {dataset['seed']}, digest {dataset['digest']}).")
+
+@bench_cli.command('run')
+@click.option('--scenario', 'names', multiple=True, help='Scenario to run (default: all).')
+@click.option('--iterations', default=10, show_default=True)
+@click.option('--warmup', default=2, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results JSON here.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Results JSON to compare against.')
+@click.option('--tolerance', default=0.2, show_default=True, help='Allowed slowdown or memory growth, as a fraction.')
+def bench_run_command(names, iterations, warmup, output, baseline, tolerance):
+    """Time the benchmark scenarios; exits non-zero on a regression against --baseline."""
+    import json
+    from app.modules.benchmarks import compare, run_benchmarks
+    try:
+        results = run_benchmarks(names, iterations=iterations, warmup=warmup, echo=click.echo)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo(f'Results written to {output}.')
+    if baseline:
+        with open(baseline) as f:
+            try:
+                regressions = compare(results, json.load(f), tolerance=tolerance)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+        for r in regressions:
+            click.echo(f"REGRESSION {r['scenario']} {r['metric']}: {r['baseline']} -> {r['current']}", err=True)
+        if regressions:
+            raise SystemExit(1)
+        click.echo(f'No regressions against {baseline}.')
+
+@bench_cli.command('load')
+@click.option('--users', default=10, show_default=True, help='Concurrent virtual users.')
+@click.option('--duration', default=30.0, show_default=True, help='Seconds of load after ramp-up.')
+@click.option('--ramp-up', default=0.0, show_default=True, help='Seconds over which users are started.')
+@click.option('--think-time', default=0.0, show_default=True, help='Mean pause between a user\'s steps, in seconds.')
+@click.option('--journey', 'journeys', multiple=True, metavar='NAME[=WEIGHT]', help='Journey mix (default: all).')
+@click.option('--target', type=click.Choice(['wsgi', 'gunicorn']), default='wsgi', show_default=True)
+@click.option('--workers', default=2, show_default=True, help='gunicorn workers.')
+@click.option('--threads', default=4, show_default=True, help='Threads per gunicorn worker.')
+@click.option('--seed', default=1, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the summary JSON here.')
+def bench_load_command(users, duration, ramp_up, think_time, journeys, target, workers, threads, seed, output):
+    """Drive concurrent virtual users through the app's main journeys."""
+    import json
+    from contextlib import nullcontext
+    from app.modules.benchmark_data import current_dataset
+    from app.modules.load_test import (StripeStub, HTTPClient, WSGIClient, discover_targets,
+                                       environment, gunicorn_server, offline_app, run_load_test)
+    weights = {}
+    for item in journeys:
+        name, _, weight = item.partition('=')
+        weights[name] = float(weight) if weight else 1.0
+    try:
+        targets = discover_targets()
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    app = current_app._get_current_object()
+    db.session.remove()
+
+    stub = StripeStub().start()
+    try:
+        if target == 'gunicorn':
+            server = gunicorn_server(stub.url, workers=workers, threads=threads)
+        else:
+            server = nullcontext()
+        with server as base_url, (offline_app(app, stub.url) if target == 'wsgi' else nullcontext()):
+            make_client = (lambda: HTTPClient(base_url)) if base_url else (lambda: WSGIClient(app))
+            click.echo(f'Running {users} user(s) for {duration:g}s against {base_url or "the WSGI app"}...')
+            summary = run_load_test(make_client, targets, users=users, duration=duration, ramp_up=ramp_up,
+                                    journeys=weights or None, think_time=think_time, seed=seed)
+    except (RuntimeError, ValueError) as e:
+        raise click.ClickException(str(e))
+    finally:
+        stub.stop()
+
+    summary['target'] = {'kind': target, 'workers': workers, 'threads': threads} if target == 'gunicorn' else {'kind': target}
+    summary['dataset'] = current_dataset()
+    summary['environment'] = environment()
+    for name, step in summary['steps'].items():
+        latency = step['latency_ms']
+        click.echo(f"{name:18} {step['requests']:6d} req {step['throughput_rps']:8.1f}/s  "
+                   f"p50 {latency['p50']:8.1f}  p95 {latency['p95']:8.1f}  p99 {latency['p99']:8.1f} ms  "
+                   f"errors {step['error_rate']:.1%}")
+    click.echo(f"Total: {summary['requests']} requests, {summary['throughput_rps']:.1f}/s, "
+               f"{summary['error_rate']:.1%} errors")
+    if output:
+        with open(output, 'w') as f:
+            json.dump(summary, f, indent=2)
+        click.echo(f'Summary written to {output}.')
+
 # Application factory
 def create_app(config_class=Config):
     app = Flask(__name__)
@@ -92,6 +277,11 @@ def create_app(config_class=Config):
     app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
     app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
 
+    # Send Stripe API calls to another host, e.g. the load test's local stub
+    if app.config.get('STRIPE_API_BASE'):
+        import stripe
+        stripe.api_base = app.config['STRIPE_API_BASE']
+
     # SQLAlchemy connection pooling options
     app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
         "pool_pre_ping": True,
@@ -101,7 +291,12 @@ def create_app(config_class=Config):
     # Register CLI commands
     app.cli.add_command(create_roles_command)
     app.cli.add_command(debug_cli)
+    app.cli.add_command(bench_cli)
     app.cli.add_command(seed_business_config_command)
+    app.cli.add_command(seed_cron_tasks_command)
+    app.cli.add_command(migrate_blobs_command)
+    app.cli.add_command(search_index_command)
+    app.cli.add_command(refresh_product_stats_command)
 
     from app.cli_worker import run_worker_command
     app.cli.add_command(run_worker_command)
@@ -148,10 +343,31 @@ def create_app(config_class=Config):
     # Initialize performance monitoring
     init_request_timing(app)
     setup_query_logging(app)
+    init_cpu_profiler(app)
     
     # Phase 24: Initialize observability
     init_correlation_id(app)
     init_request_logging(app)
+    
+    # Wake idle workers as soon as a task is enqueued
+    init_task_wakeup(app)
+    
+    # Page views are queued per request and written in batches
+    init_analytics_ingest(app)
+    
+    # New chat messages are pushed to SSE streams instead of polled for
+    init_message_broker(app)
+    
+    # Booking slot answers are cached until a booking write invalidates them
+    init_slot_cache(app)
+    
+    # Uploaded file content lives in the content-addressed blob store
+    init_blob_store(app)
+    init_image_variants(app)
+    
+    # Full-text indexes follow writes to the tables they cover
+    init_search_index(app)
+    init_product_search(app)
 
 
     # User loader for Flask-Login
@@ -456,26 +672,10 @@ def create_app(config_class=Config):
             return response
 
         try:
-            from app.models import PageView, VisitorSession
-            from app.modules.reporting import parse_user_agent
+            from app.modules.analytics_ingest import build_page_view_event, record_page_view
             from flask_login import current_user
-            import hashlib
             import uuid
             
-            ip_hash = hashlib.sha256(request.remote_addr.encode('utf-8')).hexdigest()
-            referrer = request.referrer
-            user_agent_str = request.user_agent.string
-            
-            # Parse UTM parameters
-            utm_source = request.args.get('utm_source')
-            utm_medium = request.args.get('utm_medium')
-            utm_campaign = request.args.get('utm_campaign')
-            utm_term = request.args.get('utm_term')
-            utm_content = request.args.get('utm_content')
-            
-            # Parse device info
-            device_info = parse_user_agent(user_agent_str)
-            
             # Get or create session token (stored in cookie)
             session_token = request.cookies.get('_vs_session')
             is_new_session = False
@@ -487,51 +687,8 @@ def create_app(config_class=Config):
             # Get user ID if authenticated
             user_id = current_user.id if current_user.is_authenticated else None
             
-            # Create page view record
-            view = PageView(
-                session_id=session_token,
-                user_id=user_id,
-                url=request.path,
-                referrer=referrer,
-                user_agent=user_agent_str[:500] if user_agent_str else None,
-                ip_hash=ip_hash,
-                utm_source=utm_source,
-                utm_medium=utm_medium,
-                utm_campaign=utm_campaign,
-                utm_term=utm_term,
-                utm_content=utm_content,
-                device_type=device_info['device_type'],
-                browser=device_info['browser'],
-                os=device_info['os']
-            )
-            db.session.add(view)
-            
-            # Update or create session
-            if is_new_session:
-                session = VisitorSession(
-                    session_token=session_token,
-                    user_id=user_id,
-                    ip_hash=ip_hash,
-                    entry_page=request.path,
-                    exit_page=request.path,
-                    referrer=referrer,
-                    utm_source=utm_source,
-                    utm_medium=utm_medium,
-                    utm_campaign=utm_campaign,
-                    device_type=device_info['device_type'],
-                    browser=device_info['browser'],
-                    os=device_info['os']
-                )
-                db.session.add(session)
-            else:
-                # Update existing session
-                session = VisitorSession.query.filter_by(session_token=session_token).first()
-                if session:
-                    session.update_activity(request.path)
-                    if user_id and not session.user_id:
-                        session.user_id = user_id
-            
-            db.session.commit()
+            # Written in batches by the ingestion buffer, off the request path
+            record_page_view(build_page_view_event(request, user_id, session_token, is_new_session))
             
             # Set session cookie if new
             if is_new_session:
@@ -545,7 +702,6 @@ def create_app(config_class=Config):
                 
         except Exception as e:
             app.logger.error(f"Failed to log page view: {e}")
-            db.session.rollback()
             
         return response
 
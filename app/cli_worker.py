@@ -3,7 +3,11 @@ from flask.cli import with_appcontext
 from app.worker import run_worker
 
 @click.command('run-worker')
+@click.option('--concurrency', '-c', default=1, show_default=True, type=click.IntRange(min=1), envvar='WORKER_CONCURRENCY',
+              help='Number of tasks to run in parallel threads in this process.')
+@click.option('--prefetch', '-p', default=None, type=click.IntRange(min=1), envvar='WORKER_PREFETCH',
+              help='Tasks to claim per round-trip into the local buffer (default 10).')
 @with_appcontext
-def run_worker_command():
+def run_worker_command(concurrency, prefetch):
     """Run the background worker."""
-    run_worker()
+    run_worker(concurrency=concurrency, prefetch=prefetch)
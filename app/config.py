@@ -7,11 +7,13 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', "sqlite:///mydatabase.sqlite").replace('postgres://', 'postgresql://')
 
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
+    MAIL_SEND_RATE = float(os.environ.get('MAIL_SEND_RATE', 25))  # Bulk sends, messages/second (0 = unthrottled)
     
     # Stripe
     STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY')
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
     STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+    STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')  # Point the Stripe client elsewhere, e.g. the load test's local stub
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
@@ -27,6 +29,35 @@ class Config:
     CACHE_TYPE = os.environ.get('CACHE_TYPE', 'SimpleCache')  # Use 'redis' for production
     CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 300))  # 5 minutes
     CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    SLOT_CACHE_TIMEOUT = int(os.environ.get('SLOT_CACHE_TIMEOUT', 300))  # Booking slots; writes invalidate sooner
+    
+    # File content storage (see app/modules/blob_store.py)
+    BLOB_STORAGE_BACKEND = os.environ.get('BLOB_STORAGE_BACKEND', 'local')  # local, or a dotted class path
+    BLOB_STORAGE_PATH = os.environ.get('BLOB_STORAGE_PATH')  # Defaults to <instance>/blobs
+    BLOB_ACCEL_REDIRECT_PREFIX = os.environ.get('BLOB_ACCEL_REDIRECT_PREFIX')  # e.g. /_blobs/ for nginx X-Accel-Redirect
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'  # Apache/lighttpd X-Sendfile
+    IMAGE_VARIANT_WIDTHS = [int(w) for w in os.environ.get('IMAGE_VARIANT_WIDTHS', '320,640,1280').split(',')]
+    IMAGE_VARIANT_FORMATS = os.environ.get('IMAGE_VARIANT_FORMATS', 'webp,jpeg').split(',')  # webp, jpeg, avif
+    
+    # Upload limits (see app/modules/uploads.py)
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_MB', 64)) * 1024 * 1024  # Any single request body; 413 above
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_MB', 8)) * 1024 * 1024  # Largest chunk of a resumable upload
+    CHUNKED_UPLOAD_MAX_SIZE = int(os.environ.get('CHUNKED_UPLOAD_MAX_MB', 2048)) * 1024 * 1024
+    UPLOAD_TEMP_PATH = os.environ.get('UPLOAD_TEMP_PATH')  # Part files of resumable uploads; defaults to <instance>/uploads
+    UPLOAD_EXPIRY_HOURS = int(os.environ.get('UPLOAD_EXPIRY_HOURS', 24))  # Idle resumable uploads are purged after this
+    
+    # Full-text search (see app/modules/search_index.py)
+    SEARCH_LANGUAGE = os.environ.get('SEARCH_LANGUAGE', 'english')  # Postgres text search configuration
+    
+    # Metrics (see app/modules/metrics_core.py)
+    METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')  # Shared by all gunicorn workers; empty it on service start
+    
+    # Log shipping to Loki/Elasticsearch/CloudWatch (see app/modules/advanced_observability.py)
+    LOG_SHIP_QUEUE_SIZE = int(os.environ.get('LOG_SHIP_QUEUE_SIZE', 10000))  # Records buffered per handler; newer ones are dropped when full
+    LOG_SHIP_BATCH_SIZE = int(os.environ.get('LOG_SHIP_BATCH_SIZE', 100))
+    LOG_SHIP_FLUSH_SECONDS = float(os.environ.get('LOG_SHIP_FLUSH_SECONDS', 5))
+    LOG_SPOOL_PATH = os.environ.get('LOG_SPOOL_PATH')  # Batches that could not be sent; defaults to <instance>/log-spool
+    LOG_SPOOL_MAX_MB = int(os.environ.get('LOG_SPOOL_MAX_MB', 64))
     
     # Flask-DebugToolbar Configuration (development only)
     DEBUG_TB_ENABLED = os.environ.get('DEBUG_TB_ENABLED', 'false').lower() == 'true'
@@ -42,4 +73,29 @@ class Config:
     COMPRESS_MIN_SIZE = 500  # Minimum size to compress (bytes)
     
     # Performance Settings
-    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD', 0.5))  # seconds
\ No newline at end of file
+    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD', 0.5))  # seconds
+    QUERY_PROFILE_SAMPLE_RATE = float(os.environ.get('QUERY_PROFILE_SAMPLE_RATE', 0))  # Share of requests profiled outside debug mode
+    QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5))  # Runs of one statement per request before it is reported as N+1
+    QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 20))  # Queries per request; override per view with @query_budget
+    
+    # Sampling CPU profiler (see app/modules/cpu_profiler.py)
+    CPU_PROFILE_ENABLED = os.environ.get(
+        'CPU_PROFILE_ENABLED', 'false' if os.environ.get('TESTING', '').lower() == 'true' else 'true'
+    ).lower() == 'true'  # Off by default under the test suite
+    CPU_PROFILE_INTERVAL_MS = float(os.environ.get('CPU_PROFILE_INTERVAL_MS', 10))  # Time between stack samples
+    CPU_PROFILE_SLOW_MS = int(os.environ.get('CPU_PROFILE_SLOW_MS', 1000))  # Keep profiles of requests slower than this; 0 keeps only requested ones
+    CPU_PROFILE_TOKEN = os.environ.get('CPU_PROFILE_TOKEN')  # X-Profile-Token value that requests a profile without an admin session
+    CPU_PROFILE_PATH = os.environ.get('CPU_PROFILE_PATH')  # Defaults to <instance>/profiles
+    CPU_PROFILE_KEEP = int(os.environ.get('CPU_PROFILE_KEEP', 200))  # Newest profiles kept on disk
+    
+    # Rate limiting (Flask-Limiter reads this); load tests turn it off
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true').lower() == 'true'
+    
+    # Page-view ingestion buffer
+    PAGE_VIEW_BUFFER_SIZE = int(os.environ.get('PAGE_VIEW_BUFFER_SIZE', 10000))  # Max queued events; newer ones are dropped beyond this
+    PAGE_VIEW_BATCH_SIZE = int(os.environ.get('PAGE_VIEW_BATCH_SIZE', 500))  # Flush after this many events...
+    PAGE_VIEW_FLUSH_MS = int(os.environ.get('PAGE_VIEW_FLUSH_MS', 1000))  # ...or this many milliseconds
+    
+    # Real-time messaging fan-out
+    MESSAGE_BROKER_BACKEND = os.environ.get('MESSAGE_BROKER_BACKEND', 'local')  # local, postgres, or a dotted class path
+    MESSAGE_BROKER_QUEUE_SIZE = int(os.environ.get('MESSAGE_BROKER_QUEUE_SIZE', 256))  # Per-stream backlog before it resyncs
\ No newline at end of file
@@ -395,8 +395,11 @@ class Post(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     is_published = db.Column(db.Boolean, default=False, nullable=False)
-    image = db.Column(db.LargeBinary, nullable=True)  # Store image as BLOB
+    image = db.deferred(db.Column(db.LargeBinary, nullable=True))  # Legacy BLOB, moved to the blob store by `flask migrate-blobs`
     image_mime_type = db.Column(db.String(50), nullable=True)  # Store MIME type (e.g., image/png)
+    image_checksum = db.Column(db.String(64), nullable=True)  # Blob store address of the image
+    # Hero image in the store or, before migration, the database; loaded with the row, without the BLOB
+    has_image = db.column_property(db.or_(image_checksum.isnot(None), image.expression.isnot(None)))
     
     # Phase 3: Blog Platform Enhancement fields
     blog_category_id = db.Column(db.Integer, db.ForeignKey('blog_category.id'), nullable=True)
@@ -415,6 +418,12 @@ class Post(db.Model):
         Index('idx_post_publish_at', 'publish_at'),  # Phase 3: For scheduled publishing queries
     )
     
+    @property
+    def image_version(self):
+        """?v= value for image URLs, making them content-addressed (None before migration)."""
+        from app.modules.blob_store import blob_version
+        return blob_version(self.image_checksum)
+    
     def calculate_read_time(self):
         """Calculate estimated read time in minutes based on content word count."""
         if self.content:
@@ -595,16 +604,51 @@ Post.additional_authors = db.relationship('User', secondary=post_authors, backre
 class Media(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255))
-    data = db.Column(db.LargeBinary)  # The file content
+    data = db.deferred(db.Column(db.LargeBinary))  # Legacy content; new uploads live in the blob store under checksum
     mimetype = db.Column(db.String(100))
     size = db.Column(db.Integer)
-    checksum = db.Column(db.String(64))
+    checksum = db.Column(db.String(64), index=True)  # SHA-256, the blob store address
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
     def __repr__(self):
         return f'<Media {self.filename}>'
 
+class ImageVariant(db.Model):
+    """A resized/re-encoded copy of a stored image, for responsive srcsets."""
+    __tablename__ = 'image_variant'
+    id = db.Column(db.Integer, primary_key=True)
+    source_checksum = db.Column(db.String(64), nullable=False)  # Blob store address of the original
+    width = db.Column(db.Integer, nullable=False)  # Width bucket (the variant is never wider than the source)
+    format = db.Column(db.String(10), nullable=False)  # webp, jpeg, avif
+    checksum = db.Column(db.String(64), nullable=False)  # Blob store address of the variant
+    size = db.Column(db.Integer)
+    pixel_width = db.Column(db.Integer)
+    pixel_height = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('source_checksum', 'width', 'format', name='uq_image_variant_spec'),
+    )
+
+    def __repr__(self):
+        return f'<ImageVariant {self.source_checksum[:12]} {self.width}w {self.format}>'
+
+class ChunkedUpload(db.Model):
+    """A resumable upload in progress; the bytes received so far are in a part file."""
+    __tablename__ = 'chunked_upload'
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, also the part file name
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    mimetype = db.Column(db.String(100))
+    total_size = db.Column(db.BigInteger, nullable=False)  # Declared up front
+    received = db.Column(db.BigInteger, default=0, nullable=False)  # Committed offset
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ChunkedUpload {self.id} {self.received}/{self.total_size}>'
+
 class Page(db.Model):
     """Content page with staging workflow and SEO features."""
     __tablename__ = 'page'
@@ -839,7 +883,45 @@ class Channel(db.Model):
         
         # Public channels without restriction: all authenticated users
         return True
-    
+
+    @classmethod
+    def access_filter(cls, user):
+        """
+        SQL condition equivalent to can_user_access(user), so the channels a
+        user can read are resolved in one query instead of one check per channel.
+        """
+        if not user or not user.is_authenticated:
+            return sqlalchemy.false()
+
+        channel_type = func.coalesce(cls.type, '')
+        members_only = sqlalchemy.or_(channel_type.in_(('private', 'direct')), cls.is_direct.is_(True))
+        is_member = sqlalchemy.exists().where(
+            channel_members.c.channel_id == cls.id,
+            channel_members.c.user_id == user.id
+        )
+
+        user_role_names = [role.name.lower() for role in user.roles]
+        if 'admin' in user_role_names:
+            role_allowed = sqlalchemy.true()
+        else:
+            # allowed_roles is a JSON list; match each role as a quoted element
+            roles_text = func.lower(sqlalchemy.cast(cls.allowed_roles, db.Text))
+            restricted = sqlalchemy.and_(
+                channel_type == 'public',
+                cls.is_restricted.is_(True),
+                cls.allowed_roles.isnot(None),
+                roles_text.notin_(('[]', 'null'))
+            )
+            role_allowed = sqlalchemy.or_(
+                sqlalchemy.not_(restricted),
+                *(roles_text.contains(json.dumps(name), autoescape=True) for name in user_role_names)
+            )
+
+        return sqlalchemy.or_(
+            sqlalchemy.and_(members_only, is_member),
+            sqlalchemy.and_(sqlalchemy.not_(members_only), role_allowed)
+        )
+
     @staticmethod
     def can_user_create_channels(user):
         """
@@ -1443,9 +1525,14 @@ class Task(db.Model):
     # Phase 8: Priority field (higher = processed first)
     priority = db.Column(db.Integer, default=0)  # -10=low, 0=normal, 10=high
     
+    # Claim lease: which worker owns a 'processing' task and until when
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)  # Past this, another worker may reclaim
+    
     __table_args__ = (
         Index('idx_task_status_priority', 'status', 'priority'),
         Index('idx_task_next_retry', 'next_retry_at'),
+        Index('idx_task_status_locked_until', 'status', 'locked_until'),
     )
 
     def __repr__(self):
@@ -1461,6 +1548,11 @@ class Task(db.Model):
     def should_move_to_dead_letter(self):
         """Check if task should be moved to dead letter queue."""
         return self.retry_count >= self.max_retries
+    
+    def release_lease(self):
+        """Clear the worker claim once the task leaves the 'processing' state."""
+        self.locked_by = None
+        self.locked_until = None
 
 
 class CronTask(db.Model):
@@ -1513,9 +1605,13 @@ class Newsletter(db.Model):
     content = db.Column(db.Text, nullable=False) # Markdown or text
     full_html = db.Column(db.Text, nullable=True) # Rendered HTML
     sent_at = db.Column(db.DateTime, nullable=True)
-    status = db.Column(db.String(20), default='draft') # draft, queued, sent
+    status = db.Column(db.String(20), default='draft') # draft, queued, sending, sent
     recipient_tags = db.Column(db.JSON, default=list)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Broadcast checkpoint: last recipient email delivered (recipients go out in email order)
+    delivery_cursor = db.Column(db.String(120), nullable=True)
+    delivered_count = db.Column(db.Integer, default=0)
 
 class PageView(db.Model):
     """Enhanced page view tracking with session and UTM support."""
@@ -1587,13 +1683,42 @@ class Product(db.Model):
     is_subscription = db.Column(db.Boolean, default=False)
     stripe_price_id = db.Column(db.String(100), nullable=True)  # For recurring billing
 
+    # Denormalized from approved reviews and sold order items (see app/modules/product_search.py)
+    avg_rating = db.Column(db.Float, default=0, nullable=False)
+    review_count = db.Column(db.Integer, default=0, nullable=False)
+    units_sold = db.Column(db.Integer, default=0, nullable=False)
+
     # Relationships
     image = db.relationship('Media', foreign_keys=[media_id])
     file = db.relationship('Media', foreign_keys=[file_id])
+    category = db.relationship('Category', foreign_keys=[category_id])
+
+    __table_args__ = (
+        Index('idx_product_category', 'category_id'),
+        Index('idx_product_units_sold', 'units_sold'),
+        Index('idx_product_rating', 'avg_rating', 'review_count'),
+    )
 
     def __repr__(self):
         return f'<Product {self.name}>'
 
+
+class ProductFacetValue(db.Model):
+    """An attribute value offered by a product's active variants, for faceted search."""
+    __tablename__ = 'product_facet_value'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    attribute = db.Column(db.String(100), nullable=False)  # Variant attribute key, e.g. "color"
+    value = db.Column(db.String(100), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'attribute', 'value', name='uq_product_facet_value'),
+        Index('idx_facet_attribute_value', 'attribute', 'value'),
+    )
+
+    def __repr__(self):
+        return f'<ProductFacetValue product={self.product_id} {self.attribute}={self.value}>'
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True) # Nullable for guest checkout
@@ -1859,6 +1984,7 @@ class DownloadLog(db.Model):
     ip_hash = db.Column(db.String(64), nullable=True)
     user_agent = db.Column(db.String(200), nullable=True)
     downloaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    resumed = db.Column(db.Boolean, default=False)  # Range request continuing a counted download
     
     download_token = db.relationship('DownloadToken', backref='logs')
     user = db.relationship('User')
@@ -1977,6 +2103,27 @@ class EmailTemplate(db.Model):
         Index('idx_email_template_active', 'is_active'),
     )
 
+    @staticmethod
+    def substitute(text, context, schema=None):
+        """Replace {{name}} placeholders from context.
+        
+        Schema variables missing from context (or None there) take their
+        schema default; other None values render as ''.
+        """
+        if not text:
+            return ''
+        result = text
+        # First apply schema defaults
+        for var_name, var_config in (schema or {}).items():
+            value = context.get(var_name)
+            if value is None:
+                value = var_config.get('default', '')
+            result = result.replace('{{' + var_name + '}}', str(value))
+        # Then apply any additional context
+        for key, value in context.items():
+            result = result.replace('{{' + key + '}}', '' if value is None else str(value))
+        return result
+
     def render(self, context):
         """Render template with context dict replacing placeholders.
         
@@ -1984,21 +2131,8 @@ class EmailTemplate(db.Model):
         """
         schema = self.variables_schema or {}
         
-        # Helper to apply substitutions
         def substitute(text):
-            if not text:
-                return ''
-            result = text
-            # First apply schema defaults
-            for var_name, var_config in schema.items():
-                placeholder = '{{' + var_name + '}}'
-                value = context.get(var_name, var_config.get('default', ''))
-                result = result.replace(placeholder, str(value))
-            # Then apply any additional context
-            for key, value in context.items():
-                placeholder = '{{' + key + '}}'
-                result = result.replace(placeholder, str(value))
-            return result
+            return EmailTemplate.substitute(text, context, schema)
         
         rendered_subject = substitute(self.subject)
         
@@ -2016,17 +2150,7 @@ class EmailTemplate(db.Model):
         schema = self.variables_schema or {}
         
         def substitute(text):
-            if not text:
-                return ''
-            result = text
-            for var_name, var_config in schema.items():
-                placeholder = '{{' + var_name + '}}'
-                value = context.get(var_name, var_config.get('default', ''))
-                result = result.replace(placeholder, str(value))
-            for key, value in context.items():
-                placeholder = '{{' + key + '}}'
-                result = result.replace(placeholder, str(value))
-            return result
+            return EmailTemplate.substitute(text, context, schema)
         
         return (
             substitute(self.subject),
@@ -2861,6 +2985,67 @@ class VisitorSession(db.Model):
         return f'<VisitorSession {self.session_token[:8]}... pages={self.pages_viewed}>'
 
 
+class TrafficRollup(db.Model):
+    """Hourly and daily pre-aggregated traffic, maintained by the refresh_analytics_rollups task.
+    
+    Page views are counted under their URL; sessions, bounces and durations
+    under the session's entry page.
+    """
+    __tablename__ = 'traffic_rollup'
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(5), nullable=False)  # hour, day
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    
+    # Dimensions
+    url = db.Column(db.String(500), nullable=True)
+    utm_source = db.Column(db.String(100), nullable=True)
+    utm_medium = db.Column(db.String(100), nullable=True)
+    device_type = db.Column(db.String(20), nullable=True)
+    browser = db.Column(db.String(50), nullable=True)
+    
+    # Measures
+    page_views = db.Column(db.Integer, default=0)
+    sessions = db.Column(db.Integer, default=0)
+    bounces = db.Column(db.Integer, default=0)
+    duration_sum = db.Column(db.BigInteger, default=0)  # Seconds, over sessions with a duration
+    duration_count = db.Column(db.Integer, default=0)
+    
+    __table_args__ = (
+        Index('idx_traffic_rollup_bucket', 'granularity', 'bucket_start'),
+    )
+    
+    def __repr__(self):
+        return f'<TrafficRollup {self.granularity} {self.bucket_start} {self.url}>'
+
+
+class TrafficSketch(db.Model):
+    """Hourly and daily HyperLogLog sketches of distinct sessions, visitors (ip_hash) and users."""
+    __tablename__ = 'traffic_sketch'
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(5), nullable=False)  # hour, day
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    metric = db.Column(db.String(20), nullable=False)  # sessions, visitors, users
+    registers = db.Column(db.LargeBinary, nullable=False)  # HyperLogLog.to_bytes()
+
+    __table_args__ = (
+        Index('idx_traffic_sketch_bucket', 'metric', 'granularity', 'bucket_start'),
+    )
+
+    def __repr__(self):
+        return f'<TrafficSketch {self.metric} {self.granularity} {self.bucket_start}>'
+
+
+class RollupWatermark(db.Model):
+    """High-water mark for incremental rollups: every hour before it has been aggregated."""
+    __tablename__ = 'rollup_watermark'
+    name = db.Column(db.String(50), primary_key=True)
+    high_water = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<RollupWatermark {self.name} {self.high_water}>'
+
+
 class ConversionGoal(db.Model):
     """Define conversion goals for tracking."""
     __tablename__ = 'conversion_goal'
@@ -3153,6 +3338,11 @@ class EmailCampaign(db.Model):
     subject_line_b = db.Column(db.String(200), nullable=True)  # Variant B
     ab_test_percentage = db.Column(db.Integer, default=0)  # 0 = no A/B test
     
+    # Sharded delivery (updated by worker); generation changes on each send/resume
+    send_generation = db.Column(db.Integer, default=0)
+    shard_count = db.Column(db.Integer, default=0)
+    shards_completed = db.Column(db.BigInteger, default=0)  # Bitmask of finished shard ids
+    
     # Stats (updated by worker)
     sent_count = db.Column(db.Integer, default=0)
     delivered_count = db.Column(db.Integer, default=0)
@@ -3238,6 +3428,7 @@ class EmailSend(db.Model):
     __table_args__ = (
         Index('idx_email_send_campaign', 'campaign_id'),
         Index('idx_email_send_recipient', 'recipient_email'),
+        Index('idx_email_send_campaign_recipient', 'campaign_id', 'recipient_email'),
         Index('idx_email_send_sent', 'sent_at'),
         Index('idx_email_send_token', 'tracking_token'),
     )
@@ -4047,6 +4238,16 @@ class ResourceBooking(db.Model):
         return f'<ResourceBooking {self.resource_id} {self.start_time}-{self.end_time}>'
 
 
+class SlotCacheVersion(db.Model):
+    """Version counter for one scope of cached booking slots, bumped in the writing transaction."""
+    __tablename__ = 'slot_cache_version'
+    scope = db.Column(db.String(60), primary_key=True)  # all, any, e:<estimator>, e:<estimator>:<date>, d:<date>
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<SlotCacheVersion {self.scope} {self.version}>'
+
+
 class Waitlist(db.Model):
     """Track customers waiting for appointment slots."""
     __tablename__ = 'waitlist'
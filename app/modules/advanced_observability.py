@@ -10,10 +10,15 @@ Provides:
 """
 
 import os
+import copy
+import gzip
 import json
 import logging
 import socket
+import threading
 import time
+import weakref
+from collections import defaultdict, deque
 from datetime import datetime, timezone
 from functools import wraps
 
@@ -26,7 +31,308 @@ logger = logging.getLogger(__name__)
 # Log Aggregation Handlers
 # ============================================================================
 
-class LokiHandler(logging.Handler):
+class ShippingHandler(logging.Handler):
+    """
+    Base for handlers that ship logs to a remote backend.
+    
+    emit() only copies the record and appends it to a bounded in-memory
+    queue; a background shipper thread formats, batches and sends:
+    
+    - A batch goes out every `batch_size` records or `flush_interval`
+      seconds, serialized by the subclass and gzip-compressed
+    - Failed sends are retried with exponential backoff. A batch that still
+      fails is spooled to a file under `spool_dir`, and later batches go
+      straight to the spool until a retry succeeds; the spool is then
+      replayed oldest first. The spool is capped at `spool_max_bytes`
+    - When the queue is full, new records are dropped and counted
+    - Outcomes are counted on the handler (stats()) and in
+      metrics_collector, so /metrics covers every worker in multi-process
+      mode; the queue depth is reported per process
+    - close() (run by logging.shutdown at exit) stops the thread and sends
+      or spools whatever is still queued
+    - A forked child starts with an empty queue and its own shipper
+    
+    Subclasses set `target` and implement _build(), _serialize() and
+    _deliver().
+    """
+    
+    target = None
+    
+    def __init__(self, queue_size=10000, batch_size=100, flush_interval=5,
+                 max_retries=3, retry_backoff=0.5, max_backoff=60,
+                 spool_dir=None, spool_max_bytes=64 * 1024 * 1024):
+        super().__init__()
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.spool_dir = os.path.join(spool_dir, self.target) if spool_dir else None
+        self.spool_max_bytes = spool_max_bytes
+        
+        # deque append/popleft are atomic, so emit() never takes a lock
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._ship_lock = threading.Lock()
+        self._thread = None
+        self._spool_seq = 0
+        self._backoff = 0
+        self._retry_at = 0
+        
+        self.shipped = 0
+        self.dropped = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.failures = 0
+        # Resolved here rather than on first use, which may be inside emit()
+        from app.routes.admin_routes.observability import metrics_collector
+        self._metrics = metrics_collector
+        _shipping_handlers.add(self)
+    
+    # -- request path ------------------------------------------------------
+    
+    def emit(self, record):
+        if self._thread is not None and threading.current_thread() is self._thread:
+            return  # Records logged while shipping (e.g. by urllib3) would loop back here
+        if len(self._queue) >= self.queue_size:
+            self._count('dropped')
+            return
+        try:
+            # Render the message now: args may be mutated once the caller moves on
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+            if has_request_context():
+                record.request_id = getattr(g, 'request_id', None)
+                record._ship_request = {
+                    'method': request.method,
+                    'path': request.path,
+                    'ip': request.remote_addr,
+                }
+            if self._thread is None:
+                self._start()
+            self._queue.append(record)
+            if len(self._queue) >= self.batch_size:
+                self._wakeup.set()
+        except Exception:
+            self.handleError(record)
+    
+    def pending(self):
+        return len(self._queue)
+    
+    def stats(self):
+        return {
+            'queued': len(self._queue),
+            'shipped': self.shipped,
+            'dropped': self.dropped,
+            'spooled': self.spooled,
+            'replayed': self.replayed,
+            'failures': self.failures,
+        }
+    
+    def _count(self, outcome, amount=1):
+        setattr(self, outcome, getattr(self, outcome) + amount)
+        self._metrics.record_log_shipping(self.target, outcome, amount)
+    
+    # -- shipper thread ----------------------------------------------------
+    
+    def _start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=f'log-shipper-{self.target}', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.ship()
+            except Exception:
+                self._count('failures')
+    
+    def ship(self, retry=True):
+        """Send everything queued, in batches. Returns the number of records sent."""
+        sent = 0
+        with self._ship_lock:
+            while self._queue:
+                records = []
+                while self._queue and len(records) < self.batch_size:
+                    records.append(self._queue.popleft())
+                entries = []
+                for record in records:
+                    try:
+                        entries.append(self._build(record))
+                    except Exception:
+                        self._count('dropped')
+                if not entries:
+                    continue
+                body = gzip.compress(self._serialize(entries))
+                if self._send(body, len(entries), retry):
+                    sent += len(entries)
+                    self._replay_spool()
+                else:
+                    self._spool(body, len(entries))
+            if not sent and self._retry_due():
+                # Nothing new to send, but the backend may be back for the spool
+                self._replay_spool()
+        return sent
+    
+    def _retry_due(self):
+        return time.time() >= self._retry_at
+    
+    def _send(self, body, count, retry=True):
+        """Deliver one gzipped batch, retrying with backoff. False if it failed."""
+        if not self._retry_due():
+            return False
+        attempts = self.max_retries + 1 if retry else 1
+        for attempt in range(attempts):
+            try:
+                self._deliver(body)
+            except Exception:
+                self._count('failures')
+                if attempt + 1 < attempts and not self._stopping.is_set():
+                    time.sleep(self.retry_backoff * (2 ** attempt))
+                continue
+            self._count('shipped', count)
+            self._backoff = 0
+            self._retry_at = 0
+            return True
+        # Sustained failure: stop trying for a while, doubling the pause each time
+        self._backoff = min(self.max_backoff, max(self._backoff * 2, self.retry_backoff * 2 ** attempts))
+        self._retry_at = time.time() + self._backoff
+        return False
+    
+    def _spool(self, body, count):
+        if not self.spool_dir:
+            self._count('dropped', count)
+            return
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            if self._spool_size() + len(body) > self.spool_max_bytes:
+                self._count('dropped', count)
+                return
+            self._spool_seq += 1
+            name = f'{time.time():017.6f}-{os.getpid()}-{self._spool_seq:06d}-{count}.gz'
+            tmp_path = os.path.join(self.spool_dir, f'.{name}.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, os.path.join(self.spool_dir, name))
+            self._count('spooled', count)
+        except OSError:
+            self._count('dropped', count)
+    
+    def _spool_size(self):
+        total = 0
+        for entry in os.scandir(self.spool_dir):
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                pass
+        return total
+    
+    def _replay_spool(self):
+        """Send spooled batches oldest first; stop at the first failure."""
+        if not self.spool_dir or not os.path.isdir(self.spool_dir):
+            return
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith('.gz'):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            claimed = f'{path}.{os.getpid()}.sending'
+            try:
+                # Other workers share the spool; the rename decides who sends a file
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            with open(claimed, 'rb') as f:
+                body = f.read()
+            count = int(name[:-3].rsplit('-', 1)[-1])
+            if not self._send(body, count, retry=False):
+                os.rename(claimed, path)
+                return
+            os.remove(claimed)
+            self._count('replayed', count)
+    
+    def close(self):
+        """Stop the shipper and send (or spool) whatever is still queued."""
+        self._stopping.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(self.flush_interval + 5)
+        self._thread = None
+        if self._queue:
+            try:
+                self.ship(retry=False)
+            except Exception:
+                pass
+        _shipping_handlers.discard(self)
+        super().close()
+    
+    # -- subclass hooks ----------------------------------------------------
+    
+    def _build(self, record):
+        """One log entry (any JSON-serializable value) for `record`."""
+        raise NotImplementedError
+    
+    def _serialize(self, entries):
+        """Uncompressed request body (bytes) for a batch of entries."""
+        raise NotImplementedError
+    
+    def _deliver(self, body):
+        """Send a gzipped body; raise on failure."""
+        raise NotImplementedError
+    
+    def _post(self, url, body, content_type, timeout, auth=None):
+        import requests
+        
+        response = requests.post(
+            url,
+            data=body,
+            headers={'Content-Type': content_type, 'Content-Encoding': 'gzip'},
+            auth=auth,
+            timeout=timeout
+        )
+        response.raise_for_status()
+
+
+# Live shipping handlers, for /metrics
+_shipping_handlers = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    # The parent ships what it queued before the fork, and its shipper
+    # thread (and any lock it held) does not exist in the child
+    for handler in list(_shipping_handlers):
+        handler._queue.clear()
+        handler._start_lock = threading.Lock()
+        handler._ship_lock = threading.Lock()
+        handler._wakeup = threading.Event()
+        handler._stopping = threading.Event()
+        handler._thread = None
+        handler.shipped = handler.dropped = handler.spooled = handler.replayed = handler.failures = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def log_queue_depths():
+    """{target: records queued} summed over this process's shipping handlers."""
+    depths = defaultdict(int)
+    for handler in list(_shipping_handlers):
+        depths[handler.target] += handler.pending()
+    return dict(depths)
+
+
+class LokiHandler(ShippingHandler):
     """
     Logging handler that sends logs to Grafana Loki.
     
@@ -35,8 +341,10 @@ class LokiHandler(logging.Handler):
     - LOKI_LABELS: Additional labels as JSON (e.g., {"env": "prod"})
     """
     
-    def __init__(self, url=None, labels=None):
-        super().__init__()
+    target = 'loki'
+    
+    def __init__(self, url=None, labels=None, **options):
+        super().__init__(**options)
         self.url = url or os.environ.get('LOKI_URL')
         self.labels = labels or {}
         
@@ -51,80 +359,42 @@ class LokiHandler(logging.Handler):
         # Add default labels
         self.labels.setdefault('app', 'verso-backend')
         self.labels.setdefault('hostname', socket.gethostname())
-        
-        self._batch = []
-        self._batch_size = 100
-        self._last_flush = time.time()
-        self._flush_interval = 5  # seconds
     
     def emit(self, record):
-        if not self.url:
-            return
-        
-        try:
-            # Format log entry
-            timestamp_ns = int(time.time() * 1e9)
-            
-            log_entry = {
-                'level': record.levelname,
-                'logger': record.name,
-                'message': self.format(record),
-                'module': record.module,
-                'function': record.funcName,
-            }
-            
-            # Add request context if available
-            if has_request_context():
-                log_entry['request_id'] = getattr(g, 'request_id', None)
-                log_entry['path'] = request.path
-            
-            # Add to batch
-            self._batch.append([str(timestamp_ns), json.dumps(log_entry)])
-            
-            # Flush if batch is full or interval elapsed
-            if len(self._batch) >= self._batch_size or \
-               time.time() - self._last_flush > self._flush_interval:
-                self._flush()
-                
-        except Exception:
-            self.handleError(record)
+        if self.url:
+            super().emit(record)
     
-    def _flush(self):
-        """Send batched logs to Loki."""
-        if not self._batch:
-            return
+    def _build(self, record):
+        log_entry = {
+            'level': record.levelname,
+            'logger': record.name,
+            'message': self.format(record),
+            'module': record.module,
+            'function': record.funcName,
+        }
         
-        try:
-            import requests
-            
-            # Build Loki push payload
-            payload = {
-                'streams': [{
-                    'stream': self.labels,
-                    'values': self._batch
-                }]
-            }
-            
-            requests.post(
-                self.url,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=5
-            )
-        except Exception as e:
-            # Don't fail the application if Loki is down
-            pass
-        finally:
-            self._batch = []
-            self._last_flush = time.time()
+        # Add request context if available
+        context = getattr(record, '_ship_request', None)
+        if context:
+            log_entry['request_id'] = getattr(record, 'request_id', None)
+            log_entry['path'] = context['path']
+        
+        return [str(int(record.created * 1e9)), json.dumps(log_entry)]
     
-    def close(self):
-        """Flush remaining logs on handler close."""
-        self._flush()
-        super().close()
+    def _serialize(self, entries):
+        # Build Loki push payload
+        return json.dumps({
+            'streams': [{
+                'stream': self.labels,
+                'values': entries
+            }]
+        }).encode('utf-8')
+    
+    def _deliver(self, body):
+        self._post(self.url, body, 'application/json', timeout=5)
 
 
-class ElasticsearchHandler(logging.Handler):
+class ElasticsearchHandler(ShippingHandler):
     """
     Logging handler that sends logs to Elasticsearch/OpenSearch.
     
@@ -135,97 +405,62 @@ class ElasticsearchHandler(logging.Handler):
     - ELASTICSEARCH_PASSWORD: Optional password
     """
     
-    def __init__(self, url=None, index_prefix='verso-logs'):
-        super().__init__()
+    target = 'elasticsearch'
+    
+    def __init__(self, url=None, index_prefix='verso-logs', **options):
+        super().__init__(**options)
         self.url = url or os.environ.get('ELASTICSEARCH_URL')
         self.index_prefix = os.environ.get('ELASTICSEARCH_INDEX', index_prefix)
         self.username = os.environ.get('ELASTICSEARCH_USERNAME')
         self.password = os.environ.get('ELASTICSEARCH_PASSWORD')
-        
-        self._batch = []
-        self._batch_size = 100
-        self._last_flush = time.time()
-        self._flush_interval = 5
+        self._hostname = socket.gethostname()
     
     def emit(self, record):
-        if not self.url:
-            return
-        
-        try:
-            # Format log document
-            doc = {
-                '@timestamp': datetime.now(timezone.utc).isoformat(),
-                'level': record.levelname,
-                'logger': record.name,
-                'message': self.format(record),
-                'module': record.module,
-                'function': record.funcName,
-                'line': record.lineno,
-                'hostname': socket.gethostname(),
-                'app': 'verso-backend',
-            }
-            
-            # Add request context
-            if has_request_context():
-                doc['request'] = {
-                    'id': getattr(g, 'request_id', None),
-                    'method': request.method,
-                    'path': request.path,
-                    'ip': request.remote_addr,
-                }
-            
-            # Add exception if present
-            if record.exc_info:
-                doc['exception'] = self.formatException(record.exc_info)
-            
-            self._batch.append(doc)
-            
-            if len(self._batch) >= self._batch_size or \
-               time.time() - self._last_flush > self._flush_interval:
-                self._flush()
-                
-        except Exception:
-            self.handleError(record)
+        if self.url:
+            super().emit(record)
     
-    def _flush(self):
-        """Send batched logs to Elasticsearch."""
-        if not self._batch:
-            return
+    def _build(self, record):
+        created = datetime.fromtimestamp(record.created, timezone.utc)
+        doc = {
+            '@timestamp': created.isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': self.format(record),
+            'module': record.module,
+            'function': record.funcName,
+            'line': record.lineno,
+            'hostname': self._hostname,
+            'app': 'verso-backend',
+        }
         
-        try:
-            import requests
-            
-            # Build bulk request body
-            index_name = f"{self.index_prefix}-{datetime.utcnow().strftime('%Y.%m.%d')}"
-            
-            bulk_body = ''
-            for doc in self._batch:
-                bulk_body += json.dumps({'index': {'_index': index_name}}) + '\n'
-                bulk_body += json.dumps(doc) + '\n'
-            
-            auth = None
-            if self.username and self.password:
-                auth = (self.username, self.password)
-            
-            requests.post(
-                f'{self.url}/_bulk',
-                data=bulk_body,
-                headers={'Content-Type': 'application/x-ndjson'},
-                auth=auth,
-                timeout=10
-            )
-        except Exception:
-            pass
-        finally:
-            self._batch = []
-            self._last_flush = time.time()
+        # Add request context
+        context = getattr(record, '_ship_request', None)
+        if context:
+            doc['request'] = dict(context, id=getattr(record, 'request_id', None))
+        
+        # Add exception if present
+        if record.exc_info:
+            doc['exception'] = self.formatException(record.exc_info)
+        
+        # Index by the day the record was logged, not the day it was shipped
+        return [f"{self.index_prefix}-{created.strftime('%Y.%m.%d')}", doc]
     
-    def close(self):
-        self._flush()
-        super().close()
+    def _serialize(self, entries):
+        # Build bulk request body
+        lines = []
+        for index_name, doc in entries:
+            lines.append(json.dumps({'index': {'_index': index_name}}))
+            lines.append(json.dumps(doc))
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+    
+    def _deliver(self, body):
+        auth = None
+        if self.username and self.password:
+            auth = (self.username, self.password)
+        self._post(f'{self.url}/_bulk', body, 'application/x-ndjson', timeout=10, auth=auth)
 
 
-class CloudWatchHandler(logging.Handler):
+class CloudWatchHandler(ShippingHandler):
     """
     Logging handler that sends logs to AWS CloudWatch Logs.
     
@@ -234,21 +469,20 @@ class CloudWatchHandler(logging.Handler):
     - CLOUDWATCH_LOG_GROUP: Log group name
     - CLOUDWATCH_LOG_STREAM: Log stream name (default: hostname)
     
-    Requires boto3 and AWS credentials configured.
+    Requires boto3 and AWS credentials configured. Batches are gzipped only
+    while spooled; boto3 sends them as put_log_events calls.
     """
     
-    def __init__(self, log_group=None, log_stream=None, region=None):
-        super().__init__()
+    target = 'cloudwatch'
+    
+    def __init__(self, log_group=None, log_stream=None, region=None, **options):
+        super().__init__(**options)
         self.log_group = log_group or os.environ.get('CLOUDWATCH_LOG_GROUP', 'verso-backend')
         self.log_stream = log_stream or os.environ.get('CLOUDWATCH_LOG_STREAM', socket.gethostname())
         self.region = region or os.environ.get('AWS_REGION', 'us-east-1')
         
         self._client = None
         self._sequence_token = None
-        self._batch = []
-        self._batch_size = 100
-        self._last_flush = time.time()
-        self._flush_interval = 5
     
     def _get_client(self):
         if self._client is None:
@@ -273,59 +507,37 @@ class CloudWatchHandler(logging.Handler):
                 return None
         return self._client
     
-    def emit(self, record):
-        try:
-            log_event = {
-                'timestamp': int(time.time() * 1000),
-                'message': json.dumps({
-                    'level': record.levelname,
-                    'logger': record.name,
-                    'message': self.format(record),
-                    'module': record.module,
-                    'request_id': getattr(g, 'request_id', None) if has_request_context() else None,
-                })
-            }
-            
-            self._batch.append(log_event)
-            
-            if len(self._batch) >= self._batch_size or \
-               time.time() - self._last_flush > self._flush_interval:
-                self._flush()
-                
-        except Exception:
-            self.handleError(record)
+    def _build(self, record):
+        return {
+            'timestamp': int(record.created * 1000),
+            'message': json.dumps({
+                'level': record.levelname,
+                'logger': record.name,
+                'message': self.format(record),
+                'module': record.module,
+                'request_id': getattr(record, 'request_id', None),
+            })
+        }
     
-    def _flush(self):
-        """Send batched logs to CloudWatch."""
-        if not self._batch:
-            return
-        
+    def _serialize(self, entries):
+        return json.dumps(entries).encode('utf-8')
+    
+    def _deliver(self, body):
         client = self._get_client()
         if not client:
-            self._batch = []
-            return
+            raise RuntimeError('boto3 is not installed')
         
-        try:
-            kwargs = {
-                'logGroupName': self.log_group,
-                'logStreamName': self.log_stream,
-                'logEvents': sorted(self._batch, key=lambda x: x['timestamp'])
-            }
-            
-            if self._sequence_token:
-                kwargs['sequenceToken'] = self._sequence_token
-            
-            response = client.put_log_events(**kwargs)
-            self._sequence_token = response.get('nextSequenceToken')
-        except Exception:
-            pass
-        finally:
-            self._batch = []
-            self._last_flush = time.time()
-    
-    def close(self):
-        self._flush()
-        super().close()
+        kwargs = {
+            'logGroupName': self.log_group,
+            'logStreamName': self.log_stream,
+            'logEvents': sorted(json.loads(gzip.decompress(body)), key=lambda x: x['timestamp'])
+        }
+        
+        if self._sequence_token:
+            kwargs['sequenceToken'] = self._sequence_token
+        
+        response = client.put_log_events(**kwargs)
+        self._sequence_token = response.get('nextSequenceToken')
 
 
 def setup_log_aggregation(app):
@@ -339,25 +551,34 @@ def setup_log_aggregation(app):
     """
     from app.modules.logging_config import StructuredJsonFormatter
     
+    spool_dir = app.config.get('LOG_SPOOL_PATH') or os.path.join(app.instance_path, 'log-spool')
+    options = {
+        'queue_size': app.config.get('LOG_SHIP_QUEUE_SIZE', 10000),
+        'batch_size': app.config.get('LOG_SHIP_BATCH_SIZE', 100),
+        'flush_interval': app.config.get('LOG_SHIP_FLUSH_SECONDS', 5),
+        'spool_dir': spool_dir,
+        'spool_max_bytes': app.config.get('LOG_SPOOL_MAX_MB', 64) * 1024 * 1024,
+    }
+    
     handlers_added = []
     
     # Loki
     if os.environ.get('LOKI_URL'):
-        handler = LokiHandler()
+        handler = LokiHandler(**options)
         handler.setFormatter(StructuredJsonFormatter(include_request=False))
         logging.getLogger().addHandler(handler)
         handlers_added.append('Loki')
     
     # Elasticsearch
     if os.environ.get('ELASTICSEARCH_URL'):
-        handler = ElasticsearchHandler()
+        handler = ElasticsearchHandler(**options)
         handler.setFormatter(StructuredJsonFormatter(include_request=False))
         logging.getLogger().addHandler(handler)
         handlers_added.append('Elasticsearch')
     
     # CloudWatch
     if os.environ.get('CLOUDWATCH_LOG_GROUP'):
-        handler = CloudWatchHandler()
+        handler = CloudWatchHandler(**options)
         handler.setFormatter(StructuredJsonFormatter(include_request=False))
         logging.getLogger().addHandler(handler)
         handlers_added.append('CloudWatch')
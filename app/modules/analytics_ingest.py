@@ -0,0 +1,283 @@
+"""
+Analytics Ingestion Module
+
+Buffered page-view ingestion. Requests only append an event to an
+in-process queue; a background flusher writes them out in batches:
+
+- PageView rows are bulk-inserted (executemany) every PAGE_VIEW_BATCH_SIZE
+  events or PAGE_VIEW_FLUSH_MS milliseconds, whichever comes first
+- Visitor session activity is coalesced to one INSERT or UPDATE per
+  session per flush
+- The queue is bounded (PAGE_VIEW_BUFFER_SIZE); when the database lags
+  and the queue fills, new events are dropped and counted rather than
+  growing memory or slowing requests
+
+In testing, events are flushed synchronously so a request's page view is
+visible as soon as the response returns.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import weakref
+from collections import deque
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert, select, update, bindparam
+from app.database import db
+
+logger = logging.getLogger(__name__)
+
+# Buffers to drain at interpreter exit (one atexit hook for all of them)
+_buffers = weakref.WeakSet()
+
+
+class PageViewBuffer:
+    """Bounded page-view queue with a background batch flusher."""
+
+    def __init__(self, app, max_size=10000, batch_size=500, flush_interval_ms=1000):
+        self.app = app
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        # deque append/popleft are atomic, so producers never take a lock
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.dropped = 0
+        self.flushed = 0
+        self._dropped_reported = 0
+
+    def record(self, event, background=True):
+        """Queue one page-view event. Returns False if it was dropped."""
+        if len(self._queue) >= self.max_size:
+            with self._count_lock:
+                self.dropped += 1
+            return False
+        self._queue.append(event)
+        if background and (self._thread is None or self._pid != os.getpid()):
+            with self._start_lock:
+                # Concurrent first requests: only one of them starts the flusher
+                if self._thread is None or self._pid != os.getpid():
+                    self._start()
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def pending(self):
+        return len(self._queue)
+
+    def _start(self):
+        if self._pid is not None and self._pid != os.getpid():
+            # Forked: the parent owns whatever was queued before the fork
+            self._queue.clear()
+        self._pid = os.getpid()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='page-view-flusher', daemon=True)
+        self._thread.start()
+        _buffers.add(self)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Page view flusher error: {e}")
+                finally:
+                    db.session.remove()
+
+    def stop(self, timeout=5):
+        """Stop the flusher and write out whatever is still queued."""
+        with self._start_lock:
+            self._stopping.set()
+            self._wakeup.set()
+            if self._thread is not None and self._thread.is_alive():
+                self._thread.join(timeout)
+            self._thread = None
+        if self._queue:
+            with self.app.app_context():
+                self.flush()
+                db.session.remove()
+
+    def flush(self):
+        """Drain the queue in batches. Returns the number of events written."""
+        written = 0
+        with self._flush_lock:
+            while self._queue:
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popleft())
+                try:
+                    _write_batch(batch)
+                    db.session.commit()
+                    written += len(batch)
+                except Exception as e:
+                    db.session.rollback()
+                    with self._count_lock:
+                        self.dropped += len(batch)
+                    logger.error(f"Failed to write {len(batch)} page views: {e}")
+        self.flushed += written
+        if self.dropped != self._dropped_reported:
+            logger.warning(f"Page view buffer dropped {self.dropped - self._dropped_reported} events")
+            self._dropped_reported = self.dropped
+        return written
+
+
+def _write_batch(batch):
+    """Bulk-insert page views and apply coalesced session activity."""
+    from app.models import PageView, VisitorSession
+
+    db.session.execute(
+        insert(PageView),
+        [{k: v for k, v in event.items() if k != 'is_new_session'} for event in batch]
+    )
+
+    # One entry per session token, in arrival order
+    sessions = {}
+    for event in batch:
+        token = event['session_id']
+        summary = sessions.get(token)
+        if summary is None:
+            sessions[token] = summary = {
+                'is_new': False,
+                'first': event,
+                'last': event,
+                'views': 0,
+                'user_id': None,
+            }
+        summary['is_new'] = summary['is_new'] or event['is_new_session']
+        summary['last'] = event
+        summary['views'] += 1
+        summary['user_id'] = summary['user_id'] or event['user_id']
+
+    new_rows = []
+    existing = {}
+    for token, summary in sessions.items():
+        if summary['is_new']:
+            first, last = summary['first'], summary['last']
+            new_rows.append({
+                'session_token': token,
+                'user_id': summary['user_id'],
+                'ip_hash': first['ip_hash'],
+                'entry_page': first['url'],
+                'exit_page': last['url'],
+                'pages_viewed': summary['views'],
+                'duration_seconds': int((last['timestamp'] - first['timestamp']).total_seconds()) if summary['views'] > 1 else None,
+                'bounce': summary['views'] == 1,
+                'referrer': first['referrer'],
+                'utm_source': first['utm_source'],
+                'utm_medium': first['utm_medium'],
+                'utm_campaign': first['utm_campaign'],
+                'device_type': first['device_type'],
+                'browser': first['browser'],
+                'os': first['os'],
+                'started_at': first['timestamp'],
+                'last_activity_at': last['timestamp'],
+            })
+        else:
+            existing[token] = summary
+
+    if new_rows:
+        db.session.execute(insert(VisitorSession), new_rows)
+
+    if existing:
+        started = dict(db.session.execute(
+            select(VisitorSession.session_token, VisitorSession.started_at)
+            .where(VisitorSession.session_token.in_(list(existing)))
+        ).all())
+        updates = []
+        for token, summary in existing.items():
+            if token not in started:
+                continue  # Session row was never written (e.g. dropped); nothing to update
+            last_seen = summary['last']['timestamp']
+            updates.append({
+                'token': token,
+                'views': summary['views'],
+                'last_url': summary['last']['url'],
+                'last_seen': last_seen,
+                'duration': int((last_seen - started[token]).total_seconds()) if started[token] else None,
+                'viewer_id': summary['user_id'],
+            })
+        if updates:
+            table = VisitorSession.__table__
+            db.session.execute(
+                update(table)
+                .where(table.c.session_token == bindparam('token'))
+                .values(
+                    pages_viewed=table.c.pages_viewed + bindparam('views'),
+                    exit_page=bindparam('last_url'),
+                    last_activity_at=bindparam('last_seen'),
+                    duration_seconds=bindparam('duration'),
+                    bounce=False,
+                    user_id=db.func.coalesce(table.c.user_id, bindparam('viewer_id')),
+                ),
+                updates
+            )
+
+
+def build_page_view_event(request, user_id, session_token, is_new_session):
+    """Capture everything the flusher needs from the request, without touching the DB."""
+    from app.modules.reporting import parse_user_agent
+    import hashlib
+
+    user_agent_str = request.user_agent.string
+    device_info = parse_user_agent(user_agent_str)
+    return {
+        'session_id': session_token,
+        'is_new_session': is_new_session,
+        'user_id': user_id,
+        'url': request.path,
+        'referrer': request.referrer,
+        'user_agent': user_agent_str[:500] if user_agent_str else None,
+        'ip_hash': hashlib.sha256((request.remote_addr or '').encode('utf-8')).hexdigest(),
+        'timestamp': datetime.utcnow(),
+        'utm_source': request.args.get('utm_source'),
+        'utm_medium': request.args.get('utm_medium'),
+        'utm_campaign': request.args.get('utm_campaign'),
+        'utm_term': request.args.get('utm_term'),
+        'utm_content': request.args.get('utm_content'),
+        'device_type': device_info['device_type'],
+        'browser': device_info['browser'],
+        'os': device_info['os'],
+    }
+
+
+@atexit.register
+def _stop_buffers():
+    for buffer in list(_buffers):
+        buffer.stop()
+
+
+def stop_analytics_ingest(app):
+    """Stop the app's flusher thread and write out its queue (app shutdown, test teardown)."""
+    buffer = app.extensions.get('page_view_buffer')
+    if buffer is not None:
+        buffer.stop()
+
+
+def record_page_view(event):
+    """Queue a page view on the current app's buffer (flushes inline when testing)."""
+    buffer = current_app.extensions['page_view_buffer']
+    sync = current_app.config.get('PAGE_VIEW_SYNC_FLUSH', current_app.testing)
+    buffer.record(event, background=not sync)
+    if sync:
+        buffer.flush()
+
+
+def init_analytics_ingest(app):
+    """Attach a page-view buffer to the app. The flusher starts on first use."""
+    app.extensions['page_view_buffer'] = PageViewBuffer(
+        app,
+        max_size=app.config.get('PAGE_VIEW_BUFFER_SIZE', 10000),
+        batch_size=app.config.get('PAGE_VIEW_BATCH_SIZE', 500),
+        flush_interval_ms=app.config.get('PAGE_VIEW_FLUSH_MS', 1000),
+    )
@@ -0,0 +1,458 @@
+"""
+Analytics Rollups Module
+
+Incrementally maintained traffic aggregates so reports never scan raw
+page_view rows:
+
+- Closed hours are aggregated into 'hour' rows of TrafficRollup; once a
+  day's hours are all in, they are compacted into a single 'day' row set
+- A high-water mark (RollupWatermark) records how far aggregation has
+  got, so each refresh only reads new rows
+- Queries combine day rows for whole days, hour rows for the edges of
+  the range, and raw rows only for the hours after the high-water mark
+- Distinct sessions, visitors (ip_hash) and users are kept as
+  HyperLogLog sketches (TrafficSketch) per hour and day; merging them
+  answers unique counts for any range without a COUNT(DISTINCT) scan
+
+Sessions are attributed to the hour they started in. An hour is rolled
+up ROLLUP_SETTLE_MINUTES after it closes, so late session activity
+(bounce, duration) is mostly in place by then.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import func, and_, or_, insert, delete, select, Integer
+from app.database import db
+from app.modules.hyperloglog import HyperLogLog, merge_serialized
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = 'traffic'
+ROLLUP_SETTLE_MINUTES = 30
+
+# Dimensions a caller may group by: rollup column / page_view column / visitor_session column
+DIMENSIONS = ('url', 'utm_source', 'utm_medium', 'device_type', 'browser', 'date')
+MEASURES = ('page_views', 'sessions', 'bounces', 'duration_sum', 'duration_count')
+
+# Distinct-count sketches: metric name -> PageView column
+SKETCH_METRICS = {'sessions': 'session_id', 'visitors': 'ip_hash', 'users': 'user_id'}
+
+
+def floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil_day(moment):
+    day = floor_day(moment)
+    return day if day == moment else day + timedelta(days=1)
+
+
+def _dimension_columns(dims, source):
+    """Map dimension names onto the columns of a source ('rollup', 'views' or 'sessions')."""
+    from app.models import TrafficRollup, PageView, VisitorSession
+
+    model, url, timestamp = {
+        'rollup': (TrafficRollup, TrafficRollup.url, TrafficRollup.bucket_start),
+        'views': (PageView, PageView.url, PageView.timestamp),
+        'sessions': (VisitorSession, VisitorSession.entry_page, VisitorSession.started_at),
+    }[source]
+    columns = []
+    for dim in dims:
+        if dim == 'url':
+            columns.append(url.label('url'))
+        elif dim == 'date':
+            columns.append(func.date(timestamp).label('date'))
+        else:
+            columns.append(getattr(model, dim).label(dim))
+    return columns
+
+
+# ============================================================================
+# Refresh
+# ============================================================================
+
+def get_high_water():
+    """Return the first hour not yet rolled up, or None if nothing has been."""
+    from app.models import RollupWatermark
+
+    mark = db.session.get(RollupWatermark, WATERMARK_NAME)
+    return mark.high_water if mark else None
+
+
+def _raw_hour_rows(hour):
+    """Aggregate one hour of raw page views and sessions into rollup row dicts."""
+    from app.models import PageView, VisitorSession
+
+    end = hour + timedelta(hours=1)
+    dims = ('url', 'utm_source', 'utm_medium', 'device_type', 'browser')
+    rows = {}
+
+    def row_for(result):
+        key = tuple(getattr(result, d) for d in dims)
+        if key not in rows:
+            rows[key] = dict(zip(dims, key), granularity='hour', bucket_start=hour,
+                             **{m: 0 for m in MEASURES})
+        return rows[key]
+
+    views = db.session.query(
+        *_dimension_columns(dims, 'views'),
+        func.count(PageView.id).label('page_views')
+    ).filter(
+        PageView.timestamp >= hour,
+        PageView.timestamp < end
+    ).group_by(*_dimension_columns(dims, 'views')).all()
+    for result in views:
+        row_for(result)['page_views'] = result.page_views
+
+    sessions = db.session.query(
+        *_dimension_columns(dims, 'sessions'),
+        func.count(VisitorSession.id).label('sessions'),
+        func.sum(func.cast(VisitorSession.bounce, Integer)).label('bounces'),
+        func.sum(VisitorSession.duration_seconds).label('duration_sum'),
+        func.count(VisitorSession.duration_seconds).label('duration_count')
+    ).filter(
+        VisitorSession.started_at >= hour,
+        VisitorSession.started_at < end
+    ).group_by(*_dimension_columns(dims, 'sessions')).all()
+    for result in sessions:
+        row = row_for(result)
+        row['sessions'] = result.sessions
+        row['bounces'] = result.bounces or 0
+        row['duration_sum'] = result.duration_sum or 0
+        row['duration_count'] = result.duration_count
+
+    return list(rows.values())
+
+
+def _raw_distinct(metric, start, end):
+    """Distinct non-null values of a sketch metric among raw page views in [start, end)."""
+    from app.models import PageView
+
+    column = getattr(PageView, SKETCH_METRICS[metric])
+    query = db.session.query(column).filter(column != None, PageView.timestamp < end)
+    if start is not None:
+        query = query.filter(PageView.timestamp >= start)
+    return [value for (value,) in query.distinct()]
+
+
+def _hour_sketches(hour):
+    """Build one hour's distinct-count sketches as TrafficSketch row dicts."""
+    rows = []
+    for metric in SKETCH_METRICS:
+        values = _raw_distinct(metric, hour, hour + timedelta(hours=1))
+        if values:
+            rows.append({
+                'granularity': 'hour',
+                'bucket_start': hour,
+                'metric': metric,
+                'registers': HyperLogLog().update(values).to_bytes(),
+            })
+    return rows
+
+
+def _compact_day(day):
+    """Replace a closed day's 'day' rows with the sum of its hour rows."""
+    from app.models import TrafficRollup, TrafficSketch
+
+    dims = ('url', 'utm_source', 'utm_medium', 'device_type', 'browser')
+    db.session.execute(delete(TrafficRollup).where(
+        TrafficRollup.granularity == 'day',
+        TrafficRollup.bucket_start == day
+    ))
+    hourly = select(
+        *[getattr(TrafficRollup, d) for d in dims],
+        *[func.sum(getattr(TrafficRollup, m)) for m in MEASURES]
+    ).where(
+        TrafficRollup.granularity == 'hour',
+        TrafficRollup.bucket_start >= day,
+        TrafficRollup.bucket_start < day + timedelta(days=1)
+    ).group_by(*[getattr(TrafficRollup, d) for d in dims])
+    rows = [
+        dict(zip(dims + MEASURES, result), granularity='day', bucket_start=day)
+        for result in db.session.execute(hourly)
+    ]
+    if rows:
+        db.session.execute(insert(TrafficRollup), rows)
+
+    db.session.execute(delete(TrafficSketch).where(
+        TrafficSketch.granularity == 'day',
+        TrafficSketch.bucket_start == day
+    ))
+    hourly = defaultdict(list)
+    for metric, registers in db.session.query(TrafficSketch.metric, TrafficSketch.registers).filter(
+        TrafficSketch.granularity == 'hour',
+        TrafficSketch.bucket_start >= day,
+        TrafficSketch.bucket_start < day + timedelta(days=1)
+    ):
+        hourly[metric].append(registers)
+    sketches = [
+        {'granularity': 'day', 'bucket_start': day, 'metric': metric,
+         'registers': merge_serialized(blobs).to_bytes()}
+        for metric, blobs in hourly.items()
+    ]
+    if sketches:
+        db.session.execute(insert(TrafficSketch), sketches)
+
+
+def _advance(mark, new_high_water):
+    """Move the watermark forward, compacting every day it finishes."""
+    old = mark.high_water
+    day = floor_day(old)
+    while day + timedelta(days=1) <= new_high_water:
+        if day + timedelta(days=1) > old:
+            _compact_day(day)
+        day += timedelta(days=1)
+    mark.high_water = new_high_water
+
+
+def refresh_traffic_rollups(now=None):
+    """
+    Roll up every closed hour since the high-water mark.
+
+    Each hour commits together with its watermark advance, so an
+    interrupted refresh resumes where it stopped. Hours with no traffic
+    are skipped without querying them one by one.
+
+    Returns:
+        int: number of hours aggregated
+    """
+    from app.models import TrafficRollup, TrafficSketch, RollupWatermark, PageView, VisitorSession
+
+    now = now or datetime.utcnow()
+    settled = floor_hour(now - timedelta(minutes=ROLLUP_SETTLE_MINUTES))
+
+    mark = db.session.get(RollupWatermark, WATERMARK_NAME)
+    if mark is None:
+        mark = RollupWatermark(name=WATERMARK_NAME)
+        db.session.add(mark)
+    if mark.high_water is None:
+        firsts = [
+            db.session.query(func.min(PageView.timestamp)).scalar(),
+            db.session.query(func.min(VisitorSession.started_at)).scalar(),
+        ]
+        firsts = [f for f in firsts if f is not None]
+        mark.high_water = floor_day(min(firsts)) if firsts else floor_day(settled)
+        db.session.commit()
+
+    hours = 0
+    while True:
+        # Serialize concurrent refreshes on the watermark row (no-op on SQLite)
+        db.session.refresh(mark, with_for_update=True)
+        if mark.high_water >= settled:
+            break
+
+        # Jump straight to the next hour that has any data
+        upcoming = [
+            db.session.query(func.min(PageView.timestamp)).filter(PageView.timestamp >= mark.high_water).scalar(),
+            db.session.query(func.min(VisitorSession.started_at)).filter(VisitorSession.started_at >= mark.high_water).scalar(),
+        ]
+        upcoming = [u for u in upcoming if u is not None]
+        hour = floor_hour(min(upcoming)) if upcoming else settled
+        if hour >= settled:
+            _advance(mark, settled)
+            db.session.commit()
+            break
+
+        _advance(mark, hour)
+        db.session.execute(delete(TrafficRollup).where(
+            TrafficRollup.granularity == 'hour',
+            TrafficRollup.bucket_start == hour
+        ))
+        db.session.execute(delete(TrafficSketch).where(
+            TrafficSketch.granularity == 'hour',
+            TrafficSketch.bucket_start == hour
+        ))
+        rows = _raw_hour_rows(hour)
+        if rows:
+            db.session.execute(insert(TrafficRollup), rows)
+        sketches = _hour_sketches(hour)
+        if sketches:
+            db.session.execute(insert(TrafficSketch), sketches)
+        _advance(mark, hour + timedelta(hours=1))
+        db.session.commit()
+        hours += 1
+
+    if hours:
+        logger.info(f"Rolled up {hours} hours of traffic through {mark.high_water}")
+    return hours
+
+
+# ============================================================================
+# Queries
+# ============================================================================
+
+def _bucket_filter(model, start, end):
+    """
+    Filter selecting the rollup buckets (of TrafficRollup or TrafficSketch)
+    that exactly cover [start, end): day buckets for whole days, hour
+    buckets for the partial days at either edge. start may be None.
+    """
+    day_lo = _ceil_day(start) if start else None
+    day_hi = floor_day(end)
+    if day_lo is not None and day_lo >= day_hi:
+        ranges = [('hour', start, end)]
+    else:
+        ranges = [('day', day_lo, day_hi), ('hour', day_hi, end)]
+        if start is not None:
+            ranges.append(('hour', start, day_lo))
+    conditions = []
+    for granularity, lo, hi in ranges:
+        if lo is None:
+            conditions.append(and_(model.granularity == granularity, model.bucket_start < hi))
+        elif lo < hi:
+            conditions.append(and_(
+                model.granularity == granularity,
+                model.bucket_start >= lo,
+                model.bucket_start < hi
+            ))
+    return or_(*conditions)
+
+
+def _raw_start(start, high_water):
+    """Where raw rows take over from the rollups for a range starting at start."""
+    return max(start, high_water) if start and high_water else (high_water or start)
+
+
+def query_traffic(start_date, end_date, group_by=()):
+    """
+    Aggregate traffic for [start_date, end_date), grouped by dimensions.
+
+    Args:
+        start_date: Range start (floored to the hour), or None for all time
+        end_date: Range end
+        group_by: Names from DIMENSIONS
+
+    Returns:
+        List of dicts with the group_by keys plus page_views, sessions,
+        bounces, duration_sum and duration_count.
+    """
+    from app.models import TrafficRollup, PageView, VisitorSession
+
+    group_by = tuple(group_by)
+    unknown = set(group_by) - set(DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Unknown traffic dimensions: {', '.join(sorted(unknown))}")
+
+    start = floor_hour(start_date) if start_date else None
+    high_water = get_high_water()
+    totals = defaultdict(lambda: dict.fromkeys(MEASURES, 0))
+
+    def add(results, measures):
+        for result in results:
+            key = tuple(str(getattr(result, d)) if d == 'date' else getattr(result, d) for d in group_by)
+            for measure in measures:
+                totals[key][measure] += getattr(result, measure) or 0
+
+    # Rolled-up part: [start, rolled_end)
+    rolled_end = min(end_date, high_water) if high_water else None
+    if rolled_end and (start is None or start < rolled_end):
+        dims = _dimension_columns(group_by, 'rollup')
+        add(db.session.query(
+            *dims,
+            *[func.sum(getattr(TrafficRollup, m)).label(m) for m in MEASURES]
+        ).filter(_bucket_filter(TrafficRollup, start, rolled_end)).group_by(*dims).all(), MEASURES)
+
+    # Raw part: whatever the rollups don't cover yet (normally the current hour)
+    raw_start = _raw_start(start, high_water)
+    if raw_start is None or raw_start < end_date:
+        view_dims = _dimension_columns(group_by, 'views')
+        views = db.session.query(*view_dims, func.count(PageView.id).label('page_views'))
+        if raw_start:
+            views = views.filter(PageView.timestamp >= raw_start)
+        add(views.filter(PageView.timestamp < end_date).group_by(*view_dims).all(), ('page_views',))
+
+        session_dims = _dimension_columns(group_by, 'sessions')
+        sessions = db.session.query(
+            *session_dims,
+            func.count(VisitorSession.id).label('sessions'),
+            func.sum(func.cast(VisitorSession.bounce, Integer)).label('bounces'),
+            func.sum(VisitorSession.duration_seconds).label('duration_sum'),
+            func.count(VisitorSession.duration_seconds).label('duration_count')
+        )
+        if raw_start:
+            sessions = sessions.filter(VisitorSession.started_at >= raw_start)
+        add(sessions.filter(VisitorSession.started_at < end_date).group_by(*session_dims).all(), MEASURES[1:])
+
+    return [dict(zip(group_by, key), **measures) for key, measures in totals.items()]
+
+
+def top_traffic(start_date, end_date, dimension, measure='page_views', limit=None):
+    """Rows grouped by one dimension, largest `measure` first, skipping zero rows."""
+    rows = [r for r in query_traffic(start_date, end_date, (dimension,)) if r[measure]]
+    rows.sort(key=lambda r: r[measure], reverse=True)
+    return rows[:limit] if limit else rows
+
+
+def unique_sketch(start_date, end_date, metric):
+    """
+    Merged HyperLogLog of a SKETCH_METRICS metric over [start_date, end_date).
+
+    Merges the day and hour sketches covering the range and adds the raw
+    values after the high-water mark, so the cost depends on the number
+    of days in the range rather than the amount of traffic.
+    """
+    from app.models import TrafficSketch
+
+    if metric not in SKETCH_METRICS:
+        raise ValueError(f"Unknown sketch metric: {metric}")
+
+    start = floor_hour(start_date) if start_date else None
+    high_water = get_high_water()
+    blobs = []
+
+    rolled_end = min(end_date, high_water) if high_water else None
+    if rolled_end and (start is None or start < rolled_end):
+        blobs = [registers for (registers,) in db.session.query(TrafficSketch.registers).filter(
+            TrafficSketch.metric == metric,
+            _bucket_filter(TrafficSketch, start, rolled_end)
+        )]
+    sketch = merge_serialized(blobs)
+
+    raw_start = _raw_start(start, high_water)
+    if raw_start is None or raw_start < end_date:
+        sketch.update(_raw_distinct(metric, raw_start, end_date))
+    return sketch
+
+
+def estimate_unique(start_date, end_date, metric):
+    """Approximate distinct count (about 0.8% standard error) for a metric over a range."""
+    return unique_sketch(start_date, end_date, metric).count()
+
+
+def estimate_unique_by_day(start_date, end_date, metric):
+    """Approximate distinct count per day, as {'YYYY-MM-DD': count} for days with traffic."""
+    from app.models import TrafficSketch, PageView
+
+    if metric not in SKETCH_METRICS:
+        raise ValueError(f"Unknown sketch metric: {metric}")
+
+    start = floor_hour(start_date) if start_date else None
+    high_water = get_high_water()
+    days = defaultdict(list)
+
+    rolled_end = min(end_date, high_water) if high_water else None
+    if rolled_end and (start is None or start < rolled_end):
+        for bucket_start, registers in db.session.query(TrafficSketch.bucket_start, TrafficSketch.registers).filter(
+            TrafficSketch.metric == metric,
+            _bucket_filter(TrafficSketch, start, rolled_end)
+        ):
+            days[bucket_start.date().isoformat()].append(registers)
+    sketches = {day: merge_serialized(blobs) for day, blobs in days.items()}
+
+    raw_start = _raw_start(start, high_water)
+    if raw_start is None or raw_start < end_date:
+        column = getattr(PageView, SKETCH_METRICS[metric])
+        raw = db.session.query(func.date(PageView.timestamp), column).filter(
+            column != None, PageView.timestamp < end_date
+        )
+        if raw_start:
+            raw = raw.filter(PageView.timestamp >= raw_start)
+        for day, value in raw.distinct():
+            sketches.setdefault(str(day), HyperLogLog()).add(value)
+
+    return {day: sketch.count() for day, sketch in sorted(sketches.items())}
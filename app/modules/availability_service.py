@@ -2,13 +2,17 @@
 Phase 2: Availability Service Module
 
 Core logic for availability management, conflict detection, and slot generation.
+Slot searches run on the bitmap SlotEngine (see slot_engine.py).
 """
 from datetime import datetime, date, time, timedelta
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
+from sqlalchemy.orm import joinedload
 from app.database import db
 from app.models import (
     Availability, AvailabilityException, Appointment, Estimator, Service, BusinessConfig
 )
+from app.modules.slot_engine import SlotEngine, minute_of, range_mask
+from app.modules.slot_cache import cached_slots
 
 
 def get_business_config() -> dict:
@@ -17,6 +21,23 @@ def get_business_config() -> dict:
     return {c.setting_name: c.setting_value for c in configs}
 
 
+def get_buffer_minutes() -> int:
+    """The buffer_time_minutes setting (minutes kept free around appointments)."""
+    value = db.session.query(BusinessConfig.setting_value).filter_by(
+        setting_name='buffer_time_minutes'
+    ).scalar()
+    return int(value) if value not in (None, '') else 30
+
+
+def get_service_duration(service_id: Optional[int]) -> int:
+    """Duration of a service in minutes, defaulting to 60."""
+    if service_id:
+        duration = db.session.query(Service.duration_minutes).filter_by(id=service_id).scalar()
+        if duration:
+            return duration
+    return 60
+
+
 def get_estimator_availability(estimator_id: int, target_date: date) -> List[Tuple[time, time]]:
     """
     Get available time ranges for an estimator on a specific date.
@@ -62,7 +83,6 @@ def get_booked_slots(estimator_id: int, target_date: date) -> List[Tuple[datetim
     
     Returns list of (start, end) datetime tuples.
     """
-    config = get_business_config()
     now = datetime.utcnow()
     
     # Create datetime range for the target date (in UTC)
@@ -75,7 +95,7 @@ def get_booked_slots(estimator_id: int, target_date: date) -> List[Tuple[datetim
         Appointment.preferred_date_time >= day_start,
         Appointment.preferred_date_time <= day_end,
         Appointment.status.notin_(['Cancelled', 'Expired'])
-    ).all()
+    ).options(joinedload(Appointment.service)).all()
     
     booked = []
     for appt in appointments:
@@ -110,37 +130,23 @@ def check_slot_available(
         (False, reason) if not available
     """
     target_date = slot_start.date()
-    slot_end = slot_start + timedelta(minutes=duration_minutes)
-    slot_start_time = slot_start.time()
-    slot_end_time = slot_end.time()
+    engine = SlotEngine([estimator_id], target_date, target_date)
     
     # 1. Check if estimator has availability on this day
-    availability_ranges = get_estimator_availability(estimator_id, target_date)
-    
-    if not availability_ranges:
+    windows = engine.windows(estimator_id, target_date)
+    if not windows:
         return False, "Estimator is not available on this day"
     
     # Check if slot fits within any availability window
-    slot_in_availability = False
-    for avail_start, avail_end in availability_ranges:
-        if slot_start_time >= avail_start and slot_end_time <= avail_end:
-            slot_in_availability = True
-            break
-    
-    if not slot_in_availability:
+    slot_start_minute = minute_of(slot_start.time())
+    slot_end_minute = slot_start_minute + duration_minutes
+    if not any(start <= slot_start_minute and slot_end_minute <= end for start, end in windows):
         return False, "Requested time is outside available hours"
     
-    # 2. Check for conflicts with existing appointments
-    booked_slots = get_booked_slots(estimator_id, target_date)
-    
-    for booked_start, booked_end in booked_slots:
-        # Add buffer time
-        buffered_start = booked_start - timedelta(minutes=buffer_minutes)
-        buffered_end = booked_end + timedelta(minutes=buffer_minutes)
-        
-        # Check for overlap
-        if slot_start < buffered_end and slot_end > buffered_start:
-            return False, "Time slot conflicts with existing appointment"
+    # 2. Check for conflicts with existing appointments (plus buffer)
+    busy = engine.busy_mask(estimator_id, target_date, buffer_minutes, buffer_minutes)
+    if busy & range_mask(slot_start_minute, slot_end_minute):
+        return False, "Time slot conflicts with existing appointment"
     
     return True, None
 
@@ -163,52 +169,72 @@ def get_available_slots(
     Returns:
         List of datetime objects representing available slot start times
     """
-    config = get_business_config()
-    buffer_minutes = int(config.get('buffer_time_minutes', 30))
-    
-    # Get service duration
-    duration_minutes = 60
-    if service_id:
-        service = Service.query.get(service_id)
-        if service and service.duration_minutes:
-            duration_minutes = service.duration_minutes
-    
-    # Get availability ranges
-    availability_ranges = get_estimator_availability(estimator_id, target_date)
-    if not availability_ranges:
-        return []
-    
-    # Get booked slots
-    booked_slots = get_booked_slots(estimator_id, target_date)
-    
-    available_slots = []
+    return get_available_slots_range(
+        estimator_id, target_date, 1, service_id, slot_interval_minutes
+    )[target_date]
+
+
+def get_available_slots_range(
+    estimator_id: int,
+    start_date: date,
+    days: int,
+    service_id: Optional[int] = None,
+    slot_interval_minutes: int = 30
+) -> Dict[date, List[datetime]]:
+    """
+    Available booking slots for an estimator on each of `days` days.
     
-    for avail_start, avail_end in availability_ranges:
-        # Generate slots within this availability window
-        current_time = datetime.combine(target_date, avail_start)
-        end_time = datetime.combine(target_date, avail_end)
-        
-        while current_time + timedelta(minutes=duration_minutes) <= end_time:
-            slot_end = current_time + timedelta(minutes=duration_minutes)
-            
-            # Check if slot conflicts with any booked appointment
-            is_available = True
-            for booked_start, booked_end in booked_slots:
-                buffered_start = booked_start - timedelta(minutes=buffer_minutes)
-                buffered_end = booked_end + timedelta(minutes=buffer_minutes)
-                
-                if current_time < buffered_end and slot_end > buffered_start:
-                    is_available = False
-                    break
-            
-            if is_available:
-                available_slots.append(current_time)
-            
-            current_time += timedelta(minutes=slot_interval_minutes)
+    The whole range costs a fixed handful of queries (config, service,
+    and the SlotEngine's three loads), however many days it covers.
     
-    return available_slots
+    Returns:
+        Dict of date -> list of slot start datetimes
+    """
+    buffer_minutes = get_buffer_minutes()
+    duration_minutes = get_service_duration(service_id)
+    end_date = start_date + timedelta(days=days - 1)
+    
+    engine = SlotEngine([estimator_id], start_date, end_date)
+    return engine.free_slots_by_day(
+        estimator_id, duration_minutes, slot_interval_minutes,
+        pad_before=buffer_minutes, pad_after=buffer_minutes
+    )
 
 
+
+def get_cached_slots_range(
+    estimator_id: int,
+    start_date: date,
+    days: int,
+    service_id: Optional[int] = None,
+    slot_interval_minutes: int = 30
+) -> Dict[date, List[datetime]]:
+    """
+    get_available_slots_range through the write-invalidated slot cache.
+    
+    Only days missing from the cache are computed, with one SlotEngine
+    spanning them.
+    """
+    def compute(missing):
+        buffer_minutes = get_buffer_minutes()
+        duration_minutes = get_service_duration(service_id)
+        engine = SlotEngine([estimator_id], min(missing), max(missing))
+        return {
+            day: (
+                engine.free_slots(
+                    estimator_id, day, duration_minutes, slot_interval_minutes,
+                    pad_before=buffer_minutes, pad_after=buffer_minutes
+                ),
+                engine.hold_expiry(estimator_id, day)
+            )
+            for day in missing
+        }
+    
+    wanted = [start_date + timedelta(days=i) for i in range(days)]
+    return cached_slots(
+        estimator_id, f'service:{service_id or 0}:{slot_interval_minutes}', wanted, compute
+    )
+
 def get_conflicting_appointments(
     estimator_id: int,
     start: datetime,
@@ -0,0 +1,515 @@
+"""
+Benchmark Data Module
+
+Deterministic datasets for the performance benchmarks:
+
+- Everything is drawn from random.Random(seed) and laid out backwards from
+  the fixed DATASET_END, so the same scale and seed produce the same rows
+  on SQLite or Postgres, on any machine, on any day
+- SCALES sets row counts per table (small ~10k page views, large ~1M page
+  views, 100k leads, 50k messages, 10k products); any count can be
+  overridden, which turns the scale into 'custom'
+- Rows go in through bulk Core inserts, chunk_size rows per statement and
+  commit; since they bypass the ORM events, the search indexes are rebuilt
+  and the traffic rollups refreshed once at the end
+- The dataset identity (scale, seed and a digest of the counts) is kept in
+  BusinessConfig so benchmark results can refuse to compare across datasets
+"""
+
+import hashlib
+import json
+import logging
+import random
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import func, insert, select
+from app.database import db
+from app.extensions import bcrypt
+
+logger = logging.getLogger(__name__)
+
+DATASET_SETTING = 'benchmark_dataset'
+DATASET_END = datetime(2026, 1, 1)
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+SCALES = {
+    'small': {
+        'users': 200, 'posts': 50, 'products': 1000, 'page_views': 10000, 'leads': 2000,
+        'messages': 5000, 'appointments': 1000, 'email_sends': 5000, 'span_days': 30,
+    },
+    'medium': {
+        'users': 1000, 'posts': 200, 'products': 5000, 'page_views': 100000, 'leads': 20000,
+        'messages': 20000, 'appointments': 5000, 'email_sends': 50000, 'span_days': 90,
+    },
+    'large': {
+        'users': 5000, 'posts': 500, 'products': 10000, 'page_views': 1000000, 'leads': 100000,
+        'messages': 50000, 'appointments': 20000, 'email_sends': 200000, 'span_days': 90,
+    },
+}
+
+CHANNELS = 20
+CATEGORIES = 20
+ESTIMATORS = 5
+CAMPAIGNS = 5
+
+FIRST_NAMES = ['Ava', 'Ben', 'Cara', 'Dev', 'Eli', 'Fay', 'Gus', 'Hana', 'Ivan', 'Jo',
+               'Kai', 'Lena', 'Milo', 'Nora', 'Owen', 'Pia', 'Quinn', 'Rosa', 'Sam', 'Tess']
+LAST_NAMES = ['Adams', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fox', 'Garcia', 'Hill', 'Ito', 'Jones',
+              'Khan', 'Lopez', 'Moore', 'Nash', 'Ortiz', 'Park', 'Reed', 'Shah', 'Tran', 'Young']
+ADJECTIVES = ['Classic', 'Deluxe', 'Compact', 'Heavy Duty', 'Premium', 'Eco', 'Smart', 'Rustic']
+NOUNS = ['Lamp', 'Chair', 'Panel', 'Faucet', 'Shelf', 'Mirror', 'Rug', 'Tile', 'Door', 'Fan']
+PAGES = (['/', '/about', '/services', '/contact', '/shop', '/blog', '/book']
+         + [f'/blog/post-{i}' for i in range(1, 31)]
+         + [f'/shop/product/{i}' for i in range(1, 41)])
+DEVICES = [('desktop', 'chrome', 'windows'), ('desktop', 'firefox', 'linux'), ('desktop', 'safari', 'macos'),
+           ('mobile', 'safari', 'ios'), ('mobile', 'chrome', 'android'), ('tablet', 'safari', 'ios')]
+UTM_SOURCES = ['google', 'newsletter', 'facebook', 'partner']
+LEAD_STATUSES = ['New', 'Contacted', 'Qualified', 'Won', 'Lost']
+LEAD_SOURCES = ['contact_form', 'website', 'referral', 'phone']
+APPOINTMENT_STATUSES = ['New', 'New', 'Contacted', 'Qualified', 'Won', 'Cancelled']
+EMOJI = ['👍', '🎉', '❤️', '😂', '👀']
+
+
+def dataset_counts(scale='small', **overrides):
+    """Row counts for a scale, with per-table overrides applied."""
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale '{scale}' (choose from {', '.join(SCALES)})")
+    counts = dict(SCALES[scale])
+    for name, value in overrides.items():
+        if name not in counts:
+            raise ValueError(f"Unknown dataset count '{name}'")
+        if value is not None:
+            counts[name] = int(value)
+    return counts
+
+
+def dataset_identity(scale, seed, counts):
+    """Short identity stored with the data and with every benchmark result."""
+    if counts != SCALES.get(scale):
+        scale = 'custom'
+    digest = hashlib.sha1(json.dumps(counts, sort_keys=True).encode()).hexdigest()[:12]
+    return {'scale': scale, 'seed': seed, 'digest': digest}
+
+
+def current_dataset():
+    """Identity of the seeded benchmark dataset, or None."""
+    from app.models import BusinessConfig
+    setting = BusinessConfig.query.filter_by(setting_name=DATASET_SETTING).first()
+    return json.loads(setting.setting_value) if setting else None
+
+
+def session_token(seed, index):
+    """Token of the index-th seeded visitor session."""
+    return f'bench-{seed:x}-{index:010d}'
+
+
+def _insert(target, rows, chunk_size):
+    """Bulk-insert rows in chunks, committing each. Returns the row count."""
+    written = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            db.session.execute(insert(target), chunk)
+            db.session.commit()
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(target), chunk)
+        db.session.commit()
+        written += len(chunk)
+    return written
+
+
+def _ids(model):
+    return list(db.session.execute(select(model.id).order_by(model.id)).scalars())
+
+
+def _name(rng):
+    return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+
+def _phone(rng):
+    return f'555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}'
+
+
+class DatasetBuilder:
+    """Writes one dataset; each table draws from its own seeded stream."""
+
+    def __init__(self, seed, counts, chunk_size=5000, echo=None):
+        self.seed = seed
+        self.counts = counts
+        self.chunk_size = chunk_size
+        self.echo = echo or (lambda message: None)
+        self.start = DATASET_END - timedelta(days=counts['span_days'])
+        self.span_seconds = counts['span_days'] * 86400
+
+    def rng(self, table):
+        # Independent streams keep one table's rows stable when another's count changes
+        return random.Random(f'{self.seed}:{table}')
+
+    def moment(self, rng):
+        return self.start + timedelta(seconds=rng.randrange(self.span_seconds))
+
+    def build(self):
+        self.users()
+        self.blog()
+        self.catalog()
+        self.commerce()
+        self.traffic()
+        self.leads()
+        self.scheduling()
+        self.messaging()
+        self.email()
+
+    def users(self):
+        from app.models import Role, user_roles, User
+        rng = self.rng('users')
+        # One bcrypt hash shared by every user; hashing per row would dominate seeding
+        password_hash = bcrypt.generate_password_hash(BENCHMARK_PASSWORD).decode('utf-8')
+
+        def rows():
+            for i in range(self.counts['users']):
+                first, last = _name(rng)
+                yield {
+                    'username': f'bench_user_{i}',
+                    'email': f'user{i}@bench.example.com',
+                    'password_hash': password_hash,
+                    'first_name': first,
+                    'last_name': last,
+                    'tos_accepted': True,
+                    'is_active': True,
+                    'confirmed': True,
+                    'date': self.moment(rng),
+                }
+
+        count = _insert(User, rows(), self.chunk_size)
+        self.user_ids = _ids(User)
+        admin = Role.query.filter_by(name='admin').first()
+        if admin is None:
+            admin = Role(name='admin')
+            db.session.add(admin)
+            db.session.commit()
+        db.session.execute(insert(user_roles), [{'user_id': self.user_ids[0], 'role_id': admin.id}])
+        db.session.commit()
+        self.echo(f'Seeded {count} users.')
+
+    def blog(self):
+        from app.models import Post
+        rng = self.rng('posts')
+
+        def rows():
+            for i in range(self.counts['posts']):
+                created = self.moment(rng)
+                paragraphs = [' '.join(rng.choice(NOUNS).lower() for _ in range(rng.randint(40, 120)))
+                              for _ in range(rng.randint(3, 10))]
+                yield {
+                    'title': f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} Guide {i}',
+                    'slug': f'bench-post-{i}',
+                    'content': ''.join(f'<p>{p}</p>' for p in paragraphs),
+                    'author_id': self.user_ids[0],
+                    'created_at': created,
+                    'updated_at': created,
+                    'is_published': True,
+                }
+
+        count = _insert(Post, rows(), self.chunk_size)
+        self.echo(f'Seeded {count} blog posts.')
+
+    def catalog(self):
+        from app.models import Category, Product
+        rng = self.rng('products')
+        _insert(Category, ({'name': f'Category {i}', 'slug': f'bench-category-{i}', 'display_order': i}
+                           for i in range(CATEGORIES)), self.chunk_size)
+        category_ids = _ids(Category)
+
+        def rows():
+            for i in range(self.counts['products']):
+                reviews = rng.randint(0, 200)
+                yield {
+                    'name': f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}',
+                    'description': f'Benchmark product {i}.',
+                    'price': rng.randint(500, 50000),
+                    'inventory_count': rng.randint(0, 500),
+                    'category_id': rng.choice(category_ids),
+                    'avg_rating': round(rng.uniform(1, 5), 2) if reviews else 0,
+                    'review_count': reviews,
+                    'units_sold': rng.randint(0, 5000),
+                    'created_at': self.moment(rng),
+                }
+
+        count = _insert(Product, rows(), self.chunk_size)
+        self.echo(f'Seeded {count} products.')
+
+    def commerce(self):
+        from app.models import Discount, ShippingZone, ShippingRate, TaxRate
+        db.session.add_all([
+            Discount(code='BENCH10', name='Benchmark 10% off', discount_type='percentage', value=10),
+            Discount(name='Spend $100, save 5%', discount_type='percentage', value=5,
+                     minimum_order_cents=10000, is_automatic=True),
+        ])
+        domestic = ShippingZone(name='United States', countries=['US'])
+        world = ShippingZone(name='Rest of world', is_rest_of_world=True)
+        db.session.add_all([domestic, world])
+        db.session.flush()
+        db.session.add_all([
+            ShippingRate(zone_id=domestic.id, name='Standard', price_cents=599,
+                         estimated_days_min=3, estimated_days_max=5),
+            ShippingRate(zone_id=domestic.id, name='Express', price_cents=1499,
+                         estimated_days_min=1, estimated_days_max=2),
+            ShippingRate(zone_id=domestic.id, name='Free', rate_type='free', min_order_cents=7500),
+            ShippingRate(zone_id=world.id, name='International', price_cents=2499),
+            TaxRate(name='California Sales Tax', rate=0.0725, country='US', state='CA'),
+            TaxRate(name='Beverly Hills District Tax', rate=0.0225, country='US', state='CA',
+                    zip_code='90210', priority=1),
+            TaxRate(name='New York Sales Tax', rate=0.04, country='US', state='NY'),
+            TaxRate(name='Texas Sales Tax', rate=0.0625, country='US', state='TX'),
+        ])
+        db.session.commit()
+
+    def traffic(self):
+        from app.models import PageView, VisitorSession
+        rng = self.rng('traffic')
+        remaining = self.counts['page_views']
+        sessions = []
+        views = []
+        session_count = view_count = 0
+
+        def flush():
+            nonlocal sessions, views
+            # Sessions first: page views only reference them by token
+            _insert(VisitorSession, sessions, self.chunk_size)
+            _insert(PageView, views, self.chunk_size)
+            sessions, views = [], []
+
+        index = 0
+        while remaining > 0:
+            pages = min(remaining, rng.choice([1, 1, 1, 2, 2, 3, 4, 6, 9]))
+            remaining -= pages
+            token = session_token(self.seed, index)
+            index += 1
+            device, browser, os_name = rng.choice(DEVICES)
+            user_id = rng.choice(self.user_ids) if rng.random() < 0.2 else None
+            utm_source = rng.choice(UTM_SOURCES) if rng.random() < 0.3 else None
+            ip_hash = hashlib.sha256(f'{self.seed}:{rng.randrange(1 << 24)}'.encode()).hexdigest()
+            started = self.moment(rng)
+            seen = started
+            urls = []
+            for _ in range(pages):
+                url = rng.choice(PAGES)
+                urls.append(url)
+                views.append({
+                    'session_id': token,
+                    'user_id': user_id,
+                    'url': url,
+                    'referrer': 'https://www.google.com/' if utm_source == 'google' else None,
+                    'user_agent': f'Mozilla/5.0 ({os_name}) {browser}',
+                    'ip_hash': ip_hash,
+                    'timestamp': min(seen, DATASET_END - timedelta(seconds=1)),
+                    'load_time_ms': rng.randint(80, 2500),
+                    'utm_source': utm_source,
+                    'utm_medium': 'email' if utm_source == 'newsletter' else ('cpc' if utm_source else None),
+                    'device_type': device,
+                    'browser': browser,
+                    'os': os_name,
+                })
+                seen += timedelta(seconds=rng.randint(10, 300))
+            last = views[-1]['timestamp']
+            sessions.append({
+                'session_token': token,
+                'user_id': user_id,
+                'ip_hash': ip_hash,
+                'started_at': views[-pages]['timestamp'],
+                'last_activity_at': last,
+                'entry_page': urls[0],
+                'exit_page': urls[-1],
+                'pages_viewed': pages,
+                'duration_seconds': int((last - views[-pages]['timestamp']).total_seconds()) if pages > 1 else None,
+                'bounce': pages == 1,
+                'utm_source': utm_source,
+                'device_type': device,
+                'browser': browser,
+                'os': os_name,
+            })
+            session_count += 1
+            view_count += pages
+            if len(views) >= self.chunk_size:
+                flush()
+        flush()
+        self.session_count = session_count
+        self.echo(f'Seeded {view_count} page views in {session_count} sessions.')
+
+    def leads(self):
+        from app.models import ContactFormSubmission
+        rng = self.rng('leads')
+
+        def rows():
+            for i in range(self.counts['leads']):
+                first, last = _name(rng)
+                yield {
+                    'first_name': first,
+                    'last_name': last,
+                    'email': f'lead{i}@bench.example.com',
+                    'phone': _phone(rng),
+                    'message': f'Looking for a quote on project {i}.',
+                    'submitted_at': self.moment(rng),
+                    'status': rng.choice(LEAD_STATUSES),
+                    'source': rng.choice(LEAD_SOURCES),
+                    'tags': [],
+                    'custom_fields': {},
+                }
+
+        count = _insert(ContactFormSubmission, rows(), self.chunk_size)
+        self.echo(f'Seeded {count} leads.')
+
+    def scheduling(self):
+        from app.models import Appointment, Availability, Estimator, Service
+        rng = self.rng('appointments')
+        _insert(Estimator, ({'name': f'Estimator {i}', 'is_active': True} for i in range(ESTIMATORS)),
+                self.chunk_size)
+        estimator_ids = _ids(Estimator)
+        _insert(Availability, ({'estimator_id': estimator_id, 'day_of_week': day,
+                                'start_time': time(8, 0), 'end_time': time(17, 0)}
+                               for estimator_id in estimator_ids for day in range(5)), self.chunk_size)
+        _insert(Service, ({'name': name, 'duration_minutes': minutes, 'display_order': i}
+                          for i, (name, minutes) in enumerate([('Consultation', 30), ('Estimate', 60),
+                                                               ('Site Survey', 120)])), self.chunk_size)
+        service_ids = _ids(Service)
+
+        # Bookings cover the dataset span and two weeks past its end
+        first_day = self.start.date()
+        days = self.counts['span_days'] + 14
+
+        def rows():
+            for i in range(self.counts['appointments']):
+                day = first_day + timedelta(days=rng.randrange(days))
+                while day.weekday() > 4:
+                    day += timedelta(days=1)
+                first, last = _name(rng)
+                yield {
+                    'first_name': first,
+                    'last_name': last,
+                    'phone': _phone(rng),
+                    'email': f'customer{i}@bench.example.com',
+                    'preferred_date_time': datetime.combine(day, time(8, 0)) + timedelta(minutes=30 * rng.randrange(18)),
+                    'estimator_id': rng.choice(estimator_ids),
+                    'service_id': rng.choice(service_ids),
+                    'status': rng.choice(APPOINTMENT_STATUSES),
+                    'created_at': self.moment(rng),
+                }
+
+        count = _insert(Appointment, rows(), self.chunk_size)
+        self.echo(f'Seeded {count} appointments.')
+
+    def messaging(self):
+        from app.models import Channel, Message, MessageReaction, channel_members
+        rng = self.rng('messages')
+        _insert(Channel, ({'name': f'bench-channel-{i}', 'type': 'public', 'created_by_id': self.user_ids[0],
+                           'created_at': self.start} for i in range(CHANNELS)), self.chunk_size)
+        channel_ids = _ids(Channel)
+        members = {}
+        for channel_id in channel_ids:
+            picked = rng.sample(self.user_ids, min(len(self.user_ids), 25))
+            members[channel_id] = sorted(set(picked) | {self.user_ids[0]})
+        _insert(channel_members, ({'channel_id': channel_id, 'user_id': user_id}
+                                  for channel_id, ids in members.items() for user_id in ids), self.chunk_size)
+
+        # Skewed like real chat: the first channel carries a large share of the traffic
+        weights = [8] + [1] * (len(channel_ids) - 1)
+        total = self.counts['messages']
+        step = self.span_seconds / max(total, 1)
+
+        def rows():
+            for i in range(total):
+                channel_id = rng.choices(channel_ids, weights)[0]
+                yield {
+                    'channel_id': channel_id,
+                    'user_id': rng.choice(members[channel_id]),
+                    'content': f'Benchmark message {i} ' + ' '.join(rng.choice(NOUNS).lower() for _ in range(rng.randint(3, 15))),
+                    'created_at': self.start + timedelta(seconds=int(i * step)),
+                    'read_by': [],
+                    'extra_data': {},
+                }
+
+        count = _insert(Message, rows(), self.chunk_size)
+        message_ids = _ids(Message)
+        user_ids = self.user_ids
+
+        def reactions():
+            for message_id in message_ids:
+                if rng.random() < 0.1:
+                    for user_id in rng.sample(user_ids, min(len(user_ids), rng.randint(1, 3))):
+                        yield {'message_id': message_id, 'user_id': user_id, 'emoji': rng.choice(EMOJI)}
+
+        _insert(MessageReaction, reactions(), self.chunk_size)
+        self.echo(f'Seeded {count} messages in {len(channel_ids)} channels.')
+
+    def email(self):
+        from app.models import EmailCampaign, EmailSend, EmailTemplate
+        rng = self.rng('email')
+        template = EmailTemplate(name='Benchmark newsletter', subject='News from the benchmark',
+                                 body_html='<p>Hello {{ first_name }}</p>', template_type='marketing')
+        db.session.add(template)
+        db.session.commit()
+        _insert(EmailCampaign, ({'name': f'Benchmark campaign {i}', 'template_id': template.id, 'status': 'sent',
+                                 'sent_at': self.start + timedelta(days=i)} for i in range(CAMPAIGNS)),
+                self.chunk_size)
+        campaign_ids = _ids(EmailCampaign)
+        weights = [50, 20, 15, 10, 5][:len(campaign_ids)]
+        users = len(self.user_ids)
+
+        def rows():
+            for i in range(self.counts['email_sends']):
+                sent_at = self.moment(rng)
+                opened = rng.random() < 0.35
+                clicked = opened and rng.random() < 0.25
+                yield {
+                    'campaign_id': rng.choices(campaign_ids, weights)[0],
+                    'template_id': template.id,
+                    'recipient_email': f'user{i % users}@bench.example.com',
+                    'tracking_token': f'bench-{self.seed:x}-{i:012d}',
+                    'sent_at': sent_at,
+                    'delivered_at': sent_at,
+                    'first_opened_at': sent_at + timedelta(hours=rng.randint(1, 48)) if opened else None,
+                    'open_count': rng.randint(1, 5) if opened else 0,
+                    'first_clicked_at': sent_at + timedelta(hours=rng.randint(1, 72)) if clicked else None,
+                    'click_count': rng.randint(1, 3) if clicked else 0,
+                    'bounced': rng.random() < 0.02,
+                    'unsubscribed': rng.random() < 0.005,
+                    'complained': rng.random() < 0.001,
+                }
+
+        count = _insert(EmailSend, rows(), self.chunk_size)
+        self.echo(f'Seeded {count} email sends across {len(campaign_ids)} campaigns.')
+
+
+def seed_dataset(scale='small', seed=42, chunk_size=5000, echo=None, **overrides):
+    """
+    Seed an empty database with a benchmark dataset.
+
+    Raises:
+        ValueError: unknown scale or count, or the database already has users
+
+    Returns:
+        dict: dataset identity (scale, seed, digest) plus the row counts
+    """
+    from app.models import BusinessConfig, User
+    from app.modules.analytics_rollups import refresh_traffic_rollups
+    from app.modules.search_index import get_index, index_names
+
+    counts = dataset_counts(scale, **overrides)
+    if db.session.query(func.count(User.id)).scalar():
+        raise ValueError('Benchmark data must be seeded into an empty database')
+
+    DatasetBuilder(seed, counts, chunk_size=chunk_size, echo=echo).build()
+    # Bulk inserts skip the mapper events that keep the search indexes current
+    for name in index_names():
+        get_index(name).rebuild(batch_size=chunk_size, echo=echo)
+    # Roll up every seeded hour so reports start from a settled watermark
+    refresh_traffic_rollups(now=DATASET_END + timedelta(hours=1))
+
+    identity = dataset_identity(scale, seed, counts)
+    db.session.add(BusinessConfig(setting_name=DATASET_SETTING, setting_value=json.dumps(identity)))
+    db.session.commit()
+    return dict(identity, counts=counts)
+
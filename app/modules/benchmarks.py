@@ -0,0 +1,279 @@
+"""
+Benchmarks Module
+
+Repeatable timings of hot paths against a seeded dataset (see
+benchmark_data):
+
+- Each scenario prepares its inputs from the dataset once, then runs the
+  same call for a few warm-up and measured iterations, with a fresh
+  database session each time
+- Per scenario: wall time (median, min, p95, max), the query count seen
+  by the query profiler, and peak Python memory from one extra run under
+  tracemalloc (kept out of the timings, which it would distort)
+- Results are plain JSON, tagged with the dataset identity and the
+  environment, so they can be stored as a baseline and compared later
+- compare() reports a regression when wall time or peak memory grows past
+  the tolerance (and an absolute floor that absorbs timer noise), or when
+  the query count grows at all
+
+Everything runs in-process against the configured database; nothing
+leaves the machine.
+"""
+
+import platform
+import statistics
+import time
+import tracemalloc
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import sqlalchemy
+from flask import current_app, request
+from sqlalchemy import func, select
+
+from app.database import db
+from app.modules.benchmark_data import DATASET_END, current_dataset, session_token
+from app.modules.performance import get_query_profiler
+
+RESULTS_VERSION = 1
+
+# Fixed inputs: a Tuesday in the last full week of data, and its month
+SLOT_DAY = date(2025, 12, 23)
+MONTH_START = date(2025, 12, 1)
+
+
+class Scenario:
+    """A named hot path. prepare(dataset) returns the zero-argument call to time."""
+
+    def __init__(self, name, description, prepare):
+        self.name = name
+        self.description = description
+        self.prepare = prepare
+
+
+SCENARIOS = {}
+
+
+def scenario(name, description):
+    """Register a scenario's prepare function."""
+    def decorator(prepare):
+        SCENARIOS[name] = Scenario(name, description, prepare)
+        return prepare
+    return decorator
+
+
+def _first_id(model, *criteria):
+    return db.session.execute(select(func.min(model.id)).where(*criteria)).scalar()
+
+
+@scenario('available_slots', 'Free booking slots for one estimator-day')
+def _available_slots(dataset):
+    from app.models import Estimator
+    from app.modules.availability_service import get_available_slots
+    estimator_id = _first_id(Estimator)
+    return lambda: get_available_slots(estimator_id, SLOT_DAY, slot_interval_minutes=30)
+
+
+@scenario('available_slots_month', 'Free booking slots for one estimator over 31 days')
+def _available_slots_month(dataset):
+    from app.models import Estimator
+    from app.modules.availability_service import get_available_slots_range
+    estimator_id = _first_id(Estimator)
+    return lambda: get_available_slots_range(estimator_id, MONTH_START, 31)
+
+
+@scenario('cart_totals', 'Cart totals with a coupon, automatic discount, shipping and tax')
+def _cart_totals(dataset):
+    from app.models import Product
+    rows = db.session.execute(
+        select(Product.id, Product.price).order_by(Product.id).limit(5)
+    ).all()
+    items = [{'product_id': product_id, 'price': price, 'quantity': 1 + i % 3}
+             for i, (product_id, price) in enumerate(rows)]
+
+    def run():
+        from app.modules.ecommerce import calculate_cart_totals
+        return calculate_cart_totals(items, discount_code='BENCH10', country='US',
+                                     state='CA', zip_code='90210')
+    return run
+
+
+@scenario('log_page_view', 'Capture 500 page views and write them as one ingest batch')
+def _log_page_view(dataset):
+    from app.modules.analytics_ingest import _write_batch, build_page_view_event
+    app = current_app._get_current_object()
+    seed = dataset['seed'] if dataset else 0
+    agents = ['Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0',
+              'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Safari/604.1']
+
+    def run():
+        # Half the views continue seeded sessions, half start new ones
+        prefix = uuid.uuid4().hex[:12]
+        batch = []
+        for i in range(500):
+            is_new = i % 2 == 0
+            token = f'{prefix}-{i}' if is_new else session_token(seed, i)
+            with app.test_request_context(f'/blog/post-{i % 30 + 1}?utm_source=newsletter',
+                                          headers={'User-Agent': agents[i % 2]}):
+                batch.append(build_page_view_event(request, None, token, is_new))
+        _write_batch(batch)
+        db.session.commit()
+    return run
+
+
+@scenario('traffic_metrics', 'Traffic report over the whole dataset span')
+def _traffic_metrics(dataset):
+    from app.models import PageView
+    from app.modules.reporting import calculate_traffic_metrics
+    start = db.session.execute(select(func.min(PageView.timestamp))).scalar() or DATASET_END - timedelta(days=30)
+    return lambda: calculate_traffic_metrics(start, DATASET_END)
+
+
+@scenario('campaign_stats', 'Recount delivery statistics of the largest email campaign')
+def _campaign_stats(dataset):
+    from app.models import EmailCampaign
+    from app.modules.email_marketing import calculate_campaign_stats
+    campaign_id = _first_id(EmailCampaign)
+    return lambda: calculate_campaign_stats(db.session.get(EmailCampaign, campaign_id))
+
+
+@scenario('poll_messages', 'Poll the busiest channel for its latest 50 messages')
+def _poll_messages(dataset):
+    from flask_login import login_user
+    from app.models import Channel, Message, User
+    from app.routes.admin_routes.messaging import poll_messages
+    app = current_app._get_current_object()
+    channel_id = _first_id(Channel)
+    user_id = _first_id(User)
+    last_id = db.session.execute(
+        select(Message.id).where(Message.channel_id == channel_id)
+        .order_by(Message.id.desc()).offset(50).limit(1)
+    ).scalar() or 0
+
+    def run():
+        with app.test_request_context(f'/channel/{channel_id}/poll?last_id={last_id}'):
+            login_user(db.session.get(User, user_id))
+            return poll_messages(channel_id=channel_id)
+    return run
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(call, iterations=10, warmup=2):
+    """Time call() and count its queries; returns the scenario's result dict."""
+    profiler = get_query_profiler()
+    for _ in range(warmup):
+        call()
+        db.session.remove()
+
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        profiler.start()
+        started = time.perf_counter()
+        try:
+            call()
+        finally:
+            elapsed = time.perf_counter() - started
+            summary = profiler.stop()
+        db.session.remove()
+        timings.append(elapsed * 1000)
+        queries.append(summary['count'])
+
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        db.session.remove()
+
+    return {
+        'iterations': iterations,
+        'wall_ms': {
+            'median': round(statistics.median(timings), 3),
+            'min': round(min(timings), 3),
+            'p95': round(_percentile(timings, 0.95), 3),
+            'max': round(max(timings), 3),
+        },
+        'queries': statistics.median_low(queries),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(names=None, iterations=10, warmup=2, echo=None):
+    """
+    Run scenarios (default: all) in the app context against the seeded data.
+
+    Returns:
+        dict: JSON-ready results with dataset, environment and scenarios
+    """
+    echo = echo or (lambda message: None)
+    dataset = current_dataset()
+    unknown = [name for name in names or [] if name not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"Unknown scenario(s): {', '.join(unknown)}")
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'dataset': dataset,
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'database': db.engine.dialect.name,
+        },
+        'scenarios': {},
+    }
+    for name in names or SCENARIOS:
+        call = SCENARIOS[name].prepare(dataset)
+        db.session.remove()
+        result = measure(call, iterations=iterations, warmup=warmup)
+        results['scenarios'][name] = result
+        echo(f"{name}: {result['wall_ms']['median']:.2f} ms median, "
+             f"{result['queries']} queries, {result['peak_kb']:.0f} KiB peak")
+    return results
+
+
+def compare(results, baseline, tolerance=0.2, min_ms=1.0, min_kb=64):
+    """
+    Regressions of results against a baseline run.
+
+    Wall time (median) and peak memory regress when they exceed the
+    baseline by more than tolerance and by more than min_ms / min_kb;
+    query counts regress on any increase. Scenarios missing from either
+    side are skipped.
+
+    Raises:
+        ValueError: the runs were made against different datasets
+
+    Returns:
+        list of dicts: scenario, metric, baseline, current
+    """
+    def identity(run):
+        return {k: v for k, v in (run.get('dataset') or {}).items() if k in ('scale', 'seed', 'digest')}
+
+    if identity(results) != identity(baseline):
+        raise ValueError(f"Baseline dataset {identity(baseline)} does not match {identity(results)}")
+
+    regressions = []
+    for name, current in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        checks = [
+            ('wall_ms', before['wall_ms']['median'], current['wall_ms']['median'], min_ms),
+            ('peak_kb', before['peak_kb'], current['peak_kb'], min_kb),
+        ]
+        for metric, old, new, floor in checks:
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append({'scenario': name, 'metric': metric, 'baseline': old, 'current': new})
+        if current['queries'] > before['queries']:
+            regressions.append({'scenario': name, 'metric': 'queries',
+                                'baseline': before['queries'], 'current': current['queries']})
+    return regressions
@@ -0,0 +1,275 @@
+"""
+Blob Store Module
+
+Pluggable storage for file content (Media uploads, blog post images,
+digital downloads), addressed by SHA-256 checksum:
+
+- LocalBlobStore keeps each distinct blob once, at
+  <BLOB_STORAGE_PATH>/<ab>/<cd>/<checksum>, so identical uploads share a
+  file. Writes go to a temp file beside the store and are renamed into
+  place; readers never see a partial blob
+- BLOB_STORAGE_BACKEND selects 'local' (default) or a dotted path to a
+  custom class constructed with the app
+- send_blob() serves content with send_file(conditional=True): Range
+  requests get 206 partial responses, and the body can be handed to the
+  web server with USE_X_SENDFILE (Apache/lighttpd) or
+  BLOB_ACCEL_REDIRECT_PREFIX (nginx X-Accel-Redirect)
+- Conditional GET: send_blob() answers If-None-Match/If-Modified-Since
+  with 304 from the validators it is given (checksum, or an etag and
+  last-modified time from metadata columns) before any payload is read.
+  URLs carrying ?v=<blob_version(checksum)> are content-addressed and
+  cached as immutable for a year; other URLs must revalidate
+- Released blobs are deleted only once the transaction that dropped their
+  last reference commits (blob_in_use() says whether anything still
+  refers to one); a rollback keeps them
+
+Rows written before the store existed keep their bytes in the database
+and are still served from there until `flask migrate-blobs` moves them.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from io import BytesIO
+from flask import abort, current_app, request, send_file
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.http import is_resource_modified
+from werkzeug.utils import import_string
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+VERSION_LENGTH = 16
+_CHECKSUM_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def checksum_of(data):
+    """SHA-256 hex digest used as a blob's address."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_version(checksum):
+    """Value for a blob URL's ?v= parameter; such URLs are served as immutable."""
+    return checksum[:VERSION_LENGTH] if checksum else None
+
+
+class LocalBlobStore:
+    """Content-addressed blobs on the local filesystem."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def relative_path(self, checksum):
+        if not _CHECKSUM_RE.match(checksum or ''):
+            raise ValueError(f'Invalid blob checksum: {checksum!r}')
+        return f'{checksum[:2]}/{checksum[2:4]}/{checksum}'
+
+    def local_path(self, checksum):
+        """Filesystem path of a blob, for send_file and web server offload."""
+        return os.path.join(self.root, *self.relative_path(checksum).split('/'))
+
+    def exists(self, checksum):
+        try:
+            return os.path.isfile(self.local_path(checksum))
+        except ValueError:
+            return False
+
+    def size(self, checksum):
+        return os.path.getsize(self.local_path(checksum))
+
+    def open(self, checksum):
+        return open(self.local_path(checksum), 'rb')
+
+    def put(self, data):
+        """Store bytes; returns the checksum. Existing content is not rewritten."""
+        checksum, _ = self.put_stream(BytesIO(data))
+        return checksum
+
+    def put_stream(self, stream, chunk_size=CHUNK_SIZE):
+        """
+        Store a binary stream without holding it in memory.
+
+        Returns:
+            (checksum, size)
+        """
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(prefix='.incoming-', dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    temp.write(chunk)
+            checksum = digest.hexdigest()
+            path = self.local_path(checksum)
+            if os.path.isfile(path):
+                os.unlink(temp_path)  # Already stored
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, path)
+            return checksum, size
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def delete(self, checksum):
+        try:
+            os.unlink(self.local_path(checksum))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def create_blob_store(app):
+    """Build the store named by BLOB_STORAGE_BACKEND."""
+    name = app.config.get('BLOB_STORAGE_BACKEND', 'local')
+    if name == 'local':
+        root = app.config.get('BLOB_STORAGE_PATH') or os.path.join(app.instance_path, 'blobs')
+        return LocalBlobStore(root)
+    return import_string(name)(app)
+
+
+def get_blob_store():
+    return current_app.extensions['blob_store']
+
+
+def init_blob_store(app):
+    """Attach the blob store to the app and register the delete-on-commit hooks (idempotent)."""
+    app.extensions['blob_store'] = create_blob_store(app)
+    app.add_template_global(blob_version)
+    if not event.contains(Session, 'after_commit', _session_committed):
+        event.listen(Session, 'after_commit', _session_committed)
+        event.listen(Session, 'after_rollback', _session_rolled_back)
+
+
+def blob_in_use(checksum):
+    """Whether a Media row, post image or image variant refers to a blob (sees flushed changes)."""
+    from app.database import db
+    from app.models import ImageVariant, Media, Post
+
+    return any(db.session.query(column).filter(column == checksum).first() is not None
+               for column in (Media.checksum, Post.image_checksum, ImageVariant.checksum))
+
+
+def delete_blob_after_commit(checksum):
+    """Delete a blob when the current transaction commits."""
+    from app.database import db
+
+    db.session.info.setdefault('released_blobs', set()).add(checksum)
+
+
+def _session_committed(session):
+    released = session.info.pop('released_blobs', None)
+    if released:
+        store = get_blob_store()
+        for checksum in released:
+            store.delete(checksum)
+
+
+def _session_rolled_back(session):
+    session.info.pop('released_blobs', None)
+
+
+def _not_modified(etag, last_modified):
+    """True when the client's cached copy is still current."""
+    if request.method not in ('GET', 'HEAD') or not (etag or last_modified):
+        return False
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+
+def _cache_headers(response, etag, last_modified, private, immutable):
+    if etag:
+        response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    cache_control = response.cache_control
+    cache_control.no_cache = None
+    if private:
+        cache_control.private = True
+    else:
+        cache_control.public = True
+    if immutable:
+        cache_control.max_age = IMMUTABLE_MAX_AGE
+        cache_control.immutable = True
+    else:
+        cache_control.no_cache = True
+    return response
+
+
+def send_blob(checksum=None, load_data=None, mimetype=None, download_name=None, as_attachment=False,
+              etag=None, last_modified=None, private=False, immutable=False):
+    """
+    Response serving stored content, with Range and conditional GET support.
+
+    Revalidation is answered from the validators alone, so callers should
+    load metadata columns only and defer the payload to load_data.
+
+    Args:
+        checksum: Address of a blob in the store (also the ETag)
+        load_data: Callable returning bytes still held in the database
+            (rows not yet migrated); only called when the store lacks the blob
+        mimetype: Content type
+        download_name: Filename for Content-Disposition
+        as_attachment: Prompt a download rather than display inline
+        etag: ETag for rows without a checksum, built from metadata
+        last_modified: When the content last changed
+        private: Forbid shared caches (per-user content)
+        immutable: The URL itself is content-addressed (no ?v= needed)
+    """
+    etag = checksum or etag
+    if last_modified:
+        last_modified = last_modified.replace(microsecond=0)  # HTTP dates have second precision
+    immutable = immutable or (bool(checksum) and request.args.get('v') == blob_version(checksum))
+    if _not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+        return _cache_headers(response, etag, last_modified, private, immutable)
+
+    store = get_blob_store()
+    if checksum and store.exists(checksum):
+        accel_prefix = current_app.config.get('BLOB_ACCEL_REDIRECT_PREFIX')
+        if accel_prefix and hasattr(store, 'relative_path'):
+            # nginx serves the body (and Range) from an internal location
+            response = current_app.response_class(mimetype=mimetype or 'application/octet-stream')
+            response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{store.relative_path(checksum)}"
+            disposition = 'attachment' if as_attachment else 'inline'
+            if download_name:
+                response.headers.set('Content-Disposition', disposition, filename=download_name)
+            return _cache_headers(response, etag, last_modified, private, immutable)
+        source = store.local_path(checksum) if hasattr(store, 'local_path') else store.open(checksum)
+        response = send_file(
+            source,
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            etag=checksum,
+            last_modified=last_modified,
+            conditional=True
+        )
+        return _cache_headers(response, etag, last_modified, private, immutable)
+    data = load_data() if load_data else None
+    if data is None:
+        if checksum:
+            logger.error(f"Blob {checksum} is missing from the store")
+        abort(404)
+    etag = etag or checksum_of(data)
+    response = send_file(
+        BytesIO(data),
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        etag=etag,
+        last_modified=last_modified,
+        conditional=True
+    )
+    return _cache_headers(response, etag, last_modified, private, immutable)
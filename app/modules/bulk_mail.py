@@ -0,0 +1,108 @@
+"""
+Bulk Mail Delivery Module
+
+Streaming delivery engine for large sends (newsletters, email campaigns):
+- Recipients are paged with keyset pagination (ORDER BY key, WHERE
+  key > last) so memory stays flat regardless of list size
+- Each batch goes out over a single SMTP connection via mail.connect()
+- Sends are paced to a configurable rate (MAIL_SEND_RATE messages/second)
+- Progress is checkpointed after every batch so a crashed send resumes
+  where it stopped instead of re-sending
+"""
+
+import logging
+import smtplib
+import time
+from sqlalchemy import select, union
+from app.database import db
+from app.extensions import mail
+
+logger = logging.getLogger(__name__)
+
+# Connection-level failures abort the batch; the caller retries from the last checkpoint
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+class RateLimiter:
+    """Pace work to `rate` units per second (0 or None disables pacing)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = time.monotonic()
+
+    def acquire(self, units=1):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_slot > now:
+            time.sleep(self.next_slot - now)
+        self.next_slot = max(self.next_slot, now) + units * self.interval
+
+
+def newsletter_recipients_query():
+    """
+    Distinct subscriber emails (contacts and users) minus unsubscribes,
+    deduplicated and suppressed in SQL. Returns a select of one 'email'
+    column suitable for iter_email_pages().
+    """
+    from app.models import ContactFormSubmission, User, UnsubscribedEmail
+
+    emails = union(
+        select(ContactFormSubmission.email.label('email')),
+        select(User.email.label('email')),
+    ).subquery()
+
+    return select(emails.c.email).where(
+        emails.c.email != None,
+        emails.c.email.notin_(select(UnsubscribedEmail.email))
+    )
+
+
+def iter_keyset_pages(query, key, after=None, page_size=50):
+    """
+    Yield lists of rows from `query` in ascending `key` order, resuming
+    after the `after` checkpoint. `key` must be the first selected column.
+    Each page is a fresh keyset query, so no cursor or result set is held
+    open between batches.
+    """
+    while True:
+        page_query = query.order_by(key).limit(page_size)
+        if after is not None:
+            page_query = page_query.where(key > after)
+        page = db.session.execute(page_query).all()
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        after = page[-1][0]
+
+
+def iter_email_pages(query, after=None, page_size=50):
+    """Yield lists of emails from a single-column email query, in order."""
+    for page in iter_keyset_pages(query, query.selected_columns[0], after, page_size):
+        yield [row[0] for row in page]
+
+
+def deliver_batch(messages):
+    """
+    Send messages over one SMTP connection.
+
+    Per-recipient rejections are logged and collected; connection failures
+    propagate so the caller can retry the batch from its checkpoint.
+
+    Returns (sent, failures) where failures is a list of (message, error).
+    """
+    sent = 0
+    failures = []
+    with mail.connect() as conn:
+        for msg in messages:
+            try:
+                conn.send(msg)
+                sent += 1
+            except CONNECTION_ERRORS:
+                raise
+            except Exception as e:
+                failures.append((msg, e))
+                logger.warning(f"Failed to send to {msg.recipients}: {e}")
+    return sent, failures
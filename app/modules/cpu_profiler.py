@@ -0,0 +1,318 @@
+"""
+CPU Profiler Module
+
+Statistical profiling of request threads, cheap enough to leave on in
+production:
+
+- One sampler thread per process wakes every CPU_PROFILE_INTERVAL_MS and
+  reads the stacks of the threads currently serving requests through
+  sys._current_frames(); it sleeps while no request is in flight
+- Each request's samples are aggregated in collapsed-stack form
+  ("outer;inner;leaf" -> count), the input format of flamegraph.pl and
+  speedscope
+- A request is kept when it ran longer than CPU_PROFILE_SLOW_MS, or when
+  an admin asked for it with ?_profile=1 or an X-Profile: 1 header (or
+  sent CPU_PROFILE_TOKEN in X-Profile-Token); other samples are discarded
+- Kept profiles are written to CPU_PROFILE_PATH so every worker's captures
+  appear on the admin profiles page, which renders them as flamegraphs
+
+Sampling is by OS thread, so it needs sync or gthread workers; under gevent
+the profiler stays off, as it does in TESTING apps.
+"""
+
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from itertools import count
+
+from flask import g, request
+
+from app.modules.metrics_core import _cooperative
+
+logger = logging.getLogger(__name__)
+
+MAX_DEPTH = 128
+PROFILE_ID_COUNTER = count(1)
+
+
+def _short_path(filename):
+    marker = f'site-packages{os.sep}'
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if filename.startswith(root):
+        return os.path.relpath(filename, root)
+    return os.path.basename(filename)
+
+
+class StackSampler:
+    """Samples the stacks of registered threads from a background thread."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.ticks = 0
+        self.busy_time = 0.0  # Seconds spent sampling, to keep the overhead honest
+        self._targets = {}  # thread ident -> {collapsed stack: samples}
+        self._lock = threading.Lock()
+        self._has_targets = threading.Event()
+        self._labels = {}  # code object -> frame label
+        self._thread = None
+        self._pid = None
+
+    def begin(self):
+        """Start sampling the calling thread."""
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+        stacks = {}
+        with self._lock:
+            self._targets[threading.get_ident()] = stacks
+            self._has_targets.set()
+        return stacks
+
+    def end(self):
+        """Stop sampling the calling thread; returns its collapsed stacks."""
+        with self._lock:
+            stacks = self._targets.pop(threading.get_ident(), None)
+            if not self._targets:
+                self._has_targets.clear()
+        return stacks
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            # A forked child has no sampler thread, and no requests yet
+            self._targets = {}
+            self._has_targets.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='cpu-profiler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._has_targets.wait()
+            time.sleep(self.interval)
+            started = time.perf_counter()
+            frames = None
+            with self._lock:
+                if self._targets:
+                    frames = sys._current_frames()
+                    for ident, stacks in self._targets.items():
+                        frame = frames.get(ident)
+                        if frame is not None:
+                            stack = self._collapse(frame)
+                            stacks[stack] = stacks.get(stack, 0) + 1
+            del frames
+            self.ticks += 1
+            self.busy_time += time.perf_counter() - started
+
+    def _collapse(self, frame):
+        labels = []
+        while frame is not None and len(labels) < MAX_DEPTH:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = (
+                    f'{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})'
+                ).replace(';', ':')
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+
+
+# ============================================================================
+# Stored Profiles
+# ============================================================================
+
+def save_profile(directory, stacks, meta, keep=200):
+    """Write a profile (<id>.folded and <id>.json); returns its id."""
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f'{int(time.time() * 1000)}-{os.getpid()}-{next(PROFILE_ID_COUNTER)}'
+    with open(os.path.join(directory, f'{profile_id}.folded'), 'w') as f:
+        for stack, samples in sorted(stacks.items()):
+            f.write(f'{stack} {samples}\n')
+    meta = dict(meta, id=profile_id, samples=sum(stacks.values()))
+    # Write the index entry last: listings only show profiles whose stacks exist
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as f:
+        json.dump(meta, f)
+    _prune(directory, keep)
+    return profile_id
+
+
+def _prune(directory, keep):
+    entries = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    for name in entries[:-keep] if keep else []:
+        for suffix in ('.json', '.folded'):
+            try:
+                os.remove(os.path.join(directory, name[:-5] + suffix))
+            except OSError:
+                pass
+
+
+def list_profiles(directory, limit=100):
+    """Newest stored profiles' metadata."""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((name for name in os.listdir(directory) if name.endswith('.json')),
+                   key=lambda name: int(name.split('-', 1)[0]), reverse=True)
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(directory, name)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def _profile_path(directory, profile_id, suffix):
+    if not profile_id or os.sep in profile_id or profile_id.startswith('.'):
+        return None
+    return os.path.join(directory, f'{profile_id}{suffix}')
+
+
+def load_profile(directory, profile_id):
+    """(metadata, folded text) of a stored profile, or None."""
+    meta_path = _profile_path(directory, profile_id, '.json')
+    if meta_path is None or not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    with open(_profile_path(directory, profile_id, '.folded')) as f:
+        return meta, f.read()
+
+
+def parse_folded(text):
+    """{collapsed stack: samples} from collapsed-stack text."""
+    stacks = {}
+    for line in text.splitlines():
+        stack, _, samples = line.rpartition(' ')
+        if stack and samples.isdigit():
+            stacks[stack] = stacks.get(stack, 0) + int(samples)
+    return stacks
+
+
+def flame_layout(stacks, min_width=0.001):
+    """
+    Rectangles for a flamegraph of collapsed stacks.
+
+    Returns (rects, depth): each rect has name, depth, x and width (as
+    fractions of all samples), samples and a color hue. Frames narrower
+    than min_width are left out.
+    """
+    root = {'children': {}, 'samples': 0}
+    for stack, samples in stacks.items():
+        node = root
+        node['samples'] += samples
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'children': {}, 'samples': 0})
+            node['samples'] += samples
+
+    total = root['samples']
+    rects = []
+    max_depth = 0
+    if not total:
+        return rects, max_depth
+    pending = [(root, 0.0, -1)]
+    while pending:
+        node, x, depth = pending.pop()
+        for name, child in sorted(node['children'].items()):
+            width = child['samples'] / total
+            if width >= min_width:
+                rects.append({
+                    'name': name,
+                    'depth': depth + 1,
+                    'x': x,
+                    'width': width,
+                    'samples': child['samples'],
+                    'hue': zlib.crc32(name.split(' (')[0].encode()) % 60,
+                })
+                max_depth = max(max_depth, depth + 1)
+                pending.append((child, x, depth + 1))
+            x += width
+    return rects, max_depth + 1
+
+
+# ============================================================================
+# Request Integration
+# ============================================================================
+
+sampler = StackSampler()
+
+
+def _profile_requested(app):
+    if request.args.get('_profile') != '1' and request.headers.get('X-Profile') != '1':
+        token = request.headers.get('X-Profile-Token')
+        expected = app.config.get('CPU_PROFILE_TOKEN')
+        return bool(token and expected and hmac.compare_digest(token, expected))
+    try:
+        from flask_login import current_user
+        return current_user.is_authenticated and current_user.has_role('admin')
+    except Exception:
+        return False
+
+
+def profile_directory(app):
+    return app.config.get('CPU_PROFILE_PATH') or os.path.join(app.instance_path, 'profiles')
+
+
+def init_cpu_profiler(app):
+    """Sample request threads and keep profiles of slow or requested requests."""
+    if not app.config.get('CPU_PROFILE_ENABLED', True) or app.testing or _cooperative():
+        return
+    sampler.interval = app.config.get('CPU_PROFILE_INTERVAL_MS', 10) / 1000.0
+
+    def finish(response=None):
+        state = g.pop('cpu_profile', None)
+        if state is None:
+            return None
+        stacks = sampler.end()
+        started, requested = state
+        duration = time.perf_counter() - started
+        slow_ms = app.config.get('CPU_PROFILE_SLOW_MS', 1000)
+        if not stacks or not (requested or (slow_ms and duration * 1000 >= slow_ms)):
+            return None
+        meta = {
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code if response is not None else 500,
+            'duration_ms': round(duration * 1000, 1),
+            'trigger': 'request' if requested else 'slow',
+            'interval_ms': round(sampler.interval * 1000, 2),
+            'captured_at': datetime.now(timezone.utc).isoformat(),
+        }
+        try:
+            return save_profile(profile_directory(app), stacks, meta,
+                                keep=app.config.get('CPU_PROFILE_KEEP', 200))
+        except OSError as e:
+            logger.error(f"Could not save CPU profile: {e}")
+            return None
+
+    @app.before_request
+    def start_cpu_profile():
+        if app.testing:
+            return  # Test apps often turn TESTING on only after create_app()
+        requested = _profile_requested(app)
+        if requested or app.config.get('CPU_PROFILE_SLOW_MS', 1000):
+            g.cpu_profile = (time.perf_counter(), requested)
+            sampler.begin()
+
+    @app.after_request
+    def save_cpu_profile(response):
+        profile_id = finish(response)
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    @app.teardown_request
+    def end_cpu_profile(exc):
+        # after_request is skipped when a view raises
+        finish()
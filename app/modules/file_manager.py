@@ -2,14 +2,22 @@
 File Manager Module
 
 Handles file uploads, storage, and image processing.
+File content lives in the content-addressed blob store (blob_store.py);
+Media rows hold the metadata and the checksum that addresses it.
+Image uploads queue responsive variants (image_variants.py).
 """
 
-import hashlib
+import logging
+import os
 from io import BytesIO
 from app.models import Media
 from app.database import db
+from app.modules.blob_store import blob_in_use, delete_blob_after_commit, get_blob_store
+from app.modules.image_variants import delete_variants, queue_variants, wants_variants
 from werkzeug.utils import secure_filename
 
+logger = logging.getLogger(__name__)
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'pdf', 'txt', 'md', 'doc', 'docx', 'xls', 'xlsx'}
 IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
@@ -35,17 +43,18 @@ def compress_image(data, quality=85, max_dimension=2048):
     Compress an image using Pillow.
     
     Args:
-        data: Raw image bytes
+        data: Raw image bytes, or a seekable binary stream (read by
+            Pillow directly, so the upload is never copied into memory)
         quality: JPEG quality (1-100)
         max_dimension: Max width/height, larger images are resized
     
     Returns:
-        Compressed image bytes
+        Compressed image bytes, or `data` unchanged if it cannot be compressed
     """
     try:
         from PIL import Image
         
-        img = Image.open(BytesIO(data))
+        img = Image.open(data if hasattr(data, 'read') else BytesIO(data))
         
         # Convert RGBA to RGB for JPEG
         if img.mode in ('RGBA', 'P'):
@@ -75,67 +84,137 @@ def compress_image(data, quality=85, max_dimension=2048):
         return data
 
 
-def save_media(file_storage, user_id=None, compress=True):
+def stream_size(stream):
+    """Length of a seekable stream, leaving it rewound."""
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def media_from_stream(stream, filename, mimetype, user_id=None):
     """
-    Saves a FileStorage object to the database.
+    Stream content into the blob store and add a Media row for it (not committed).
     
-    Args:
-        file_storage: Werkzeug FileStorage object
-        user_id: Optional user ID for tracking
-        compress: Auto-compress large images
+    The content is copied in fixed-size chunks and hashed as it goes, so
+    memory use does not depend on the file size.
     
     Returns:
-        Created Media object or None if invalid
+        Flushed Media object
     """
-    if not file_storage or not allowed_file(file_storage.filename):
-        return None
+    checksum, size = get_blob_store().put_stream(stream)
+    return _add_media(filename, mimetype, size, checksum, user_id)
 
-    filename = secure_filename(file_storage.filename)
-    data = file_storage.read()
-    size = len(data)
-    mimetype = file_storage.mimetype
-    
-    # Auto-compress large images
-    if compress and is_image(filename) and size > AUTO_COMPRESS_THRESHOLD:
-        compressed_data = compress_image(data)
-        if len(compressed_data) < size:
-            data = compressed_data
-            size = len(data)
-            # Update mimetype for JPEG conversion
-            if mimetype not in ('image/jpeg', 'image/jpg'):
-                mimetype = 'image/jpeg'
-                # Update filename extension
-                name_parts = filename.rsplit('.', 1)
-                if len(name_parts) == 2:
-                    filename = f"{name_parts[0]}.jpg"
-    
-    checksum = hashlib.sha256(data).hexdigest()
 
+def _add_media(filename, mimetype, size, checksum, user_id):
     media = Media(
         filename=filename,
-        data=data,
         mimetype=mimetype,
         size=size,
         checksum=checksum,
         uploaded_by_id=user_id
     )
-    
     db.session.add(media)
+    db.session.flush()
+    if wants_variants(mimetype):
+        queue_variants(checksum)
+    return media
+
+
+def media_from_upload(file_storage, user_id=None, compress=False):
+    """
+    Store an uploaded file's content and add a Media row for it (not committed).
+    
+    Large images are re-encoded when `compress` is set and that makes them
+    smaller; everything else is streamed into the blob store. Werkzeug has
+    already spooled multipart file parts to disk, so nothing here reads the
+    whole upload into memory.
+    
+    Args:
+        file_storage: Werkzeug FileStorage object
+        user_id: Optional user ID for tracking
+        compress: Auto-compress large images
+    
+    Returns:
+        Flushed Media object
+    """
+    filename = secure_filename(file_storage.filename)
+    mimetype = file_storage.mimetype
+    stream = file_storage.stream
+    
+    if compress and is_image(filename):
+        size = stream_size(stream)
+        
+        # Auto-compress large images
+        if size > AUTO_COMPRESS_THRESHOLD:
+            compressed_data = compress_image(stream)
+            if isinstance(compressed_data, bytes) and len(compressed_data) < size:
+                # Update mimetype for JPEG conversion
+                if mimetype not in ('image/jpeg', 'image/jpg'):
+                    mimetype = 'image/jpeg'
+                    # Update filename extension
+                    name_parts = filename.rsplit('.', 1)
+                    if len(name_parts) == 2:
+                        filename = f"{name_parts[0]}.jpg"
+                # Identical content is stored once
+                checksum = get_blob_store().put(compressed_data)
+                return _add_media(filename, mimetype, len(compressed_data), checksum, user_id)
+            stream.seek(0)
+    
+    return media_from_stream(stream, filename, mimetype, user_id=user_id)
+
+
+def save_media(file_storage, user_id=None, compress=True):
+    """
+    Saves a FileStorage object to the blob store and the media library.
+    
+    Args:
+        file_storage: Werkzeug FileStorage object
+        user_id: Optional user ID for tracking
+        compress: Auto-compress large images
+    
+    Returns:
+        Created Media object or None if invalid
+    """
+    if not file_storage or not allowed_file(file_storage.filename):
+        return None
+
+    media = media_from_upload(file_storage, user_id=user_id, compress=compress)
     db.session.commit()
     
     return media
 
 
+def release_blob(checksum):
+    """
+    Delete a blob, and its image variants, once nothing refers to it.
+    
+    Rows are deleted with the caller's commit and files only after it, so
+    call this before committing the change that dropped the reference.
+    
+    Returns:
+        True if the blob will be deleted, False if it is still in use
+    """
+    if not checksum or blob_in_use(checksum):
+        return False
+    delete_variants(checksum)
+    delete_blob_after_commit(checksum)
+    return True
+
+
 def delete_media(media_id):
     """
-    Delete a media item by ID.
+    Delete a media item by ID, and its content if nothing else shares it.
     
     Returns:
         True if deleted, False if not found
     """
     media = Media.query.get(media_id)
     if media:
+        checksum = media.checksum
         db.session.delete(media)
+        db.session.flush()
+        release_blob(checksum)
         db.session.commit()
         return True
     return False
@@ -148,4 +227,48 @@ def get_media_by_checksum(checksum):
     Returns:
         Media object or None
     """
-    return Media.query.filter_by(checksum=checksum).first()
\ No newline at end of file
+    return Media.query.filter_by(checksum=checksum).first()
+
+
+def migrate_blobs_to_store(batch_size=100, echo=None):
+    """
+    Move Media.data and Post.image BLOBs into the blob store.
+    
+    Rows are read by id in batches of `batch_size`, each batch committed
+    before the next is loaded, so memory use is bounded by one batch
+    whatever the table size. Safe to rerun; migrated rows are skipped.
+    
+    Returns:
+        dict with counts of migrated media and post images
+    """
+    from app.models import Post
+    
+    store = get_blob_store()
+    counts = {'media': 0, 'post_images': 0}
+    
+    for model, content, checksum_col, key in (
+        (Media, Media.data, Media.checksum, 'media'),
+        (Post, Post.image, Post.image_checksum, 'post_images'),
+    ):
+        last_id = 0
+        while True:
+            rows = db.session.query(model.id, content).filter(
+                model.id > last_id,
+                content.isnot(None)
+            ).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            for row_id, data in rows:
+                checksum = store.put(data)
+                db.session.query(model).filter_by(id=row_id).update(
+                    {checksum_col: checksum, content: None}, synchronize_session=False
+                )
+            db.session.commit()
+            db.session.expunge_all()
+            last_id = rows[-1][0]
+            counts[key] += len(rows)
+            if echo:
+                echo(f"{key}: {counts[key]} moved (up to id {last_id})")
+    
+    logger.info(f"Blob migration complete: {counts}")
+    return counts
@@ -0,0 +1,106 @@
+"""
+HyperLogLog Module
+
+Fixed-size, mergeable sketches for approximate distinct counts. With
+the default precision (2^14 registers) the standard error is about
+0.8%, and a sketch costs at most 16 KB however many values it has seen.
+Sparse sketches compress to a few hundred bytes for storage.
+
+Merging is a register-wise max. Registers are packed into one Python
+integer and the max is done with SWAR byte arithmetic, so merging a year
+of daily sketches takes milliseconds without numpy.
+"""
+
+import hashlib
+import math
+import zlib
+
+DEFAULT_PRECISION = 14
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """Approximate distinct counter."""
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError("register count does not match precision")
+
+    def add(self, value):
+        """Add one value (anything with a stable str())."""
+        h = _hash64(value)
+        width = 64 - self.precision
+        index = h >> width
+        rank = width - (h & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, *others):
+        """Fold other sketches into this one (register-wise max)."""
+        merged = merge_registers([self.registers] + [o.registers for o in others])
+        self.registers[:] = merged
+        return self
+
+    def count(self):
+        """Estimated number of distinct values added."""
+        registers = bytes(self.registers)
+        m = self.m
+        zeros = registers.count(0)
+        inverse_sum = sum(registers.count(rank) * 2.0 ** -rank for rank in set(registers))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / inverse_sum
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction: linear counting is more accurate here
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    __len__ = count
+
+    def to_bytes(self):
+        """Compact serialized form: precision byte + compressed registers."""
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data[0], zlib.decompress(data[1:]))
+
+    def __repr__(self):
+        return f'<HyperLogLog p={self.precision} ~{self.count()}>'
+
+
+def merge_registers(register_sets):
+    """Register-wise max of equal-length register arrays, returned as bytes."""
+    register_sets = list(register_sets)
+    if not register_sets:
+        raise ValueError("nothing to merge")
+    length = len(register_sets[0])
+    # Ranks are < 128, so each byte lane can borrow from its own high bit
+    high = int.from_bytes(b'\x80' * length, 'big')
+    result = int.from_bytes(register_sets[0], 'big')
+    for registers in register_sets[1:]:
+        other = int.from_bytes(registers, 'big')
+        at_least = (((result | high) - other) & high) >> 7  # 1 in lanes where result >= other
+        mask = (at_least << 8) - at_least  # 0xFF in those lanes
+        result = other ^ ((result ^ other) & mask)
+    return result.to_bytes(length, 'big')
+
+
+def merge_serialized(blobs, precision=DEFAULT_PRECISION):
+    """Merge serialized sketches into one HyperLogLog (empty if there are none)."""
+    sketches = [HyperLogLog.from_bytes(blob) for blob in blobs]
+    if not sketches:
+        return HyperLogLog(precision)
+    return HyperLogLog(sketches[0].precision, merge_registers(s.registers for s in sketches))
@@ -0,0 +1,251 @@
+"""
+Image Variants Module
+
+Responsive derivatives of uploaded images, so listing pages stop sending
+full-size originals:
+
+- Each source image (addressed by its blob checksum) gets width-bucketed
+  variants (IMAGE_VARIANT_WIDTHS, default 320/640/1280) in each of
+  IMAGE_VARIANT_FORMATS (default WebP and JPEG; AVIF when Pillow has it).
+  Variant bytes go to the blob store; ImageVariant rows map
+  (source checksum, width, format) to them
+- Uploads queue a `generate_image_variants` worker task; the upload
+  request never resizes anything
+- /media/variants/<checksum>/<width>.<format> serves a variant, creating
+  it on first request if the worker has not got to it yet. The unique
+  (source, width, format) key means it is generated once; the URL is
+  content-addressed and served as immutable
+- image_srcset() and the image_macros.html `responsive_image` macro build
+  srcset/<picture> markup from a checksum alone, without queries
+
+Variants are never wider than their source: buckets above the source
+width hold a re-encode at the source size.
+"""
+
+import logging
+from io import BytesIO
+from flask import current_app, url_for
+from sqlalchemy.exc import IntegrityError
+from app.database import db
+from app.modules.blob_store import blob_in_use, delete_blob_after_commit, get_blob_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (320, 640, 1280)
+DEFAULT_FORMATS = ('webp', 'jpeg')
+
+# format: (Pillow format, MIME type, encoder options)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'avif': ('AVIF', 'image/avif', {'quality': 60}),
+}
+
+# Sources worth resizing (GIF would lose its animation, SVG is already scalable)
+SOURCE_MIMETYPES = {'image/jpeg', 'image/jpg', 'image/png', 'image/webp'}
+
+
+def variant_widths():
+    return tuple(sorted(current_app.config.get('IMAGE_VARIANT_WIDTHS') or DEFAULT_WIDTHS))
+
+
+def variant_formats():
+    """Configured formats this Pillow build can encode."""
+    from PIL import features
+
+    formats = current_app.config.get('IMAGE_VARIANT_FORMATS') or DEFAULT_FORMATS
+    return tuple(f for f in formats if f in FORMATS and (f != 'avif' or features.check('avif')))
+
+
+def variant_mimetype(fmt):
+    return FORMATS[fmt][1]
+
+
+def wants_variants(mimetype):
+    """Whether an upload of this type should get responsive variants."""
+    return (mimetype or '').lower() in SOURCE_MIMETYPES
+
+
+# ============================================================================
+# Generation
+# ============================================================================
+
+def _open_source(checksum):
+    from PIL import Image, ImageOps
+
+    with get_blob_store().open(checksum) as source:
+        image = Image.open(BytesIO(source.read()))
+        image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def _encode(image, fmt):
+    from PIL import Image
+
+    pil_format, _, options = FORMATS[fmt]
+    if fmt == 'jpeg' and image.mode == 'RGBA':
+        # JPEG has no alpha: flatten onto white, as compress_image does
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[3])
+        image = background
+    output = BytesIO()
+    image.save(output, format=pil_format, **options)
+    return output.getvalue()
+
+
+def _resized(image, widths):
+    """{width: image no wider than width}, each resized from the next larger one."""
+    from PIL import Image
+
+    results = {}
+    current = image
+    for width in sorted(widths, reverse=True):
+        if current.width > width:
+            height = max(1, round(current.height * width / current.width))
+            current = current.resize((width, height), Image.Resampling.LANCZOS)
+        results[width] = current
+    return results
+
+
+def _store_variant(source_checksum, width, fmt, image):
+    """Encode, store and record one variant; returns the ImageVariant row."""
+    from app.models import ImageVariant
+
+    data = _encode(image, fmt)
+    variant = ImageVariant(
+        source_checksum=source_checksum,
+        width=width,
+        format=fmt,
+        checksum=get_blob_store().put(data),
+        size=len(data),
+        pixel_width=image.width,
+        pixel_height=image.height
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(variant)
+    except IntegrityError:
+        # Another worker or request made it first
+        return get_variant(source_checksum, width, fmt)
+    return variant
+
+
+def get_variant(source_checksum, width, fmt):
+    from app.models import ImageVariant
+
+    return ImageVariant.query.filter_by(source_checksum=source_checksum, width=width, format=fmt).first()
+
+
+def generate_variants(source_checksum, widths=None, formats=None):
+    """
+    Create any missing variants of a stored image.
+
+    Returns:
+        Number of variants created
+    """
+    from app.models import ImageVariant
+
+    widths = widths or variant_widths()
+    formats = formats or variant_formats()
+    existing = set(db.session.query(ImageVariant.width, ImageVariant.format).filter(
+        ImageVariant.source_checksum == source_checksum
+    ).all())
+    wanted = [(w, f) for w in widths for f in formats if (w, f) not in existing]
+    if not wanted:
+        return 0
+    if not get_blob_store().exists(source_checksum):
+        logger.warning(f"Image {source_checksum} is missing from the blob store")
+        return 0
+
+    images = _resized(_open_source(source_checksum), {w for w, _ in wanted})
+    for width, fmt in wanted:
+        _store_variant(source_checksum, width, fmt, images[width])
+    db.session.commit()
+    return len(wanted)
+
+
+def _is_public_image(checksum):
+    """Only media-library images and post images get on-demand variants."""
+    from app.models import Media, Post
+
+    if Post.query.filter_by(image_checksum=checksum).first() is not None:
+        return True
+    return db.session.query(Media.id).filter(
+        Media.checksum == checksum, Media.mimetype.in_(SOURCE_MIMETYPES)
+    ).first() is not None
+
+
+def ensure_variant(source_checksum, width, fmt):
+    """
+    The requested variant, generated now if missing.
+
+    Returns:
+        ImageVariant, or None if the spec is not configured or the source
+        is not a known image
+    """
+    if width not in variant_widths() or fmt not in variant_formats():
+        return None
+    variant = get_variant(source_checksum, width, fmt)
+    if variant:
+        return variant
+    store = get_blob_store()
+    if not (store.exists(source_checksum) and _is_public_image(source_checksum)):
+        return None
+    try:
+        image = _resized(_open_source(source_checksum), [width])[width]
+    except Exception as e:
+        logger.warning(f"Could not read image {source_checksum}: {e}")
+        return None
+    variant = _store_variant(source_checksum, width, fmt, image)
+    db.session.commit()
+    return variant
+
+
+def queue_variants(source_checksum):
+    """Queue background generation of an image's variants (committed by the caller)."""
+    from app.models import Task
+
+    if source_checksum:
+        db.session.add(Task(name='generate_image_variants', payload={'checksum': source_checksum}, priority=-5))
+
+
+def delete_variants(source_checksum):
+    """
+    Drop an image's variants (when the source is released).
+
+    The rows go with the caller's commit; each variant's blob is deleted
+    after it, unless another row still refers to the same content.
+    """
+    from app.models import ImageVariant
+
+    variants = ImageVariant.query.filter_by(source_checksum=source_checksum).all()
+    for variant in variants:
+        db.session.delete(variant)
+    db.session.flush()
+    for checksum in {v.checksum for v in variants}:
+        if not blob_in_use(checksum):
+            delete_blob_after_commit(checksum)
+
+
+# ============================================================================
+# Templates
+# ============================================================================
+
+def variant_url(source_checksum, width, fmt):
+    return url_for('media.serve_variant', checksum=source_checksum, width=width, fmt=fmt)
+
+
+def image_srcset(source_checksum, fmt='webp'):
+    """srcset value listing every width bucket of an image, or '' without a checksum."""
+    if not source_checksum or fmt not in variant_formats():
+        return ''
+    return ', '.join(f'{variant_url(source_checksum, w, fmt)} {w}w' for w in variant_widths())
+
+
+def init_image_variants(app):
+    """Expose the srcset helpers to templates."""
+    app.add_template_global(image_srcset)
+    app.add_template_global(variant_formats, name='image_variant_formats')
+    app.add_template_global(variant_mimetype, name='image_variant_mimetype')
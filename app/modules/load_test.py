@@ -0,0 +1,516 @@
+"""
+Load Test Module
+
+Concurrent end-to-end traffic against the app, entirely on one machine:
+
+- Virtual users, one thread each, loop over weighted journeys until the
+  run ends: browse the blog, shop (view a product, add it to the cart,
+  check out), book an appointment, and chat
+- Each user keeps its own cookies and CSRF token, like a browser; chat
+  users log in as seeded benchmark users (see benchmark_data)
+- The target is either the WSGI app in-process (a test client per user)
+  or a gunicorn launched on a free local port by gunicorn_server()
+- Checkout goes through StripeStub, a local HTTP server that answers the
+  Checkout Session calls the app makes, so nothing leaves the machine
+- Every step records its latency and status; summary() reports requests,
+  throughput, latency percentiles and error rate per step as JSON
+
+A step fails when its status is not one it expects (a booking may get
+409 when another user took the slot); the rest of that journey is
+skipped and the journey counts as failed.
+"""
+
+import http.cookiejar
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import func, select
+
+from app.database import db
+
+SUMMARY_VERSION = 1
+CSRF_META_RE = re.compile(rb'<meta name="csrf-token" content="([^"]+)"')
+
+
+class StepFailed(Exception):
+    """A journey step got an unexpected response; the journey stops."""
+
+
+# ============================================================================
+# Stripe Stub
+# ============================================================================
+
+class StripeStub:
+    """
+    Local stand-in for the Stripe API's Checkout Session endpoints.
+
+    Point stripe.api_base (or STRIPE_API_BASE) at .url. Sessions are kept
+    in memory and can be retrieved by id, as checkout_success does.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        stub = self
+        self.sessions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path.rstrip('/') != '/v1/checkout/sessions':
+                    return self._reply(404, {'error': {'message': f'No stub for {self.path}'}})
+                length = int(self.headers.get('Content-Length') or 0)
+                form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+                self._reply(200, stub.create_session(form))
+
+            def do_GET(self):
+                prefix = '/v1/checkout/sessions/'
+                session = stub.sessions.get(self.path[len(prefix):]) if self.path.startswith(prefix) else None
+                if session is None:
+                    return self._reply(404, {'error': {'type': 'invalid_request_error', 'message': 'No such session'}})
+                self._reply(200, session)
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+        self._thread = None
+
+    def create_session(self, form):
+        with self._lock:
+            session_id = f'cs_test_stub{next(self._ids)}'
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'url': f'{self.url}/pay/{session_id}',
+            'mode': (form.get('mode') or ['payment'])[0],
+            'status': 'open',
+            'client_reference_id': (form.get('client_reference_id') or [None])[0],
+            'metadata': {key[9:-1]: values[0] for key, values in form.items() if key.startswith('metadata[')},
+        }
+        self.sessions[session_id] = session
+        return session
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='stripe-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ============================================================================
+# Clients
+# ============================================================================
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+
+class WSGIClient:
+    """One user's session against the app object, through its test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers=None, data=None, json_body=None):
+        response = self.client.open(path, method=method, headers=headers, data=data, json=json_body)
+        return Response(response.status_code, response.headers, response.get_data())
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None  # Report the 3xx itself, as the test client does
+
+
+class HTTPClient:
+    """One user's session against a running server, with its own cookie jar."""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method, path, headers=None, data=None, json_body=None):
+        headers = dict(headers or {})
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return Response(response.status, response.headers, response.read())
+        except urllib.error.HTTPError as e:
+            return Response(e.code, e.headers, e.read())
+
+
+# ============================================================================
+# Virtual Users and Journeys
+# ============================================================================
+
+class VirtualUser:
+    def __init__(self, index, client, targets, stats, rng, think_time=0.0):
+        self.index = index
+        self.client = client
+        self.targets = targets
+        self.stats = stats
+        self.rng = rng
+        self.think_time = think_time
+        self.csrf_token = None
+        self.logged_in = False
+        self.last_seen = dict(targets['channels'])  # channel id -> newest message id seen
+
+    def step(self, name, method, path, expect=(200,), headers=None, **kwargs):
+        headers = dict(headers or {})
+        if method != 'GET' and self.csrf_token:
+            headers['X-CSRFToken'] = self.csrf_token
+        started = time.perf_counter()
+        try:
+            response = self.client.request(method, path, headers=headers, **kwargs)
+        except Exception as e:
+            self.stats.record(name, time.perf_counter() - started, type(e).__name__, False)
+            raise StepFailed(f'{name}: {e}')
+        ok = response.status in expect
+        self.stats.record(name, time.perf_counter() - started, response.status, ok)
+        if not ok:
+            raise StepFailed(f'{name}: HTTP {response.status}')
+        match = CSRF_META_RE.search(response.body)
+        if match:
+            self.csrf_token = match.group(1).decode()
+        if self.think_time:
+            time.sleep(self.rng.uniform(0, 2 * self.think_time))
+        return response
+
+    def login(self):
+        self.step('login_page', 'GET', '/login')
+        email = self.targets['users'][self.index % len(self.targets['users'])]
+        self.step('login', 'POST', '/login', expect=(302,),
+                  data={'email': email, 'password': self.targets['password']})
+        self.logged_in = True
+
+
+def browse_blog(vu):
+    vu.step('blog_index', 'GET', '/blog')
+    vu.step('blog_post', 'GET', f"/blog/{vu.rng.choice(vu.targets['posts'])}")
+
+
+def shop(vu):
+    product_id = vu.rng.choice(vu.targets['products'])
+    vu.step('view_product', 'GET', f'/shop/{product_id}')
+    vu.step('add_to_cart', 'POST', f'/shop/cart/add/{product_id}',
+            headers={'Accept': 'application/json'}, data={'quantity': '1'})
+    vu.step('view_cart', 'GET', '/shop/cart')
+    # 302: stock ran out under other users' inventory locks
+    response = vu.step('checkout', 'POST', '/shop/checkout', expect=(200, 302),
+                       headers={'Accept': 'application/json'})
+    if response.status == 200:
+        session_id = response.json()['redirect_url'].rsplit('/', 1)[-1]
+        vu.step('checkout_success', 'GET', f'/shop/checkout/success?session_id={session_id}')
+
+
+def book_appointment(vu):
+    vu.step('booking_page', 'GET', '/booking')
+    day = date.today() + timedelta(days=vu.rng.randint(1, 28))
+    while day.weekday() > 4:
+        day += timedelta(days=1)
+    estimator_id = vu.rng.choice(vu.targets['estimators'])
+    slots = vu.step('booking_slots', 'GET',
+                    f'/api/booking/slots?estimator_id={estimator_id}&date={day.isoformat()}').json()['slots']
+    if not slots:
+        return
+    # 409: another user booked the slot first
+    vu.step('book', 'POST', '/api/booking/create', expect=(200, 409), json_body={
+        'service_id': vu.rng.choice(vu.targets['services']),
+        'estimator_id': estimator_id,
+        'date': day.isoformat(),
+        'time': vu.rng.choice(slots),
+        'first_name': 'Load',
+        'last_name': f'User {vu.index}',
+        'email': f'load{vu.index}@bench.example.com',
+        'phone': '555-000-0000',
+    })
+
+
+def chat(vu):
+    if not vu.logged_in:
+        vu.login()
+    channel_id = vu.rng.choice(list(vu.targets['channels']))
+    messages = vu.step('chat_poll', 'GET',
+                       f'/messaging/channel/{channel_id}/poll?last_id={vu.last_seen[channel_id]}').json()
+    if messages:
+        vu.last_seen[channel_id] = max(message['id'] for message in messages)
+    vu.step('chat_send', 'POST', f'/messaging/channel/{channel_id}/send',
+            headers={'X-Requested-With': 'XMLHttpRequest'},
+            data={'content': f'Load test message from user {vu.index}'})
+
+
+JOURNEYS = {
+    'browse_blog': (browse_blog, 4),
+    'shop': (shop, 3),
+    'book_appointment': (book_appointment, 2),
+    'chat': (chat, 1),
+}
+
+
+def discover_targets(limit=200):
+    """Ids and logins the journeys pick from, read from the seeded benchmark data."""
+    from app.models import Channel, Estimator, Message, Post, Product, Service, User
+    from app.modules.benchmark_data import BENCHMARK_PASSWORD
+
+    def ids(statement):
+        return list(db.session.execute(statement.limit(limit)).scalars())
+
+    targets = {
+        'posts': ids(select(Post.slug).where(Post.is_published.is_(True)).order_by(Post.id)),
+        'products': ids(select(Product.id).where(Product.inventory_count > 0).order_by(Product.id)),
+        'estimators': ids(select(Estimator.id).where(Estimator.is_active.is_(True)).order_by(Estimator.id)),
+        'services': ids(select(Service.id).order_by(Service.id)),
+        'users': ids(select(User.email).where(User.username.like('bench_user_%')).order_by(User.id)),
+        'channels': dict(db.session.execute(
+            select(Channel.id, func.coalesce(func.max(Message.id), 0))
+            .outerjoin(Message, Message.channel_id == Channel.id)
+            .where(Channel.type == 'public', Channel.is_archived.is_(False))
+            .group_by(Channel.id).order_by(Channel.id).limit(limit)
+        ).all()),
+        'password': BENCHMARK_PASSWORD,
+    }
+    missing = [name for name, values in targets.items() if not values]
+    if missing:
+        raise ValueError(f"No {', '.join(missing)} to load test against; run `flask bench seed` first")
+    return targets
+
+
+# ============================================================================
+# Statistics
+# ============================================================================
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class LoadStats:
+    """Thread-safe per-step latencies and statuses."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.steps = {}
+        self.journeys = {}
+
+    def record(self, step, seconds, status, ok):
+        with self._lock:
+            stats = self.steps.get(step)
+            if stats is None:
+                stats = self.steps[step] = {'latencies': [], 'errors': 0, 'statuses': {}}
+            stats['latencies'].append(seconds)
+            if not ok:
+                stats['errors'] += 1
+            stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+
+    def journey(self, name, ok):
+        with self._lock:
+            counts = self.journeys.setdefault(name, {'completed': 0, 'failed': 0})
+            counts['completed' if ok else 'failed'] += 1
+
+    def summary(self, elapsed):
+        steps = {}
+        with self._lock:
+            for name, stats in self.steps.items():
+                ordered = sorted(stats['latencies'])
+                count = len(ordered)
+                steps[name] = {
+                    'requests': count,
+                    'errors': stats['errors'],
+                    'error_rate': round(stats['errors'] / count, 4),
+                    'throughput_rps': round(count / elapsed, 2),
+                    'latency_ms': {
+                        'mean': round(sum(ordered) / count * 1000, 2),
+                        'p50': round(_percentile(ordered, 0.50) * 1000, 2),
+                        'p90': round(_percentile(ordered, 0.90) * 1000, 2),
+                        'p95': round(_percentile(ordered, 0.95) * 1000, 2),
+                        'p99': round(_percentile(ordered, 0.99) * 1000, 2),
+                        'max': round(ordered[-1] * 1000, 2),
+                    },
+                    'statuses': dict(sorted(stats['statuses'].items())),
+                }
+            journeys = {name: dict(counts) for name, counts in self.journeys.items()}
+        requests = sum(step['requests'] for step in steps.values())
+        errors = sum(step['errors'] for step in steps.values())
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'requests': requests,
+            'errors': errors,
+            'error_rate': round(errors / requests, 4) if requests else 0.0,
+            'throughput_rps': round(requests / elapsed, 2) if elapsed else 0.0,
+            'steps': dict(sorted(steps.items())),
+            'journeys': dict(sorted(journeys.items())),
+        }
+
+
+# ============================================================================
+# Runner
+# ============================================================================
+
+def run_load_test(make_client, targets, users=10, duration=30.0, ramp_up=0.0,
+                  journeys=None, think_time=0.0, seed=1):
+    """
+    Run virtual users against make_client() clients for duration seconds.
+
+    Args:
+        make_client: called once per user for its own client (cookies, CSRF)
+        journeys: {name: weight} (default: JOURNEYS' weights)
+        ramp_up: seconds over which users are started, evenly spaced
+
+    Returns:
+        dict: summary from LoadStats plus the run's configuration
+    """
+    weights = journeys or {name: weight for name, (_, weight) in JOURNEYS.items()}
+    unknown = [name for name in weights if name not in JOURNEYS]
+    if unknown:
+        raise ValueError(f"Unknown journey(s): {', '.join(unknown)}")
+    names = [name for name, weight in weights.items() if weight > 0]
+    stats = LoadStats()
+    started = time.perf_counter()
+    deadline = started + ramp_up + duration
+
+    def user(index):
+        time.sleep(ramp_up * index / users)
+        rng = random.Random(f'{seed}:{index}')
+        vu = VirtualUser(index, make_client(), targets, stats, rng, think_time)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, [weights[n] for n in names])[0]
+            try:
+                JOURNEYS[name][0](vu)
+            except StepFailed:
+                stats.journey(name, False)
+            else:
+                stats.journey(name, True)
+
+    threads = [threading.Thread(target=user, args=(i,), name=f'vu-{i}', daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = stats.summary(time.perf_counter() - started)
+    summary['version'] = SUMMARY_VERSION
+    summary['created_at'] = datetime.now(timezone.utc).isoformat()
+    summary['config'] = {
+        'users': users,
+        'duration_s': duration,
+        'ramp_up_s': ramp_up,
+        'think_time_s': think_time,
+        'seed': seed,
+        'journeys': {name: weights[name] for name in names},
+    }
+    return summary
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': db.engine.dialect.name,
+    }
+
+
+@contextmanager
+def offline_app(app, stripe_url):
+    """Route the app's Stripe calls to the stub and lift per-IP rate limits for the run."""
+    import stripe
+    from app.modules.security import rate_limiter
+
+    limiter = rate_limiter.limiter
+    saved = stripe.api_base, app.config.get('STRIPE_SECRET_KEY'), limiter.enabled if limiter else None
+    stripe.api_base = stripe_url
+    app.config['STRIPE_SECRET_KEY'] = saved[1] or 'sk_test_load'
+    if limiter:
+        limiter.enabled = False  # Every virtual user shares one address
+    try:
+        yield app
+    finally:
+        stripe.api_base = saved[0]
+        app.config['STRIPE_SECRET_KEY'] = saved[1]
+        if limiter:
+            limiter.enabled = saved[2]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def gunicorn_server(stripe_url, workers=2, threads=4, worker_class='gthread', timeout=30):
+    """Launch gunicorn on a free local port for the run; yields its base URL."""
+    port = _free_port()
+    env = dict(os.environ, STRIPE_API_BASE=stripe_url, RATELIMIT_ENABLED='false',
+               STRIPE_SECRET_KEY=os.environ.get('STRIPE_SECRET_KEY') or 'sk_test_load')
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         '--threads', str(threads), '--worker-class', worker_class, 'app:create_app()'],
+        cwd=root, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        give_up = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None or time.monotonic() > give_up:
+                log.seek(0)
+                raise RuntimeError('gunicorn did not start:\n' + log.read()[-2000:].decode(errors='replace'))
+            try:
+                with urllib.request.urlopen(f'{base_url}/live', timeout=2) as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                time.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
@@ -0,0 +1,268 @@
+"""
+Message Broker Module
+
+Publish/subscribe fan-out for real-time messaging:
+
+- send_message publishes each new message once; every SSE connection on
+  the channel receives the same pre-serialized frame from its own bounded
+  queue, so connected clients never query the database to learn about it
+- Subscribers block on a queue instead of sleeping and polling. Under a
+  gevent worker (gunicorn -k gevent) the queue and its locks are
+  monkey-patched, so one process can hold thousands of idle streams
+- A pluggable backend carries publishes to other processes and nodes.
+  'local' (default) is in-process only; 'postgres' uses LISTEN/NOTIFY.
+  MESSAGE_BROKER_BACKEND may also be a dotted path to a custom class.
+
+A subscriber that falls behind (full queue), or an event too large to
+send inline across processes, is marked for resync: the stream catches
+up with one query from its last message id.
+"""
+
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+import uuid
+from collections import defaultdict
+from sqlalchemy import text
+from werkzeug.utils import import_string
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'verso_messages'
+NOTIFY_PAYLOAD_LIMIT = 7900  # Postgres rejects NOTIFY payloads of 8000 bytes or more
+
+
+def sse_frame(event, data):
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ChannelEvent:
+    """A batch of new messages for one channel, serialized once for all subscribers."""
+
+    def __init__(self, channel_id, messages=None):
+        self.channel_id = channel_id
+        self.resync = messages is None
+        self.last_id = max(m['id'] for m in messages) if messages else None
+        self._frames = {}
+        if messages:
+            # is_me is the only per-viewer field: one frame per author, one for everybody else
+            self._frames[None] = sse_frame('messages', [dict(m, is_me=False) for m in messages])
+            for author_id in {m['user_id'] for m in messages}:
+                self._frames[author_id] = sse_frame(
+                    'messages', [dict(m, is_me=m['user_id'] == author_id) for m in messages]
+                )
+
+    def frame_for(self, viewer_id):
+        return self._frames.get(viewer_id, self._frames.get(None))
+
+
+class Subscription:
+    """One stream's bounded queue of ChannelEvents."""
+
+    def __init__(self, broker, channel_id, max_pending):
+        self.broker = broker
+        self.channel_id = channel_id
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.lagged = False
+
+    def offer(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Drop rather than block the publisher; the stream resyncs from the database
+            self.lagged = True
+
+    def get(self, timeout=None):
+        """Next event, or None if nothing arrived within timeout seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def reset(self):
+        """Discard queued events after a resync."""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self.lagged = False
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalBackend:
+    """Single-process delivery only; nothing leaves the process."""
+
+    def start(self, broker):
+        pass
+
+    def publish(self, channel_id, messages):
+        pass
+
+    def stop(self):
+        pass
+
+
+class PostgresNotifyBackend:
+    """
+    Cross-process delivery over Postgres LISTEN/NOTIFY.
+
+    Each process listens on one dedicated connection in a daemon thread
+    (started with the first subscription). Publishes carry the serialized
+    messages inline when they fit in a NOTIFY payload, otherwise a resync
+    marker. A process ignores its own notifications, which it has already
+    delivered locally.
+    """
+
+    def __init__(self, app, channel=NOTIFY_CHANNEL):
+        self.app = app
+        self.channel = channel
+        self.broker = None
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, broker):
+        self.broker = broker
+
+    def ensure_listening(self):
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='message-broker-listener', daemon=True)
+            self._thread.start()
+
+    def publish(self, channel_id, messages):
+        from app.database import db
+
+        payload = json.dumps({'origin': self.broker.node_id, 'channel_id': channel_id, 'messages': messages})
+        if len(payload.encode('utf-8')) > NOTIFY_PAYLOAD_LIMIT:
+            payload = json.dumps({'origin': self.broker.node_id, 'channel_id': channel_id, 'messages': None})
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                conn.execute(text('SELECT pg_notify(:channel, :payload)'),
+                             {'channel': self.channel, 'payload': payload})
+                conn.commit()
+
+    def _run(self):
+        from app.database import db
+
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    raw = db.engine.raw_connection()
+                try:
+                    conn = raw.driver_connection
+                    conn.autocommit = True
+                    with conn.cursor() as cursor:
+                        cursor.execute(f'LISTEN {self.channel}')
+                    while not self._stopping.is_set():
+                        if select.select([conn], [], [], 5) == ([], [], []):
+                            continue
+                        conn.poll()
+                        while conn.notifies:
+                            self.receive(conn.notifies.pop(0).payload)
+                finally:
+                    raw.invalidate()
+            except Exception as e:
+                logger.error(f"Message broker listener error: {e}")
+                time.sleep(1)
+
+    def receive(self, payload):
+        data = json.loads(payload)
+        if data.get('origin') == self.broker.node_id:
+            return
+        self.broker.deliver(ChannelEvent(data['channel_id'], data.get('messages')))
+
+    def stop(self):
+        self._stopping.set()
+
+
+class MessageBroker:
+    """Channel-keyed fan-out of new messages to SSE subscribers."""
+
+    def __init__(self, backend=None, max_pending=256):
+        self.node_id = uuid.uuid4().hex
+        self.max_pending = max_pending
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self.backend = backend or LocalBackend()
+        self.backend.start(self)
+
+    def subscribe(self, channel_id):
+        if hasattr(self.backend, 'ensure_listening'):
+            self.backend.ensure_listening()
+        subscription = Subscription(self, channel_id, self.max_pending)
+        with self._lock:
+            self._subscribers[channel_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel_id]
+
+    def subscriber_count(self, channel_id=None):
+        with self._lock:
+            if channel_id is not None:
+                return len(self._subscribers.get(channel_id, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, channel_id, messages):
+        """Fan out serialized messages (dicts, without is_me) to this and other processes."""
+        if not messages:
+            return
+        self.deliver(ChannelEvent(channel_id, messages))
+        try:
+            self.backend.publish(channel_id, messages)
+        except Exception as e:
+            # Local subscribers already have it; remote ones catch up on reconnect
+            logger.error(f"Message broker publish failed: {e}")
+
+    def deliver(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(event.channel_id, ()))
+        for subscription in subscribers:
+            subscription.offer(event)
+
+
+def create_backend(app):
+    """Build the backend named by MESSAGE_BROKER_BACKEND."""
+    name = app.config.get('MESSAGE_BROKER_BACKEND', 'local')
+    if name == 'local':
+        return LocalBackend()
+    if name == 'postgres':
+        return PostgresNotifyBackend(app)
+    return import_string(name)(app)
+
+
+def get_broker():
+    from flask import current_app
+    return current_app.extensions['message_broker']
+
+
+def init_message_broker(app):
+    """Attach the message broker to the app."""
+    app.extensions['message_broker'] = MessageBroker(
+        create_backend(app),
+        max_pending=app.config.get('MESSAGE_BROKER_QUEUE_SIZE', 256),
+    )
@@ -0,0 +1,184 @@
+"""
+Message Serialization Module
+
+Shared Message -> JSON serialization for the messaging views, using a
+constant number of queries per page of messages:
+
+- message_load_options() eager-loads authors, pinners, channels and
+  attachments with selectinload (attachments without their file bytes)
+- Reaction counts are aggregated in SQL with one GROUP BY over the page;
+  reacting usernames, where a view shows them, take one more query
+- render_message_content() HTML is cached per message id and a hash of
+  its content, so unchanged messages are rendered once (a reused id or a
+  quick second edit never hits another version's HTML)
+"""
+
+import hashlib
+import logging
+from collections import defaultdict
+from flask import url_for
+from markupsafe import Markup, escape
+from sqlalchemy import func, case
+from sqlalchemy.orm import selectinload
+from app.database import db
+from app.modules.blob_store import blob_version
+from app.modules.cache import cache
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_TIMEOUT = 24 * 3600
+SUMMARY_LENGTH = 200
+
+
+def message_load_options():
+    """Loader options for a page of messages; apply with query.options(*...)."""
+    from app.models import Message, Media
+
+    return (
+        selectinload(Message.user),
+        selectinload(Message.pinned_by),
+        selectinload(Message.channel),
+        selectinload(Message.attachment).load_only(Media.id, Media.filename, Media.mimetype),
+    )
+
+
+def render_message_content(message):
+    """Escape user content and wrap @mentions in spans."""
+    content = escape(message.content or '')
+    for mention in message.get_mentions():
+        mention_text = f'@{mention}'
+        content = content.replace(
+            mention_text,
+            Markup(f'<span class="mention">@{escape(mention)}</span>')
+        )
+    return Markup(content)
+
+
+def _render_key(message):
+    digest = hashlib.sha1((message.content or '').encode()).hexdigest()
+    return f'message_html:{message.id}:{digest}'
+
+
+def rendered_contents(messages):
+    """Rendered HTML for each message as {id: str}, from cache where possible."""
+    keys = [_render_key(m) for m in messages]
+    try:
+        cached = cache.get_many(*keys) if keys else []
+    except Exception as e:
+        logger.warning(f"Message render cache unavailable: {e}")
+        cached = [None] * len(keys)
+
+    html = {}
+    missing = {}
+    for message, key, value in zip(messages, keys, cached):
+        if value is None:
+            value = str(render_message_content(message))
+            missing[key] = value
+        html[message.id] = value
+    if missing:
+        try:
+            cache.set_many(missing, timeout=RENDER_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Message render cache unavailable: {e}")
+    return html
+
+
+def reaction_summary(message_ids, viewer_id=None, with_users=False):
+    """
+    Reactions per message as {message_id: {emoji: {'count', 'user_reacted'[, 'users']}}}.
+
+    Counts and the viewer's own reactions come from a single GROUP BY;
+    with_users adds one query for the reacting usernames.
+    """
+    from app.models import MessageReaction, User
+
+    message_ids = list(message_ids)
+    summary = defaultdict(dict)
+    if not message_ids:
+        return summary
+
+    rows = db.session.query(
+        MessageReaction.message_id,
+        MessageReaction.emoji,
+        func.count(MessageReaction.id),
+        func.max(case((MessageReaction.user_id == viewer_id, 1), else_=0))
+    ).filter(
+        MessageReaction.message_id.in_(message_ids)
+    ).group_by(MessageReaction.message_id, MessageReaction.emoji).all()
+    for message_id, emoji, count, reacted in rows:
+        summary[message_id][emoji] = {'count': count, 'user_reacted': bool(reacted)}
+
+    if with_users and rows:
+        for entry in summary.values():
+            for reaction in entry.values():
+                reaction['users'] = []
+        users = db.session.query(
+            MessageReaction.message_id, MessageReaction.emoji, User.username
+        ).join(User, User.id == MessageReaction.user_id).filter(
+            MessageReaction.message_id.in_(message_ids)
+        ).order_by(MessageReaction.id).all()
+        for message_id, emoji, username in users:
+            summary[message_id][emoji]['users'].append(username)
+
+    return summary
+
+
+def attachment_payload(message):
+    """Attachment link info for a message, or None."""
+    if not (message.attachment_id and message.attachment):
+        return None
+    return {
+        'url': url_for('media.serve_media', media_id=message.attachment_id,
+                       v=blob_version(message.attachment.checksum)),
+        'name': message.attachment.filename,
+        'is_image': message.attachment.mimetype.startswith('image/') if message.attachment.mimetype else False
+    }
+
+
+def serialize_messages(messages, viewer_id=None, reactions=True, reaction_users=False):
+    """
+    Full message dicts, as used by the channel view, polling and the SSE stream.
+
+    Args:
+        messages: Messages loaded with message_load_options()
+        viewer_id: Adds is_me and user_reacted for this user; None gives a
+            viewer-independent payload suitable for broadcasting
+        reactions: Set False for messages known to have none (just sent)
+        reaction_users: Include reacting usernames per emoji
+    """
+    messages = list(messages)
+    html = rendered_contents(messages)
+    summary = reaction_summary([m.id for m in messages], viewer_id, reaction_users) if reactions else {}
+
+    results = []
+    for msg in messages:
+        payload = {
+            'id': msg.id,
+            'user': msg.user.username,
+            'user_id': msg.user_id,
+            'content': html[msg.id],
+            'raw_content': msg.content,
+            'created_at': msg.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'attachment': attachment_payload(msg),
+            'reactions': summary.get(msg.id, {}),
+            'message_type': msg.message_type or 'text',
+            'card': msg.get_card(),
+            'is_pinned': bool(msg.is_pinned),
+            'extra_data': msg.extra_data
+        }
+        if viewer_id is not None:
+            payload['is_me'] = msg.user_id == viewer_id
+        results.append(payload)
+    return results
+
+
+def message_summary(message):
+    """Short form for lists (search results, pinned messages)."""
+    content = message.content or ''
+    return {
+        'id': message.id,
+        'channel_id': message.channel_id,
+        'user': message.user.username,
+        'content': content[:SUMMARY_LENGTH] + ('...' if len(content) > SUMMARY_LENGTH else ''),
+        'created_at': message.created_at.strftime('%Y-%m-%d %H:%M'),
+    }
@@ -0,0 +1,480 @@
+"""
+Metrics Core Module
+
+Counters, fixed-bucket histograms and gauges behind MetricsCollector and
+/metrics:
+
+- Every value lives in a shard owned by one OS thread, so recording is a
+  few dict (or mmap) writes with no lock on the request path. A scrape
+  sums the shards. Under gevent all greenlets of a process share one
+  shard, since they never preempt each other mid-update
+- Histograms count each observation in one fixed bucket (bisect over the
+  bounds) and are made cumulative only when exported
+- Gauges are read from a function when scraped and describe only the
+  process answering the scrape; they are never summed over shards or files
+- A metric admits at most `max_series` label sets per process; later
+  label sets are recorded under one series whose labels are all "other"
+- Multi-process mode backs each shard with an mmap'd file in a shared
+  directory. A scrape answered by any gunicorn worker reads every file,
+  so /metrics reports the whole node. Files are numbered slots held with
+  an exclusive flock while a thread writes to them; when the thread or
+  its process exits, the next new thread on the node takes the slot over
+  and keeps adding to its values. The directory therefore holds about as
+  many files as threads ever recorded at once. Values left by exited
+  workers keep counting toward the totals, as counters should; empty the
+  directory when the service (re)starts
+
+Shard files hold a used-bytes header followed by entries of
+(key length, key, padding, float64 value), appended as new series are
+first seen and updated in place afterwards.
+"""
+
+import glob
+import itertools
+import json
+import mmap
+import os
+import struct
+import threading
+import weakref
+from bisect import bisect_left
+from collections import defaultdict
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: fall back to a file per process and thread
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_MAX_SERIES = 1000
+OVERFLOW_LABEL = 'other'
+
+HEADER_SIZE = 8
+INITIAL_FILE_SIZE = 64 * 1024
+
+# Registries to reset in forked children
+_registries = weakref.WeakSet()
+
+
+def _cooperative():
+    """Whether threading is monkey-patched by gevent (greenlets, not threads)."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# ============================================================================
+# Shards
+# ============================================================================
+
+class MemoryShard:
+    """Values written by one thread, kept in a dict."""
+
+    def __init__(self):
+        self.values = {}
+
+    def inc(self, key, amount):
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def snapshot(self):
+        return self.values.copy()
+
+    def close(self):
+        pass
+
+
+class MmapShard:
+    """Values written by one thread, mirrored to an mmap'd file."""
+
+    def __init__(self, path, fd=None):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644) if fd is None else fd
+        size = os.fstat(self._fd).st_size
+        if size < INITIAL_FILE_SIZE:
+            os.ftruncate(self._fd, INITIAL_FILE_SIZE)
+            size = INITIAL_FILE_SIZE
+        self._size = size
+        self._map = mmap.mmap(self._fd, size)
+        self._used = struct.unpack_from('<I', self._map, 0)[0] or HEADER_SIZE
+        self._positions = {}
+        self.values = {}
+        # Slots are reused by later threads; carry on from what is there
+        for key, position, value in _entries(self._map, self._used):
+            self._positions[key] = position
+            self.values[key] = value
+
+    def inc(self, key, amount):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._allocate(key)
+        value = self.values.get(key, 0.0) + amount
+        self.values[key] = value
+        struct.pack_into('<d', self._map, position, value)
+
+    def _allocate(self, key):
+        encoded = key.encode('utf-8')
+        padding = (8 - (4 + len(encoded)) % 8) % 8
+        needed = 4 + len(encoded) + padding + 8
+        if self._used + needed > self._size:
+            size = self._size
+            while self._used + needed > size:
+                size *= 2
+            os.ftruncate(self._fd, size)
+            self._map.close()
+            self._map = mmap.mmap(self._fd, size)
+            self._size = size
+        position = self._used + 4 + len(encoded) + padding
+        struct.pack_into(f'<I{len(encoded)}s{padding}xd', self._map, self._used, len(encoded), encoded, 0.0)
+        self._used += needed
+        # Readers only look below the header's mark, so publish the entry last
+        struct.pack_into('<I', self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def snapshot(self):
+        return self.values.copy()
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)  # Also releases the slot's lock
+
+
+def claim_shard_file(directory):
+    """An MmapShard on the lowest-numbered slot file no live thread holds."""
+    if fcntl is None:
+        name = f'metrics_{os.getpid()}_{threading.get_ident()}.db'
+        return MmapShard(os.path.join(directory, name))
+    for slot in itertools.count():
+        path = os.path.join(directory, f'metrics_{slot}.db')
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        return MmapShard(path, fd)
+
+
+def _entries(data, used):
+    offset = HEADER_SIZE
+    while offset < used:
+        length = struct.unpack_from('<I', data, offset)[0]
+        key = bytes(data[offset + 4:offset + 4 + length]).decode('utf-8')
+        padding = (8 - (4 + length) % 8) % 8
+        position = offset + 4 + length + padding
+        yield key, position, struct.unpack_from('<d', data, position)[0]
+        offset = position + 8
+
+
+def read_shard_file(path):
+    """{key: value} stored in a shard file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER_SIZE:
+        return {}
+    used = struct.unpack_from('<I', data, 0)[0]
+    return {key: value for key, _, value in _entries(data, min(used, len(data)))}
+
+
+# ============================================================================
+# Metrics
+# ============================================================================
+
+class Metric:
+    """A named family of series; subclasses define how values are recorded."""
+
+    type = None
+
+    def __init__(self, registry, name, help, labelnames, max_series):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+        self._series = {}  # label values -> keys
+        self._overflow = None
+
+    def _keys(self, labels):
+        keys = self._series.get(labels)
+        if keys is not None:
+            return keys
+        if len(self._series) >= self.max_series:
+            if self._overflow is None:
+                self._overflow = self._make_keys((OVERFLOW_LABEL,) * len(self.labelnames))
+            return self._overflow
+        with self.registry._lock:
+            keys = self._series.get(labels)
+            if keys is None and len(self._series) < self.max_series:
+                keys = self._series[labels] = self._make_keys(labels)
+        return keys if keys is not None else self._keys(labels)
+
+    def _make_keys(self, labels):
+        raise NotImplementedError
+
+    def _key(self, sample, labels):
+        return json.dumps([sample, [str(v) for v in labels]])
+
+    def sample_names(self):
+        return (self.name,)
+
+    def expose(self, samples):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _make_keys(self, labels):
+        return self._key(self.name, labels)
+
+    def inc(self, *labels, amount=1.0):
+        self.registry._shard().inc(self._keys(labels), amount)
+
+    def values(self, samples):
+        """{label values: total} from registry.samples()."""
+        return samples.get(self.name, {})
+
+    def expose(self, samples):
+        lines = []
+        for labels, value in sorted(self.values(samples).items()):
+            lines.append(f'{self.name}{_label_text(self.labelnames, labels)} {format_value(value)}')
+        return lines
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames, max_series, buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames, max_series)
+        self.bounds = tuple(sorted(float(b) for b in buckets))
+        self._le = [repr(b) for b in self.bounds] + ['+Inf']
+
+    def _make_keys(self, labels):
+        return (
+            [self._key(f'{self.name}_bucket', labels + (le,)) for le in self._le],
+            self._key(f'{self.name}_sum', labels),
+            self._key(f'{self.name}_count', labels),
+        )
+
+    def observe(self, value, *labels):
+        buckets, sum_key, count_key = self._keys(labels)
+        shard = self.registry._shard()
+        shard.inc(buckets[bisect_left(self.bounds, value)], 1)
+        shard.inc(sum_key, value)
+        shard.inc(count_key, 1)
+
+    def sample_names(self):
+        return (f'{self.name}_bucket', f'{self.name}_sum', f'{self.name}_count')
+
+    def totals(self, samples):
+        """{label values: (count, sum)} from registry.samples()."""
+        sums = samples.get(f'{self.name}_sum', {})
+        return {labels: (count, sums.get(labels, 0.0))
+                for labels, count in samples.get(f'{self.name}_count', {}).items()}
+
+    def expose(self, samples):
+        buckets = defaultdict(dict)
+        for labels, value in samples.get(f'{self.name}_bucket', {}).items():
+            buckets[labels[:-1]][labels[-1]] = value
+        lines = []
+        for labels, (count, total) in sorted(self.totals(samples).items()):
+            cumulative = 0
+            for le in self._le:
+                cumulative += buckets[labels].get(le, 0)
+                label_text = _label_text(self.labelnames + ('le',), labels + (le,))
+                lines.append(f'{self.name}_bucket{label_text} {format_value(cumulative)}')
+            label_text = _label_text(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {format_value(total)}')
+            lines.append(f'{self.name}_count{label_text} {format_value(count)}')
+        return lines
+
+
+class Gauge(Metric):
+    """Current values of this process, read from `function` ({label values: value}) on each scrape."""
+
+    type = 'gauge'
+
+    def __init__(self, registry, name, help, labelnames, max_series, function):
+        super().__init__(registry, name, help, labelnames, max_series)
+        self.function = function
+
+    def sample_names(self):
+        return ()
+
+    def values(self, samples=None):
+        values = {}
+        for labels, value in self.function().items():
+            labels = tuple(str(v) for v in labels)
+            if labels not in values and len(values) >= self.max_series:
+                labels = (OVERFLOW_LABEL,) * len(self.labelnames)
+            values[labels] = values.get(labels, 0.0) + value
+        return values
+
+    def expose(self, samples):
+        lines = []
+        for labels, value in sorted(self.values().items()):
+            lines.append(f'{self.name}{_label_text(self.labelnames, labels)} {format_value(value)}')
+        return lines
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{escape_label(v)}"' for n, v in zip(names, values)) + '}'
+
+
+# ============================================================================
+# Registry
+# ============================================================================
+
+class MetricsRegistry:
+    """
+    A set of metrics and the shards holding their values.
+
+    Args:
+        max_series: Default cap on label sets per metric
+    """
+
+    def __init__(self, max_series=DEFAULT_MAX_SERIES):
+        self.max_series = max_series
+        self.multiprocess_dir = None
+        self._metrics = {}
+        self._sample_owner = {}
+        self._lock = threading.Lock()
+        self._reset_shards()
+        _registries.add(self)
+
+    def _reset_shards(self):
+        self._local = threading.local()
+        self._shards = []  # [(owning thread, shard)]
+        self._retired = defaultdict(float)  # Totals of exited threads' in-memory shards
+        self._process_shard = None
+
+    def counter(self, name, help, labelnames=(), max_series=None):
+        return self._register(Counter(self, name, help, labelnames, max_series or self.max_series))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, max_series=None):
+        return self._register(Histogram(self, name, help, labelnames, max_series or self.max_series, buckets))
+
+    def gauge(self, name, help, function, labelnames=(), max_series=None):
+        return self._register(Gauge(self, name, help, labelnames, max_series or self.max_series, function))
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        for sample in metric.sample_names():
+            self._sample_owner[sample] = metric
+        return metric
+
+    def enable_multiprocess(self, directory):
+        """Keep values in shard files under `directory`, shared by every process using it."""
+        directory = os.path.abspath(directory)
+        if directory == self.multiprocess_dir:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            for _, shard in self._shards:
+                shard.close()
+            self.multiprocess_dir = directory
+            self._reset_shards()
+
+    def _new_shard(self):
+        if self.multiprocess_dir:
+            return claim_shard_file(self.multiprocess_dir)
+        return MemoryShard()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is not None:
+            return shard
+        with self._lock:
+            if _cooperative():
+                # Greenlet-local storage would give every greenlet a shard
+                if self._process_shard is None:
+                    self._process_shard = self._new_shard()
+                    self._shards.append((None, self._process_shard))
+                return self._process_shard
+            self._prune_shards()
+            shard = self._local.shard = self._new_shard()
+            self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _prune_shards(self):
+        """Drop exited threads' shards (call with the lock held)."""
+        live = []
+        for thread, shard in self._shards:
+            if thread is not None and not thread.is_alive():
+                if self.multiprocess_dir:
+                    shard.close()  # Its file stays, keeps counting and frees the slot
+                else:
+                    for key, value in shard.snapshot().items():
+                        self._retired[key] += value
+            else:
+                live.append((thread, shard))
+        self._shards = live
+
+    def collect(self):
+        """{key: total} across threads, and across processes in multi-process mode."""
+        totals = defaultdict(float)
+        if self.multiprocess_dir:
+            with self._lock:
+                self._prune_shards()
+            for path in glob.glob(os.path.join(self.multiprocess_dir, 'metrics_*.db')):
+                try:
+                    values = read_shard_file(path)
+                except OSError:
+                    continue
+                for key, value in values.items():
+                    totals[key] += value
+            return totals
+        with self._lock:
+            self._prune_shards()
+            totals.update(self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            for key, value in shard.snapshot().items():
+                totals[key] += value
+        return totals
+
+    def samples(self):
+        """{sample name: {label values: total}} for this registry's metrics."""
+        samples = defaultdict(dict)
+        for key, value in self.collect().items():
+            sample, labels = json.loads(key)
+            if sample in self._sample_owner:
+                samples[sample][tuple(labels)] = value
+        return samples
+
+    def exposition(self, samples=None):
+        """Prometheus text lines for every metric."""
+        samples = self.samples() if samples is None else samples
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.expose(samples))
+        return lines
+
+
+def _reset_after_fork():
+    # Shards belong to the parent's threads (and files); children start their own
+    for registry in list(_registries):
+        registry._lock = threading.Lock()
+        if registry.multiprocess_dir:
+            # The parent keeps its slots locked through its own descriptors
+            for _, shard in registry._shards:
+                shard.close()
+        registry._reset_shards()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
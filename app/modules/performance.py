@@ -1,47 +1,162 @@
 """
 Phase 23: Performance Optimization - Performance Utilities Module
 
-Provides request timing, slow query logging, and query counting for N+1 detection.
+Provides request timing, slow query logging, and a request-scoped SQL
+profiler for N+1 detection:
+
+- The active QueryProfile lives in a context variable, so each thread (or
+  greenlet) records only the queries its own request issued
+- Statements are reduced to fingerprints (literals and placeholders become
+  ?, IN lists collapse) and counted per fingerprint; a fingerprint run more
+  than QUERY_REPEAT_THRESHOLD times in one request is reported as a likely
+  N+1, with the application frame that issued it
+- Profiled responses carry X-Query-Count and X-Query-Time headers, and
+  each endpoint's query counts are kept against its budget (QUERY_BUDGET,
+  or @query_budget on the view) for the query budget report
+- Requests are profiled in debug mode, or sampled at
+  QUERY_PROFILE_SAMPLE_RATE; unprofiled requests only pay for one
+  context-variable lookup per query
 """
 
+import contextvars
+import os
+import random
+import re
+import sys
+import threading
 import time
 import logging
-from functools import wraps
+from functools import lru_cache, wraps
 from flask import g, request, current_app
 from sqlalchemy import event
 from sqlalchemy.engine import Engine
 
 logger = logging.getLogger(__name__)
 
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])')
+_PLACEHOLDER_RE = re.compile(r'%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+|\?')
+_IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_VALUES_RE = re.compile(r'\bVALUES\s*\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*',
+                        re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
 
-class QueryProfiler:
-    """Tracks SQL query count and duration for N+1 detection."""
+# Frames from these files are skipped when finding who issued a query
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SKIP_FILES = (os.path.abspath(__file__),)
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement):
+    """Statement with literals and bind placeholders replaced by ?."""
+    text = _STRING_RE.sub('?', statement)
+    text = _PLACEHOLDER_RE.sub('?', text)
+    text = _NUMBER_RE.sub('?', text)
+    text = _IN_LIST_RE.sub('IN (?)', text)
+    text = _VALUES_RE.sub('VALUES (?)', text)
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+def _origin():
+    """file:line (function) of the innermost application frame outside this module."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_ROOT) and filename not in _SKIP_FILES:
+            relative = os.path.relpath(filename, os.path.dirname(_APP_ROOT))
+            return f'{relative}:{frame.f_lineno} ({frame.f_code.co_name})'
+        frame = frame.f_back
+    return None
+
+
+class QueryProfile:
+    """Queries issued while one request (or block) was being profiled."""
     
-    def __init__(self):
+    def __init__(self, endpoint=None, repeat_threshold=5, keep_queries=50):
+        self.endpoint = endpoint
+        self.repeat_threshold = repeat_threshold
+        self.keep_queries = keep_queries
+        self.count = 0
+        self.total_time = 0.0
         self.queries = []
-        self.enabled = False
+        self.fingerprints = {}  # fingerprint -> {'count', 'total_time', 'origin'}
     
-    def start(self):
-        """Start tracking queries."""
-        self.queries = []
-        self.enabled = True
+    def record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        if len(self.queries) < self.keep_queries:
+            self.queries.append({
+                'statement': statement[:200],  # Truncate for readability
+                'duration': duration
+            })
+        key = fingerprint(statement)
+        stats = self.fingerprints.get(key)
+        if stats is None:
+            self.fingerprints[key] = {'count': 1, 'total_time': duration, 'origin': None}
+            return
+        stats['count'] += 1
+        stats['total_time'] += duration
+        if stats['origin'] is None:
+            # Only repeated statements need a stack walk
+            stats['origin'] = _origin()
     
-    def stop(self):
-        """Stop tracking and return summary."""
-        self.enabled = False
+    def repeated(self):
+        """Likely N+1 patterns: fingerprints run more than repeat_threshold times."""
+        found = [
+            {'fingerprint': key, **stats}
+            for key, stats in self.fingerprints.items()
+            if stats['count'] > self.repeat_threshold
+        ]
+        return sorted(found, key=lambda item: item['count'], reverse=True)
+    
+    def summary(self):
         return {
-            'count': len(self.queries),
-            'total_time': sum(q['duration'] for q in self.queries),
-            'queries': self.queries
+            'count': self.count,
+            'total_time': self.total_time,
+            'queries': self.queries,
+            'repeated': self.repeated(),
         }
+
+
+_current_profile = contextvars.ContextVar('query_profile', default=None)
+
+
+def current_query_profile():
+    """The QueryProfile collecting this context's queries, if any."""
+    return _current_profile.get()
+
+
+class QueryProfiler:
+    """
+    Starts and stops query profiling for the current context.
+    
+    Every thread or greenlet gets its own profile, so one instance can be
+    shared by concurrent requests.
+    """
+    
+    def start(self, endpoint=None, repeat_threshold=5):
+        """Start tracking queries in this context."""
+        profile = QueryProfile(endpoint, repeat_threshold)
+        _current_profile.set(profile)
+        return profile
+    
+    def stop(self):
+        """Stop tracking and return summary."""
+        profile = _current_profile.get()
+        _current_profile.set(None)
+        if profile is None:
+            return QueryProfile().summary()
+        return profile.summary()
+    
+    @property
+    def enabled(self):
+        return _current_profile.get() is not None
     
     def record(self, statement, duration):
         """Record a query execution."""
-        if self.enabled:
-            self.queries.append({
-                'statement': statement[:200],  # Truncate for readability
-                'duration': duration
-            })
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.record(statement, duration)
 
 
 # Global query profiler instance
@@ -53,43 +168,128 @@ def get_query_profiler():
     return _query_profiler
 
 
+def query_budget(max_queries):
+    """Set the number of queries a view is expected to stay within."""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+class QueryBudgetReport:
+    """Per-endpoint query counts of profiled requests in this process."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+    
+    def add(self, endpoint, profile, budget):
+        repeated = profile.repeated()
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    'requests': 0, 'queries': 0, 'max_queries': 0, 'query_time': 0.0,
+                    'over_budget': 0, 'n_plus_one': {},
+                }
+            stats['budget'] = budget
+            stats['requests'] += 1
+            stats['queries'] += profile.count
+            stats['max_queries'] = max(stats['max_queries'], profile.count)
+            stats['query_time'] += profile.total_time
+            if profile.count > budget:
+                stats['over_budget'] += 1
+            for item in repeated:
+                seen = stats['n_plus_one'].setdefault(item['fingerprint'], {
+                    'requests': 0, 'max_count': 0, 'origin': item['origin']})
+                seen['requests'] += 1
+                seen['max_count'] = max(seen['max_count'], item['count'])
+    
+    def report(self):
+        """Endpoints, worst first (over budget, then most queries per request)."""
+        with self._lock:
+            rows = []
+            for endpoint, stats in self._endpoints.items():
+                rows.append({
+                    'endpoint': endpoint,
+                    'budget': stats['budget'],
+                    'requests': stats['requests'],
+                    'avg_queries': round(stats['queries'] / stats['requests'], 1),
+                    'max_queries': stats['max_queries'],
+                    'avg_query_ms': round(stats['query_time'] / stats['requests'] * 1000, 2),
+                    'over_budget': stats['over_budget'],
+                    'n_plus_one': [
+                        {'fingerprint': key, **seen}
+                        for key, seen in sorted(stats['n_plus_one'].items(),
+                                                key=lambda kv: kv[1]['max_count'], reverse=True)
+                    ],
+                })
+        return sorted(rows, key=lambda r: (r['over_budget'], r['avg_queries']), reverse=True)
+    
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+query_budget_report = QueryBudgetReport()
+
+_listeners = {}
+_settings = {'slow_query_threshold': 0.5}
+
+
 def setup_query_logging(app):
     """
     Set up SQLAlchemy event listeners for query logging.
-    Only active in debug mode or when SLOW_QUERY_THRESHOLD is set.
+    
+    Logs queries slower than SLOW_QUERY_THRESHOLD, counts them in the
+    db_* metrics, and records them in the current query profile.
     """
+    from app.routes.admin_routes.observability import metrics_collector
+    
+    _settings['slow_query_threshold'] = app.config.get('SLOW_QUERY_THRESHOLD', 0.5)
+    
+    # The listeners are Engine-wide, so register them once per process
+    if _listeners.get('query_logging'):
+        return
+    _listeners['query_logging'] = True
     
     @event.listens_for(Engine, "before_cursor_execute")
     def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-        conn.info.setdefault('query_start_time', []).append(time.time())
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
     
     @event.listens_for(Engine, "after_cursor_execute")
     def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-        total = time.time() - conn.info['query_start_time'].pop(-1)
+        total = time.perf_counter() - conn.info['query_start_time'].pop(-1)
         
-        # Record in profiler if enabled
-        _query_profiler.record(statement, total)
+        metrics_collector.record_query(total)
+        
+        # Record in this request's profile, if it is being profiled
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.record(statement, total)
         
         # Log slow queries
-        threshold = app.config.get('SLOW_QUERY_THRESHOLD', 0.5)
-        if total > threshold:
+        if total > _settings['slow_query_threshold']:
             logger.warning(
                 f"Slow query ({total:.3f}s): {statement[:100]}..."
             )
 
 
+
 def init_request_timing(app):
     """
     Initialize request timing middleware.
-    Records request start time and logs slow requests.
-    """
     
+    Records request start time, logs slow requests, and profiles the
+    queries of debug-mode or sampled requests.
+    """
     @app.before_request
     def start_timer():
         g.request_start_time = time.time()
-        # Start query profiler in debug mode
-        if app.debug:
-            _query_profiler.start()
+        sample_rate = app.config.get('QUERY_PROFILE_SAMPLE_RATE', 0.0)
+        if app.debug or (sample_rate and random.random() < sample_rate):
+            g.query_profile = _query_profiler.start(
+                request.endpoint, app.config.get('QUERY_REPEAT_THRESHOLD', 5))
     
     @app.after_request
     def log_request_timing(response):
@@ -104,16 +304,35 @@ def init_request_timing(app):
                 logger.warning(
                     f"Slow request ({elapsed:.3f}s): {request.method} {request.path}"
                 )
+        
+        profile = g.pop('query_profile', None)
+        if profile is not None:
+            _query_profiler.stop()
+            response.headers['X-Query-Count'] = str(profile.count)
+            response.headers['X-Query-Time'] = f'{profile.total_time:.3f}s'
+            
+            endpoint = request.endpoint or request.path
+            view = app.view_functions.get(request.endpoint)
+            budget = getattr(view, 'query_budget', app.config.get('QUERY_BUDGET', 20))
+            query_budget_report.add(endpoint, profile, budget)
             
-            # Log query count in debug mode
-            if app.debug:
-                stats = _query_profiler.stop()
-                if stats['count'] > 10:  # Potential N+1
-                    logger.warning(
-                        f"High query count ({stats['count']}) for {request.path}"
-                    )
+            if profile.count > budget:
+                logger.warning(
+                    f"Query budget exceeded for {endpoint}: {profile.count} queries (budget {budget})"
+                )
+            for item in profile.repeated():
+                logger.warning(
+                    f"Possible N+1 in {endpoint}: {item['count']} x {item['fingerprint'][:120]} "
+                    f"from {item['origin'] or 'unknown'}"
+                )
         
         return response
+    
+    @app.teardown_request
+    def stop_query_profile(exc):
+        # after_request is skipped when a view raises
+        if g.pop('query_profile', None) is not None:
+            _query_profiler.stop()
 
 
 def timed(func):
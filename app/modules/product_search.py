@@ -0,0 +1,365 @@
+"""
+Product Search Module
+
+Catalog search and listing for the storefront API:
+
+- Matching runs on the 'product' full-text index (name, variant SKUs,
+  variant attribute values, description; see search_index.py)
+- Product.avg_rating, review_count and units_sold are denormalized from
+  approved Reviews and OrderItems of sold orders, so the 'rating' and
+  'popular' sorts read indexed columns
+- ProductFacetValue holds the attribute values of each product's active
+  variants, so attribute facets and filters are plain indexed lookups
+- Facet counts (category, price bucket, attribute value) come back from
+  one grouped UNION ALL query. Each facet is counted with every filter
+  except its own, so the other choices of a facet stay visible
+
+Mapper events on Review, OrderItem, Order and ProductVariant queue the
+products they touch; after each flush those products' stats, facet rows
+and index entries are refreshed in the same transaction. Bulk
+Query.update()/delete() bypass the events; run
+`flask refresh-product-stats` after them.
+"""
+
+import logging
+from sqlalchemy import (
+    String, and_, cast, case, delete, event, func, insert, inspect, literal_column, null, select, true,
+    union_all, update
+)
+from sqlalchemy.orm import Session, joinedload, object_session
+from app.database import db
+from app.modules.search_index import get_index, query_terms
+
+logger = logging.getLogger(__name__)
+
+# Order statuses whose items count as sold
+SOLD_STATUSES = ('paid', 'partially_paid', 'processing', 'shipped', 'delivered', 'completed')
+
+# Price facet buckets in cents, (min, max) with max exclusive
+PRICE_BUCKETS = ((0, 2500), (2500, 5000), (5000, 10000), (10000, 25000), (25000, None))
+
+SORTS = ('relevance', 'newest', 'price_low', 'price_high', 'popular', 'rating')
+
+# Registered mapper listeners by model
+_listeners = {}
+
+
+# ============================================================================
+# Denormalized stats and facet rows
+# ============================================================================
+
+def refresh_product_stats(connection, product_ids):
+    """Recompute avg_rating, review_count and units_sold for products."""
+    from app.models import Order, OrderItem, Product, Review
+
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    approved = and_(Review.product_id == Product.id, Review.status == 'approved')
+    sold = select(func.coalesce(func.sum(OrderItem.quantity), 0)).join(
+        Order, Order.id == OrderItem.order_id
+    ).where(OrderItem.product_id == Product.id, Order.status.in_(SOLD_STATUSES))
+    connection.execute(
+        update(Product.__table__).where(Product.id.in_(product_ids)).values(
+            avg_rating=select(func.coalesce(func.avg(Review.rating), 0)).where(approved).scalar_subquery(),
+            review_count=select(func.count(Review.id)).where(approved).scalar_subquery(),
+            units_sold=sold.scalar_subquery(),
+            # Stats are not an edit of the product
+            updated_at=Product.__table__.c.updated_at
+        )
+    )
+
+
+def refresh_product_facets(connection, product_ids):
+    """Rewrite the ProductFacetValue rows of products from their active variants."""
+    from app.models import ProductFacetValue, ProductVariant
+
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    connection.execute(delete(ProductFacetValue.__table__).where(ProductFacetValue.product_id.in_(product_ids)))
+    rows = connection.execute(
+        select(ProductVariant.product_id, ProductVariant.attributes).where(
+            ProductVariant.product_id.in_(product_ids), ProductVariant.is_active == True
+        )
+    )
+    values = {}
+    for product_id, attributes in rows:
+        for attribute, value in (attributes or {}).items():
+            if value is None or value == '':
+                continue
+            key = (product_id, str(attribute).lower()[:100], str(value)[:100])
+            values[key] = {'product_id': key[0], 'attribute': key[1], 'value': key[2]}
+    if values:
+        connection.execute(insert(ProductFacetValue.__table__), list(values.values()))
+
+
+def refresh_all_products(batch_size=500, echo=None):
+    """
+    Recompute stats and facet rows for every product (committed per batch).
+
+    Returns:
+        Number of products refreshed
+    """
+    from app.models import Product
+
+    count = 0
+    last_id = 0
+    while True:
+        ids = [row.id for row in db.session.query(Product.id).filter(Product.id > last_id)
+               .order_by(Product.id).limit(batch_size)]
+        if not ids:
+            break
+        connection = db.session.connection()
+        refresh_product_stats(connection, ids)
+        refresh_product_facets(connection, ids)
+        db.session.commit()
+        count += len(ids)
+        last_id = ids[-1]
+        if echo:
+            echo(f'{count} products refreshed')
+    return count
+
+
+def _values(target, name):
+    """Current and pre-change values of an attribute, without None."""
+    history = inspect(target).attrs[name].history
+    return {v for v in list(history.unchanged) + list(history.added) + list(history.deleted) if v is not None}
+
+
+def _queue(target, key, ids):
+    session = object_session(target)
+    session.info.setdefault('product_search', {}).setdefault(key, set()).update(ids)
+
+
+def _rules():
+    from app.models import Order, OrderItem, ProductVariant, Review
+
+    return {
+        Review: (('rating', 'status', 'product_id'), lambda t: {'stats': _values(t, 'product_id')}),
+        OrderItem: (('quantity', 'product_id', 'order_id'), lambda t: {'stats': _values(t, 'product_id')}),
+        Order: (('status',), lambda t: {'orders': {t.id}}),
+        ProductVariant: (
+            ('sku', 'attributes', 'is_active', 'product_id'),
+            lambda t: {'facets': _values(t, 'product_id')}
+        ),
+    }
+
+
+def _make_listener(queued_for, watched=None):
+    def listener(mapper, connection, target):
+        if watched is not None:
+            state = inspect(target)
+            if not any(state.attrs[name].history.has_changes() for name in watched):
+                return
+        for key, ids in queued_for(target).items():
+            _queue(target, key, ids)
+    return listener
+
+
+def _product_deleted(mapper, connection, target):
+    _queue(target, 'facets', {target.id})
+
+
+def _session_flushed(session, flush_context):
+    queued = session.info.pop('product_search', None)
+    if not queued:
+        return
+    from app.models import OrderItem, Product
+
+    connection = session.connection()
+    stats = set(queued.get('stats', ()))
+    if queued.get('orders'):
+        stats.update(connection.execute(
+            select(OrderItem.product_id).where(OrderItem.order_id.in_(queued['orders'])).distinct()
+        ).scalars())
+    refresh_product_stats(connection, stats)
+
+    facets = queued.get('facets')
+    if facets:
+        refresh_product_facets(connection, facets)
+        # SKUs and attribute values are part of the product's search document
+        index = get_index('product')
+        if index.is_ready(connection):
+            with session.no_autoflush:
+                products = session.query(Product).options(joinedload(Product.variants)).filter(
+                    Product.id.in_(facets)
+                ).populate_existing().all()
+            index.write(connection, products)
+
+
+def _session_rolled_back(session):
+    session.info.pop('product_search', None)
+
+
+def init_product_search(app):
+    """Register the stats, facet and reindex hooks (idempotent)."""
+    for model, (watched, queued_for) in _rules().items():
+        if model in _listeners:
+            continue
+        _listeners[model] = _make_listener(queued_for)
+        event.listen(model, 'after_insert', _listeners[model])
+        event.listen(model, 'after_update', _make_listener(queued_for, watched))
+        event.listen(model, 'after_delete', _listeners[model])
+    from app.models import Product
+    if not event.contains(Product, 'after_delete', _product_deleted):
+        event.listen(Product, 'after_delete', _product_deleted)
+    if not event.contains(Session, 'after_flush', _session_flushed):
+        event.listen(Session, 'after_flush', _session_flushed)
+        event.listen(Session, 'after_rollback', _session_rolled_back)
+
+
+# ============================================================================
+# Search
+# ============================================================================
+
+class ProductSearch:
+    """
+    A catalog query: filters, sort, page and facet counts.
+
+    Args:
+        text: Full-text query ('' for none)
+        category_id: Category filter
+        min_price: Minimum price in cents
+        max_price: Maximum price in cents
+        product_type: 'digital' or 'physical'
+        attributes: {attribute: [values]}; values of one attribute are
+            alternatives, different attributes must all match
+        sort: One of SORTS; defaults to relevance for text queries, else newest
+    """
+
+    def __init__(self, text='', category_id=None, min_price=None, max_price=None,
+                 product_type=None, attributes=None, sort=None):
+        self.terms = query_terms(text)
+        self.category_id = category_id
+        self.min_price = min_price
+        self.max_price = max_price
+        self.product_type = product_type
+        self.attributes = {k.lower(): list(v) for k, v in (attributes or {}).items() if v}
+        if sort not in SORTS or (sort == 'relevance' and not self.terms):
+            sort = 'relevance' if self.terms else 'newest'
+        self.sort = sort
+
+    def _conditions(self, exclude=None):
+        """Filter conditions, leaving out one facet's own filter."""
+        from app.models import Product, ProductFacetValue
+
+        conditions = []
+        if self.category_id and exclude != 'category':
+            conditions.append(Product.category_id == self.category_id)
+        if exclude != 'price':
+            if self.min_price:
+                conditions.append(Product.price >= self.min_price)
+            if self.max_price:
+                conditions.append(Product.price <= self.max_price)
+        if self.product_type == 'digital':
+            conditions.append(Product.is_digital == True)
+        elif self.product_type == 'physical':
+            conditions.append(Product.is_digital == False)
+        for attribute, values in self.attributes.items():
+            if exclude == f'attr:{attribute}':
+                continue
+            conditions.append(Product.id.in_(
+                select(ProductFacetValue.product_id).where(
+                    ProductFacetValue.attribute == attribute, ProductFacetValue.value.in_(values)
+                )
+            ))
+        return conditions
+
+    def _matching_ids(self, exclude=None):
+        from app.models import Product
+
+        stmt = select(Product.id).where(*self._conditions(exclude))
+        if self.terms:
+            matches = get_index('product').matches(self.terms)
+            stmt = stmt.join(matches, matches.c.id == Product.id)
+        return stmt
+
+    def query(self):
+        """Product query with filters and sort applied, category and image eager-loaded."""
+        from app.models import Product
+
+        query = Product.query.options(joinedload(Product.image), joinedload(Product.category)).filter(
+            *self._conditions()
+        )
+        if self.terms:
+            query = get_index('product').ranked(query, self.terms)
+            if self.sort == 'relevance':
+                return query
+            query = query.order_by(None)
+        if self.sort == 'price_low':
+            return query.order_by(Product.price.asc(), Product.id.desc())
+        if self.sort == 'price_high':
+            return query.order_by(Product.price.desc(), Product.id.desc())
+        if self.sort == 'popular':
+            return query.order_by(Product.units_sold.desc(), Product.id.desc())
+        if self.sort == 'rating':
+            return query.order_by(Product.avg_rating.desc(), Product.review_count.desc(), Product.id.desc())
+        return query.order_by(Product.created_at.desc(), Product.id.desc())
+
+    def paginate(self, page=1, per_page=12):
+        return self.query().paginate(page=page, per_page=per_page, error_out=False)
+
+    def facets(self):
+        """
+        Facet counts, from one query.
+
+        Returns:
+            {'categories': [{'id', 'name', 'count'}],
+             'price': [{'min', 'max', 'count'}],
+             'attributes': {attribute: [{'value', 'count'}]}}
+        """
+        from app.models import Category, Product, ProductFacetValue
+
+        # Constants are inlined: Postgres cannot match bound parameters
+        # between the select list and GROUP BY, or type them in a UNION
+        bucket = case(
+            *((Product.price < literal_column(str(high)), literal_column(f"'{i}'"))
+              for i, (low, high) in enumerate(PRICE_BUCKETS) if high is not None),
+            else_=literal_column(f"'{len(PRICE_BUCKETS) - 1}'")
+        )
+        parts = [
+            select(
+                literal_column("'category'", String).label('facet'), cast(Product.category_id, String).label('value'),
+                func.min(Category.name).label('label'), func.count(Product.id).label('count')
+            ).join(Category, Category.id == Product.category_id)
+            .where(Product.id.in_(self._matching_ids(exclude='category')))
+            .group_by(Product.category_id),
+            select(
+                literal_column("'price'", String).label('facet'), bucket.label('value'),
+                cast(null(), String).label('label'), func.count(Product.id).label('count')
+            ).where(Product.id.in_(self._matching_ids(exclude='price')))
+            .group_by(bucket),
+        ]
+        # Each attribute with an active filter is counted without it
+        attribute_ids = {None: self._matching_ids()}
+        for attribute in self.attributes:
+            attribute_ids[attribute] = self._matching_ids(exclude=f'attr:{attribute}')
+        for attribute, ids in attribute_ids.items():
+            if attribute is None:
+                condition = ProductFacetValue.attribute.notin_(list(self.attributes)) \
+                    if self.attributes else true()
+            else:
+                condition = ProductFacetValue.attribute == attribute
+            parts.append(
+                select(
+                    (literal_column("'attr:'", String) + ProductFacetValue.attribute).label('facet'), ProductFacetValue.value.label('value'),
+                    cast(null(), String).label('label'), func.count(ProductFacetValue.product_id).label('count')
+                ).where(condition, ProductFacetValue.product_id.in_(ids))
+                .group_by(ProductFacetValue.attribute, ProductFacetValue.value)
+            )
+
+        facets = {'categories': [], 'price': [], 'attributes': {}}
+        for facet, value, label, count in db.session.execute(union_all(*parts)):
+            if facet == 'category':
+                facets['categories'].append({'id': int(value), 'name': label, 'count': count})
+            elif facet == 'price':
+                low, high = PRICE_BUCKETS[int(value)]
+                facets['price'].append({'min': low, 'max': high, 'count': count})
+            else:
+                facets['attributes'].setdefault(facet[len('attr:'):], []).append({'value': value, 'count': count})
+        facets['categories'].sort(key=lambda c: (-c['count'], c['name'] or ''))
+        facets['price'].sort(key=lambda b: b['min'])
+        for values in facets['attributes'].values():
+            values.sort(key=lambda v: (-v['count'], v['value']))
+        return facets
@@ -241,91 +241,77 @@ def calculate_tax_report(start_date, end_date):
     }
 
 
-def calculate_traffic_metrics(start_date, end_date):
+def count_unique_traffic(start_date, end_date, approximate=False):
     """
-    Calculate traffic and engagement metrics.
+    Count distinct sessions and visitors (ip_hash) in a period.
+    
+    Args:
+        approximate: Merge the HyperLogLog sketches (about 1% error, cost
+            independent of traffic volume) instead of running an exact
+            COUNT(DISTINCT) over raw page views
     
     Returns:
-        dict with page_views, unique_visitors, bounce_rate, 
-        avg_session_duration, top_pages, utm_sources.
+        dict with unique_sessions and unique_visitors.
     """
-    from app.models import PageView, VisitorSession, db
+    if approximate:
+        from app.modules.analytics_rollups import estimate_unique
+        return {
+            'unique_sessions': estimate_unique(start_date, end_date, 'sessions'),
+            'unique_visitors': estimate_unique(start_date, end_date, 'visitors'),
+        }
     
-    # Page views
-    page_views = PageView.query.filter(
-        PageView.timestamp >= start_date,
-        PageView.timestamp <= end_date
-    ).count()
+    from app.models import PageView, db
     
-    # Unique sessions
-    unique_sessions = db.session.query(
-        func.count(func.distinct(PageView.session_id))
+    counts = db.session.query(
+        func.count(func.distinct(PageView.session_id)),
+        func.count(func.distinct(PageView.ip_hash))
     ).filter(
         PageView.timestamp >= start_date,
-        PageView.timestamp <= end_date,
-        PageView.session_id.isnot(None)
-    ).scalar() or 0
-    
-    # Bounce rate from sessions
-    sessions = VisitorSession.query.filter(
-        VisitorSession.started_at >= start_date,
-        VisitorSession.started_at <= end_date
-    ).all()
+        PageView.timestamp < end_date
+    ).one()
+    return {'unique_sessions': counts[0] or 0, 'unique_visitors': counts[1] or 0}
+
+
+def calculate_traffic_metrics(start_date, end_date, approximate=False):
+    """
+    Calculate traffic and engagement metrics.
     
-    total_sessions = len(sessions)
-    bounced_sessions = sum(1 for s in sessions if s.bounce)
-    bounce_rate = (bounced_sessions / total_sessions * 100) if total_sessions > 0 else 0
+    Reads the hourly/daily traffic rollups; only traffic newer than the
+    last rollup refresh is counted from raw rows. Unique counts are exact
+    unless approximate=True (see count_unique_traffic).
     
-    # Average session duration
-    durations = [s.duration_seconds for s in sessions if s.duration_seconds]
-    avg_duration = sum(durations) / len(durations) if durations else 0
+    Returns:
+        dict with page_views, unique_sessions, unique_visitors, bounce_rate, 
+        avg_session_duration, top_pages, utm_sources.
+    """
+    from app.modules.analytics_rollups import query_traffic, top_traffic
     
-    # Top pages
-    top_pages = db.session.query(
-        PageView.url,
-        func.count(PageView.id).label('views')
-    ).filter(
-        PageView.timestamp >= start_date,
-        PageView.timestamp <= end_date
-    ).group_by(
-        PageView.url
-    ).order_by(
-        desc('views')
-    ).limit(10).all()
+    unique = count_unique_traffic(start_date, end_date, approximate)
+    totals = query_traffic(start_date, end_date)
+    totals = totals[0] if totals else {}
+    page_views = totals.get('page_views', 0)
+    total_sessions = totals.get('sessions', 0)
     
-    # UTM source breakdown
-    utm_sources = db.session.query(
-        PageView.utm_source,
-        func.count(PageView.id).label('views')
-    ).filter(
-        PageView.timestamp >= start_date,
-        PageView.timestamp <= end_date,
-        PageView.utm_source.isnot(None)
-    ).group_by(
-        PageView.utm_source
-    ).order_by(
-        desc('views')
-    ).limit(10).all()
+    # Bounce rate and average duration over sessions started in the period
+    bounce_rate = (totals.get('bounces', 0) / total_sessions * 100) if total_sessions > 0 else 0
+    duration_count = totals.get('duration_count', 0)
+    avg_duration = totals.get('duration_sum', 0) / duration_count if duration_count else 0
     
-    # Device breakdown
-    devices = db.session.query(
-        PageView.device_type,
-        func.count(PageView.id).label('views')
-    ).filter(
-        PageView.timestamp >= start_date,
-        PageView.timestamp <= end_date
-    ).group_by(
-        PageView.device_type
-    ).all()
+    top_pages = top_traffic(start_date, end_date, 'url', limit=10)
+    utm_sources = [
+        u for u in top_traffic(start_date, end_date, 'utm_source') if u['utm_source'] is not None
+    ][:10]
+    devices = top_traffic(start_date, end_date, 'device_type')
     
     return {
         'page_views': page_views,
-        'unique_sessions': unique_sessions,
+        'unique_sessions': unique['unique_sessions'],
+        'unique_visitors': unique['unique_visitors'],
         'bounce_rate': round(bounce_rate, 1),
         'avg_session_duration': int(avg_duration),
-        'top_pages': [{'url': p.url, 'views': p.views} for p in top_pages],
-        'utm_sources': [{'source': u.utm_source or 'Direct', 'views': u.views} for u in utm_sources],
-        'devices': [{'type': d.device_type or 'Unknown', 'views': d.views} for d in devices],
+        'top_pages': [{'url': p['url'], 'views': p['page_views']} for p in top_pages],
+        'utm_sources': [{'source': u['utm_source'] or 'Direct', 'views': u['page_views']} for u in utm_sources],
+        'devices': [{'type': d['device_type'] or 'Unknown', 'views': d['page_views']} for d in devices],
         'period_start': start_date,
         'period_end': end_date
     }
@@ -475,7 +461,7 @@ def execute_saved_report(report):
         limit = config.get('limit', 100)
         return {'customers': calculate_customer_clv(limit)}
     elif report.report_type == 'traffic':
-        return calculate_traffic_metrics(start_date, end_date)
+        return calculate_traffic_metrics(start_date, end_date, config.get('approximate', False))
     elif report.report_type == 'tax':
         return calculate_tax_report(start_date, end_date)
     else:
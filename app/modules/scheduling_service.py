@@ -7,6 +7,7 @@ Core business logic for advanced scheduling:
 - Waitlist processing
 - Check-in token generation
 """
+from collections import defaultdict
 from datetime import datetime, timedelta, date, time
 from typing import List, Tuple, Optional, Dict, Any
 from sqlalchemy import and_, or_
@@ -16,7 +17,11 @@ from app.models import (
     Waitlist, BookingPolicy, CheckInToken, Estimator, 
     Availability, AvailabilityException
 )
-from app.modules.availability_service import get_estimator_availability, get_booked_slots
+from app.modules.slot_engine import SlotEngine
+from app.modules.slot_cache import cached_slots
+
+# Candidate start times step by this many minutes
+SLOT_INTERVAL_MINUTES = 15
 
 def get_appointment_type_slots(
     appointment_type_id: int, 
@@ -30,44 +35,84 @@ def get_appointment_type_slots(
     2. Resource availability (if type requires resource)
     3. Buffer times from appointment type
     """
+    return get_appointment_type_slots_range(
+        appointment_type_id, target_date, 1, location_id
+    ).get(target_date, [])
+
+def get_appointment_type_slots_range(
+    appointment_type_id: int,
+    start_date: date,
+    days: int,
+    location_id: Optional[int] = None
+) -> Dict[date, List[datetime]]:
+    """
+    Available start times for an appointment type on each of `days` days.
+    
+    Every estimator's availability, exceptions and bookings for the range
+    are loaded once by a SlotEngine; resource bookings in one more query.
+    """
+    appt_type = AppointmentType.query.get(appointment_type_id)
+    if not appt_type:
+        return {}
+    
+    engine = _type_engine(start_date, start_date + timedelta(days=days - 1))
+    return {day: _type_slots(engine, appt_type, day, location_id) for day in engine.days()}
+
+def get_cached_appointment_type_slots(
+    appointment_type_id: int, 
+    target_date: date, 
+    location_id: Optional[int] = None
+) -> List[datetime]:
+    """get_appointment_type_slots through the write-invalidated slot cache."""
     appt_type = AppointmentType.query.get(appointment_type_id)
     if not appt_type:
         return []
-        
-    duration = appt_type.duration_minutes
-    buffer_before = appt_type.buffer_before
-    buffer_after = appt_type.buffer_after
-    total_duration = duration + buffer_after  # We need slot for duration + after buffer (before buffer handled by gap)
+    
+    def compute(missing):
+        engine = _type_engine(min(missing), max(missing))
+        results = {}
+        for day in missing:
+            expiries = [engine.hold_expiry(e_id, day) for e_id in engine.estimator_ids]
+            results[day] = (
+                _type_slots(engine, appt_type, day, location_id),
+                min((e for e in expiries if e), default=None)
+            )
+        return results
+    
+    return cached_slots(
+        None, f'type:{appt_type.id}:loc:{location_id or 0}', [target_date], compute
+    )[target_date]
 
+def _type_engine(start_date: date, end_date: date) -> SlotEngine:
     # 1. Get eligible estimators
     # For now, get all active estimators. Phase 17.1 says "service-based scheduling with staff assignment"
     # We assume all estimators perform all services unless restricted (future enhancement)
-    estimators = Estimator.query.all()
+    estimator_ids = [e_id for (e_id,) in db.session.query(Estimator.id)]
+    return SlotEngine(estimator_ids, start_date, end_date)
+
+def _type_slots(
+    engine: SlotEngine, 
+    appt_type: AppointmentType, 
+    day: date, 
+    location_id: Optional[int] = None
+) -> List[datetime]:
+    duration = appt_type.duration_minutes
     
-    available_slots = set()
+    # A slot needs [start - buffer_before, end + buffer_after] clear of bookings
+    day_slots = engine.any_free_slots(
+        day, duration, SLOT_INTERVAL_MINUTES,
+        pad_before=appt_type.buffer_after, pad_after=appt_type.buffer_before
+    )
     
-    for estimator in estimators:
-        # Get base availability for this estimator
-        est_slots = get_available_slots_for_type(
-            estimator.id, 
-            target_date, 
-            duration, 
-            buffer_before, 
-            buffer_after
+    # Filter by resource availability if needed
+    if appt_type.required_resource_type and day_slots:
+        day_slots = filter_slots_by_resource(
+            day_slots, 
+            appt_type.required_resource_type, 
+            duration,
+            location_id
         )
-        
-        # Filter by resource availability if needed
-        if appt_type.required_resource_type:
-            est_slots = filter_slots_by_resource(
-                est_slots, 
-                appt_type.required_resource_type, 
-                duration,
-                location_id
-            )
-            
-        available_slots.update(est_slots)
-        
-    return sorted(list(available_slots))
+    return day_slots
 
 def get_available_slots_for_type(
     estimator_id: int, 
@@ -77,50 +122,11 @@ def get_available_slots_for_type(
     buffer_after: int
 ) -> List[datetime]:
     """Helper to get slots for specific estimator considering buffers."""
-    
-    # 1. Get raw working hours
-    availabilities = get_estimator_availability(estimator_id, target_date)
-    if not availabilities:
-        return []
-        
-    # 2. Get existing bookings to calculate gaps
-    booked_ranges = get_booked_slots(estimator_id, target_date)
-    # Add buffer logic to booked ranges? 
-    # Existing `get_booked_slots` returns (start, end).
-    # We should treat booked_start - buffer_after (of prev appt) and booked_end + buffer_before (of next appt)
-    # But for simplicity, we assume generic buffer or check gaps.
-    
-    # Let's generate potential slots every 15 mins and check if they fit
-    interval = 15
-    slots = []
-    
-    for start_time_range, end_time_range in availabilities:
-        # Construct full datetime
-        current = datetime.combine(target_date, start_time_range)
-        end_abs = datetime.combine(target_date, end_time_range)
-        
-        while current + timedelta(minutes=duration_minutes) <= end_abs:
-            slot_start = current
-            slot_end = current + timedelta(minutes=duration_minutes)
-            
-            # Check conflicts
-            is_conflict = False
-            for b_start, b_end in booked_ranges:
-                # Check overlap including buffers
-                # Effective slot needed: [start - buffer_before, end + buffer_after]
-                needed_start = slot_start - timedelta(minutes=buffer_before)
-                needed_end = slot_end + timedelta(minutes=buffer_after)
-                
-                if (needed_start < b_end) and (needed_end > b_start):
-                    is_conflict = True
-                    break
-            
-            if not is_conflict:
-                slots.append(slot_start)
-                
-            current += timedelta(minutes=interval)
-            
-    return slots
+    engine = SlotEngine([estimator_id], target_date, target_date)
+    return engine.free_slots(
+        estimator_id, target_date, duration_minutes, SLOT_INTERVAL_MINUTES,
+        pad_before=buffer_after, pad_after=buffer_before
+    )
 
 def filter_slots_by_resource(
     slots: List[datetime], 
@@ -129,27 +135,40 @@ def filter_slots_by_resource(
     location_id: Optional[int] = None
 ) -> List[datetime]:
     """Filter slots where at least one resource of type is available."""
-    valid_slots = []
+    if not slots:
+        return []
     
     resources_query = Resource.query.filter_by(resource_type=resource_type, is_active=True)
     if location_id:
         resources_query = resources_query.filter_by(location_id=location_id)
-    resources = resources_query.all()
+    resource_ids = [r.id for r in resources_query.all()]
     
-    if not resources:
+    if not resource_ids:
         return []
 
+    # Every booking of these resources that could touch any slot, in one query
+    window_start = min(slots)
+    window_end = max(slots) + timedelta(minutes=duration_minutes)
+    busy = defaultdict(list)
+    for resource_id, start, end in db.session.query(
+        ResourceBooking.resource_id, ResourceBooking.start_time, ResourceBooking.end_time
+    ).filter(
+        ResourceBooking.resource_id.in_(resource_ids),
+        ResourceBooking.status != 'cancelled',
+        ResourceBooking.start_time < window_end,
+        ResourceBooking.end_time > window_start
+    ):
+        busy[resource_id].append((start, end))
+
+    valid_slots = []
     for slot in slots:
         slot_end = slot + timedelta(minutes=duration_minutes)
         
         # Check if ANY resource is free
-        resource_available = False
-        for res in resources:
-            if check_resource_availability(res.id, slot, slot_end):
-                resource_available = True
-                break
-        
-        if resource_available:
+        if any(
+            all(not (start < slot_end and end > slot) for start, end in busy[resource_id])
+            for resource_id in resource_ids
+        ):
             valid_slots.append(slot)
             
     return valid_slots
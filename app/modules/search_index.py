@@ -0,0 +1,451 @@
+"""
+Search Index Module
+
+Full-text indexes kept beside their tables, replacing `ilike('%term%')`
+scans that no index can serve:
+
+- On SQLite each index is an FTS5 table (`<name>_fts`, porter stemming)
+  whose rowid is the indexed row's id. It stores the plain-text document,
+  so results are ranked with bm25() and excerpted with snippet()
+- On Postgres it is a weighted `search_vector` tsvector column on the
+  table itself with a GIN index, ranked with ts_rank_cd() and excerpted
+  with ts_headline()
+- Both are created by `db.create_all()` (after_create DDL hooks) and kept
+  in sync by mapper events on insert, delete, and updates that touch an
+  indexed field, inside the writing transaction. Bulk Query.update() and
+  delete() bypass those events; run `flask search-index rebuild` after them
+- Queries match every word, each as a prefix ("deplo" finds "deployment")
+- A database created before an index existed (or another dialect) falls
+  back to ilike matching until `flask search-index rebuild` creates it
+
+SearchIndex.ranked() joins the matches to any base query (so callers add
+their own filters) and orders by rank; paginate() does the same and
+attaches highlighted snippets for the page it returns.
+"""
+
+import logging
+import re
+from flask import current_app
+from flask_sqlalchemy.pagination import Pagination
+from markupsafe import Markup, escape
+from sqlalchemy import Float, Integer, bindparam, event, false, inspect, literal, or_, select, text
+from app.database import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE = 'english'
+MAX_TERMS = 8
+SNIPPET_TOKENS = 24
+
+# Private-use characters marking hits in raw snippets, swapped for <mark>
+# after the text has been escaped
+MARK_START = '\ue000'
+MARK_END = '\ue001'
+
+PG_WEIGHTS = 'ABCD'
+
+# Registered indexes by name
+_indexes = {}
+
+# Engine URLs whose structures are known to exist, by index name
+_ready = {}
+
+
+def html_to_text(html):
+    """Plain text of an HTML fragment, for indexing."""
+    return Markup(html or '').striptags()
+
+
+def query_terms(query_text):
+    """The words of a search query, lowercased, at most MAX_TERMS of them."""
+    return re.findall(r'\w+', (query_text or '').lower())[:MAX_TERMS]
+
+
+def highlight(raw):
+    """Escape a raw snippet and turn its hit markers into <mark> tags."""
+    return Markup(str(escape(raw)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search_language():
+    return current_app.config.get('SEARCH_LANGUAGE', DEFAULT_LANGUAGE)
+
+
+class SearchIndex:
+    """
+    A full-text index over one model.
+
+    Args:
+        name: Index name (the FTS5 table is `<name>_fts`)
+        model: Indexed model; its `id` is the index key
+        fields: Document fields, most important first
+        document: Function(row) -> {field: text}, or None to leave the row out
+        watched: Model attributes whose changes require reindexing
+        fallback_columns: Columns searched with ilike when the index is unavailable
+        weights: Relative bm25 weights of the fields (Postgres weighs them A, B, C, D in order)
+        snippet_field: Field that snippets are cut from
+    """
+
+    def __init__(self, name, model, fields, document, watched, fallback_columns,
+                 weights=None, snippet_field=None):
+        self.name = name
+        self.model = model
+        self.fields = tuple(fields)
+        self.document = document
+        self.watched = tuple(watched)
+        self.fallback_columns = tuple(fallback_columns)
+        self.weights = tuple(weights or [1.0] * len(self.fields))
+        self.snippet_field = snippet_field or self.fields[-1]
+
+    @property
+    def fts_table(self):
+        return f'{self.name}_fts'
+
+    @property
+    def table(self):
+        return self.model.__tablename__
+
+    # ------------------------------------------------------------------
+    # Structures
+    # ------------------------------------------------------------------
+
+    def create(self, connection):
+        """Create the index structures if missing (idempotent)."""
+        dialect = connection.dialect.name
+        if dialect == 'sqlite':
+            columns = ', '.join(self.fields)
+            connection.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts_table} "
+                f"USING fts5({columns}, tokenize='porter unicode61 remove_diacritics 2')"
+            )
+        elif dialect == 'postgresql':
+            connection.exec_driver_sql(f'ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS search_vector tsvector')
+            connection.exec_driver_sql(
+                f'CREATE INDEX IF NOT EXISTS ix_{self.table}_search_vector ON {self.table} USING GIN (search_vector)'
+            )
+        else:
+            return
+        _ready.setdefault(self.name, set()).add(str(connection.engine.url))
+
+    def drop(self, connection):
+        if connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS {self.fts_table}')
+        _ready.get(self.name, set()).discard(str(connection.engine.url))
+
+    def is_ready(self, connection):
+        """Whether the index structures exist on this database."""
+        url = str(connection.engine.url)
+        if url in _ready.get(self.name, ()):
+            return True
+        dialect = connection.dialect.name
+        if dialect == 'sqlite':
+            exists = connection.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.fts_table,)
+            ).first() is not None
+        elif dialect == 'postgresql':
+            exists = connection.execute(text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = :table AND column_name = 'search_vector'"
+            ), {'table': self.table}).first() is not None
+        else:
+            exists = False
+        if exists:
+            _ready.setdefault(self.name, set()).add(url)
+        return exists
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def _documents(self, rows):
+        documents = []
+        for row in rows:
+            doc = self.document(row)
+            if doc is not None:
+                documents.append(dict({f: doc.get(f) or '' for f in self.fields}, id=row.id))
+        return documents
+
+    def write(self, connection, rows):
+        """Index (or reindex) rows on `connection`, in the caller's transaction."""
+        rows = list(rows)
+        if not rows:
+            return
+        documents = self._documents(rows)
+        dialect = connection.dialect.name
+        if dialect == 'sqlite':
+            connection.execute(
+                text(f'DELETE FROM {self.fts_table} WHERE rowid IN :ids').bindparams(bindparam('ids', expanding=True)),
+                {'ids': [row.id for row in rows]}
+            )
+            if documents:
+                columns = ', '.join(self.fields)
+                values = ', '.join(f':{f}' for f in self.fields)
+                connection.execute(
+                    text(f'INSERT INTO {self.fts_table} (rowid, {columns}) VALUES (:id, {values})'), documents
+                )
+        elif dialect == 'postgresql':
+            vector = ' || '.join(
+                f"setweight(to_tsvector(CAST(:language AS regconfig), :{f}), '{PG_WEIGHTS[min(i, 3)]}')"
+                for i, f in enumerate(self.fields)
+            )
+            language = search_language()
+            indexed = {doc['id'] for doc in documents}
+            if documents:
+                connection.execute(
+                    text(f'UPDATE {self.table} SET search_vector = {vector} WHERE id = :id'),
+                    [dict(doc, language=language) for doc in documents]
+                )
+            skipped = [row.id for row in rows if row.id not in indexed]
+            if skipped:
+                connection.execute(
+                    text(f'UPDATE {self.table} SET search_vector = NULL WHERE id IN :ids')
+                    .bindparams(bindparam('ids', expanding=True)),
+                    {'ids': skipped}
+                )
+
+    def remove(self, connection, ids):
+        """Drop rows from the index, for deletes that bypass the ORM."""
+        if connection.dialect.name == 'sqlite' and ids and self.is_ready(connection):
+            connection.execute(
+                text(f'DELETE FROM {self.fts_table} WHERE rowid IN :ids').bindparams(bindparam('ids', expanding=True)),
+                {'ids': list(ids)}
+            )
+
+    def rebuild(self, batch_size=500, echo=None):
+        """
+        Create the structures if needed and reindex every row (committed).
+
+        Returns:
+            Number of rows indexed
+        """
+        connection = db.session.connection()
+        self.create(connection)
+        if connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql(f'DELETE FROM {self.fts_table}')
+        elif connection.dialect.name != 'postgresql':
+            logger.warning(f"Full-text search is not supported on {connection.dialect.name}")
+            return 0
+        db.session.commit()
+
+        count = 0
+        last_id = 0
+        while True:
+            rows = self.model.query.filter(self.model.id > last_id).order_by(self.model.id).limit(batch_size).all()
+            if not rows:
+                break
+            self.write(db.session.connection(), rows)
+            db.session.commit()
+            count += len(rows)
+            last_id = rows[-1].id
+            db.session.expunge_all()
+            if echo:
+                echo(f'{self.name}: {count} indexed')
+        return count
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def matches(self, terms):
+        """
+        Selectable of (id, rank) for rows matching every term; lower rank is better.
+
+        Returns:
+            A subquery, or None when there are no terms
+        """
+        if not terms:
+            return None
+        connection = db.session.connection()
+        dialect = connection.dialect.name
+        if not self.is_ready(connection):
+            return self._fallback_matches(terms)
+        if dialect == 'sqlite':
+            weights = ', '.join(str(float(w)) for w in self.weights)
+            stmt = text(
+                f'SELECT rowid AS id, bm25({self.fts_table}, {weights}) AS rank '
+                f'FROM {self.fts_table} WHERE {self.fts_table} MATCH :match'
+            ).bindparams(match=' '.join(f'"{t}"*' for t in terms))
+        else:
+            stmt = text(
+                f'SELECT id, -ts_rank_cd(search_vector, search_query, 32) AS rank '
+                f'FROM {self.table}, to_tsquery(CAST(:language AS regconfig), :match) AS search_query '
+                f'WHERE search_vector @@ search_query'
+            ).bindparams(language=search_language(), match=' & '.join(f'{t}:*' for t in terms))
+        return stmt.columns(id=Integer, rank=Float).subquery(f'{self.name}_matches')
+
+    def _fallback_matches(self, terms):
+        conditions = []
+        for term in terms:
+            pattern = f'%{term}%'
+            conditions.append(or_(*(column.ilike(pattern) for column in self.fallback_columns)))
+        return select(self.model.id.label('id'), literal(0.0).label('rank')).where(*conditions).subquery(
+            f'{self.name}_matches'
+        )
+
+    def snippets(self, terms, rows):
+        """{row id: highlighted excerpt of the snippet field} for rows matching the terms."""
+        ids = [row.id for row in rows]
+        if not terms or not ids:
+            return {}
+        connection = db.session.connection()
+        if not self.is_ready(connection):
+            return {}
+        if connection.dialect.name == 'sqlite':
+            column = self.fields.index(self.snippet_field)
+            result = connection.execute(
+                text(
+                    f'SELECT rowid, snippet({self.fts_table}, {column}, :start, :end, :ellipsis, {SNIPPET_TOKENS}) '
+                    f'FROM {self.fts_table} WHERE {self.fts_table} MATCH :match AND rowid IN :ids'
+                ).bindparams(bindparam('ids', expanding=True)),
+                {'start': MARK_START, 'end': MARK_END, 'ellipsis': '…',
+                 'match': ' '.join(f'"{t}"*' for t in terms), 'ids': ids}
+            )
+        else:
+            documents = self._documents(rows)
+            result = connection.execute(
+                text(
+                    'SELECT d.id, ts_headline(CAST(:language AS regconfig), d.body, '
+                    'to_tsquery(CAST(:language AS regconfig), :match), :options) '
+                    'FROM unnest(CAST(:ids AS integer[]), CAST(:bodies AS text[])) AS d(id, body)'
+                ),
+                {'language': search_language(), 'match': ' & '.join(f'{t}:*' for t in terms),
+                 'options': f'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SNIPPET_TOKENS}, '
+                            f'MinWords={SNIPPET_TOKENS // 2}, MaxFragments=2, FragmentDelimiter=" … "',
+                 'ids': [d['id'] for d in documents], 'bodies': [d[self.snippet_field] for d in documents]}
+            )
+        return {row_id: highlight(raw) for row_id, raw in result if raw}
+
+    def ranked(self, base_query, terms):
+        """`base_query` narrowed to rows matching every term, best first."""
+        matches = self.matches(terms)
+        if matches is None:
+            return base_query.filter(false())
+        return base_query.join(matches, matches.c.id == self.model.id).order_by(
+            matches.c.rank, self.model.id.desc()
+        )
+
+    def paginate(self, query_text, base_query, page=1, per_page=10):
+        """
+        Page of `base_query` rows matching `query_text`, best first.
+
+        The returned pagination has a `snippets` dict of highlighted
+        excerpts by row id.
+        """
+        terms = query_terms(query_text)
+        query = self.ranked(base_query, terms)
+        return SearchPagination(page=page, per_page=per_page, error_out=False, query=query, index=self, terms=terms)
+
+    # ------------------------------------------------------------------
+    # Sync
+    # ------------------------------------------------------------------
+
+    def _inserted(self, mapper, connection, target):
+        if self.is_ready(connection):
+            self.write(connection, [target])
+
+    def _updated(self, mapper, connection, target):
+        state = inspect(target)
+        if any(state.attrs[name].history.has_changes() for name in self.watched) and self.is_ready(connection):
+            self.write(connection, [target])
+
+    def _deleted(self, mapper, connection, target):
+        if self.is_ready(connection):
+            self.remove(connection, [target.id])
+
+    def register(self):
+        """Hook the index to table creation and row writes (idempotent)."""
+        if event.contains(self.model, 'after_insert', self._inserted):
+            return
+        table = self.model.__table__
+        event.listen(table, 'after_create', lambda target, connection, **kw: self.create(connection))
+        event.listen(table, 'before_drop', lambda target, connection, **kw: self.drop(connection))
+        event.listen(self.model, 'after_insert', self._inserted)
+        event.listen(self.model, 'after_update', self._updated)
+        event.listen(self.model, 'after_delete', self._deleted)
+
+
+class SearchPagination(Pagination):
+    """Pagination over ranked search results, with snippets for the page."""
+
+    def _query_items(self):
+        items = self._query_args['query'].limit(self.per_page).offset(self._query_offset).all()
+        self.snippets = self._query_args['index'].snippets(self._query_args['terms'], items)
+        return items
+
+    def _query_count(self):
+        return self._query_args['query'].order_by(None).count()
+
+
+def register_index(index):
+    _indexes[index.name] = index
+    return index
+
+
+def get_index(name):
+    return _indexes[name]
+
+
+def index_names():
+    return list(_indexes)
+
+
+# ============================================================================
+# Indexes
+# ============================================================================
+
+def _post_document(post):
+    return {'title': post.title, 'summary': post.meta_description, 'body': html_to_text(post.content)}
+
+
+def _message_document(message):
+    return {'content': message.content}
+
+
+def _product_document(product):
+    variants = [v for v in product.variants if v.is_active]
+    values = [str(value) for v in variants for value in (v.attributes or {}).values()]
+    return {
+        'name': product.name,
+        'sku': ' '.join(v.sku for v in variants),
+        'attributes': ' '.join(dict.fromkeys(values)),
+        'description': html_to_text(product.description),
+    }
+
+
+def _define_indexes():
+    from app.models import Message, Post, Product
+
+    register_index(SearchIndex(
+        'post', Post,
+        fields=('title', 'summary', 'body'),
+        document=_post_document,
+        watched=('title', 'meta_description', 'content'),
+        fallback_columns=(Post.title, Post.content, Post.meta_description),
+        weights=(10.0, 4.0, 1.0)
+    ))
+
+    register_index(SearchIndex(
+        'message', Message,
+        fields=('content',),
+        document=_message_document,
+        watched=('content',),
+        fallback_columns=(Message.content,)
+    ))
+
+    # Variant SKUs and attributes are reindexed by app/modules/product_search.py
+    register_index(SearchIndex(
+        'product', Product,
+        fields=('name', 'sku', 'attributes', 'description'),
+        document=_product_document,
+        watched=('name', 'description'),
+        fallback_columns=(Product.name, Product.description),
+        weights=(10.0, 8.0, 3.0, 1.0),
+        snippet_field='description'
+    ))
+
+
+def init_search_index(app):
+    """Register the indexes and their sync hooks (idempotent)."""
+    if not _indexes:
+        _define_indexes()
+    for index in _indexes.values():
+        index.register()
@@ -0,0 +1,348 @@
+"""
+Slot Cache Module
+
+Write-invalidated cache of computed booking slots for the public booking
+APIs, keyed by (estimator, appointment type, date):
+
+- Entries live in the app cache under keys that embed version counters
+  from SlotCacheVersion. ORM writes to Appointment, Availability,
+  AvailabilityException and ResourceBooking (plus the services, types,
+  resources and config that slots derive from) bump the counters of the
+  scopes they touch inside the writing transaction. A reader reads the
+  versions before computing, so it stores either old data under the old
+  version or new data under the new one: once a booking commits, no
+  worker can serve slots from before it, whatever the cache backend.
+- Scopes: 'all' (services, appointment types, resources, buffer config),
+  'any' (the estimator roster and schedules, for all-estimator entries),
+  'e:<id>' (an estimator's weekly schedule), 'e:<id>:<date>' and
+  'd:<date>' (bookings and exceptions on a day).
+- An entry that counts a pending payment hold expires with the hold.
+
+Bulk Query.update()/delete() bypass ORM events; call bump_scopes()
+alongside them. Hits, misses and invalidations are exported on /metrics.
+"""
+
+import logging
+import math
+import threading
+from collections import defaultdict
+from datetime import datetime, date, time, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from flask import current_app
+from sqlalchemy import event, inspect, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session
+from app.database import db
+from app.modules.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 300
+
+# Registered mapper listeners by model
+_listeners = {}
+
+
+class SlotCacheStats:
+    """Per-process hit, miss and invalidation counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = defaultdict(int)  # {model name: committed writes}
+
+    def record_lookups(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def record_invalidations(self, counts):
+        with self._lock:
+            for model, count in counts.items():
+                self.invalidations[model] += count
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0,
+                'invalidations': dict(self.invalidations),
+            }
+
+
+slot_cache_stats = SlotCacheStats()
+
+
+# ============================================================================
+# Scopes and versions
+# ============================================================================
+
+def entry_scopes(estimator_id: Optional[int], day: date) -> List[str]:
+    """Version scopes a cached day of slots depends on."""
+    if estimator_id is None:
+        return ['all', 'any', f'd:{day.isoformat()}']
+    return ['all', f'e:{estimator_id}', f'e:{estimator_id}:{day.isoformat()}']
+
+
+def read_versions(scopes: Iterable[str]) -> Dict[str, int]:
+    """Current version of each scope (0 if never bumped), in one query."""
+    from app.models import SlotCacheVersion
+
+    scopes = list(set(scopes))
+    rows = db.session.query(SlotCacheVersion.scope, SlotCacheVersion.version).filter(
+        SlotCacheVersion.scope.in_(scopes)
+    ).all()
+    versions = dict.fromkeys(scopes, 0)
+    versions.update(rows)
+    return versions
+
+
+def bump_scopes(connection, scopes: Iterable[str]):
+    """Increment scope versions on `connection` (in the caller's transaction)."""
+    from app.models import SlotCacheVersion
+
+    table = SlotCacheVersion.__table__
+    # Sorted so concurrent writers lock rows in the same order
+    scopes = sorted(set(scopes))
+    if not scopes:
+        return
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = dialect_insert(table).values([{'scope': s, 'version': 1} for s in scopes])
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.scope],
+            set_={'version': table.c.version + 1}
+        ))
+        return
+    for scope in scopes:
+        result = connection.execute(
+            update(table).where(table.c.scope == scope).values(version=table.c.version + 1)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(scope=scope, version=1))
+
+
+# ============================================================================
+# ORM hooks
+# ============================================================================
+
+def _values(target, name, connection):
+    """Current and pre-change values of an attribute, read from the row if unloaded."""
+    state = inspect(target)
+    history = state.attrs[name].history
+    values = set(history.added or ()) | set(history.unchanged or ()) | set(history.deleted or ())
+    if not values:
+        if name in target.__dict__:
+            values.add(target.__dict__[name])
+        elif state.identity is not None:
+            table = state.mapper.local_table
+            pk = state.mapper.primary_key[0]
+            values.add(connection.execute(
+                select(table.c[name]).where(pk == state.identity[0])
+            ).scalar())
+    values.discard(None)
+    return values
+
+
+def _days_around(moments):
+    """Days a booking at each moment can affect (buffers cross midnight)."""
+    days = set()
+    for moment in moments:
+        days.update(moment.date() + timedelta(days=offset) for offset in (-1, 0, 1))
+    return days
+
+
+def _estimator_day_scopes(estimator_ids, days):
+    # Anything unknown (e.g. a deleted row that was never loaded) invalidates everything
+    if not estimator_ids or not days:
+        return {'all'}
+    scopes = {f'd:{day.isoformat()}' for day in days}
+    scopes.update(f'e:{e}:{day.isoformat()}' for e in estimator_ids for day in days)
+    return scopes
+
+
+def _appointment_scopes(target, connection):
+    return _estimator_day_scopes(
+        _values(target, 'estimator_id', connection),
+        _days_around(_values(target, 'preferred_date_time', connection))
+    )
+
+
+def _exception_scopes(target, connection):
+    return _estimator_day_scopes(
+        _values(target, 'estimator_id', connection),
+        _values(target, 'date', connection)
+    )
+
+
+def _availability_scopes(target, connection):
+    estimator_ids = _values(target, 'estimator_id', connection)
+    if not estimator_ids:
+        return {'all'}
+    return {'any'} | {f'e:{e}' for e in estimator_ids}
+
+
+def _resource_booking_scopes(target, connection):
+    starts = _values(target, 'start_time', connection)
+    ends = _values(target, 'end_time', connection)
+    if not starts or not ends:
+        return {'all'}
+    day, last = min(starts).date(), max(ends).date()
+    scopes = set()
+    while day <= last:
+        scopes.add(f'd:{day.isoformat()}')
+        day += timedelta(days=1)
+    return scopes
+
+
+def _scope_rules():
+    """{model: (attributes whose updates matter, scopes function)}"""
+    from app.models import (
+        Appointment, Availability, AvailabilityException, ResourceBooking,
+        Estimator, Service, AppointmentType, Resource, BusinessConfig
+    )
+
+    return {
+        Appointment: (
+            ('estimator_id', 'preferred_date_time', 'service_id', 'status',
+             'payment_status', 'payment_expires_at'),
+            _appointment_scopes
+        ),
+        AvailabilityException: (
+            ('estimator_id', 'date', 'is_blocked', 'custom_start_time', 'custom_end_time'),
+            _exception_scopes
+        ),
+        Availability: (
+            ('estimator_id', 'day_of_week', 'start_time', 'end_time'),
+            _availability_scopes
+        ),
+        ResourceBooking: (
+            ('resource_id', 'start_time', 'end_time', 'status'),
+            _resource_booking_scopes
+        ),
+        Estimator: ((), lambda target, connection: {'any'}),
+        Service: (('duration_minutes',), lambda target, connection: {'all'}),
+        AppointmentType: (
+            ('duration_minutes', 'buffer_before', 'buffer_after', 'required_resource_type'),
+            lambda target, connection: {'all'}
+        ),
+        Resource: (('resource_type', 'location_id', 'is_active'), lambda target, connection: {'all'}),
+        BusinessConfig: (('setting_name', 'setting_value'), lambda target, connection: {'all'}),
+    }
+
+
+def _make_listener(scopes_for):
+    def listener(mapper, connection, target):
+        session = object_session(target)
+        session.info.setdefault('slot_cache_scopes', set()).update(scopes_for(target, connection))
+        counts = session.info.setdefault('slot_cache_invalidations', defaultdict(int))
+        counts[mapper.class_.__name__] += 1
+    return listener
+
+
+def _make_update_listener(watched, listener):
+    def update_listener(mapper, connection, target):
+        state = inspect(target)
+        if any(state.attrs[name].history.has_changes() for name in watched):
+            listener(mapper, connection, target)
+    return update_listener
+
+
+def _session_flushed(session, flush_context):
+    scopes = session.info.pop('slot_cache_scopes', None)
+    if scopes:
+        bump_scopes(session.connection(), scopes)
+
+
+def _session_committed(session):
+    counts = session.info.pop('slot_cache_invalidations', None)
+    if counts:
+        slot_cache_stats.record_invalidations(counts)
+
+
+def _session_rolled_back(session):
+    session.info.pop('slot_cache_scopes', None)
+    session.info.pop('slot_cache_invalidations', None)
+
+
+# ============================================================================
+# Cached lookups
+# ============================================================================
+
+def cached_slots(
+    estimator_id: Optional[int],
+    type_key: str,
+    days: List[date],
+    compute: Callable[[List[date]], Dict[date, Tuple[List[datetime], Optional[datetime]]]]
+) -> Dict[date, List[datetime]]:
+    """
+    Slots per day, computing only the days missing from the cache.
+
+    Args:
+        estimator_id: The estimator, or None for slots where any estimator will do
+        type_key: What the slots are for, e.g. 'service:3' or 'type:2:loc:0'
+        days: Dates wanted
+        compute: Called with the missing dates; returns
+            {date: (slot datetimes, time the answer lapses or None)}
+
+    Returns:
+        Dict of date -> list of slot start datetimes
+    """
+    owner = 'any' if estimator_id is None else f'e{estimator_id}'
+    scopes = {day: entry_scopes(estimator_id, day) for day in days}
+    versions = read_versions(s for day_scopes in scopes.values() for s in day_scopes)
+    keys = {
+        day: f"slots:{owner}:{type_key}:{day.isoformat()}:" + '.'.join(str(versions[s]) for s in day_scopes)
+        for day, day_scopes in scopes.items()
+    }
+
+    try:
+        cached = cache.get_many(*keys.values()) if keys else []
+    except Exception as e:
+        logger.warning(f"Slot cache unavailable: {e}")
+        cached = [None] * len(keys)
+
+    results = {}
+    for day, value in zip(keys, cached):
+        if value is not None:
+            day_start = datetime.combine(day, time.min)
+            results[day] = [day_start + timedelta(minutes=m) for m in value]
+    missing = [day for day in days if day not in results]
+    slot_cache_stats.record_lookups(len(results), len(missing))
+    if not missing:
+        return results
+
+    timeout = current_app.config.get('SLOT_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    now = datetime.utcnow()
+    for day, (slots, lapses_at) in compute(missing).items():
+        results[day] = slots
+        day_timeout = timeout
+        if lapses_at is not None:
+            day_timeout = min(timeout, max(1, math.ceil((lapses_at - now).total_seconds())))
+        day_start = datetime.combine(day, time.min)
+        minutes = [int((s - day_start).total_seconds() // 60) for s in slots]
+        try:
+            cache.set(keys[day], minutes, timeout=day_timeout)
+        except Exception as e:
+            logger.warning(f"Slot cache unavailable: {e}")
+    return results
+
+
+def init_slot_cache(app):
+    """Register the slot invalidation hooks (idempotent)."""
+    for model, (watched, scopes_for) in _scope_rules().items():
+        if model in _listeners:
+            continue
+        listener = _make_listener(scopes_for)
+        _listeners[model] = listener
+        event.listen(model, 'after_insert', listener)
+        event.listen(model, 'after_update', _make_update_listener(watched, listener))
+        event.listen(model, 'after_delete', listener)
+    if not event.contains(Session, 'after_flush', _session_flushed):
+        event.listen(Session, 'after_flush', _session_flushed)
+        event.listen(Session, 'after_commit', _session_committed)
+        event.listen(Session, 'after_rollback', _session_rolled_back)
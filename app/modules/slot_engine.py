@@ -0,0 +1,213 @@
+"""
+Slot Engine Module
+
+Set-based availability for many estimators over many days:
+
+- Each estimator-day is a 1440-bit integer, one bit per minute
+- Recurring availability, date exceptions and appointments for the
+  whole date range and every requested estimator are loaded in three
+  queries when the engine is built
+- Busy time is OR-ed into a mask; free slot starts are found with
+  shift-and-AND runs over the free bits, so the cost no longer grows
+  with slots x bookings
+
+Appointments block [start - pad_before, end + pad_after). A slot of
+`duration` minutes is free when all of its minutes are free and inside
+a single availability window; candidate starts step by `interval` from
+each window's start.
+"""
+
+from collections import defaultdict
+from datetime import datetime, date, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.database import db
+
+MINUTES_PER_DAY = 24 * 60
+DEFAULT_DURATION_MINUTES = 60
+
+
+def minute_of(value: time) -> int:
+    return value.hour * 60 + value.minute
+
+
+def range_mask(start: int, end: int) -> int:
+    """Bits [start, end), clipped to the day."""
+    start, end = max(start, 0), min(end, MINUTES_PER_DAY)
+    if end <= start:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+
+def step_mask(start: int, end: int, interval: int) -> int:
+    """Bits at start, start + interval, ... below end."""
+    mask = 0
+    for minute in range(max(start, 0), min(end, MINUTES_PER_DAY), interval):
+        mask |= 1 << minute
+    return mask
+
+
+def runs_of(mask: int, length: int) -> int:
+    """Bit i is set iff bits i .. i + length - 1 are all set in mask."""
+    covered = 1
+    while covered < length and mask:
+        shift = min(covered, length - covered)
+        mask &= mask >> shift
+        covered += shift
+    return mask
+
+
+def iter_bits(mask: int) -> Iterable[int]:
+    """Positions of set bits, ascending."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class SlotEngine:
+    """
+    Free/busy bitmaps for a set of estimators over [start_date, end_date].
+
+    Build one per request and ask it for as many estimator-days as needed;
+    nothing is queried after construction.
+    """
+
+    def __init__(self, estimator_ids: Iterable[int], start_date: date, end_date: date,
+                 now: Optional[datetime] = None):
+        from app.models import Availability, AvailabilityException, Appointment, Service
+
+        self.estimator_ids = sorted(set(estimator_ids))
+        self.start_date = start_date
+        self.end_date = end_date
+        now = now or datetime.utcnow()
+
+        # Query 1: recurring weekly windows
+        self._weekly = defaultdict(list)
+        rows = db.session.query(
+            Availability.estimator_id, Availability.day_of_week,
+            Availability.start_time, Availability.end_time
+        ).filter(
+            Availability.estimator_id.in_(self.estimator_ids)
+        ).order_by(Availability.start_time).all()
+        for estimator_id, day_of_week, start, end in rows:
+            self._weekly[(estimator_id, day_of_week)].append((minute_of(start), minute_of(end)))
+
+        # Query 2: date exceptions (the first one per estimator-day wins, as before)
+        self._exceptions = {}
+        rows = db.session.query(
+            AvailabilityException.estimator_id, AvailabilityException.date,
+            AvailabilityException.is_blocked,
+            AvailabilityException.custom_start_time, AvailabilityException.custom_end_time
+        ).filter(
+            AvailabilityException.estimator_id.in_(self.estimator_ids),
+            AvailabilityException.date >= start_date,
+            AvailabilityException.date <= end_date
+        ).order_by(AvailabilityException.id).all()
+        for estimator_id, day, is_blocked, custom_start, custom_end in rows:
+            self._exceptions.setdefault((estimator_id, day), (is_blocked, custom_start, custom_end))
+
+        # Query 3: appointments with their service durations. A day's look-around
+        # either side catches bookings whose buffers cross midnight.
+        self._bookings = defaultdict(list)
+        self._holds = defaultdict(list)
+        rows = db.session.query(
+            Appointment.estimator_id, Appointment.preferred_date_time,
+            Appointment.payment_status, Appointment.payment_expires_at,
+            Service.duration_minutes
+        ).outerjoin(
+            Service, Service.id == Appointment.service_id
+        ).filter(
+            Appointment.estimator_id.in_(self.estimator_ids),
+            Appointment.preferred_date_time >= datetime.combine(start_date - timedelta(days=1), time.min),
+            Appointment.preferred_date_time < datetime.combine(end_date + timedelta(days=2), time.min),
+            Appointment.status.notin_(['Cancelled', 'Expired'])
+        ).all()
+        for estimator_id, start, payment_status, expires_at, duration in rows:
+            if payment_status == 'pending' and expires_at:
+                if expires_at <= now:
+                    continue  # Expired payment hold, the slot is free again
+                self._holds[estimator_id].append((start, expires_at))
+            end = start + timedelta(minutes=duration or DEFAULT_DURATION_MINUTES)
+            self._bookings[estimator_id].append((start, end))
+        self._day_index = {}
+
+    # ------------------------------------------------------------------
+    # Per estimator-day views
+    # ------------------------------------------------------------------
+
+    def windows(self, estimator_id: int, day: date) -> List[Tuple[int, int]]:
+        """Working windows as (start_minute, end_minute), after exceptions."""
+        exception = self._exceptions.get((estimator_id, day))
+        if exception:
+            is_blocked, custom_start, custom_end = exception
+            if is_blocked:
+                return []
+            if custom_start and custom_end:
+                return [(minute_of(custom_start), minute_of(custom_end))]
+        return self._weekly.get((estimator_id, day.weekday()), [])
+
+    def bookings(self, estimator_id: int, day: date) -> List[Tuple[datetime, datetime]]:
+        """Bookings starting within a day of `day` (candidates for overlapping it)."""
+        key = (estimator_id, day)
+        if key not in self._day_index:
+            lo = datetime.combine(day - timedelta(days=1), time.min)
+            hi = datetime.combine(day + timedelta(days=2), time.min)
+            self._day_index[key] = [b for b in self._bookings.get(estimator_id, ()) if lo <= b[0] < hi]
+        return self._day_index[key]
+
+    def hold_expiry(self, estimator_id: int, day: date) -> Optional[datetime]:
+        """When the first payment hold affecting `day` lapses (freeing its slot), if any."""
+        lo = datetime.combine(day - timedelta(days=1), time.min)
+        hi = datetime.combine(day + timedelta(days=2), time.min)
+        expiries = [expires for start, expires in self._holds.get(estimator_id, ()) if lo <= start < hi]
+        return min(expiries) if expiries else None
+
+    def busy_mask(self, estimator_id: int, day: date, pad_before: int = 0, pad_after: int = 0) -> int:
+        """Minutes of `day` blocked by bookings padded by pad_before/pad_after."""
+        day_start = datetime.combine(day, time.min)
+        mask = 0
+        for start, end in self.bookings(estimator_id, day):
+            first = (start - timedelta(minutes=pad_before) - day_start).total_seconds() / 60
+            last = (end + timedelta(minutes=pad_after) - day_start).total_seconds() / 60
+            mask |= range_mask(int(first // 1), -int(-last // 1))
+        return mask
+
+    def free_slots(self, estimator_id: int, day: date, duration: int, interval: int = 30,
+                   pad_before: int = 0, pad_after: int = 0) -> List[datetime]:
+        """Free slot start times for one estimator-day."""
+        windows = self.windows(estimator_id, day)
+        if not windows:
+            return []
+        free = ~self.busy_mask(estimator_id, day, pad_before, pad_after)
+        starts = 0
+        for window_start, window_end in windows:
+            fits = runs_of(range_mask(window_start, window_end) & free, duration)
+            starts |= fits & step_mask(window_start, window_end, interval)
+        day_start = datetime.combine(day, time.min)
+        return [day_start + timedelta(minutes=m) for m in iter_bits(starts)]
+
+    # ------------------------------------------------------------------
+    # Batch views
+    # ------------------------------------------------------------------
+
+    def days(self) -> Iterable[date]:
+        day = self.start_date
+        while day <= self.end_date:
+            yield day
+            day += timedelta(days=1)
+
+    def free_slots_by_day(self, estimator_id: int, duration: int, interval: int = 30,
+                          pad_before: int = 0, pad_after: int = 0) -> Dict[date, List[datetime]]:
+        """{day: [slot starts]} for every day in the range."""
+        return {
+            day: self.free_slots(estimator_id, day, duration, interval, pad_before, pad_after)
+            for day in self.days()
+        }
+
+    def any_free_slots(self, day: date, duration: int, interval: int = 30,
+                       pad_before: int = 0, pad_after: int = 0) -> List[datetime]:
+        """Slot starts on `day` where at least one estimator is free."""
+        starts = set()
+        for estimator_id in self.estimator_ids:
+            starts.update(self.free_slots(estimator_id, day, duration, interval, pad_before, pad_after))
+        return sorted(starts)
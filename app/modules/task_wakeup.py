@@ -0,0 +1,214 @@
+"""
+Task Queue Wakeup Module
+
+Event-driven wakeup for the background worker. Committing a new Task
+signals idle workers immediately instead of leaving them to poll:
+
+- PostgreSQL: the inserting transaction issues NOTIFY on the task channel
+  (delivered on commit); each worker LISTENs on a dedicated connection.
+- Elsewhere (SQLite, local development): after commit, a datagram is sent
+  to every worker socket in WORKER_WAKEUP_DIR.
+- In-process: a threading event, used by tests and single-process setups.
+
+The worker still polls with exponential backoff as a safety net for
+retries coming due and any missed signal.
+"""
+
+import glob
+import logging
+import os
+import select
+import socket
+import tempfile
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'verso_tasks'
+WAKEUP_DIR = os.environ.get(
+    'WORKER_WAKEUP_DIR',
+    os.path.join(tempfile.gettempdir(), 'verso-worker-wakeup')
+)
+
+# Signalled whenever a Task commits in this process
+_local_event = threading.Event()
+
+
+class TaskWakeup:
+    """Wakeup backend interface: block until a task is enqueued or timeout."""
+
+    def wait(self, timeout):
+        """Return True if woken by an enqueue, False on timeout."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LocalWakeup(TaskWakeup):
+    """In-process wakeup for workers sharing the enqueuing process."""
+
+    def wait(self, timeout):
+        woken = _local_event.wait(timeout)
+        _local_event.clear()
+        return woken
+
+
+class UnixSocketWakeup(TaskWakeup):
+    """Datagram socket per worker; enqueuers broadcast to all of them."""
+
+    def __init__(self, worker_id, directory=None):
+        self.directory = directory or WAKEUP_DIR
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self.path = os.path.join(self.directory, f'{worker_id}.sock')
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return False
+        # Coalesce a burst of enqueues into one wakeup
+        try:
+            while True:
+                self.sock.recv(64)
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def broadcast(directory=None):
+        """Poke every listening worker socket; stale sockets are removed."""
+        paths = glob.glob(os.path.join(directory or WAKEUP_DIR, '*.sock'))
+        if not paths:
+            return
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.setblocking(False)
+        try:
+            for path in paths:
+                try:
+                    sender.sendto(b'1', path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    try:
+                        os.unlink(path)  # Worker exited without cleaning up
+                    except OSError:
+                        pass
+                except (BlockingIOError, OSError):
+                    pass  # Receiver's buffer is full: it already has a pending wakeup
+        finally:
+            sender.close()
+
+
+class PostgresWakeup(TaskWakeup):
+    """LISTEN on a dedicated autocommit connection outside the pool."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+
+    def _connect(self):
+        raw = self.engine.raw_connection()
+        raw.detach()  # Never hand a LISTENing connection back to the pool
+        conn = raw.driver_connection
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        self.connection = conn
+
+    def wait(self, timeout):
+        try:
+            if self.connection is None:
+                self._connect()
+            readable, _, _ = select.select([self.connection], [], [], timeout)
+            if not readable:
+                return False
+            self.connection.poll()
+            woken = bool(self.connection.notifies)
+            self.connection.notifies.clear()
+            return woken
+        except Exception as e:
+            logger.warning(f"Task LISTEN connection failed, falling back to polling: {e}")
+            self.close()
+            # Wait out the timeout so an unreachable database is not retried in a tight loop
+            time.sleep(timeout)
+            return False
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+def create_wakeup(app, worker_id):
+    """
+    Build the wakeup backend for a worker.
+
+    WORKER_WAKEUP selects it: 'auto' (default) uses LISTEN/NOTIFY on
+    Postgres and Unix sockets elsewhere; 'postgres', 'socket' and 'local'
+    force a backend.
+    """
+    from app.database import db
+
+    backend = app.config.get('WORKER_WAKEUP', os.environ.get('WORKER_WAKEUP', 'auto'))
+    if backend == 'auto':
+        if db.engine.dialect.name == 'postgresql':
+            backend = 'postgres'
+        elif hasattr(socket, 'AF_UNIX'):
+            backend = 'socket'
+        else:
+            backend = 'local'
+
+    if backend == 'postgres':
+        return PostgresWakeup(db.engine)
+    if backend == 'socket':
+        try:
+            return UnixSocketWakeup(worker_id)
+        except OSError as e:
+            logger.warning(f"Could not open worker wakeup socket in {WAKEUP_DIR}: {e}")
+    return LocalWakeup()
+
+
+def _task_inserted(mapper, connection, target):
+    if connection.dialect.name == 'postgresql':
+        # Transactional: listeners only hear it if the insert commits
+        connection.exec_driver_sql(f'NOTIFY {CHANNEL}')
+    else:
+        session = object_session(target)
+        if session is not None:
+            session.info['task_enqueued'] = True
+
+
+def _session_committed(session):
+    if session.info.pop('task_enqueued', False):
+        _local_event.set()
+        UnixSocketWakeup.broadcast()
+
+
+def _session_rolled_back(session):
+    session.info.pop('task_enqueued', None)
+
+
+def init_task_wakeup(app):
+    """Register the Task enqueue hooks (idempotent)."""
+    from app.models import Task
+
+    if not event.contains(Task, 'after_insert', _task_inserted):
+        event.listen(Task, 'after_insert', _task_inserted)
+        event.listen(Session, 'after_commit', _session_committed)
+        event.listen(Session, 'after_rollback', _session_rolled_back)
@@ -0,0 +1,206 @@
+"""
+Uploads Module
+
+Resumable chunked uploads, so peak memory per upload stays flat whatever
+the file size:
+
+- MAX_CONTENT_LENGTH caps every request body. Werkzeug answers 413 from
+  the Content-Length header before reading anything and stops a body
+  that overruns it. Multipart file parts above 500 KB are spooled to
+  temp files by werkzeug; file_manager then streams them into the blob
+  store in fixed-size chunks, hashing as it goes
+- Files bigger than one request go through a ChunkedUpload. The client
+  declares the name and size first (checked against
+  CHUNKED_UPLOAD_MAX_SIZE before any bytes are sent), then sends
+  consecutive byte ranges of at most UPLOAD_CHUNK_SIZE. Each chunk is
+  copied from the request stream onto a part file under
+  UPLOAD_TEMP_PATH, COPY_SIZE bytes at a time. The committed offset is
+  stored in the database, so an interrupted upload resumes from it on
+  any process sharing the directory
+- The last chunk moves the file into the blob store as a Media row
+- purge_stale_uploads() drops uploads idle for UPLOAD_EXPIRY_HOURS
+"""
+
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from werkzeug.utils import secure_filename
+from app.database import db
+
+logger = logging.getLogger(__name__)
+
+COPY_SIZE = 64 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_SIZE = 2 * 1024 * 1024 * 1024
+DEFAULT_EXPIRY_HOURS = 24
+
+
+class UploadError(Exception):
+    """A rejected upload request, with the HTTP status to answer it with."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadOffsetMismatch(UploadError):
+    """The client sent a chunk for the wrong offset; it should resume from `offset`."""
+
+    def __init__(self, offset):
+        super().__init__(f'Expected offset {offset}', 409)
+        self.offset = offset
+
+
+def upload_dir():
+    path = current_app.config.get('UPLOAD_TEMP_PATH') or os.path.join(current_app.instance_path, 'uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def part_path(upload):
+    return os.path.join(upload_dir(), f'{upload.id}.part')
+
+
+def chunk_size_limit():
+    return current_app.config.get('UPLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def start_upload(user_id, filename, total_size, mimetype=None):
+    """
+    Register a resumable upload (committed).
+
+    Raises:
+        UploadError: Disallowed file type, or a size that is missing or too large
+    """
+    from app.models import ChunkedUpload
+    from app.modules.file_manager import allowed_file
+
+    filename = secure_filename(filename or '')
+    if not filename or not allowed_file(filename):
+        raise UploadError('File type not allowed')
+    if not isinstance(total_size, int) or total_size <= 0:
+        raise UploadError('A positive file size is required')
+    if total_size > current_app.config.get('CHUNKED_UPLOAD_MAX_SIZE', DEFAULT_MAX_SIZE):
+        raise UploadError('File is too large', 413)
+
+    upload = ChunkedUpload(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        filename=filename,
+        mimetype=mimetype or 'application/octet-stream',
+        total_size=total_size,
+        received=0
+    )
+    open(part_path(upload), 'wb').close()
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+
+def get_upload(upload_id, user_id):
+    """An upload in progress, if it belongs to the user."""
+    from app.models import ChunkedUpload
+
+    return ChunkedUpload.query.filter_by(id=upload_id, user_id=user_id).first()
+
+
+def append_chunk(upload, offset, stream, length):
+    """
+    Write one chunk at `offset` and commit the new offset.
+
+    Args:
+        upload: The ChunkedUpload
+        offset: Where the client says the chunk starts
+        stream: Request body stream
+        length: Chunk size from Content-Length
+
+    Returns:
+        The finished Media row once the last byte arrives, else None
+
+    Raises:
+        UploadOffsetMismatch: The offset is not the committed one
+        UploadError: Missing length, an oversized chunk, or a body that ended early
+    """
+    from app.models import ChunkedUpload
+
+    if offset != upload.received:
+        raise UploadOffsetMismatch(upload.received)
+    if length is None:
+        raise UploadError('Content-Length is required', 411)
+    if length > chunk_size_limit() or offset + length > upload.total_size:
+        raise UploadError('Chunk is too large', 413)
+
+    path = part_path(upload)
+    try:
+        part = open(path, 'r+b')
+    except FileNotFoundError:
+        raise UploadError('Upload data is gone; start again', 410)
+    with part:
+        part.seek(offset)
+        remaining = length
+        while remaining:
+            data = stream.read(min(COPY_SIZE, remaining))
+            if not data:
+                break
+            part.write(data)
+            remaining -= len(data)
+        if remaining:
+            # Client went away mid-chunk: keep the committed offset, it resumes there
+            raise UploadError('Chunk ended early', 400)
+        part.truncate()
+        part.flush()
+        os.fsync(part.fileno())
+
+    # Only one request can move the offset forward
+    moved = ChunkedUpload.query.filter_by(id=upload.id, received=offset).update(
+        {'received': offset + length, 'updated_at': datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+    if not moved:
+        db.session.refresh(upload)
+        raise UploadOffsetMismatch(upload.received)
+    db.session.refresh(upload)
+
+    if upload.received == upload.total_size:
+        return finish_upload(upload)
+    return None
+
+
+def finish_upload(upload):
+    """Move a complete upload into the blob store as Media (committed)."""
+    from app.modules.file_manager import media_from_stream
+
+    path = part_path(upload)
+    with open(path, 'rb') as part:
+        media = media_from_stream(part, upload.filename, upload.mimetype, user_id=upload.user_id)
+    db.session.delete(upload)
+    db.session.commit()
+    os.unlink(path)
+    return media
+
+
+def cancel_upload(upload):
+    path = part_path(upload)
+    db.session.delete(upload)
+    db.session.commit()
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def purge_stale_uploads(max_age_hours=None):
+    """
+    Delete uploads that have not received a chunk for a while.
+
+    Returns:
+        Number of uploads removed
+    """
+    from app.models import ChunkedUpload
+
+    max_age_hours = max_age_hours or current_app.config.get('UPLOAD_EXPIRY_HOURS', DEFAULT_EXPIRY_HOURS)
+    cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+    stale = ChunkedUpload.query.filter(ChunkedUpload.updated_at < cutoff).all()
+    for upload in stale:
+        cancel_upload(upload)
+    return len(stale)
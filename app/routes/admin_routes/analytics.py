@@ -8,20 +8,29 @@ visitor analysis, session tracking, and conversion funnel management.
 from flask import Blueprint, render_template, jsonify, request, flash, redirect, url_for
 from flask_login import login_required, current_user
 from app.models import (
-    PageView, VisitorSession, ConversionGoal, Conversion, 
+    VisitorSession, ConversionGoal, Conversion, 
     Funnel, FunnelStep, db
 )
 from app.modules.decorators import role_required
 from app.modules.reporting import (
     calculate_traffic_metrics, calculate_daily_revenue,
-    get_date_range_presets, track_conversion
+    get_date_range_presets, track_conversion, count_unique_traffic
 )
+from app.modules.analytics_rollups import query_traffic, top_traffic, estimate_unique_by_day
 from sqlalchemy import func, desc, case
 from datetime import datetime, timedelta
 
 analytics_bp = Blueprint('analytics', __name__, url_prefix='/admin/analytics')
 
 
+def _breakdown(start_date, end_date, dimension, limit=None):
+    """Traffic rollup rows for one dimension, with views and sessions per value."""
+    return [
+        {dimension: r[dimension], 'views': r['page_views'], 'sessions': r['sessions']}
+        for r in top_traffic(start_date, end_date, dimension, limit=limit)
+    ]
+
+
 @analytics_bp.route('/')
 @login_required
 @role_required('admin')
@@ -32,18 +41,18 @@ def dashboard():
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
-    # Get traffic metrics
-    metrics = calculate_traffic_metrics(start_date, end_date)
+    # Get traffic metrics (unique counts from the distinct-count sketches)
+    metrics = calculate_traffic_metrics(start_date, end_date, approximate=True)
     
     # Total views (all time)
-    total_views = PageView.query.count()
+    all_time = query_traffic(None, end_date)
+    total_views = all_time[0]['page_views'] if all_time else 0
     
     # Top pages
-    top_pages = db.session.query(
-        PageView.url, func.count(PageView.id).label('count')
-    ).filter(
-        PageView.timestamp >= start_date
-    ).group_by(PageView.url).order_by(desc('count')).limit(10).all()
+    top_pages = [
+        {'url': p['url'], 'count': p['page_views']}
+        for p in top_traffic(start_date, end_date, 'url', limit=10)
+    ]
     
     # Conversion goals summary
     goals = ConversionGoal.query.filter_by(is_active=True).all()
@@ -74,54 +83,30 @@ def dashboard():
 def traffic():
     """Traffic breakdown by sources, pages, and devices."""
     days = request.args.get('days', 30, type=int)
+    approximate = request.args.get('approximate', 1, type=int) == 1
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
-    # UTM source breakdown
-    sources = db.session.query(
-        PageView.utm_source,
-        func.count(PageView.id).label('views'),
-        func.count(func.distinct(PageView.session_id)).label('sessions')
-    ).filter(
-        PageView.timestamp >= start_date,
-        PageView.timestamp <= end_date
-    ).group_by(PageView.utm_source).order_by(desc('views')).all()
+    # Unique sessions / visitors (?approximate=0 forces an exact count)
+    unique = count_unique_traffic(start_date, end_date, approximate)
+    
+    # UTM source breakdown (sessions are those whose landing hit carried the source)
+    sources = _breakdown(start_date, end_date, 'utm_source')
     
     # UTM medium breakdown
-    mediums = db.session.query(
-        PageView.utm_medium,
-        func.count(PageView.id).label('views')
-    ).filter(
-        PageView.timestamp >= start_date,
-        PageView.timestamp <= end_date
-    ).group_by(PageView.utm_medium).order_by(desc('views')).all()
+    mediums = _breakdown(start_date, end_date, 'utm_medium')
     
-    # Top landing pages
-    landing_pages = db.session.query(
-        VisitorSession.entry_page,
-        func.count(VisitorSession.id).label('sessions')
-    ).filter(
-        VisitorSession.started_at >= start_date,
-        VisitorSession.started_at <= end_date
-    ).group_by(VisitorSession.entry_page).order_by(desc('sessions')).limit(10).all()
+    # Top landing pages (sessions are rolled up under their entry page)
+    landing_pages = [
+        {'entry_page': p['url'], 'sessions': p['sessions']}
+        for p in top_traffic(start_date, end_date, 'url', measure='sessions', limit=10)
+    ]
     
     # Device breakdown
-    devices = db.session.query(
-        PageView.device_type,
-        func.count(PageView.id).label('views')
-    ).filter(
-        PageView.timestamp >= start_date,
-        PageView.timestamp <= end_date
-    ).group_by(PageView.device_type).all()
+    devices = _breakdown(start_date, end_date, 'device_type')
     
     # Browser breakdown
-    browsers = db.session.query(
-        PageView.browser,
-        func.count(PageView.id).label('views')
-    ).filter(
-        PageView.timestamp >= start_date,
-        PageView.timestamp <= end_date
-    ).group_by(PageView.browser).order_by(desc('views')).limit(10).all()
+    browsers = _breakdown(start_date, end_date, 'browser', limit=10)
     
     return render_template('admin/analytics/traffic.html',
         sources=sources,
@@ -129,6 +114,8 @@ def traffic():
         landing_pages=landing_pages,
         devices=devices,
         browsers=browsers,
+        unique=unique,
+        approximate=approximate,
         days=days
     )
 
@@ -142,24 +129,15 @@ def visitors():
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
-    # Daily unique visitors - convert to dicts for JSON serialization
-    daily_visitors_query = db.session.query(
-        func.date(VisitorSession.started_at).label('date'),
-        func.count(VisitorSession.id).label('sessions'),
-        func.count(func.distinct(VisitorSession.ip_hash)).label('unique_visitors')
-    ).filter(
-        VisitorSession.started_at >= start_date,
-        VisitorSession.started_at <= end_date
-    ).group_by(
-        func.date(VisitorSession.started_at)
-    ).order_by(
-        func.date(VisitorSession.started_at)
-    ).all()
-    
-    # Convert Row objects to dicts for JSON serialization
+    # Daily sessions from the rollups, unique visitors from the sketches
+    sessions_by_day = {
+        r['date']: r['sessions']
+        for r in query_traffic(start_date, end_date, ('date',)) if r['sessions']
+    }
+    unique_by_day = estimate_unique_by_day(start_date, end_date, 'visitors')
     daily_visitors = [
-        {'date': str(r.date), 'sessions': r.sessions, 'unique_visitors': r.unique_visitors}
-        for r in daily_visitors_query
+        {'date': day, 'sessions': sessions, 'unique_visitors': unique_by_day.get(day, 0)}
+        for day, sessions in sorted(sessions_by_day.items())
     ]
     
     # New vs returning (based on user_id presence)
@@ -254,21 +232,10 @@ def sessions():
     pages_dist = [{'bucket': r.bucket, 'count': r.count} for r in pages_dist_query]
     
     # Bounce rate trend - convert to dicts
-    bounce_trend_query = db.session.query(
-        func.date(VisitorSession.started_at).label('date'),
-        func.count(VisitorSession.id).label('total'),
-        func.sum(func.cast(VisitorSession.bounce, db.Integer)).label('bounces')
-    ).filter(
-        VisitorSession.started_at >= start_date
-    ).group_by(
-        func.date(VisitorSession.started_at)
-    ).order_by(
-        func.date(VisitorSession.started_at)
-    ).all()
-    
     bounce_trend = [
-        {'date': str(r.date), 'total': r.total, 'bounces': r.bounces or 0}
-        for r in bounce_trend_query
+        {'date': r['date'], 'total': r['sessions'], 'bounces': r['bounces']}
+        for r in sorted(query_traffic(start_date, end_date, ('date',)), key=lambda r: r['date'])
+        if r['sessions']
     ]
     
     return render_template('admin/analytics/sessions.html',
@@ -503,22 +470,12 @@ def daily_traffic():
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
-    results = db.session.query(
-        func.date(PageView.timestamp).label('date'),
-        func.count(PageView.id).label('page_views'),
-        func.count(func.distinct(PageView.session_id)).label('sessions')
-    ).filter(
-        PageView.timestamp >= start_date
-    ).group_by(
-        func.date(PageView.timestamp)
-    ).order_by(
-        func.date(PageView.timestamp).asc()
-    ).all()
+    results = sorted(query_traffic(start_date, end_date, ('date',)), key=lambda r: r['date'])
     
     data = {
-        'labels': [str(r.date) for r in results],
-        'page_views': [r.page_views for r in results],
-        'sessions': [r.sessions for r in results]
+        'labels': [r['date'] for r in results],
+        'page_views': [r['page_views'] for r in results],
+        'sessions': [r['sessions'] for r in results]
     }
     return jsonify(data)
 
@@ -532,18 +489,11 @@ def utm_breakdown():
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
-    results = db.session.query(
-        func.coalesce(PageView.utm_source, 'Direct').label('source'),
-        func.count(PageView.id).label('views')
-    ).filter(
-        PageView.timestamp >= start_date
-    ).group_by(
-        PageView.utm_source
-    ).order_by(desc('views')).limit(10).all()
+    results = top_traffic(start_date, end_date, 'utm_source', limit=10)
     
     data = {
-        'labels': [r.source for r in results],
-        'values': [r.views for r in results]
+        'labels': [r['utm_source'] or 'Direct' for r in results],
+        'values': [r['page_views'] for r in results]
     }
     return jsonify(data)
 
@@ -557,18 +507,11 @@ def device_breakdown():
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
-    results = db.session.query(
-        func.coalesce(PageView.device_type, 'Unknown').label('device'),
-        func.count(PageView.id).label('views')
-    ).filter(
-        PageView.timestamp >= start_date
-    ).group_by(
-        PageView.device_type
-    ).all()
+    results = top_traffic(start_date, end_date, 'device_type')
     
     data = {
-        'labels': [r.device for r in results],
-        'values': [r.views for r in results]
+        'labels': [r['device_type'] or 'Unknown' for r in results],
+        'values': [r['page_views'] for r in results]
     }
     return jsonify(data)
 
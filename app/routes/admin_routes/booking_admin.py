@@ -9,6 +9,7 @@ from flask import Blueprint, jsonify, request, render_template
 from flask_login import login_required, current_user
 from app.modules.auth_manager import admin_required
 from app.database import db
+from app.modules.slot_cache import bump_scopes
 from app.models import (
     Service, Estimator, User, Role, AppointmentType, Resource, Availability, BusinessConfig,
     Appointment, RescheduleRequest
@@ -298,8 +299,9 @@ def set_staff_availability(staff_id):
     if not data or 'availability' not in data:
         return jsonify({'error': 'availability array is required'}), 400
     
-    # Clear existing availability
+    # Clear existing availability (a bulk delete, so invalidate cached slots by hand)
     Availability.query.filter_by(estimator_id=staff_id).delete()
+    bump_scopes(db.session.connection(), ['any', f'e:{staff_id}'])
     
     # Create new availability entries
     for avail in data['availability']:
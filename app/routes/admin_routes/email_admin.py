@@ -460,7 +460,7 @@ def send_campaign(id):
     db.session.add(task)
     
     campaign.status = 'sending'
-    campaign.sent_at = datetime.utcnow()
+    campaign.sent_at = campaign.sent_at or datetime.utcnow()  # Keep original start on resume
     db.session.commit()
     
     flash(f'Campaign "{campaign.name}" is now being sent.', 'success')
@@ -10,6 +10,9 @@ from app.database import db
 from app.models import Media
 from app.modules.decorators import role_required
 from app.modules.file_manager import save_media, delete_media, allowed_file
+from app.modules.uploads import (
+    UploadError, UploadOffsetMismatch, append_chunk, cancel_upload, chunk_size_limit, get_upload, start_upload
+)
 from datetime import datetime
 
 media_admin_bp = Blueprint('media_admin', __name__, url_prefix='/admin/media')
@@ -103,6 +106,99 @@ def upload_media():
     return redirect(url_for('media_admin.list_media'))
 
 
+# =============================================================================
+# Resumable Chunked Uploads
+# =============================================================================
+
+def _upload_status(upload):
+    return {
+        'id': upload.id,
+        'filename': upload.filename,
+        'size': upload.total_size,
+        'offset': upload.received,
+        'chunk_size': chunk_size_limit(),
+        'url': url_for('media_admin.upload_chunk', upload_id=upload.id)
+    }
+
+
+def _upload_error(e):
+    body = {'error': str(e)}
+    if isinstance(e, UploadOffsetMismatch):
+        body['offset'] = e.offset
+    return jsonify(body), e.status_code
+
+
+@media_admin_bp.route('/uploads', methods=['POST'])
+@login_required
+@role_required('admin')
+def create_upload():
+    """
+    Start a resumable upload.
+    
+    JSON body: {"filename": str, "size": int, "mimetype": str}
+    Then PUT the file to the returned url in chunks of at most chunk_size
+    bytes, each with an Upload-Offset header.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = start_upload(current_user.id, data.get('filename'), data.get('size'), data.get('mimetype'))
+    except UploadError as e:
+        return _upload_error(e)
+    return jsonify(_upload_status(upload)), 201
+
+
+@media_admin_bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+@role_required('admin')
+def upload_status(upload_id):
+    """Committed offset of an upload, to resume from after a dropped connection."""
+    upload = get_upload(upload_id, current_user.id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(_upload_status(upload))
+
+
+@media_admin_bp.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+@role_required('admin')
+def upload_chunk(upload_id):
+    """Append a chunk; the body is streamed to disk, never read whole."""
+    upload = get_upload(upload_id, current_user.id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Upload-Offset header is required'}), 400
+    try:
+        media = append_chunk(upload, offset, request.stream, request.content_length)
+    except UploadError as e:
+        return _upload_error(e)
+    if media is None:
+        return jsonify(_upload_status(upload))
+    return jsonify({
+        'complete': True,
+        'media': {
+            'id': media.id,
+            'filename': media.filename,
+            'mimetype': media.mimetype,
+            'size': media.size,
+            'url': url_for('media.serve_media', media_id=media.id)
+        }
+    }), 201
+
+
+@media_admin_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+@role_required('admin')
+def delete_upload(upload_id):
+    """Abandon an upload and discard its data."""
+    upload = get_upload(upload_id, current_user.id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    cancel_upload(upload)
+    return jsonify({'success': True})
+
+
 @media_admin_bp.route('/<int:id>')
 @login_required
 @role_required('admin')
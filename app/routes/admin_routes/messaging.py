@@ -16,9 +16,15 @@ from app.models import (
     MessageReaction
 )
 from app.database import db
-from datetime import datetime
+from app.modules.file_manager import media_from_upload
+from app.modules.message_broker import get_broker, sse_frame
+from app.modules.search_index import get_index, query_terms
+from app.modules.message_serialization import (
+    render_message_content, message_load_options, serialize_messages, message_summary
+)
+from datetime import datetime, timedelta
 import re
-from markupsafe import Markup, escape
+from sqlalchemy.orm import selectinload
 
 messaging_bp = Blueprint('messaging', __name__, url_prefix='/messaging')
 
@@ -27,18 +33,6 @@ messaging_bp = Blueprint('messaging', __name__, url_prefix='/messaging')
 # Helper Functions
 # ============================================================================
 
-def render_message_content(message):
-    """Escape user content and wrap @mentions in spans."""
-    content = escape(message.content or '')
-    for mention in message.get_mentions():
-        mention_text = f'@{mention}'
-        content = content.replace(
-            mention_text,
-            Markup(f'<span class="mention">@{escape(mention)}</span>')
-        )
-    return Markup(content)
-
-
 def user_can_access_channel(channel):
     """Return True if current_user can access the channel."""
     # Use the new model method for access control
@@ -273,9 +267,10 @@ def channel(channel_id):
         return redirect(url_for('messaging.index'))
     
     messages = Message.query.filter_by(channel_id=channel_id)\
+        .options(*message_load_options())\
         .order_by(Message.created_at.asc()).all()
-    for msg in messages:
-        msg.rendered_content = render_message_content(msg)
+    # Serialize before the read-receipt commit expires the loaded messages
+    messages_data = serialize_messages(messages, current_user.id)
     
     # Update read receipt
     last_message = messages[-1] if messages else None
@@ -287,13 +282,14 @@ def channel(channel_id):
     
     # Get read receipts for display
     read_receipts = {}
-    memberships = ChannelMember.query.filter_by(channel_id=channel_id).all()
+    memberships = ChannelMember.query.filter_by(channel_id=channel_id)\
+        .options(selectinload(ChannelMember.user)).all()
     for m in memberships:
         if m.last_read_message_id:
             read_receipts[m.user_id] = m.last_read_message_id
     seen_users = []
-    if messages:
-        last_id = messages[-1].id
+    if messages_data:
+        last_id = messages_data[-1]['id']
         seen_users = [
             m.user for m in memberships 
             if m.user_id != current_user.id and m.last_read_message_id and m.last_read_message_id >= last_id
@@ -331,35 +327,7 @@ def channel(channel_id):
         'display_name': channel.get_display_name(current_user)
     })
     
-    def serialize_message(msg):
-        attachment_info = None
-        if msg.attachment_id and msg.attachment:
-            attachment_info = {
-                'url': url_for('media.serve_media', media_id=msg.attachment_id),
-                'name': msg.attachment.filename,
-                'is_image': msg.attachment.mimetype.startswith('image/') if msg.attachment.mimetype else False
-            }
-        
-        # Get reactions
-        reactions = {}
-        for reaction in msg.reactions:
-            if reaction.emoji not in reactions:
-                reactions[reaction.emoji] = {'count': 0, 'user_reacted': False}
-            reactions[reaction.emoji]['count'] += 1
-            if reaction.user_id == current_user.id:
-                reactions[reaction.emoji]['user_reacted'] = True
-        
-        return {
-            'id': msg.id,
-            'user': msg.user.username,
-            'user_id': msg.user_id,
-            'content': str(render_message_content(msg)),
-            'created_at': msg.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'attachment': attachment_info,
-            'reactions': reactions
-        }
-    
-    messages_json = json.dumps([serialize_message(msg) for msg in messages])
+    messages_json = json.dumps(messages_data)
     
     seen_users_json = json.dumps([
         {'id': u.id, 'username': u.username}
@@ -405,18 +373,7 @@ def send_message(channel_id):
     
     attachment_id = None
     if file and file.filename:
-        from werkzeug.utils import secure_filename
-        filename = secure_filename(file.filename)
-        data = file.read()
-        media = Media(
-            filename=filename, 
-            mimetype=file.mimetype, 
-            data=data, 
-            size=len(data), 
-            uploaded_by_id=current_user.id
-        )
-        db.session.add(media)
-        db.session.flush()
+        media = media_from_upload(file, user_id=current_user.id)
         attachment_id = media.id
     
     # Process slash commands
@@ -451,8 +408,14 @@ def send_message(channel_id):
         extra_data=extra_data if extra_data else None
     )
     db.session.add(message)
+    db.session.flush()
+    # Serialize while the attachment is still loaded; commit would expire it
+    payload = serialize_messages([message], reactions=False)[0]
     db.session.commit()
     
+    # Push to connected streams (once per channel, not once per client)
+    get_broker().publish(channel_id, [payload])
+    
     # Process @mentions
     process_mentions(message)
     
@@ -484,49 +447,13 @@ def poll_messages(channel_id):
     messages = Message.query.filter(
         Message.channel_id == channel_id, 
         Message.id > last_id
-    ).order_by(Message.created_at.asc()).all()
+    ).options(*message_load_options()).order_by(Message.created_at.asc()).all()
+    results = serialize_messages(messages, current_user.id, reaction_users=True)
     
     # Update read receipt
     if messages:
         update_read_receipt(channel_id, current_user.id, messages[-1].id)
     
-    results = []
-    for msg in messages:
-        attachment_info = None
-        if msg.attachment_id and msg.attachment:
-            attachment_info = {
-                'url': url_for('media.serve_media', media_id=msg.attachment_id),
-                'name': msg.attachment.filename,
-                'is_image': msg.attachment.mimetype.startswith('image/') if msg.attachment.mimetype else False
-            }
-        
-        # Get reactions
-        reactions = {}
-        for reaction in msg.reactions:
-            if reaction.emoji not in reactions:
-                reactions[reaction.emoji] = {'count': 0, 'users': [], 'user_reacted': False}
-            reactions[reaction.emoji]['count'] += 1
-            reactions[reaction.emoji]['users'].append(reaction.user.username)
-            if reaction.user_id == current_user.id:
-                reactions[reaction.emoji]['user_reacted'] = True
-        
-        results.append({
-            'id': msg.id,
-            'user': msg.user.username,
-            'user_id': msg.user_id,
-            'content': str(render_message_content(msg)),
-            'raw_content': msg.content,
-            'created_at': msg.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'is_me': msg.user_id == current_user.id,
-            'attachment': attachment_info,
-            'reactions': reactions,
-            # Enterprise messaging fields
-            'message_type': getattr(msg, 'message_type', 'text') or 'text',
-            'card': msg.get_card() if hasattr(msg, 'get_card') else None,
-            'is_pinned': getattr(msg, 'is_pinned', False),
-            'extra_data': msg.extra_data if hasattr(msg, 'extra_data') else None
-        })
-    
     return jsonify(results)
 
 
@@ -583,10 +510,13 @@ def delete_channel(channel_id):
     try:
         # Explicitly delete related records to ensure clean removal
         # Delete message reactions first (foreign key to messages)
-        for msg in Message.query.filter_by(channel_id=channel_id).all():
-            MessageReaction.query.filter_by(message_id=msg.id).delete()
+        message_ids = [row.id for row in db.session.query(Message.id).filter_by(channel_id=channel_id)]
+        if message_ids:
+            MessageReaction.query.filter(MessageReaction.message_id.in_(message_ids))\
+                .delete(synchronize_session=False)
         
-        # Delete messages
+        # Delete messages (a bulk delete skips the search index's model events)
+        get_index('message').remove(db.session.connection(), message_ids)
         Message.query.filter_by(channel_id=channel_id).delete()
         
         # Delete channel memberships
@@ -803,18 +733,16 @@ def get_pinned_messages(channel_id):
     pinned = Message.query.filter_by(
         channel_id=channel_id, 
         is_pinned=True
-    ).order_by(Message.pinned_at.desc()).all()
-    
-    results = []
-    for msg in pinned:
-        results.append({
-            'id': msg.id,
-            'content': msg.content[:200] + ('...' if len(msg.content or '') > 200 else ''),
-            'user': msg.user.username,
-            'created_at': msg.created_at.strftime('%Y-%m-%d %H:%M'),
-            'pinned_at': msg.pinned_at.strftime('%Y-%m-%d %H:%M') if msg.pinned_at else None,
-            'pinned_by': msg.pinned_by.username if msg.pinned_by else None
-        })
+    ).options(*message_load_options()).order_by(Message.pinned_at.desc()).all()
+    
+    results = [
+        dict(
+            message_summary(msg),
+            pinned_at=msg.pinned_at.strftime('%Y-%m-%d %H:%M') if msg.pinned_at else None,
+            pinned_by=msg.pinned_by.username if msg.pinned_by else None
+        )
+        for msg in pinned
+    ]
     
     return jsonify(results)
 
@@ -884,8 +812,12 @@ def guest_send_message(token):
     )
     db.session.add(message)
     access.last_accessed_at = datetime.utcnow()
+    db.session.flush()
+    payload = serialize_messages([message], reactions=False)[0]
     db.session.commit()
     
+    get_broker().publish(channel.id, [payload])
+    
     return jsonify({'success': True, 'message_id': message.id})
 
 
@@ -896,43 +828,54 @@ def guest_send_message(token):
 @messaging_bp.route('/search')
 @login_required
 def search_messages():
-    """Search messages across accessible channels."""
+    """
+    Search messages across accessible channels, best matches first.
+
+    Optional filters: channel_id, user_id, after and before (YYYY-MM-DD).
+    """
     query = request.args.get('q', '').strip()
     channel_id = request.args.get('channel_id', type=int)
+    user_id = request.args.get('user_id', type=int)
     
     if not query or len(query) < 2:
         return jsonify({'error': 'Query too short', 'results': []})
     
-    # Build base query
-    msg_query = Message.query.filter(Message.content.ilike(f'%{query}%'))
+    try:
+        after = request.args.get('after')
+        after = datetime.strptime(after, '%Y-%m-%d') if after else None
+        before = request.args.get('before')
+        before = datetime.strptime(before, '%Y-%m-%d') + timedelta(days=1) if before else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD', 'results': []})
     
     # Filter by channel if specified
     if channel_id:
         channel = Channel.query.get(channel_id)
         if channel and user_can_access_channel(channel):
-            msg_query = msg_query.filter(Message.channel_id == channel_id)
+            msg_query = Message.query.filter(Message.channel_id == channel_id)
         else:
             return jsonify({'error': 'Access denied', 'results': []})
     else:
-        # Get all accessible channels
-        accessible_channels = []
-        for ch in Channel.query.all():
-            if user_can_access_channel(ch):
-                accessible_channels.append(ch.id)
-        msg_query = msg_query.filter(Message.channel_id.in_(accessible_channels))
-    
-    messages = msg_query.order_by(Message.created_at.desc()).limit(50).all()
-    
-    results = []
-    for msg in messages:
-        results.append({
-            'id': msg.id,
-            'channel_id': msg.channel_id,
-            'channel_name': msg.channel.name,
-            'user': msg.user.username,
-            'content': msg.content[:200] + ('...' if len(msg.content or '') > 200 else ''),
-            'created_at': msg.created_at.strftime('%Y-%m-%d %H:%M')
-        })
+        accessible = db.session.query(Channel.id).filter(Channel.access_filter(current_user))
+        msg_query = Message.query.filter(Message.channel_id.in_(accessible.scalar_subquery()))
+    
+    if user_id:
+        msg_query = msg_query.filter(Message.user_id == user_id)
+    if after:
+        msg_query = msg_query.filter(Message.created_at >= after)
+    if before:
+        msg_query = msg_query.filter(Message.created_at < before)
+    
+    index = get_index('message')
+    terms = query_terms(query)
+    messages = index.ranked(msg_query, terms).options(*message_load_options()).limit(50).all()
+    snippets = index.snippets(terms, messages)
+    
+    results = [
+        dict(message_summary(msg), channel_name=msg.channel.name,
+             snippet=str(snippets[msg.id]) if msg.id in snippets else None)
+        for msg in messages
+    ]
     
     return jsonify({'results': results, 'count': len(results)})
 
@@ -948,11 +891,11 @@ def api_channels():
     from app.models import Role
     
     # Get public channels user can access
-    all_public = Channel.query.filter(
+    public_channels = Channel.query.filter(
         Channel.type == 'public',
-        Channel.is_archived == False
+        Channel.is_archived == False,
+        Channel.access_filter(current_user)
     ).order_by(Channel.category, Channel.name).all()
-    public_channels = [c for c in all_public if c.can_user_access(current_user)]
     
     # Get private channels
     private_channels = Channel.query.filter(
@@ -1176,7 +1119,10 @@ def stream_messages(channel_id):
     SSE endpoint for real-time message streaming.
     
     Clients connect to this endpoint to receive new messages as they arrive.
-    Uses simple polling on the server side (no Redis) per roadmap requirements.
+    Messages since last_id are sent from the database on connect; after
+    that the stream waits on a message broker subscription and relays
+    what send_message publishes, without querying per client. Run the web
+    workers with gevent to hold many streams per process.
     
     Usage:
         const eventSource = new EventSource('/messaging/channel/1/stream?last_id=100');
@@ -1187,87 +1133,70 @@ def stream_messages(channel_id):
     """
     from flask import Response, stream_with_context
     import time
-    import json
     
     channel = Channel.query.get_or_404(channel_id)
     if not user_can_access_channel(channel):
         return jsonify({'error': 'Access denied'}), 403
     
     last_id = request.args.get('last_id', 0, type=int)
+    viewer_id = current_user.id
+    broker = get_broker()
+    
+    def catch_up(after_id):
+        """Messages after after_id from the database (on connect and on resync)."""
+        try:
+            new_messages = Message.query.filter(
+                Message.channel_id == channel_id,
+                Message.id > after_id
+            ).options(*message_load_options()).order_by(Message.created_at.asc()).all()
+            return serialize_messages(new_messages, viewer_id)
+        finally:
+            # Don't hold a pooled connection for the life of the stream
+            db.session.close()
     
     def generate():
         """Generator function for SSE stream."""
         nonlocal last_id
-        heartbeat_interval = 30  # Send heartbeat every 30 seconds
-        poll_interval = 2  # Check for new messages every 2 seconds
-        last_heartbeat = time.time()
-        
-        # Initial connection event
-        yield f"event: connected\ndata: {json.dumps({'channel_id': channel_id, 'status': 'connected'})}\n\n"
+        heartbeat_interval = 30  # Send heartbeat after 30 seconds without messages
+        resync = True
+        # Subscribe before the catch-up query so nothing sent in between is missed
+        subscription = broker.subscribe(channel_id)
         
-        while True:
-            try:
-                # Check for new messages
-                new_messages = Message.query.filter(
-                    Message.channel_id == channel_id,
-                    Message.id > last_id
-                ).order_by(Message.created_at.asc()).all()
-                
-                if new_messages:
-                    messages_data = []
-                    for msg in new_messages:
-                        attachment_info = None
-                        if msg.attachment_id and msg.attachment:
-                            attachment_info = {
-                                'url': url_for('media.serve_media', media_id=msg.attachment_id),
-                                'name': msg.attachment.filename,
-                                'is_image': msg.attachment.mimetype.startswith('image/') if msg.attachment.mimetype else False
-                            }
-                        
-                        # Get reactions
-                        reactions = {}
-                        for reaction in msg.reactions:
-                            if reaction.emoji not in reactions:
-                                reactions[reaction.emoji] = {'count': 0, 'user_reacted': False}
-                            reactions[reaction.emoji]['count'] += 1
-                            if reaction.user_id == current_user.id:
-                                reactions[reaction.emoji]['user_reacted'] = True
-                        
-                        messages_data.append({
-                            'id': msg.id,
-                            'user': msg.user.username,
-                            'user_id': msg.user_id,
-                            'content': str(render_message_content(msg)),
-                            'raw_content': msg.content,
-                            'created_at': msg.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                            'is_me': msg.user_id == current_user.id,
-                            'attachment': attachment_info,
-                            'reactions': reactions,
-                            'message_type': getattr(msg, 'message_type', 'text') or 'text',
-                            'card': msg.get_card() if hasattr(msg, 'get_card') else None,
-                            'is_pinned': getattr(msg, 'is_pinned', False),
-                            'extra_data': msg.extra_data if hasattr(msg, 'extra_data') else None
-                        })
+        try:
+            # Initial connection event
+            yield sse_frame('connected', {'channel_id': channel_id, 'status': 'connected'})
+            
+            while True:
+                try:
+                    if resync or subscription.lagged:
+                        subscription.reset()
+                        resync = False
+                        messages_data = catch_up(last_id)
+                        if messages_data:
+                            last_id = messages_data[-1]['id']
+                            yield sse_frame('messages', messages_data)
                     
-                    last_id = new_messages[-1].id
-                    yield f"event: messages\ndata: {json.dumps(messages_data)}\n\n"
-                
-                # Send heartbeat
-                current_time = time.time()
-                if current_time - last_heartbeat >= heartbeat_interval:
-                    yield f"event: heartbeat\ndata: {json.dumps({'timestamp': int(current_time)})}\n\n"
-                    last_heartbeat = current_time
-                
-                # Wait before next poll
-                time.sleep(poll_interval)
+                    event = subscription.get(timeout=heartbeat_interval)
+                    if event is None:
+                        yield sse_frame('heartbeat', {'timestamp': int(time.time())})
+                        # Safety net for publishes this process never heard about
+                        resync = True
+                    elif event.resync:
+                        resync = True
+                    elif event.last_id > last_id:
+                        last_id = event.last_id
+                        yield event.frame_for(viewer_id)
                 
-            except GeneratorExit:
-                # Client disconnected
-                break
-            except Exception as e:
-                # Log error but keep stream alive
-                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
-                time.sleep(poll_interval)
+                except GeneratorExit:
+                    raise
+                except Exception as e:
+                    # Log error but keep stream alive
+                    yield sse_frame('error', {'error': str(e)})
+                    resync = True
+                    time.sleep(2)
+        finally:
+            # Client disconnected
+            subscription.close()
     
     response = Response(
         stream_with_context(generate()),
@@ -9,17 +9,18 @@ Provides:
 - Admin metrics dashboard
 """
 
+import re
 import time
 import os
 import platform
 from datetime import datetime, timezone, timedelta
 from functools import wraps
-from collections import defaultdict
-from threading import Lock
 
-from flask import Blueprint, jsonify, request, render_template, current_app, g
+from flask import Blueprint, jsonify, request, render_template, current_app, g, abort
 from flask_login import login_required, current_user
 
+from app.modules.metrics_core import DEFAULT_MAX_SERIES, MetricsRegistry
+
 try:
     from app.modules.decorators import role_required
 except ImportError:
@@ -32,86 +33,121 @@ except ImportError:
 # Metrics Collection
 # ============================================================================
 
+PATH_ID_RE = re.compile(r'/\d+')
+
+
 class MetricsCollector:
     """
-    Simple in-memory metrics collector.
+    Metrics collector backed by a MetricsRegistry (see app.modules.metrics_core).
     
     Collects:
     - Request counts by method, path, status
     - Request duration histograms
     - Database query counts and durations
-    - Worker task counts
-    - Business metrics (orders, leads, appointments)
+    - Worker task counts and duration histograms
+    - Cache hits and misses
+    - Log shipping outcomes, and log records queued in this process
+    
+    Recording touches only the calling thread's shard. With
+    enable_multiprocess() the values live in files shared by every gunicorn
+    worker, so any worker can answer a scrape for the whole node.
     """
     
-    def __init__(self):
-        self._lock = Lock()
+    SLOW_QUERY_SECONDS = 0.5
+    
+    def __init__(self, max_series=DEFAULT_MAX_SERIES):
         self._start_time = time.time()
+        self.registry = MetricsRegistry(max_series=max_series)
         
         # Request metrics
-        self._request_count = defaultdict(int)  # {(method, path, status): count}
-        self._request_duration = defaultdict(list)  # {(method, path): [durations]}
+        self.requests = self.registry.counter(
+            'http_requests_total', 'Total HTTP requests', ('method', 'path', 'status'))
+        self.request_duration = self.registry.histogram(
+            'http_request_duration_seconds', 'HTTP request duration', ('method', 'path'))
         
         # Database metrics
-        self._query_count = 0
-        self._query_duration_total = 0.0
-        self._slow_queries = 0
+        self.queries = self.registry.counter('db_queries_total', 'Total database queries')
+        self.query_seconds = self.registry.counter('db_query_seconds_total', 'Total database query time')
+        self.slow_queries = self.registry.counter('db_slow_queries_total', 'Slow database queries')
         
         # Worker metrics
-        self._task_count = defaultdict(int)  # {(task_name, status): count}
-        self._task_duration = defaultdict(list)
+        self.tasks = self.registry.counter(
+            'worker_tasks_total', 'Total background tasks', ('task', 'status'))
+        self.task_duration = self.registry.histogram(
+            'worker_task_duration_seconds', 'Background task duration', ('task',))
         
         # Cache metrics
-        self._cache_hits = 0
-        self._cache_misses = 0
+        self.cache_hits = self.registry.counter('cache_hits_total', 'Cache hits')
+        self.cache_misses = self.registry.counter('cache_misses_total', 'Cache misses')
+        
+        # Log shipping metrics
+        self.log_shipping = {
+            outcome: self.registry.counter(name, help_text, ('handler',))
+            for outcome, name, help_text in (
+                ('shipped', 'log_records_shipped_total', 'Log records delivered to the log backend'),
+                ('dropped', 'log_records_dropped_total', 'Log records dropped because the queue or spool was full'),
+                ('spooled', 'log_records_spooled_total', 'Log records spooled to disk after failed sends'),
+                ('replayed', 'log_records_replayed_total', 'Spooled log records delivered later'),
+                ('failures', 'log_ship_failures_total', 'Failed log shipping attempts'),
+            )
+        }
+        self.log_queue_depth = self.registry.gauge(
+            'log_ship_queue_depth', 'Log records waiting to be shipped by this process',
+            self._log_queue_depths, ('handler',))
+    
+    def enable_multiprocess(self, directory):
+        """Aggregate across every process recording into `directory`."""
+        self.registry.enable_multiprocess(directory)
     
     def get_uptime(self):
         """Get application uptime in seconds."""
         return time.time() - self._start_time
     
-    def record_request(self, method, path, status, duration):
-        """Record a completed HTTP request."""
-        with self._lock:
-            # Normalize path to reduce cardinality
-            normalized_path = self._normalize_path(path)
-            self._request_count[(method, normalized_path, status)] += 1
-            
-            # Keep last 1000 durations per endpoint
-            durations = self._request_duration[(method, normalized_path)]
-            durations.append(duration)
-            if len(durations) > 1000:
-                self._request_duration[(method, normalized_path)] = durations[-1000:]
+    def record_request(self, method, path, status, duration, normalize=True):
+        """
+        Record a completed HTTP request.
+        
+        Pass normalize=False when `path` is already a route template
+        (request.url_rule.rule) rather than a concrete URL.
+        """
+        if normalize:
+            path = self._normalize_path(path)
+        self.requests.inc(method, path, status)
+        self.request_duration.observe(duration, method, path)
     
     def record_query(self, duration):
         """Record a database query."""
-        with self._lock:
-            self._query_count += 1
-            self._query_duration_total += duration
-            if duration > 0.5:  # Slow query threshold
-                self._slow_queries += 1
+        self.queries.inc()
+        self.query_seconds.inc(amount=duration)
+        if duration > self.SLOW_QUERY_SECONDS:
+            self.slow_queries.inc()
     
     def record_task(self, task_name, status, duration=None):
         """Record a background task completion."""
-        with self._lock:
-            self._task_count[(task_name, status)] += 1
-            if duration is not None:
-                self._task_duration[task_name].append(duration)
+        self.tasks.inc(task_name, status)
+        if duration is not None:
+            self.task_duration.observe(duration, task_name)
     
     def record_cache_hit(self):
         """Record a cache hit."""
-        with self._lock:
-            self._cache_hits += 1
+        self.cache_hits.inc()
     
     def record_cache_miss(self):
         """Record a cache miss."""
-        with self._lock:
-            self._cache_misses += 1
+        self.cache_misses.inc()
+    
+    def record_log_shipping(self, handler, outcome, count=1):
+        """Record log records shipped, dropped, spooled or replayed, or failed sends."""
+        self.log_shipping[outcome].inc(handler, amount=count)
+    
+    def _log_queue_depths(self):
+        from app.modules.advanced_observability import log_queue_depths
+        return {(target,): queued for target, queued in log_queue_depths().items()}
     
     def _normalize_path(self, path):
         """Normalize path to reduce metric cardinality."""
         # Replace numeric IDs with placeholder
-        import re
-        normalized = re.sub(r'/\d+', '/{id}', path)
+        normalized = PATH_ID_RE.sub('/{id}', path)
         # Truncate long paths
         if len(normalized) > 50:
             normalized = normalized[:50] + '...'
@@ -119,36 +155,37 @@ class MetricsCollector:
     
     def get_request_stats(self):
         """Get request statistics."""
-        with self._lock:
-            total = sum(self._request_count.values())
-            errors = sum(v for (m, p, s), v in self._request_count.items() if s >= 400)
-            
-            # Calculate average duration
-            all_durations = []
-            for durations in self._request_duration.values():
-                all_durations.extend(durations)
-            
-            avg_duration = sum(all_durations) / len(all_durations) if all_durations else 0
-            
-            return {
-                'total': total,
-                'errors': errors,
-                'error_rate': errors / total if total > 0 else 0,
-                'avg_duration_ms': round(avg_duration * 1000, 2)
-            }
+        samples = self.registry.samples()
+        counts = self.requests.values(samples)
+        total = sum(counts.values())
+        errors = sum(v for (m, p, s), v in counts.items() if s.isdigit() and int(s) >= 400)
+        
+        durations = self.request_duration.totals(samples).values()
+        observed = sum(count for count, _ in durations)
+        duration_total = sum(seconds for _, seconds in durations)
+        avg_duration = duration_total / observed if observed else 0
+        
+        return {
+            'total': int(total),
+            'errors': int(errors),
+            'error_rate': errors / total if total > 0 else 0,
+            'avg_duration_ms': round(avg_duration * 1000, 2)
+        }
     
     def get_db_stats(self):
         """Get database statistics."""
-        with self._lock:
-            return {
-                'total_queries': self._query_count,
-                'total_duration': round(self._query_duration_total, 3),
-                'slow_queries': self._slow_queries,
-                'avg_duration_ms': round(
-                    (self._query_duration_total / self._query_count * 1000) 
-                    if self._query_count > 0 else 0, 2
-                )
-            }
+        samples = self.registry.samples()
+        query_count = self.queries.values(samples).get((), 0)
+        duration_total = self.query_seconds.values(samples).get((), 0.0)
+        return {
+            'total_queries': int(query_count),
+            'total_duration': round(duration_total, 3),
+            'slow_queries': int(self.slow_queries.values(samples).get((), 0)),
+            'avg_duration_ms': round(
+                (duration_total / query_count * 1000)
+                if query_count > 0 else 0, 2
+            )
+        }
     
     def get_prometheus_metrics(self):
         """Generate Prometheus-compatible metrics output."""
@@ -164,68 +201,25 @@ class MetricsCollector:
         lines.append('# TYPE verso_uptime_seconds counter')
         lines.append(f'verso_uptime_seconds {self.get_uptime():.0f}')
         
-        # Request total
-        lines.append('# HELP http_requests_total Total HTTP requests')
-        lines.append('# TYPE http_requests_total counter')
-        with self._lock:
-            for (method, path, status), count in self._request_count.items():
-                path_escaped = path.replace('"', '\\"')
-                lines.append(
-                    f'http_requests_total{{method="{method}",path="{path_escaped}",status="{status}"}} {count}'
-                )
-        
-        # Request duration histogram
-        lines.append('# HELP http_request_duration_seconds HTTP request duration')
-        lines.append('# TYPE http_request_duration_seconds histogram')
-        with self._lock:
-            for (method, path), durations in self._request_duration.items():
-                if durations:
-                    path_escaped = path.replace('"', '\\"')
-                    # Create histogram buckets
-                    buckets = [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
-                    for bucket in buckets:
-                        count = sum(1 for d in durations if d <= bucket)
-                        lines.append(
-                            f'http_request_duration_seconds_bucket{{method="{method}",path="{path_escaped}",le="{bucket}"}} {count}'
-                        )
-                    lines.append(
-                        f'http_request_duration_seconds_bucket{{method="{method}",path="{path_escaped}",le="+Inf"}} {len(durations)}'
-                    )
-                    lines.append(
-                        f'http_request_duration_seconds_sum{{method="{method}",path="{path_escaped}"}} {sum(durations):.3f}'
-                    )
-                    lines.append(
-                        f'http_request_duration_seconds_count{{method="{method}",path="{path_escaped}"}} {len(durations)}'
-                    )
-        
-        # Database metrics
-        lines.append('# HELP db_queries_total Total database queries')
-        lines.append('# TYPE db_queries_total counter')
-        lines.append(f'db_queries_total {self._query_count}')
-        
-        lines.append('# HELP db_query_seconds_total Total database query time')
-        lines.append('# TYPE db_query_seconds_total counter')
-        lines.append(f'db_query_seconds_total {self._query_duration_total:.3f}')
-        
-        lines.append('# HELP db_slow_queries_total Slow database queries')
-        lines.append('# TYPE db_slow_queries_total counter')
-        lines.append(f'db_slow_queries_total {self._slow_queries}')
+        # Request, database, worker, cache and log shipping metrics
+        lines.extend(self.registry.exposition())
         
-        # Worker metrics
-        lines.append('# HELP worker_tasks_total Total background tasks')
-        lines.append('# TYPE worker_tasks_total counter')
-        with self._lock:
-            for (task_name, status), count in self._task_count.items():
-                lines.append(f'worker_tasks_total{{task="{task_name}",status="{status}"}} {count}')
+        # Booking slot cache metrics (per process)
+        from app.modules.slot_cache import slot_cache_stats
+        slot_stats = slot_cache_stats.snapshot()
+        lines.append('# HELP slot_cache_lookups_total Booking slot cache lookups (one per cached day)')
+        lines.append('# TYPE slot_cache_lookups_total counter')
+        lines.append(f'slot_cache_lookups_total{{result="hit"}} {slot_stats["hits"]}')
+        lines.append(f'slot_cache_lookups_total{{result="miss"}} {slot_stats["misses"]}')
         
-        # Cache metrics
-        lines.append('# HELP cache_hits_total Cache hits')
-        lines.append('# TYPE cache_hits_total counter')
-        lines.append(f'cache_hits_total {self._cache_hits}')
+        lines.append('# HELP slot_cache_hit_ratio Booking slot cache hit ratio since start')
+        lines.append('# TYPE slot_cache_hit_ratio gauge')
+        lines.append(f'slot_cache_hit_ratio {slot_stats["hit_ratio"]:.4f}')
         
-        lines.append('# HELP cache_misses_total Cache misses')
-        lines.append('# TYPE cache_misses_total counter')
-        lines.append(f'cache_misses_total {self._cache_misses}')
+        lines.append('# HELP slot_cache_invalidations_total Committed writes that invalidated cached slots')
+        lines.append('# TYPE slot_cache_invalidations_total counter')
+        for model, count in sorted(slot_stats['invalidations'].items()):
+            lines.append(f'slot_cache_invalidations_total{{model="{model}"}} {count}')
         
         return '\n'.join(lines)
 
@@ -547,22 +541,30 @@ def init_metrics_collection(app):
     """
     Initialize metrics collection middleware.
     
-    Hooks into request/response cycle to collect metrics.
+    Hooks into request/response cycle to collect metrics. With
+    METRICS_MULTIPROC_DIR set, every worker records into that directory and
+    /metrics reports the sum across workers.
     """
+    multiproc_dir = app.config.get('METRICS_MULTIPROC_DIR')
+    if multiproc_dir:
+        metrics_collector.enable_multiprocess(multiproc_dir)
     
     @app.before_request
     def before_request_metrics():
-        g.metrics_start_time = time.time()
+        g.metrics_start_time = time.perf_counter()
     
     @app.after_request
     def after_request_metrics(response):
         if hasattr(g, 'metrics_start_time'):
-            duration = time.time() - g.metrics_start_time
+            duration = time.perf_counter() - g.metrics_start_time
+            # The route template is already low-cardinality
+            rule = request.url_rule
             metrics_collector.record_request(
                 method=request.method,
-                path=request.path,
+                path=rule.rule if rule is not None else request.path,
                 status=response.status_code,
-                duration=duration
+                duration=duration,
+                normalize=rule is None
             )
         return response
     
@@ -629,6 +631,73 @@ def export_alerting_rules():
             return jsonify({'error': 'Advanced observability module not available'}), 500
 
 
+@observability_bp.route('/admin/query-budgets')
+@login_required
+@role_required('admin')
+def query_budgets():
+    """
+    Per-endpoint query budget report for this worker.
+    
+    Covers requests profiled in debug mode or sampled through
+    QUERY_PROFILE_SAMPLE_RATE, worst endpoints first, with the repeated
+    statements (likely N+1 queries) seen in each.
+    """
+    from app.modules.performance import query_budget_report
+    
+    return jsonify({
+        'pid': os.getpid(),
+        'sample_rate': current_app.config.get('QUERY_PROFILE_SAMPLE_RATE', 0.0),
+        'endpoints': query_budget_report.report(),
+    })
+
+
+@observability_bp.route('/admin/profiles')
+@login_required
+@role_required('admin')
+def cpu_profiles():
+    """List captured CPU profiles, newest first."""
+    from app.modules.cpu_profiler import list_profiles, profile_directory, sampler
+    
+    return render_template(
+        'admin/observability/profiles.html',
+        profiles=list_profiles(profile_directory(current_app)),
+        slow_ms=current_app.config.get('CPU_PROFILE_SLOW_MS', 1000),
+        interval_ms=round(sampler.interval * 1000, 2),
+        overhead=sampler.busy_time / metrics_collector.get_uptime(),
+    )
+
+
+@observability_bp.route('/admin/profiles/<profile_id>')
+@login_required
+@role_required('admin')
+def cpu_profile(profile_id):
+    """Flamegraph of one captured CPU profile."""
+    from app.modules.cpu_profiler import flame_layout, load_profile, parse_folded, profile_directory
+    
+    loaded = load_profile(profile_directory(current_app), profile_id)
+    if loaded is None:
+        abort(404)
+    meta, folded = loaded
+    rects, depth = flame_layout(parse_folded(folded))
+    return render_template('admin/observability/profile.html', profile=meta, rects=rects, depth=depth)
+
+
+@observability_bp.route('/admin/profiles/<profile_id>.folded')
+@login_required
+@role_required('admin')
+def cpu_profile_folded(profile_id):
+    """Collapsed stacks of a profile, for flamegraph.pl or speedscope."""
+    from app.modules.cpu_profiler import load_profile, profile_directory
+    
+    loaded = load_profile(profile_directory(current_app), profile_id)
+    if loaded is None:
+        abort(404)
+    return loaded[1], 200, {
+        'Content-Type': 'text/plain; charset=utf-8',
+        'Content-Disposition': f'attachment; filename=profile-{profile_id}.folded'
+    }
+
+
 @observability_bp.route('/admin/observability-config')
 @login_required
 @role_required('admin')
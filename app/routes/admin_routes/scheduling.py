@@ -17,7 +17,7 @@ from app.models import (
 )
 from app.forms import CSRFTokenForm  # Needs new forms
 from app.modules.scheduling_service import (
-    get_appointment_type_slots, book_with_resources, 
+    get_cached_appointment_type_slots, book_with_resources, 
     generate_checkin_token
 )
 from datetime import datetime
@@ -230,7 +230,7 @@ def api_slots(slug):
         return jsonify({'error': 'Date required'}), 400
         
     target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-    slots = get_appointment_type_slots(appt_type.id, target_date)
+    slots = get_cached_appointment_type_slots(appt_type.id, target_date)
     
     return jsonify({
         'date': date_str,
@@ -4,10 +4,10 @@ Enterprise-level shop management with JSON APIs for React consumption.
 """
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, current_app
 from flask_login import login_required, current_user
-from app.models import Product, ProductImage, ProductVariant, Category, Media, Order, db
+from app.models import Product, ProductImage, ProductVariant, Category, Order, db
 from app.modules.decorators import role_required
+from app.modules.file_manager import media_from_upload
 from datetime import datetime, timedelta
-from werkzeug.utils import secure_filename
 import json
 
 shop_admin_bp = Blueprint('shop_admin', __name__, url_prefix='/admin/shop')
@@ -281,19 +281,7 @@ def api_upload_product_image(product_id):
     if not image_file.filename:
         return jsonify({'error': 'No file selected'}), 400
     
-    filename = secure_filename(image_file.filename)
-    mimetype = image_file.mimetype
-    data = image_file.read()
-    
-    media = Media(
-        filename=filename,
-        data=data,
-        mimetype=mimetype,
-        size=len(data),
-        uploaded_by_id=current_user.id
-    )
-    db.session.add(media)
-    db.session.flush()
+    media = media_from_upload(image_file, user_id=current_user.id)
     
     # Set as primary image
     product.media_id = media.id
@@ -423,19 +411,7 @@ def create_product():
         image_file = request.files.get('image')
         media_id = None
         if image_file and image_file.filename:
-            filename = secure_filename(image_file.filename)
-            mimetype = image_file.mimetype
-            data = image_file.read()
-            
-            media = Media(
-                filename=filename,
-                data=data,
-                mimetype=mimetype,
-                size=len(data),
-                uploaded_by_id=current_user.id
-            )
-            db.session.add(media)
-            db.session.flush()
+            media = media_from_upload(image_file, user_id=current_user.id)
             media_id = media.id
             
         product = Product(
@@ -472,19 +448,7 @@ def edit_product(id):
         # Image Update
         image_file = request.files.get('image')
         if image_file and image_file.filename:
-            filename = secure_filename(image_file.filename)
-            mimetype = image_file.mimetype
-            data = image_file.read()
-            
-            media = Media(
-                filename=filename,
-                data=data,
-                mimetype=mimetype,
-                size=len(data),
-                uploaded_by_id=current_user.id
-            )
-            db.session.add(media)
-            db.session.flush()
+            media = media_from_upload(image_file, user_id=current_user.id)
             product.media_id = media.id
             
         db.session.commit()
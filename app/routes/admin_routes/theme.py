@@ -9,7 +9,7 @@ from app.models import BusinessConfig, Media
 from app.forms import CSRFTokenForm
 from app.database import db
 from app.modules.audit import log_audit_event
-from werkzeug.utils import secure_filename
+from app.modules.file_manager import media_from_upload
 import os
 
 theme_bp = Blueprint('theme', __name__, template_folder='templates')
@@ -125,16 +125,8 @@ def upload_logo():
     
     if file:
         try:
-            filename = secure_filename(file.filename)
-            
             # Store in Media model
-            media = Media(
-                filename=filename,
-                content_type=file.content_type,
-                data=file.read()
-            )
-            db.session.add(media)
-            db.session.flush()  # Get the ID
+            media = media_from_upload(file, user_id=current_user.id)
             
             # Update BusinessConfig with logo_media_id
             config = BusinessConfig.query.filter_by(setting_name='logo_media_id').first()
@@ -145,7 +137,7 @@ def upload_logo():
                 db.session.add(config)
             
             db.session.commit()
-            log_audit_event(current_user.id, 'upload_logo', 'Media', media.id, {'filename': filename}, request.remote_addr)
+            log_audit_event(current_user.id, 'upload_logo', 'Media', media.id, {'filename': media.filename}, request.remote_addr)
             flash('Logo uploaded successfully!', 'success')
             
         except Exception as e:
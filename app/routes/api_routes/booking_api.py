@@ -1,7 +1,7 @@
 from flask import Blueprint, jsonify, request, current_app, url_for, render_template
 from app.models import Estimator, Service, Availability, Appointment, RescheduleRequest, User, db
 from flask_login import login_required, current_user
-from app.modules.availability_service import get_available_slots, check_slot_available
+from app.modules.availability_service import get_cached_slots_range, check_slot_available
 from app.modules.security import rate_limiter
 from datetime import datetime, date, time, timedelta
 from decimal import Decimal
@@ -66,7 +66,9 @@ def get_slots():
     
     Excludes slots that are:
     - Already booked
-    - Held for pending payment (within PAYMENT_HOLD_MINUTES)
+    - Held for pending payment (until the hold expires)
+    
+    Answers come from the slot cache, which booking writes invalidate.
     """
     estimator_id = request.args.get('estimator_id', type=int)
     date_str = request.args.get('date')
@@ -82,26 +84,59 @@ def get_slots():
         if target_date < date.today():
             return jsonify({'slots': []})
         
-        slots = get_available_slots(estimator_id, target_date, service_id)
-        
-        # Also filter out slots held for pending payments
-        now = datetime.utcnow()
-        pending_appointments = Appointment.query.filter(
-            Appointment.estimator_id == estimator_id,
-            Appointment.payment_status == 'pending',
-            Appointment.payment_expires_at > now
-        ).all()
+        slots = get_cached_slots_range(estimator_id, target_date, 1, service_id)[target_date]
         
-        pending_times = set()
-        for appt in pending_appointments:
-            if appt.preferred_date_time and appt.preferred_date_time.date() == target_date:
-                pending_times.add(appt.preferred_date_time.time())
+        return jsonify({
+            'slots': [s.strftime('%H:%M') for s in slots]
+        })
+    except ValueError as e:
+        return jsonify({'error': f'Invalid date format: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Longest range the month view may ask for in one request
+MAX_AVAILABILITY_DAYS = 62
+
+
+@booking_api_bp.route('/availability')
+@rate_limiter.exempt
+def get_availability():
+    """Get available time slots for an estimator over a range of days.
+    
+    Serves the booking widget's month view in one request: `start`
+    (YYYY-MM-DD, default today) and `days` (default 31). Days in the
+    past come back empty.
+    """
+    estimator_id = request.args.get('estimator_id', type=int)
+    service_id = request.args.get('service_id', type=int)
+    days = request.args.get('days', 31, type=int)
+    
+    if not estimator_id:
+        return jsonify({'error': 'Missing required parameter: estimator_id'}), 400
+    if days < 1 or days > MAX_AVAILABILITY_DAYS:
+        return jsonify({'error': f'days must be between 1 and {MAX_AVAILABILITY_DAYS}'}), 400
+    
+    try:
+        today = date.today()
+        start_str = request.args.get('start')
+        start_date = datetime.strptime(start_str, '%Y-%m-%d').date() if start_str else today
+        end_date = start_date + timedelta(days=days - 1)
         
-        # Remove slots that overlap with pending payments
-        available_slots = [s for s in slots if s not in pending_times]
+        slots_by_day = {}
+        if end_date >= today:
+            first_day = max(start_date, today)
+            slots_by_day = get_cached_slots_range(
+                estimator_id, first_day, (end_date - first_day).days + 1, service_id
+            )
         
         return jsonify({
-            'slots': [s.strftime('%H:%M') for s in available_slots]
+            'days': {
+                (start_date + timedelta(days=i)).isoformat(): [
+                    s.strftime('%H:%M')
+                    for s in slots_by_day.get(start_date + timedelta(days=i), [])
+                ]
+                for i in range(days)
+            }
         })
     except ValueError as e:
         return jsonify({'error': f'Invalid date format: {str(e)}'}), 400
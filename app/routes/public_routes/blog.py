@@ -7,8 +7,12 @@ from app.forms import (RegistrationForm, LoginForm, EstimateRequestForm, CreateP
                        EditPostForm, CSRFTokenForm, CommentForm, BlogCategoryForm, TagForm,
                        PostSeriesForm, BlogSearchForm, CommentModerationForm)
 from app.modules.auth_manager import blogger_required, admin_required
+from app.modules.blob_store import get_blob_store, send_blob
+from app.modules.file_manager import release_blob
+from app.modules.image_variants import queue_variants
+from app.modules.search_index import get_index
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy import or_
+from werkzeug.exceptions import HTTPException
 import logging
 import io
 import bleach
@@ -53,12 +57,26 @@ def combined_context_processor():
 def serve_image(post_id):
     """Serve the image for a blog post."""
     try:
-        post = Post.query.get_or_404(post_id)
-        if not post.image or not post.image_mime_type:
+        # Metadata only; the payload is read just for legacy rows that are not cached
+        meta = db.session.query(
+            Post.image_checksum, Post.image_mime_type, Post.updated_at, Post.image.isnot(None)
+        ).filter(Post.id == post_id).first()
+        if meta is None:
+            return Response(status=404)
+        checksum, mime_type, updated_at, has_legacy_image = meta
+        if not mime_type or not (checksum or has_legacy_image):
             logger.debug(f"No image found for post ID {post_id}")
             return Response(status=404)
         logger.debug(f"Serving image for post ID {post_id}")
-        return Response(post.image, mimetype=post.image_mime_type)
+        return send_blob(
+            checksum,
+            load_data=lambda: db.session.query(Post.image).filter(Post.id == post_id).scalar(),
+            mimetype=mime_type,
+            etag=f'post-{post_id}-{updated_at:%Y%m%d%H%M%S}',
+            last_modified=updated_at
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error serving image for post ID {post_id}: {e}")
         return Response(status=500)
@@ -128,8 +146,8 @@ def manage_posts():
         posts_json = []
         for post in posts.items:
             # Create thumbnail HTML
-            if post.image and post.image_mime_type:
-                thumbnail = f'<img src="{url_for("blog.serve_image", post_id=post.id)}" alt="{post.title}" class="img-thumbnail" style="max-width: 60px; max-height: 40px;">'
+            if post.has_image and post.image_mime_type:
+                thumbnail = f'<img src="{url_for("blog.serve_image", post_id=post.id, v=post.image_version)}" alt="{post.title}" class="img-thumbnail" style="max-width: 60px; max-height: 40px;">'
             else:
                 thumbnail = '<span class="text-muted"><i class="fas fa-image"></i></span>'
             
@@ -188,13 +206,14 @@ def new_post():
     if form.validate_on_submit():
         try:
             # Initialize image fields
-            image_data = None
+            image_checksum = None
             image_mime_type = None
             if form.image.data:
                 # Reset file pointer to ensure the stream is readable
                 form.image.data.seek(0)
-                image_data = form.image.data.read()
+                image_checksum, _ = get_blob_store().put_stream(form.image.data.stream)
                 image_mime_type = form.image.data.mimetype
+                queue_variants(image_checksum)
             # Sanitize the content
             sanitized_content = bleach.clean(
                 form.content.data,
@@ -219,7 +238,7 @@ def new_post():
                 is_published=is_published,
                 author_id=current_user.id,
                 slug=slug,
-                image=image_data,
+                image_checksum=image_checksum,
                 image_mime_type=image_mime_type,
                 # Phase 3 fields
                 blog_category_id=form.blog_category_id.data if form.blog_category_id.data else None,
@@ -319,7 +338,7 @@ def api_create_post():
             return jsonify({'success': False, 'errors': errors, 'message': 'Validation failed.'}), 400
         
         # Handle image
-        image_data = None
+        image_checksum = None
         image_mime_type = None
         if 'image' in request.files:
             file = request.files['image']
@@ -330,12 +349,14 @@ def api_create_post():
                 if ext not in allowed_extensions:
                     return jsonify({'success': False, 'errors': {'image': 'Only PNG, JPG, JPEG allowed.'}, 'message': 'Invalid image format.'}), 400
                 
+                file.seek(0, 2)
+                if file.tell() > 5 * 1024 * 1024:
+                    return jsonify({'success': False, 'errors': {'image': 'Image must be less than 5MB.'}, 'message': 'Image too large.'}), 400
+                
                 file.seek(0)
-                image_data = file.read()
+                image_checksum, _ = get_blob_store().put_stream(file.stream)
                 image_mime_type = file.mimetype
-                
-                if len(image_data) > 5 * 1024 * 1024:
-                    return jsonify({'success': False, 'errors': {'image': 'Image must be less than 5MB.'}, 'message': 'Image too large.'}), 400
+                queue_variants(image_checksum)
         
         # Sanitize content
         sanitized_content = bleach.clean(
@@ -366,7 +387,7 @@ def api_create_post():
             is_published=is_published,
             author_id=current_user.id,
             slug=slug,
-            image=image_data,
+            image_checksum=image_checksum,
             image_mime_type=image_mime_type,
             blog_category_id=blog_category_id if blog_category_id else None,
             is_featured=is_featured,
@@ -481,10 +502,15 @@ def edit_post(post_id):
             # Recalculate read time
             post.read_time_minutes = post.calculate_read_time()
             
+            replaced_image = None
             if form.image.data:
                 form.image.data.seek(0)
-                post.image = form.image.data.read()
+                replaced_image = post.image_checksum
+                post.image_checksum, _ = get_blob_store().put_stream(form.image.data.stream)
+                post.image = None
                 post.image_mime_type = form.image.data.mimetype
+                if post.image_checksum != replaced_image:
+                    queue_variants(post.image_checksum)
             
             # Phase 3: Update tags
             post.tags.clear()
@@ -509,6 +535,8 @@ def edit_post(post_id):
                 )
                 db.session.add(revision)
             
+            if replaced_image and replaced_image != post.image_checksum:
+                release_blob(replaced_image)
             db.session.commit()
             logger.info(f'"{post.title}" updated successfully by {current_user.username}')
             flash('Record updated successfully.', 'success')
@@ -563,7 +591,7 @@ def delete_post(id):
 # Blog Search
 @blog_blueprint.route('/blog/search')
 def search():
-    """Search blog posts by title and content."""
+    """Search blog posts by title, summary and content, best matches first."""
     query = request.args.get('q', '').strip()
     page = request.args.get('page', 1, type=int)
     per_page = 10
@@ -573,15 +601,9 @@ def search():
         return redirect(url_for('blog.show_blog'))
     
     try:
-        search_term = f'%{query}%'
-        posts = Post.query.filter(
-            Post.is_published == True,
-            or_(
-                Post.title.ilike(search_term),
-                Post.content.ilike(search_term),
-                Post.meta_description.ilike(search_term)
-            )
-        ).order_by(Post.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        posts = get_index('post').paginate(
+            query, Post.query.filter(Post.is_published == True), page=page, per_page=per_page
+        )
         
         logger.debug(f"Search for '{query}' returned {posts.total} results")
         return render_template('blog/blog_search.html', posts=posts, query=query)
@@ -739,7 +761,7 @@ def featured_posts():
                 'title': p.title,
                 'slug': p.slug,
                 'created_at': p.created_at.isoformat(),
-                'image_url': url_for('blog.serve_image', post_id=p.id) if p.image else None
+                'image_url': url_for('blog.serve_image', post_id=p.id, v=p.image_version) if p.has_image else None
             } for p in posts])
         
         return render_template('blog/featured.html', posts=posts)
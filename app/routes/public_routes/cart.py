@@ -4,21 +4,24 @@ Session-based cart using Flask's secure cookie session.
 Cart stored as {product_id: quantity} dictionary in session.
 For logged-in users, cart is persisted to UserCart model.
 """
-from flask import Blueprint, render_template, request, session, jsonify, flash, redirect, url_for, current_app, send_file
+from flask import Blueprint, render_template, request, session, jsonify, flash, redirect, url_for, current_app, abort
 from flask_login import current_user
 from app.models import Product, Order, OrderItem, DownloadToken, UserCart, InventoryLock, DownloadLog, db
 from app.modules.security import rate_limiter
+from app.modules.blob_store import send_blob
 import stripe
 import secrets
 import hashlib
 from datetime import datetime, timedelta
-from io import BytesIO
 
 cart_bp = Blueprint('cart', __name__, url_prefix='/shop')
 
 # Inventory lock timeout in minutes
 INVENTORY_LOCK_TIMEOUT = 15
 
+# Range requests allowed to continue each counted download for free
+DOWNLOAD_RESUMES_PER_DOWNLOAD = 10
+
 
 def get_cart():
     """
@@ -534,18 +537,42 @@ def checkout_success():
     return render_template('shop/checkout_success.html', order_id=order_id)
 
 
+def _resumes_download(download_token, file_media, user_id, ip_hash):
+    """
+    Whether this request continues a download this client already had counted.
+    
+    Only a single satisfiable range past the first byte qualifies, served
+    as a 206 (an If-Range that no longer matches would get the whole file).
+    The client (user, else IP) needs a counted download of this token, and
+    each counted download covers DOWNLOAD_RESUMES_PER_DOWNLOAD resumes.
+    """
+    if request.range is None or not file_media.size or datetime.utcnow() > download_token.expires_at:
+        return False
+    span = request.range.range_for_length(file_media.size)
+    if span is None or span[0] == 0:
+        return False
+    if request.if_range.etag is not None and request.if_range.etag != file_media.checksum:
+        return False
+    if request.if_range.date is not None:
+        return False
+    
+    if not user_id and not ip_hash:
+        return False
+    client = DownloadLog.user_id == user_id if user_id else DownloadLog.ip_hash == ip_hash
+    logs = DownloadLog.query.filter(DownloadLog.download_token_id == download_token.id, client)
+    counted = logs.filter(DownloadLog.resumed.is_not(True)).count()
+    resumed = logs.filter(DownloadLog.resumed.is_(True)).count()
+    return resumed < counted * DOWNLOAD_RESUMES_PER_DOWNLOAD
+
+
 @cart_bp.route('/download/<token>')
 def download_file(token):
     """Serve digital download with token verification and logging."""
     download_token = DownloadToken.query.filter_by(token=token).first_or_404()
     
-    # Check validity
-    if not download_token.is_valid():
-        if datetime.utcnow() > download_token.expires_at:
-            flash('This download link has expired.', 'danger')
-        else:
-            flash('Download limit reached.', 'danger')
-        return redirect(url_for('shop.index'))
+    # Multi-range requests are not served (werkzeug would send the whole file)
+    if ',' in request.headers.get('Range', ''):
+        abort(416)
     
     # Get the product file
     order_item = download_token.order_item
@@ -555,31 +582,48 @@ def download_file(token):
         flash('This product does not have a downloadable file.', 'danger')
         return redirect(url_for('shop.index'))
     
-    # Log the download attempt
+    # Serve the file
+    from app.models import Media
+    file_media = Media.query.get(product.file_id)
+    if not file_media:
+        flash('File not found.', 'danger')
+        return redirect(url_for('shop.index'))
+    
     ip_hash = hashlib.sha256(request.remote_addr.encode()).hexdigest() if request.remote_addr else None
+    user_id = current_user.id if current_user.is_authenticated else None
+    resuming = _resumes_download(download_token, file_media, user_id, ip_hash)
+    
+    # Check validity
+    if not resuming and not download_token.is_valid():
+        if datetime.utcnow() > download_token.expires_at:
+            flash('This download link has expired.', 'danger')
+        else:
+            flash('Download limit reached.', 'danger')
+        return redirect(url_for('shop.index'))
+    
+    # Log the download attempt, resumed or not
     download_log = DownloadLog(
         download_token_id=download_token.id,
-        user_id=current_user.id if current_user.is_authenticated else None,
+        user_id=user_id,
         ip_hash=ip_hash,
-        user_agent=request.user_agent.string[:200] if request.user_agent else None
+        user_agent=request.user_agent.string[:200] if request.user_agent else None,
+        resumed=resuming
     )
     db.session.add(download_log)
     
-    # Increment download count
-    download_token.use()
-    
-    # Serve the file
-    from app.models import Media
-    file_media = Media.query.get(product.file_id)
-    if not file_media:
-        flash('File not found.', 'danger')
-        return redirect(url_for('shop.index'))
+    if resuming:
+        db.session.commit()
+    else:
+        # Increment download count
+        download_token.use()
     
-    return send_file(
-        BytesIO(file_media.data),
+    return send_blob(
+        file_media.checksum,
+        load_data=lambda: file_media.data,
         mimetype=file_media.mimetype,
         as_attachment=True,
-        download_name=file_media.filename
+        download_name=file_media.filename,
+        private=True
     )
 
 
@@ -1,17 +1,30 @@
-from flask import Blueprint, send_file, abort, Response
+from flask import Blueprint, abort
 from app.models import Media
-from io import BytesIO
+from app.modules.blob_store import send_blob
+from app.modules.image_variants import ensure_variant, variant_mimetype
 
 media_bp = Blueprint('media', __name__)
 
 @media_bp.route('/media/<int:media_id>')
 def serve_media(media_id):
+    # Media.data is deferred: a revalidation is answered without loading it
     media = Media.query.get_or_404(media_id)
     
-    return send_file(
-        BytesIO(media.data),
+    return send_blob(
+        media.checksum,
+        load_data=lambda: media.data,
         mimetype=media.mimetype,
         as_attachment=False,
         download_name=media.filename,
-        etag=media.checksum
+        etag=f'media-{media.id}',
+        last_modified=media.uploaded_at
     )
+
+
+@media_bp.route('/media/variants/<checksum>/<int:width>.<fmt>')
+def serve_variant(checksum, width, fmt):
+    """A responsive variant of an image, generated on first request if missing."""
+    variant = ensure_variant(checksum, width, fmt)
+    if variant is None:
+        abort(404)
+    return send_blob(variant.checksum, mimetype=variant_mimetype(fmt), immutable=True)
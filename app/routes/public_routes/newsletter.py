@@ -16,13 +16,13 @@ def index():
     form = CSRFTokenForm()
     
     # Status color mapping
-    status_colors = {'sent': 'success', 'queued': 'warning', 'draft': 'secondary'}
+    status_colors = {'sent': 'success', 'sending': 'info', 'queued': 'warning', 'draft': 'secondary'}
     
     # Serialize for AdminDataTable
     newsletters_json = json.dumps([{
         'id': n.id,
         'subject': n.subject,
-        'status': f'<span class="badge bg-{status_colors.get(n.status, "secondary")}">{n.status}</span>',
+        'status': f'<span class="badge bg-{status_colors.get(n.status, "secondary")}">{n.status}</span>' + (f' <small class="text-muted">{n.delivered_count or 0} delivered</small>' if n.status == 'sending' else ''),
         'tags': ', '.join(n.recipient_tags) if n.recipient_tags else '-',
         'created_at': n.created_at.strftime('%Y-%m-%d') if n.created_at else '-',
         'actions': (
@@ -1,7 +1,11 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app, jsonify
 from flask_login import current_user
 from app.models import Product, Order, OrderItem, Category, Wishlist, db
-from sqlalchemy import or_, func
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from app.modules.blob_store import blob_version
+from app.modules.image_variants import image_srcset
+from app.modules.product_search import ProductSearch
 import stripe
 
 shop_bp = Blueprint('shop', __name__, url_prefix='/shop')
@@ -13,86 +17,54 @@ shop_bp = Blueprint('shop', __name__, url_prefix='/shop')
 
 @shop_bp.route('/api/products')
 def api_products():
-    """Get paginated products with filtering and sorting for the React storefront."""
+    """
+    Get paginated products with filtering, sorting and facet counts for the React storefront.
+
+    Attribute filters are repeated `attr=<name>:<value>` parameters.
+    """
     try:
         # Pagination
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 12, type=int), 50)
         
         # Filters
-        search = request.args.get('search', '').strip()
-        category_id = request.args.get('category', type=int)
-        min_price = request.args.get('min_price', type=int)
-        max_price = request.args.get('max_price', type=int)
-        product_type = request.args.get('type')  # 'digital' or 'physical'
-        
-        # Sorting
-        sort = request.args.get('sort', 'newest')
-        
-        # Build query
-        query = Product.query
-        
-        # Search filter
-        if search:
-            query = query.filter(
-                or_(
-                    Product.name.ilike(f'%{search}%'),
-                    Product.description.ilike(f'%{search}%')
-                )
-            )
-        
-        # Category filter
-        if category_id:
-            query = query.filter(Product.category_id == category_id)
-        
-        # Price filters
-        if min_price:
-            query = query.filter(Product.price >= min_price)
-        if max_price:
-            query = query.filter(Product.price <= max_price)
-        
-        # Product type filter
-        if product_type == 'digital':
-            query = query.filter(Product.is_digital == True)
-        elif product_type == 'physical':
-            query = query.filter(Product.is_digital == False)
-        
-        # Sorting
-        if sort == 'newest':
-            query = query.order_by(Product.created_at.desc())
-        elif sort == 'price_low':
-            query = query.order_by(Product.price.asc())
-        elif sort == 'price_high':
-            query = query.order_by(Product.price.desc())
-        elif sort == 'popular':
-            query = query.order_by(Product.created_at.desc())  # TODO: Add popularity tracking
-        elif sort == 'rating':
-            query = query.order_by(Product.created_at.desc())  # TODO: Add rating
-        else:
-            query = query.order_by(Product.created_at.desc())
+        attributes = {}
+        for param in request.args.getlist('attr'):
+            name, _, value = param.partition(':')
+            if name and value:
+                attributes.setdefault(name, []).append(value)
+        search = ProductSearch(
+            text=request.args.get('search', '').strip(),
+            category_id=request.args.get('category', type=int),
+            min_price=request.args.get('min_price', type=int),
+            max_price=request.args.get('max_price', type=int),
+            product_type=request.args.get('type'),  # 'digital' or 'physical'
+            attributes=attributes,
+            sort=request.args.get('sort')
+        )
         
-        # Paginate
-        paginated = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Category and image metadata are joined in; Media.data is deferred
+        paginated = search.paginate(page=page, per_page=per_page)
         
         # Check wishlist status for authenticated users
         wishlist_product_ids = set()
-        if current_user.is_authenticated:
-            wishlist_items = Wishlist.query.filter_by(user_id=current_user.id).all()
+        if current_user.is_authenticated and paginated.items:
+            wishlist_items = Wishlist.query.filter(
+                Wishlist.user_id == current_user.id,
+                Wishlist.product_id.in_([p.id for p in paginated.items])
+            ).all()
             wishlist_product_ids = {item.product_id for item in wishlist_items}
         
         # Serialize products
         products = []
         for product in paginated.items:
-            # Get category name
-            category_name = None
-            if product.category_id:
-                category = Category.query.get(product.category_id)
-                category_name = category.name if category else None
-            
-            # Get image URL
+            # Get image URL, plus responsive variants for blob-stored images
             image_url = None
+            image_srcset_value = None
             if product.media_id:
-                image_url = url_for('media_bp.serve_media', media_id=product.media_id)
+                checksum = product.image.checksum if product.image else None
+                image_url = url_for('media.serve_media', media_id=product.media_id, v=blob_version(checksum))
+                image_srcset_value = image_srcset(checksum) or None
             
             products.append({
                 'id': product.id,
@@ -103,10 +75,12 @@ def api_products():
                 'inventory_count': product.inventory_count,
                 'is_digital': product.is_digital,
                 'category_id': product.category_id,
-                'category_name': category_name,
+                'category_name': product.category.name if product.category else None,
                 'image_url': image_url,
-                'rating': 4.5,  # TODO: Calculate from reviews
-                'reviews_count': 0,  # TODO: Get from reviews
+                'image_srcset': image_srcset_value,
+                'rating': round(product.avg_rating or 0, 1),
+                'reviews_count': product.review_count or 0,
+                'units_sold': product.units_sold or 0,
                 'is_new': False,  # TODO: Calculate based on created_at
                 'is_featured': False,  # TODO: Add featured flag
                 'in_wishlist': product.id in wishlist_product_ids
@@ -114,6 +88,8 @@ def api_products():
         
         return jsonify({
             'products': products,
+            'facets': search.facets(),
+            'sort': search.sort,
             'pagination': {
                 'page': paginated.page,
                 'per_page': paginated.per_page,
@@ -205,7 +181,7 @@ def api_related(product_id):
 def index():
     """Shop index page - renders the React ShopStorefront."""
     # Get initial data for server-side rendering / SEO
-    products = Product.query.order_by(Product.created_at.desc()).limit(12).all()
+    products = Product.query.options(joinedload(Product.image)).order_by(Product.created_at.desc()).limit(12).all()
     categories = Category.query.order_by(Category.display_order).all()
     return render_template('shop/index.html', products=products, categories=categories)
 
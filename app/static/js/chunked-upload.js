@@ -0,0 +1,172 @@
+/**
+ * Resumable Chunked Upload Client
+ * Sends large files to the media library in chunks (see app/modules/uploads.py)
+ *
+ * Usage:
+ *   <input type="file" multiple
+ *          data-chunked-upload="{{ url_for('media_admin.create_upload') }}"
+ *          data-progress="#upload-progress">
+ *   <progress id="upload-progress" max="100" value="0" hidden></progress>
+ *
+ * Selected files are uploaded as soon as they are picked. The input fires
+ * `chunked-upload:progress`, `chunked-upload:complete` (detail.media) and
+ * `chunked-upload:error` events. A dropped connection is retried from the
+ * offset the server committed, and an upload interrupted by a page reload
+ * resumes when the same file is picked again.
+ */
+
+class ChunkedUploader {
+    constructor(createUrl, options = {}) {
+        this.createUrl = createUrl;
+        this.maxRetries = options.maxRetries ?? 5;
+        this.retryDelay = options.retryDelay ?? 1000;
+        this.onProgress = options.onProgress || (() => {});
+        this.csrfToken = options.csrfToken ||
+            document.querySelector('meta[name="csrf-token"]')?.getAttribute('content') || '';
+    }
+
+    /**
+     * Upload one file; resolves with the created media ({id, filename, mimetype, size, url})
+     */
+    async upload(file) {
+        const key = this.storageKey(file);
+        let status = await this.resume(key);
+        if (!status) {
+            status = await this.request('POST', this.createUrl, {
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({
+                    filename: file.name,
+                    size: file.size,
+                    mimetype: file.type || 'application/octet-stream'
+                })
+            });
+            localStorage.setItem(key, status.url);
+        }
+
+        let offset = status.offset;
+        let retries = 0;
+        this.onProgress(offset, file.size);
+        while (true) {
+            const chunk = file.slice(offset, offset + status.chunk_size);
+            let response;
+            try {
+                response = await fetch(status.url, {
+                    method: 'PUT',
+                    credentials: 'same-origin',
+                    headers: {
+                        'Content-Type': 'application/octet-stream',
+                        'Upload-Offset': String(offset),
+                        'X-CSRFToken': this.csrfToken
+                    },
+                    body: chunk
+                });
+            } catch (error) {
+                // Connection dropped: ask the server how far it got, then carry on
+                if (++retries > this.maxRetries) {
+                    throw error;
+                }
+                await this.sleep(this.retryDelay * 2 ** (retries - 1));
+                offset = (await this.request('GET', status.url)).offset;
+                continue;
+            }
+
+            const data = await response.json().catch(() => ({}));
+            if (response.status === 409 && data.offset !== undefined) {
+                offset = data.offset;  // The server committed a different offset
+                continue;
+            }
+            if (!response.ok) {
+                localStorage.removeItem(key);
+                throw new Error(data.error || `Upload failed (${response.status})`);
+            }
+            retries = 0;
+            if (data.complete) {
+                localStorage.removeItem(key);
+                this.onProgress(file.size, file.size);
+                return data.media;
+            }
+            offset = data.offset;
+            this.onProgress(offset, file.size);
+        }
+    }
+
+    /**
+     * Status of an unfinished upload of the same file, or null
+     */
+    async resume(key) {
+        const url = localStorage.getItem(key);
+        if (!url) {
+            return null;
+        }
+        try {
+            return await this.request('GET', url);
+        } catch (error) {
+            localStorage.removeItem(key);  // Expired, purged or finished elsewhere
+            return null;
+        }
+    }
+
+    async request(method, url, options = {}) {
+        const response = await fetch(url, {
+            method,
+            credentials: 'same-origin',
+            ...options,
+            headers: {'X-CSRFToken': this.csrfToken, ...(options.headers || {})}
+        });
+        const data = await response.json().catch(() => ({}));
+        if (!response.ok) {
+            throw new Error(data.error || `Upload failed (${response.status})`);
+        }
+        return data;
+    }
+
+    storageKey(file) {
+        return `chunked-upload:${this.createUrl}:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+}
+
+/**
+ * Wire up every <input type="file" data-chunked-upload="...">
+ */
+function initChunkedUploads(root = document) {
+    root.querySelectorAll('input[type="file"][data-chunked-upload]').forEach(input => {
+        const progress = input.dataset.progress ? document.querySelector(input.dataset.progress) : null;
+
+        input.addEventListener('change', async () => {
+            const files = Array.from(input.files);
+            const total = files.reduce((sum, file) => sum + file.size, 0) || 1;
+            let done = 0;
+
+            const uploader = new ChunkedUploader(input.dataset.chunkedUpload, {
+                onProgress: (sent, size) => {
+                    const percent = Math.round((done + sent) / total * 100);
+                    if (progress) {
+                        progress.hidden = false;
+                        progress.value = percent;
+                    }
+                    input.dispatchEvent(new CustomEvent('chunked-upload:progress', {detail: {percent}}));
+                }
+            });
+
+            input.disabled = true;
+            for (const file of files) {
+                try {
+                    const media = await uploader.upload(file);
+                    input.dispatchEvent(new CustomEvent('chunked-upload:complete', {detail: {file, media}}));
+                } catch (error) {
+                    console.error(`Upload of ${file.name} failed:`, error);
+                    input.dispatchEvent(new CustomEvent('chunked-upload:error', {detail: {file, error}}));
+                }
+                done += file.size;
+            }
+            input.disabled = false;
+            input.value = '';
+        });
+    });
+}
+
+document.addEventListener('DOMContentLoaded', () => initChunkedUploads());
@@ -40,6 +40,7 @@ interface Product {
     category_id: number | null
     category_name: string | null
     image_url: string | null
+    image_srcset?: string | null
     rating: number
     reviews_count: number
     is_new: boolean
@@ -73,6 +74,23 @@ interface ShopStorefrontProps {
     heroSubtitle?: string
 }
 
+// =============================================================================
+// ProductImage Component
+// =============================================================================
+
+/** Rendered width of a grid card image, for picking a srcset candidate */
+const GRID_IMAGE_SIZES = '(min-width: 1200px) 25vw, (min-width: 768px) 33vw, 50vw'
+
+/** Product image that prefers server-generated WebP width variants when available */
+const ProductImage: React.FC<{ product: Product; sizes: string }> = ({ product, sizes }) => (
+    <picture style={{ display: 'contents' }}>
+        {product.image_srcset && (
+            <source type="image/webp" srcSet={product.image_srcset} sizes={sizes} />
+        )}
+        <img src={product.image_url ?? undefined} alt={product.name} loading="lazy" decoding="async" />
+    </picture>
+)
+
 // =============================================================================
 // ProductCard Component
 // =============================================================================
@@ -122,7 +140,7 @@ const ProductCard: React.FC<ProductCardProps> = ({
             <div className="shop-product-row">
                 <a href={productUrl} className="shop-product-row-image">
                     {product.image_url ? (
-                        <img src={product.image_url} alt={product.name} />
+                        <ProductImage product={product} sizes="100px" />
                     ) : (
                         <div className="shop-product-placeholder">
                             <Package size={32} />
@@ -199,7 +217,7 @@ const ProductCard: React.FC<ProductCardProps> = ({
             {/* Image */}
             <a href={productUrl} className="shop-product-image">
                 {product.image_url ? (
-                    <img src={product.image_url} alt={product.name} loading="lazy" />
+                    <ProductImage product={product} sizes={GRID_IMAGE_SIZES} />
                 ) : (
                     <div className="shop-product-placeholder">
                         <Package size={48} />
@@ -333,7 +351,7 @@ export const ShopStorefront: React.FC<ShopStorefrontProps> = ({
     const [loading, setLoading] = useState(!initialProducts.length)
     const [searchQuery, setSearchQuery] = useState('')
     const [selectedCategory, setSelectedCategory] = useState<number | null>(null)
-    const [sortBy, setSortBy] = useState<string>('newest')
+    const [sortBy, setSortBy] = useState<string>('relevance')
     const [viewMode, setViewMode] = useState<'grid' | 'list'>('grid')
     const [page, setPage] = useState(1)
     const [totalPages, setTotalPages] = useState(1)
@@ -508,6 +526,7 @@ export const ShopStorefront: React.FC<ShopStorefrontProps> = ({
                                         setPage(1)
                                     }}
                                 >
+                                    <option value="relevance">Best Match</option>
                                     <option value="newest">Newest</option>
                                     <option value="price_low">Price: Low to High</option>
                                     <option value="price_high">Price: High to Low</option>
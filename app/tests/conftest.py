@@ -19,6 +19,7 @@ def app():
     """Create application for testing."""
     from app import create_app
     from app.database import db
+    from app.modules.analytics_ingest import stop_analytics_ingest
     
     # Create a temporary database
     db_fd, db_path = tempfile.mkstemp()
@@ -40,6 +41,7 @@ def app():
         
         yield app
         
+        stop_analytics_ingest(app)
         db.session.remove()
         db.drop_all()
     
@@ -47,6 +49,32 @@ def app():
     os.unlink(db_path)
 
 
+@pytest.fixture(scope='function')
+def file_app(monkeypatch):
+    """Create a fresh application backed by a file database so threads share it."""
+    from app import create_app
+    from app.database import db
+    from app.modules.analytics_ingest import stop_analytics_ingest
+
+    db_fd, db_path = tempfile.mkstemp(suffix='.sqlite')
+    # create_app() reads these from the environment, so point them here first
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{db_path}')
+    monkeypatch.setenv('SECRET_KEY', 'test-secret-key-for-testing-only')
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        stop_analytics_ingest(app)
+        db.session.remove()
+        db.drop_all()
+
+    os.close(db_fd)
+    os.unlink(db_path)
+
+
 @pytest.fixture(scope='function')
 def client(app):
     """Create test client for each test."""
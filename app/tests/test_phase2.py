@@ -235,6 +235,209 @@ class TestAvailabilityService(unittest.TestCase):
         result = get_estimator_availability(self.estimator.id, date(2024, 12, 2))
         self.assertEqual(len(result), 0)
 
+    
+    def test_slots_avoid_bookings_and_buffer(self):
+        """Test slot generation around an existing appointment."""
+        from app.modules.availability_service import get_available_slots, check_slot_available
+        
+        db.session.add(Availability(
+            estimator_id=self.estimator.id, day_of_week=0,
+            start_time=time(9, 0), end_time=time(13, 0)
+        ))
+        db.session.add(Appointment(
+            first_name='Booked', last_name='Client', phone='555-0100',
+            email='booked@example.com', estimator_id=self.estimator.id,
+            preferred_date_time=datetime(2024, 12, 2, 11, 0), status='Confirmed'
+        ))
+        db.session.commit()
+        
+        slots = get_available_slots(self.estimator.id, date(2024, 12, 2))
+        # 60 min appointment at 11:00 plus 30 min buffer keeps 10:30-12:30 busy
+        self.assertEqual([s.time() for s in slots], [time(9, 0), time(9, 30)])
+        
+        self.assertEqual(check_slot_available(self.estimator.id, datetime(2024, 12, 2, 9, 0)), (True, None))
+        self.assertFalse(check_slot_available(self.estimator.id, datetime(2024, 12, 2, 12, 0))[0])
+        self.assertEqual(
+            check_slot_available(self.estimator.id, datetime(2024, 12, 2, 12, 30))[1],
+            "Requested time is outside available hours"
+        )
+    
+    def test_slot_range_constant_queries(self):
+        """Test a month of slots costs the same queries as a single day."""
+        from sqlalchemy import event
+        from app.modules.availability_service import get_available_slots_range
+        
+        for day_of_week in range(5):
+            db.session.add(Availability(
+                estimator_id=self.estimator.id, day_of_week=day_of_week,
+                start_time=time(9, 0), end_time=time(17, 0)
+            ))
+        db.session.add(AvailabilityException(
+            estimator_id=self.estimator.id, date=date(2024, 12, 3), is_blocked=True
+        ))
+        db.session.add(Appointment(
+            first_name='Booked', last_name='Client', phone='555-0100',
+            email='booked@example.com', estimator_id=self.estimator.id,
+            preferred_date_time=datetime(2024, 12, 4, 9, 0), status='Confirmed'
+        ))
+        db.session.commit()
+        estimator_id = self.estimator.id
+        
+        statements = []
+        
+        def count(*args):
+            statements.append(args[2])
+        
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            get_available_slots_range(estimator_id, date(2024, 12, 2), 1)
+            day_queries = len(statements)
+            del statements[:]
+            month = get_available_slots_range(estimator_id, date(2024, 12, 2), 31)
+            month_queries = len(statements)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        
+        self.assertEqual(month_queries, day_queries)
+        self.assertEqual(len(month), 31)
+        self.assertEqual(len(month[date(2024, 12, 2)]), 15)  # 9:00 .. 16:00 every 30 min
+        self.assertEqual(month[date(2024, 12, 3)], [])  # Blocked
+        self.assertEqual(month[date(2024, 12, 4)][0].time(), time(10, 30))
+        self.assertEqual(month[date(2024, 12, 7)], [])  # Saturday
+
+
+
+class TestSlotCache(unittest.TestCase):
+    """Test the write-invalidated booking slot cache."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app()
+        cls.app.config['TESTING'] = True
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+        db.create_all()
+    
+    @classmethod
+    def tearDownClass(cls):
+        db.session.remove()
+        cls.app_context.pop()
+    
+    def setUp(self):
+        from flask_caching import Cache
+        
+        self.cache = Cache(self.app, config={'CACHE_TYPE': 'SimpleCache'})
+        self.cache_patch = patch('app.modules.slot_cache.cache', self.cache)
+        self.cache_patch.start()
+        
+        self.estimator = Estimator(name='Cached Estimator')
+        db.session.add(self.estimator)
+        db.session.commit()
+        self.estimator_id = self.estimator.id
+        db.session.add(Availability(
+            estimator_id=self.estimator_id, day_of_week=0,
+            start_time=time(9, 0), end_time=time(12, 0)
+        ))
+        db.session.commit()
+    
+    def tearDown(self):
+        self.cache_patch.stop()
+        db.session.rollback()
+        Availability.query.delete()
+        AvailabilityException.query.delete()
+        Appointment.query.delete()
+        Estimator.query.delete()
+        db.session.commit()
+    
+    def _slots(self, day=date(2024, 12, 2)):
+        from app.modules.availability_service import get_cached_slots_range
+        return [s.time() for s in get_cached_slots_range(self.estimator_id, day, 1)[day]]
+    
+    def _count_queries(self, func):
+        from sqlalchemy import event
+        
+        statements = []
+        
+        def count(*args):
+            statements.append(args[2])
+        
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            result = func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return result, len(statements)
+    
+    def test_hit_costs_one_query(self):
+        """Test a cached day is served after a single version lookup."""
+        from app.modules.slot_cache import slot_cache_stats
+        
+        first = self._slots()
+        hits = slot_cache_stats.snapshot()['hits']
+        second, queries = self._count_queries(self._slots)
+        
+        self.assertEqual(first, second)
+        self.assertEqual(len(first), 5)  # 9:00 .. 11:00 every 30 min
+        self.assertEqual(queries, 1)
+        self.assertEqual(slot_cache_stats.snapshot()['hits'], hits + 1)
+    
+    def test_booking_invalidates(self):
+        """Test committing a booking changes the next answer."""
+        from app.modules.slot_cache import slot_cache_stats
+        
+        self.assertIn(time(9, 0), self._slots())
+        before = slot_cache_stats.snapshot()['invalidations'].get('Appointment', 0)
+        
+        db.session.add(Appointment(
+            first_name='New', last_name='Booking', phone='555-0101',
+            email='new@example.com', estimator_id=self.estimator_id,
+            preferred_date_time=datetime(2024, 12, 2, 9, 0), status='New'
+        ))
+        db.session.commit()
+        
+        self.assertEqual(self._slots(), [time(10, 30), time(11, 0)])  # 9:00-10:00 plus 30 min buffer
+        self.assertEqual(slot_cache_stats.snapshot()['invalidations']['Appointment'], before + 1)
+    
+    def test_invalidation_is_scoped(self):
+        """Test writes only invalidate the estimator-days they touch."""
+        self._slots(date(2024, 12, 2))
+        self._slots(date(2024, 12, 9))
+        
+        appointment = Appointment(
+            first_name='Other', last_name='Day', phone='555-0102',
+            email='other@example.com', estimator_id=self.estimator_id,
+            preferred_date_time=datetime(2024, 12, 9, 9, 0), status='New'
+        )
+        db.session.add(appointment)
+        db.session.commit()
+        
+        _, queries = self._count_queries(lambda: self._slots(date(2024, 12, 2)))
+        self.assertEqual(queries, 1)
+        _, queries = self._count_queries(lambda: self._slots(date(2024, 12, 9)))
+        self.assertGreater(queries, 1)
+        
+        # Irrelevant columns don't invalidate
+        appointment.notes = 'Bring plans'
+        db.session.commit()
+        _, queries = self._count_queries(lambda: self._slots(date(2024, 12, 9)))
+        self.assertEqual(queries, 1)
+        
+        # Cancelling frees the slot again
+        appointment.status = 'Cancelled'
+        db.session.commit()
+        self.assertEqual(len(self._slots(date(2024, 12, 9))), 5)
+    
+    def test_schedule_change_invalidates_every_day(self):
+        """Test editing the weekly schedule invalidates all of the estimator's days."""
+        self.assertEqual(len(self._slots()), 5)
+        
+        availability = Availability.query.filter_by(estimator_id=self.estimator_id).first()
+        availability.end_time = time(10, 0)
+        db.session.commit()
+        
+        self.assertEqual(self._slots(), [time(9, 0)])
+
 
 if __name__ == '__main__':
     unittest.main()
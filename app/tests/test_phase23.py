@@ -141,6 +141,82 @@ class TestPerformanceModule:
         assert stats['total_time'] == 0.05
         assert len(stats['queries']) == 1
     
+    def test_fingerprint_strips_literals(self, app):
+        """Statements differing only in literals share a fingerprint."""
+        from app.modules.performance import fingerprint
+        
+        assert fingerprint("SELECT * FROM product WHERE id = 7 AND name = 'x'") == \
+            fingerprint("SELECT * FROM product WHERE id = 12 AND name = 'it''s'")
+        assert fingerprint('SELECT a FROM t WHERE id IN (?, ?, ?)') == 'SELECT a FROM t WHERE id IN (?)'
+        assert fingerprint('SELECT a FROM t WHERE id = %(id_1)s LIMIT :limit') == \
+            'SELECT a FROM t WHERE id = ? LIMIT ?'
+        assert fingerprint('SELECT table1.col_2 FROM table1') == 'SELECT table1.col_2 FROM table1'
+    
+    def test_profiles_are_per_thread(self, app):
+        """Concurrent profiles only see their own queries."""
+        import threading
+        from app.modules.performance import get_query_profiler
+        
+        profiler = get_query_profiler()
+        barrier = threading.Barrier(4)
+        counts = {}
+        
+        def work(n):
+            profiler.start()
+            barrier.wait()
+            for _ in range(n):
+                profiler.record('SELECT 1', 0.001)
+            barrier.wait()
+            counts[n] = profiler.stop()['count']
+        
+        threads = [threading.Thread(target=work, args=(n,)) for n in (1, 2, 3, 4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert counts == {1: 1, 2: 2, 3: 3, 4: 4}
+        assert not profiler.enabled
+    
+    def test_repeated_statement_is_flagged_with_origin(self, app):
+        """A statement run in a loop is reported as N+1 with the calling line."""
+        from sqlalchemy import text
+        from app.database import db
+        from app.modules.performance import get_query_profiler
+        
+        profiler = get_query_profiler()
+        with app.app_context():
+            profiler.start(repeat_threshold=3)
+            for i in range(5):
+                db.session.execute(text('SELECT :value'), {'value': i}).scalar()
+            stats = profiler.stop()
+        
+        [repeated] = stats['repeated']
+        assert repeated['fingerprint'] == 'SELECT ?'
+        assert repeated['count'] == 5
+        assert repeated['origin'].startswith('app/tests/test_phase23.py:')
+    
+    def test_sampled_request_gets_query_headers_and_budget_report(self, app, client):
+        """Profiled responses carry query headers and feed the budget report."""
+        from app.modules.performance import query_budget_report
+        
+        query_budget_report.reset()
+        app.config['QUERY_PROFILE_SAMPLE_RATE'] = 1.0
+        app.config['QUERY_BUDGET'] = 0
+        try:
+            response = client.get('/live')
+        finally:
+            app.config['QUERY_PROFILE_SAMPLE_RATE'] = 0.0
+            app.config['QUERY_BUDGET'] = 20
+        
+        assert 'X-Query-Count' in response.headers
+        assert response.headers['X-Query-Time'].endswith('s')
+        [row] = [r for r in query_budget_report.report() if r['endpoint'] == 'observability.live']
+        assert row['requests'] == 1
+        assert row['budget'] == 0
+        
+        assert 'X-Query-Count' not in client.get('/live').headers
+    
     def test_timed_decorator(self, app):
         """Test timed decorator."""
         import time
@@ -155,6 +231,283 @@ class TestPerformanceModule:
         assert result == "done"
 
 
+class TestCpuProfiler:
+    """Test the sampling CPU profiler."""
+    
+    def _profiled_app(self, tmp_path, monkeypatch, **config):
+        import time
+        from flask import Flask
+        from app.modules.cpu_profiler import init_cpu_profiler, sampler
+        
+        # The sampler is process-wide; put its interval back afterwards
+        monkeypatch.setattr(sampler, 'interval', sampler.interval)
+        app = Flask(__name__)
+        app.config.update(CPU_PROFILE_PATH=str(tmp_path), CPU_PROFILE_INTERVAL_MS=1,
+                          CPU_PROFILE_SLOW_MS=100, CPU_PROFILE_TOKEN='secret')
+        app.config.update(config)
+        
+        def spin(seconds):
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                pass
+        
+        @app.route('/busy')
+        def busy():
+            spin(0.15)
+            return 'ok'
+        
+        @app.route('/quick')
+        def quick():
+            spin(0.02)
+            return 'ok'
+        
+        init_cpu_profiler(app)
+        return app
+    
+    def test_slow_request_is_captured(self, tmp_path, monkeypatch):
+        """Requests over CPU_PROFILE_SLOW_MS keep their collapsed stacks."""
+        from app.modules.cpu_profiler import list_profiles, load_profile, parse_folded
+        
+        client = self._profiled_app(tmp_path, monkeypatch).test_client()
+        response = client.get('/busy')
+        assert 'X-Profile-Id' in response.headers
+        assert 'X-Profile-Id' not in client.get('/quick').headers
+        
+        [meta] = list_profiles(str(tmp_path))
+        assert meta['endpoint'] == 'busy'
+        assert meta['trigger'] == 'slow'
+        stacks = parse_folded(load_profile(str(tmp_path), meta['id'])[1])
+        assert sum(stacks.values()) == meta['samples'] > 10
+        spinning = sum(n for stack, n in stacks.items() if 'busy (' in stack and stack.endswith(')'))
+        assert spinning / meta['samples'] > 0.8
+    
+    def test_profile_on_request(self, tmp_path, monkeypatch):
+        """A fast request is captured when asked for with the profile token."""
+        from app.modules.cpu_profiler import list_profiles
+        
+        client = self._profiled_app(tmp_path, monkeypatch, CPU_PROFILE_SLOW_MS=0).test_client()
+        assert 'X-Profile-Id' not in client.get('/quick?_profile=1').headers
+        assert 'X-Profile-Id' not in client.get('/quick', headers={'X-Profile-Token': 'wrong'}).headers
+        response = client.get('/quick', headers={'X-Profile-Token': 'secret'})
+        
+        [meta] = list_profiles(str(tmp_path))
+        assert response.headers['X-Profile-Id'] == meta['id']
+        assert meta['trigger'] == 'request'
+    
+    def test_flame_layout(self):
+        """Collapsed stacks become nested rectangles sized by sample share."""
+        from app.modules.cpu_profiler import flame_layout
+        
+        rects, depth = flame_layout({'main;a;x': 2, 'main;b': 1, 'main;a': 1})
+        by_name = {(r['name'], r['depth']): r for r in rects}
+        
+        assert depth == 3
+        assert by_name[('main', 0)]['width'] == 1.0
+        assert by_name[('a', 1)]['width'] == 0.75
+        assert by_name[('b', 1)]['x'] == 0.75
+        assert by_name[('x', 2)]['x'] == 0.0
+        assert by_name[('x', 2)]['width'] == 0.5
+    
+    def test_admin_pages_render_profiles(self, app, admin_client, tmp_path):
+        """The admin pages list profiles and draw their flamegraphs."""
+        from app.modules.cpu_profiler import save_profile
+        
+        app.config['CPU_PROFILE_PATH'] = str(tmp_path)
+        try:
+            profile_id = save_profile(str(tmp_path), {'wsgi;view;render': 3, 'wsgi;view': 1}, {
+                'endpoint': 'reports.export', 'method': 'GET', 'path': '/admin/reports/export',
+                'status': 200, 'duration_ms': 1500.0, 'trigger': 'slow', 'interval_ms': 10,
+                'captured_at': '2026-01-01T00:00:00+00:00',
+            })
+            listing = admin_client.get('/admin/profiles')
+            graph = admin_client.get(f'/admin/profiles/{profile_id}')
+            folded = admin_client.get(f'/admin/profiles/{profile_id}.folded')
+        finally:
+            app.config.pop('CPU_PROFILE_PATH')
+        
+        assert listing.status_code == 200
+        assert b'/admin/reports/export' in listing.data
+        assert graph.status_code == 200
+        assert b'render' in graph.data
+        assert folded.data.decode().splitlines() == ['wsgi;view 1', 'wsgi;view;render 3']
+        assert admin_client.get('/admin/profiles/missing').status_code == 404
+
+class TestBenchmarks:
+    """Test the seeded benchmark dataset and harness."""
+
+    TINY = dict(users=10, posts=5, products=20, page_views=300, leads=20, messages=120,
+                appointments=40, email_sends=100, span_days=2)
+
+    def _snapshot(self):
+        from app.models import Message, PageView, Product
+        return (
+            [(p.name, p.price) for p in Product.query.order_by(Product.id)],
+            [(v.session_id, v.url, v.timestamp) for v in PageView.query.order_by(PageView.id)],
+            [(m.channel_id, m.user_id, m.content) for m in Message.query.order_by(Message.id)],
+        )
+
+    def test_seed_is_deterministic(self, app):
+        """The same scale and seed produce the same rows."""
+        from app.models import ContactFormSubmission, PageView, Post
+        from app.modules.benchmark_data import current_dataset, seed_dataset
+        from app.modules.search_index import get_index
+
+        with app.app_context():
+            first = seed_dataset('small', seed=7, **self.TINY)
+            snapshot = self._snapshot()
+            assert PageView.query.count() == 300
+            assert ContactFormSubmission.query.count() == 20
+            with app.test_request_context():
+                found = get_index('post').paginate('guide', Post.query.filter(Post.is_published == True))
+                assert found.total == 5
+            assert current_dataset() == {'scale': 'custom', 'seed': 7, 'digest': first['digest']}
+            with pytest.raises(ValueError):
+                seed_dataset('small', seed=7, **self.TINY)
+
+            db.drop_all()
+            db.create_all()
+            second = seed_dataset('small', seed=7, **self.TINY)
+            assert second == first
+            assert self._snapshot() == snapshot
+
+    def test_run_and_compare(self, app):
+        """Scenarios record time, queries and memory; compare flags regressions."""
+        import copy
+        from app.modules.benchmark_data import seed_dataset
+        from app.modules.benchmarks import SCENARIOS, compare, run_benchmarks
+
+        with app.app_context():
+            seed_dataset('small', seed=7, **self.TINY)
+            results = run_benchmarks(iterations=2, warmup=1)
+
+        assert set(results['scenarios']) == set(SCENARIOS)
+        for result in results['scenarios'].values():
+            assert result['queries'] > 0
+            assert result['wall_ms']['min'] <= result['wall_ms']['median'] <= result['wall_ms']['max']
+            assert result['peak_kb'] > 0
+        assert compare(results, results) == []
+
+        baseline = copy.deepcopy(results)
+        baseline['scenarios']['cart_totals']['queries'] -= 1
+        baseline['scenarios']['traffic_metrics']['wall_ms']['median'] /= 10
+        baseline['scenarios']['traffic_metrics']['wall_ms']['median'] -= 5
+        flagged = {(r['scenario'], r['metric']) for r in compare(results, baseline, tolerance=0.5)}
+        assert flagged == {('cart_totals', 'queries'), ('traffic_metrics', 'wall_ms')}
+
+        baseline['dataset']['seed'] = 8
+        with pytest.raises(ValueError):
+            compare(results, baseline)
+
+    def test_poll_messages_scenario_returns_messages(self, app):
+        """The messaging scenario is served as the admin, not refused."""
+        from app.models import Message
+        from app.modules.benchmark_data import seed_dataset
+        from app.modules.benchmarks import SCENARIOS
+
+        with app.app_context():
+            seed_dataset('small', seed=7, **self.TINY)
+            in_channel = Message.query.filter_by(channel_id=1).count()
+            response = SCENARIOS['poll_messages'].prepare(None)()
+            assert response.status_code == 200
+            assert len(response.get_json()) == min(50, in_channel) > 0
+
+    def test_cli_fails_on_regression(self, app, tmp_path):
+        """`flask bench run --baseline` exits non-zero when a scenario regresses."""
+        import json
+
+        runner = app.test_cli_runner()
+        counts = [arg for name, n in self.TINY.items() for arg in ('--count', f'{name}={n}')]
+        result = runner.invoke(args=['bench', 'seed', *counts])
+        assert result.exit_code == 0, result.output
+
+        output = tmp_path / 'results.json'
+        result = runner.invoke(args=['bench', 'run', '--scenario', 'cart_totals',
+                                     '--iterations', '2', '--output', str(output)])
+        assert result.exit_code == 0, result.output
+
+        baseline = json.loads(output.read_text())
+        baseline['scenarios']['cart_totals']['queries'] = 1
+        (tmp_path / 'baseline.json').write_text(json.dumps(baseline))
+        result = runner.invoke(args=['bench', 'run', '--scenario', 'cart_totals', '--iterations', '2',
+                                     '--baseline', str(tmp_path / 'baseline.json')])
+        assert result.exit_code == 1
+        assert 'REGRESSION cart_totals queries' in result.output
+
+class TestLoadTest:
+    """Test the load generator and its Stripe stub."""
+
+    def test_stripe_stub_serves_checkout_sessions(self):
+        """Sessions created through the stripe library can be retrieved by id."""
+        import stripe
+        from app.modules.load_test import StripeStub
+
+        stub = StripeStub().start()
+        saved = stripe.api_base
+        stripe.api_base = stub.url
+        try:
+            created = stripe.checkout.Session.create(
+                api_key='sk_test_stub', mode='payment', client_reference_id='42',
+                success_url='http://localhost/success', line_items=[],
+                metadata={'order': '7'},
+            )
+            fetched = stripe.checkout.Session.retrieve(created.id, api_key='sk_test_stub')
+            assert fetched.client_reference_id == '42'
+            assert fetched.metadata['order'] == '7'
+            with pytest.raises(stripe.error.InvalidRequestError):
+                stripe.checkout.Session.retrieve('cs_missing', api_key='sk_test_stub')
+        finally:
+            stripe.api_base = saved
+            stub.stop()
+
+    def test_stats_summary(self):
+        """Per-step percentiles, error rates and status counts."""
+        from app.modules.load_test import LoadStats
+
+        stats = LoadStats()
+        for ms in range(1, 101):
+            stats.record('view', ms / 1000, 200, True)
+        stats.record('book', 0.05, 409, True)
+        stats.record('book', 0.05, 500, False)
+        stats.journey('shop', True)
+        stats.journey('shop', False)
+        summary = stats.summary(elapsed=2.0)
+
+        view = summary['steps']['view']
+        assert view['latency_ms']['p50'] == 51.0
+        assert view['latency_ms']['p99'] == 99.0
+        assert view['latency_ms']['max'] == 100.0
+        assert view['throughput_rps'] == 50.0
+        assert summary['steps']['book']['error_rate'] == 0.5
+        assert summary['steps']['book']['statuses'] == {'409': 1, '500': 1}
+        assert summary['requests'] == 102 and summary['errors'] == 1
+        assert summary['journeys'] == {'shop': {'completed': 1, 'failed': 1}}
+
+    def test_journeys_against_wsgi_app(self, app):
+        """Every journey runs clean against the seeded dataset in-process."""
+        from app.modules.benchmark_data import seed_dataset
+        from app.modules.load_test import (JOURNEYS, StripeStub, WSGIClient,
+                                           discover_targets, offline_app, run_load_test)
+
+        with app.app_context():
+            seed_dataset('small', seed=7, **TestBenchmarks.TINY)
+            targets = discover_targets()
+        db.session.remove()
+
+        stub = StripeStub().start()
+        try:
+            with offline_app(app, stub.url):
+                for name in JOURNEYS:
+                    summary = run_load_test(lambda: WSGIClient(app), targets, users=2,
+                                            duration=0.2, journeys={name: 1})
+                    assert summary['journeys'][name]['failed'] == 0
+                    assert summary['errors'] == 0, summary['steps']
+                    assert summary['config']['journeys'] == {name: 1}
+        finally:
+            stub.stop()
+
+        assert stub.sessions
+
+
 class TestSelfHostedAssets:
     """Test self-hosted assets for data sovereignty."""
     
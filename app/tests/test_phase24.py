@@ -91,6 +91,15 @@ class TestMetricsEndpoint:
         # Should contain business metrics
         assert 'business_' in content or 'verso_' in content
     
+    def test_metrics_contains_slot_cache(self, client):
+        """Metrics should include booking slot cache hits and invalidations."""
+        response = client.get('/metrics')
+        content = response.data.decode('utf-8')
+        
+        assert 'slot_cache_lookups_total{result="hit"}' in content
+        assert 'slot_cache_hit_ratio' in content
+        assert '# TYPE slot_cache_invalidations_total counter' in content
+    
     def test_metrics_token_protection(self, client, app):
         """Metrics endpoint should be protectable via token."""
         import os
@@ -311,6 +320,103 @@ class TestMetricsCollector:
         assert 'http_requests_total' in output
         assert 'verso_uptime_seconds' in output
 
+    def test_histogram_buckets_are_cumulative(self):
+        """Each observation lands in one bucket; exported buckets accumulate."""
+        from app.modules.metrics_core import MetricsRegistry
+        
+        registry = MetricsRegistry()
+        latency = registry.histogram('latency_seconds', 'Latency', ('path',), buckets=(0.1, 0.5, 1.0))
+        for value in (0.05, 0.1, 0.3, 0.7, 2.0):
+            latency.observe(value, '/a')
+        
+        lines = registry.exposition()
+        assert 'latency_seconds_bucket{path="/a",le="0.1"} 2' in lines
+        assert 'latency_seconds_bucket{path="/a",le="0.5"} 3' in lines
+        assert 'latency_seconds_bucket{path="/a",le="1.0"} 4' in lines
+        assert 'latency_seconds_bucket{path="/a",le="+Inf"} 5' in lines
+        assert 'latency_seconds_count{path="/a"} 5' in lines
+    
+    def test_label_cardinality_is_capped(self):
+        """Label sets beyond max_series are folded into one 'other' series."""
+        from app.modules.metrics_core import MetricsRegistry
+        
+        registry = MetricsRegistry()
+        hits = registry.counter('hits_total', 'Hits', ('path',), max_series=2)
+        for path in ('/a', '/b', '/c', '/d', '/a'):
+            hits.inc(path)
+        
+        assert hits.values(registry.samples()) == {('/a',): 2, ('/b',): 1, ('other',): 2}
+    
+    def test_counts_are_exact_across_threads(self):
+        """Per-thread shards add up, including threads that have exited."""
+        import threading
+        from app.routes.admin_routes.observability import MetricsCollector
+        
+        collector = MetricsCollector()
+        
+        def work():
+            for _ in range(500):
+                collector.record_request('GET', '/items/7', 200, 0.02)
+        
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert collector.get_request_stats()['total'] == 4000
+        assert collector.get_request_stats()['total'] == 4000
+        assert 'http_requests_total{method="GET",path="/items/{id}",status="200"} 4000' in \
+            collector.registry.exposition()
+    
+    @pytest.mark.skipif(not hasattr(__import__('os'), 'fork'), reason='Requires os.fork')
+    def test_multiprocess_mode_sums_worker_files(self, tmp_path):
+        """Any process sharing the directory reports every process's values."""
+        import os
+        from app.routes.admin_routes.observability import MetricsCollector
+        
+        collector = MetricsCollector()
+        collector.enable_multiprocess(str(tmp_path))
+        collector.record_request('GET', '/a', 200, 0.2)
+        
+        # One worker after another, as when gunicorn replaces a worker
+        for _ in range(2):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    collector.record_request('GET', '/a', 500, 0.2)
+                    collector.record_query(0.7)
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+        
+        stats = collector.get_request_stats()
+        assert stats['total'] == 3
+        assert stats['errors'] == 2
+        assert collector.get_db_stats()['slow_queries'] == 2
+        # The second worker took over the slot the first one left
+        assert len(list(tmp_path.glob('metrics_*.db'))) == 2
+
+    def test_multiprocess_mode_closes_exited_threads_shards(self, tmp_path):
+        """Shard files of exited threads are closed but still counted."""
+        import threading
+        from app.routes.admin_routes.observability import MetricsCollector
+        
+        collector = MetricsCollector()
+        collector.enable_multiprocess(str(tmp_path))
+        
+        def work():
+            collector.record_request('GET', '/a', 200, 0.2)
+        
+        for _ in range(5):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        
+        assert collector.get_request_stats()['total'] == 5
+        assert collector.registry._shards == []
+        assert [p.name for p in tmp_path.glob('metrics_*.db')] == ['metrics_0.db']
+
 
 class TestAdminMetricsDashboard:
     """Tests for admin metrics dashboard."""
@@ -457,6 +563,170 @@ class TestAdvancedObservability:
         assert result == 'success'
 
 
+class _LogStub:
+    """Local HTTP server standing in for a log backend."""
+    
+    def __init__(self, status=200, delay=0):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        stub = self
+        self.status = status
+        self.delay = delay
+        self.bodies = []
+        self.received = threading.Event()
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                import gzip
+                import time
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                time.sleep(stub.delay)
+                if stub.status == 200:
+                    assert self.headers['Content-Encoding'] == 'gzip'
+                    stub.bodies.append(gzip.decompress(body))
+                    stub.received.set()
+                self.send_response(stub.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _log_record(message):
+    import logging
+    return logging.LogRecord('app.test', logging.INFO, __file__, 1, message, (), None)
+
+
+class TestLogShipping:
+    """Tests for the background log shipping handlers."""
+    
+    def test_loki_batches_are_gzipped_and_shipped_in_background(self):
+        """Records are sent by the shipper thread as one compressed push."""
+        from app.modules.advanced_observability import LokiHandler
+        
+        stub = _LogStub()
+        handler = LokiHandler(url=stub.url, batch_size=3, flush_interval=60)
+        try:
+            for i in range(3):
+                handler.emit(_log_record(f'event {i}'))
+            assert stub.received.wait(5)
+            handler.close()
+            
+            payload = json.loads(stub.bodies[0])
+            values = payload['streams'][0]['values']
+            assert [json.loads(v[1])['message'] for v in values] == ['event 0', 'event 1', 'event 2']
+            assert handler.stats()['shipped'] == 3
+        finally:
+            handler.close()
+            stub.stop()
+    
+    def test_emit_does_not_wait_for_slow_backend(self):
+        """A slow backend delays the shipper, never the logging thread."""
+        import time
+        from app.modules.advanced_observability import ElasticsearchHandler
+        
+        stub = _LogStub(delay=1)
+        handler = ElasticsearchHandler(url=stub.url, batch_size=1, flush_interval=60)
+        try:
+            started = time.perf_counter()
+            for i in range(50):
+                handler.emit(_log_record(f'event {i}'))
+            assert time.perf_counter() - started < 0.5
+        finally:
+            stub.delay = 0
+            handler.close()
+            stub.stop()
+        
+        lines = b''.join(stub.bodies).decode().splitlines()
+        assert len(lines) == 100
+        assert handler.stats()['shipped'] == 50
+    
+    def test_full_queue_drops_and_counts(self):
+        """Records beyond queue_size are dropped and counted."""
+        from app.modules.advanced_observability import LokiHandler
+        
+        handler = LokiHandler(url='http://127.0.0.1:9', queue_size=5, batch_size=100,
+                              flush_interval=60, max_retries=0)
+        for i in range(8):
+            handler.emit(_log_record(f'event {i}'))
+        
+        assert handler.pending() == 5
+        assert handler.stats()['dropped'] == 3
+        handler.close()
+
+    def test_outcomes_are_recorded_in_metrics_registry(self):
+        """Shipping counters live in the metrics registry; queue depth is read per process."""
+        from app.modules.advanced_observability import CloudWatchHandler
+        from app.routes.admin_routes.observability import metrics_collector
+
+        dropped = metrics_collector.log_shipping['dropped']
+        before = dropped.values(metrics_collector.registry.samples()).get(('cloudwatch',), 0)
+        handler = CloudWatchHandler(log_group='test', queue_size=2, batch_size=100, flush_interval=60)
+        try:
+            for i in range(5):
+                handler.emit(_log_record(f'event {i}'))
+
+            samples = metrics_collector.registry.samples()
+            assert dropped.values(samples)[('cloudwatch',)] - before == 3
+            assert metrics_collector.log_queue_depth.values()[('cloudwatch',)] == 2
+            assert 'log_ship_queue_depth{handler="cloudwatch"} 2' in metrics_collector.registry.exposition()
+        finally:
+            handler._queue.clear()
+            handler.close()
+
+    def test_failed_batches_spool_and_replay(self, tmp_path):
+        """Batches that cannot be sent are spooled, then replayed in order."""
+        from app.modules.advanced_observability import LokiHandler
+        
+        stub = _LogStub(status=503)
+        handler = LokiHandler(url=stub.url, batch_size=2, flush_interval=60,
+                              max_retries=1, retry_backoff=0.01, spool_dir=str(tmp_path))
+        try:
+            for i in range(4):
+                handler._queue.append(_log_record(f'event {i}'))
+            handler.ship()
+            
+            assert handler.stats()['spooled'] == 4
+            assert len(list((tmp_path / 'loki').glob('*.gz'))) == 2
+            
+            stub.status = 200
+            handler._retry_at = 0
+            handler._queue.append(_log_record('event 4'))
+            handler.ship()
+            
+            messages = [json.loads(v[1])['message']
+                        for body in stub.bodies
+                        for v in json.loads(body)['streams'][0]['values']]
+            assert messages == ['event 4', 'event 0', 'event 1', 'event 2', 'event 3']
+            assert handler.stats()['replayed'] == 4
+            assert not list((tmp_path / 'loki').iterdir())
+        finally:
+            handler.close()
+            stub.stop()
+    
+    def test_close_flushes_queued_records(self):
+        """close() sends what is still queued."""
+        from app.modules.advanced_observability import LokiHandler
+        
+        stub = _LogStub()
+        handler = LokiHandler(url=stub.url, batch_size=100, flush_interval=60)
+        handler.emit(_log_record('last words'))
+        handler.close()
+        stub.stop()
+        
+        assert json.loads(stub.bodies[0])['streams'][0]['values'][0][1].count('last words') == 1
+
+
 class TestObservabilityConfigEndpoint:
     """Tests for observability configuration endpoint."""
     
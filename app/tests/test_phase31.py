@@ -0,0 +1,555 @@
+"""
+Phase 31: Task Queue Throughput Tests
+
+Tests for:
+- Atomic task claiming (compare-and-set on SQLite)
+- Lease expiry and reclaiming of abandoned tasks
+- Concurrent claimers never running the same task twice
+"""
+import threading
+import time
+import pytest
+from datetime import datetime, timedelta
+from app.database import db
+from app.models import Task
+
+
+@pytest.fixture
+def app(file_app):
+    """Create application backed by a file database."""
+    return file_app
+
+
+class TestTaskClaiming:
+    """Tests for claim_next_task()."""
+
+    def test_claim_marks_task_processing_with_lease(self, app):
+        """Claiming sets status, owner and lease expiry."""
+        from app.worker import claim_next_task
+
+        with app.app_context():
+            db.session.add(Task(name='test_task', payload={}))
+            db.session.commit()
+
+            task = claim_next_task('worker-a', lease_seconds=60)
+
+            assert task is not None
+            assert task.status == 'processing'
+            assert task.locked_by == 'worker-a'
+            assert task.locked_until > datetime.utcnow()
+
+    def test_claimed_task_not_claimed_again(self, app):
+        """A task with a live lease is invisible to other workers."""
+        from app.worker import claim_next_task
+
+        with app.app_context():
+            db.session.add(Task(name='test_task', payload={}))
+            db.session.commit()
+
+            assert claim_next_task('worker-a') is not None
+            assert claim_next_task('worker-b') is None
+
+    def test_claim_respects_priority(self, app):
+        """Higher priority tasks are claimed first."""
+        from app.worker import claim_next_task
+
+        with app.app_context():
+            db.session.add_all([
+                Task(name='low', priority=-10),
+                Task(name='high', priority=10),
+            ])
+            db.session.commit()
+
+            assert claim_next_task('worker-a').name == 'high'
+            assert claim_next_task('worker-a').name == 'low'
+
+    def test_expired_lease_is_reclaimed(self, app):
+        """A processing task past its lease is picked up by another worker."""
+        from app.worker import claim_next_task
+
+        with app.app_context():
+            task = Task(
+                name='test_task',
+                status='processing',
+                locked_by='dead-worker',
+                locked_until=datetime.utcnow() - timedelta(seconds=1),
+            )
+            db.session.add(task)
+            db.session.commit()
+
+            reclaimed = claim_next_task('worker-b')
+
+            assert reclaimed is not None
+            assert reclaimed.id == task.id
+            assert reclaimed.locked_by == 'worker-b'
+            assert reclaimed.retry_count == 1
+
+    def test_execute_task_releases_lease(self, app):
+        """Completing a task clears the claim."""
+        from app.worker import claim_next_task, execute_task
+
+        with app.app_context():
+            db.session.add(Task(name='test_task', payload={}))
+            db.session.commit()
+
+            task = claim_next_task('worker-a')
+            processed, failed = execute_task(task)
+
+            assert (processed, failed) == (1, 0)
+            assert task.status == 'completed'
+            assert task.locked_by is None
+            assert task.locked_until is None
+
+
+class TestConcurrentClaiming:
+    """Concurrent claimers must partition the queue."""
+
+    def test_each_task_claimed_once(self, app):
+        """Threads racing on the same queue never claim a task twice."""
+        from app.worker import claim_next_task
+
+        with app.app_context():
+            db.session.add_all([Task(name='test_task', payload={}) for _ in range(30)])
+            db.session.commit()
+
+        claimed = []
+        lock = threading.Lock()
+
+        def claimer(worker_id):
+            with app.app_context():
+                while True:
+                    try:
+                        task = claim_next_task(worker_id)
+                    except Exception:
+                        db.session.rollback()  # SQLite busy; try again
+                        continue
+                    if task is None:
+                        break
+                    with lock:
+                        claimed.append(task.id)
+                db.session.remove()
+
+        threads = [threading.Thread(target=claimer, args=(f'worker-{i}',)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=30)
+
+        assert len(claimed) == 30
+        assert len(set(claimed)) == 30
+
+
+class TestBatchClaiming:
+    """Tests for claim_tasks() and batched result write-back."""
+
+    def test_claim_tasks_returns_batch_in_priority_order(self, app):
+        """One claim statement takes up to `limit` tasks."""
+        from app.worker import claim_tasks
+
+        with app.app_context():
+            db.session.add_all([Task(name=f'task-{i}', priority=i) for i in range(5)])
+            db.session.commit()
+
+            claimed = claim_tasks('worker-a', limit=3)
+
+            assert [t.name for t in claimed] == ['task-4', 'task-3', 'task-2']
+            assert all(t.status == 'processing' for t in claimed)
+            assert len(claim_tasks('worker-b', limit=10)) == 2
+
+    def test_record_task_results_writes_batch(self, app):
+        """Completions, failures and heartbeat counters land in one write-back."""
+        from app.worker import claim_tasks, record_task_results
+        from app.models import WorkerHeartbeat
+
+        with app.app_context():
+            db.session.add_all([Task(name='ok'), Task(name='ok'), Task(name='bad')])
+            db.session.commit()
+
+            claimed = claim_tasks('worker-a', limit=3)
+            results = [(t.id, 'boom' if t.name == 'bad' else None) for t in claimed]
+
+            assert record_task_results(results, 'worker-a') == (2, 1)
+
+            statuses = sorted(t.status for t in Task.query.all())
+            assert statuses == ['completed', 'completed', 'pending']
+            failed = Task.query.filter_by(name='bad').first()
+            assert failed.retry_count == 1
+            assert failed.locked_by is None
+
+            heartbeat = WorkerHeartbeat.query.filter_by(worker_id='worker-a').first()
+            assert heartbeat.tasks_processed == 2
+            assert heartbeat.tasks_failed == 1
+
+    def test_record_task_results_skips_lost_leases(self, app):
+        """A worker cannot complete a task that another worker reclaimed."""
+        from app.worker import claim_tasks, record_task_results
+
+        with app.app_context():
+            db.session.add(Task(name='ok'))
+            db.session.commit()
+
+            task = claim_tasks('worker-a')[0]
+            task.locked_by = 'worker-b'
+            db.session.commit()
+
+            record_task_results([(task.id, None)], 'worker-a')
+
+            assert Task.query.get(task.id).status == 'processing'
+
+
+class TestLeaseRenewal:
+    """Tests for keeping leases alive while a worker holds its tasks."""
+
+    def test_handler_outliving_lease_is_not_reclaimed(self, app, monkeypatch):
+        """A handler running past the lease keeps its task, as does the buffered one behind it."""
+        import app.worker as worker
+
+        monkeypatch.setattr(worker, 'TASK_LEASE_SECONDS', 1)
+        stolen = []
+
+        def slow(payload):
+            time.sleep(2)
+            stolen.extend(worker.claim_tasks('worker-b', limit=10))
+
+        def stop(payload):
+            raise KeyboardInterrupt
+
+        monkeypatch.setitem(worker.TASK_HANDLERS, 'slow', slow)
+        monkeypatch.setitem(worker.TASK_HANDLERS, 'stop', stop)
+
+        with app.app_context():
+            db.session.add_all([Task(name='slow', priority=1), Task(name='stop', priority=0)])
+            db.session.commit()
+
+            worker.run_worker()
+
+            assert stolen == []
+            slow_task = Task.query.filter_by(name='slow').first()
+            assert slow_task.status == 'completed'
+            assert slow_task.retry_count == 0
+
+    def test_renew_skips_reclaimed_tasks(self, app):
+        """Only leases still owned by the worker are pushed back."""
+        from app.worker import claim_tasks, renew_leases
+
+        with app.app_context():
+            db.session.add_all([Task(name='a'), Task(name='b')])
+            db.session.commit()
+
+            tasks = claim_tasks('worker-a', limit=2, lease_seconds=1)
+            tasks[1].locked_by = 'worker-b'
+            db.session.commit()
+
+            assert renew_leases('worker-a', [t.id for t in tasks], lease_seconds=600) == 1
+            db.session.expire_all()
+            assert Task.query.get(tasks[0].id).locked_until > datetime.utcnow() + timedelta(seconds=500)
+
+
+class TestTaskWakeup:
+    """Tests for enqueue-driven worker wakeup."""
+
+    def test_task_commit_wakes_local_listener(self, app):
+        """Committing a task signals in-process waiters."""
+        from app.modules.task_wakeup import LocalWakeup
+
+        with app.app_context():
+            wakeup = LocalWakeup()
+            wakeup.wait(0)  # Drain signals from earlier inserts
+
+            assert wakeup.wait(0) is False
+            db.session.add(Task(name='test_task'))
+            db.session.commit()
+            assert wakeup.wait(0.1) is True
+
+    def test_rolled_back_task_does_not_wake(self, app):
+        """Only committed enqueues wake workers."""
+        from app.modules.task_wakeup import LocalWakeup
+
+        with app.app_context():
+            wakeup = LocalWakeup()
+            wakeup.wait(0)
+
+            db.session.add(Task(name='test_task'))
+            db.session.flush()
+            db.session.rollback()
+            assert wakeup.wait(0) is False
+
+    def test_unix_socket_broadcast_wakes_worker(self, tmp_path):
+        """A broadcast reaches every worker socket in the directory."""
+        from app.modules.task_wakeup import UnixSocketWakeup
+
+        workers = [UnixSocketWakeup(f'w{i}', directory=str(tmp_path)) for i in range(2)]
+        try:
+            assert all(w.wait(0) is False for w in workers)
+            UnixSocketWakeup.broadcast(str(tmp_path))
+            UnixSocketWakeup.broadcast(str(tmp_path))
+            assert all(w.wait(1) is True for w in workers)
+            # Bursts coalesce into a single wakeup
+            assert all(w.wait(0) is False for w in workers)
+        finally:
+            for w in workers:
+                w.close()
+
+    def test_failed_listen_waits_before_retrying(self):
+        """A broken LISTEN connection still waits out the timeout."""
+        from app.modules.task_wakeup import PostgresWakeup
+
+        class DownEngine:
+            def raw_connection(self):
+                raise ConnectionError('database is down')
+
+        wakeup = PostgresWakeup(DownEngine())
+        started = time.monotonic()
+        assert wakeup.wait(0.2) is False
+        assert time.monotonic() - started >= 0.2
+
+
+class TestNewsletterDelivery:
+    """Tests for the streaming newsletter broadcast."""
+
+    def _seed(self):
+        from app.models import ContactFormSubmission, User, UnsubscribedEmail, Newsletter
+
+        for i in range(7):
+            db.session.add(ContactFormSubmission(
+                first_name='Lead', last_name=str(i), email=f'lead{i}@example.com',
+                phone='555-0100', message='Hi'
+            ))
+        # Duplicate across sources and an unsubscribed address
+        db.session.add(User(username='dup', email='lead0@example.com', password='testpass'))
+        db.session.add(User(username='member', email='member@example.com', password='testpass'))
+        db.session.add(UnsubscribedEmail(email='lead6@example.com'))
+        newsletter = Newsletter(subject='News', content='Hello', status='queued')
+        db.session.add(newsletter)
+        db.session.commit()
+        return newsletter
+
+    def test_recipients_deduped_and_suppressed_in_sql(self, app):
+        """Duplicates collapse and unsubscribes drop out."""
+        from app.modules.bulk_mail import iter_email_pages, newsletter_recipients_query
+
+        with app.app_context():
+            self._seed()
+            pages = list(iter_email_pages(newsletter_recipients_query(), page_size=3))
+
+            emails = [e for page in pages for e in page]
+            assert emails == sorted(emails)
+            assert len(emails) == len(set(emails)) == 7
+            assert 'lead6@example.com' not in emails
+            assert [len(p) for p in pages] == [3, 3, 1]
+
+    def test_broadcast_batches_connections_and_checkpoints(self, app, monkeypatch):
+        """One SMTP connection per batch; progress recorded on the newsletter."""
+        import app.worker as worker
+        from app.extensions import mail
+
+        app.config['SERVER_NAME'] = 'localhost'
+        app.config['MAIL_SEND_RATE'] = 0
+        # Mail state is captured at init, before the test config applies
+        app.extensions['mail'].suppress = True
+        app.extensions['mail'].default_sender = 'news@example.com'
+        monkeypatch.setattr(worker, 'BATCH_SIZE', 3)
+        connects = []
+        original_connect = mail.connect
+        monkeypatch.setattr(mail, 'connect', lambda: connects.append(1) or original_connect())
+
+        with app.app_context():
+            newsletter = self._seed()
+            with mail.record_messages() as outbox:
+                worker.handle_send_newsletter_broadcast({'newsletter_id': newsletter.id})
+
+            assert len(outbox) == 7
+            assert len(connects) == 3
+            assert 'unsubscribe?email=lead0%40example.com' in outbox[0].body
+            assert newsletter.status == 'sent'
+            assert newsletter.delivered_count == 7
+
+    def test_broadcast_resumes_after_checkpoint(self, app):
+        """A retried broadcast skips recipients already delivered."""
+        import app.worker as worker
+        from app.extensions import mail
+
+        app.config['SERVER_NAME'] = 'localhost'
+        app.config['MAIL_SEND_RATE'] = 0
+        # Mail state is captured at init, before the test config applies
+        app.extensions['mail'].suppress = True
+        app.extensions['mail'].default_sender = 'news@example.com'
+
+        with app.app_context():
+            newsletter = self._seed()
+            newsletter.status = 'sending'
+            newsletter.delivery_cursor = 'lead4@example.com'
+            newsletter.delivered_count = 5
+            db.session.commit()
+
+            with mail.record_messages() as outbox:
+                worker.handle_send_newsletter_broadcast({'newsletter_id': newsletter.id})
+
+            assert [m.recipients[0] for m in outbox] == ['lead5@example.com', 'member@example.com']
+            assert newsletter.delivered_count == 7
+
+
+class TestEmailCampaignDelivery:
+    """Tests for the sharded send_email_campaign handlers."""
+
+    def _seed(self, recipients=7, suppressed=1):
+        from app.models import User, EmailTemplate, EmailCampaign, EmailSuppressionList
+
+        for i in range(recipients):
+            user = User(username=f'member{i}', email=f'member{i}@example.com', password='testpass')
+            user.first_name = f'Member{i}'
+            db.session.add(user)
+        for i in range(suppressed):
+            db.session.add(EmailSuppressionList(email=f'member{i}@example.com', reason='unsubscribe'))
+        template = EmailTemplate(
+            name='Promo', subject='Hi {{first_name}}',
+            body_html='<p>Hello {{first_name}}</p><a href="https://example.com/sale">Sale</a>',
+            body_text='Hello {{first_name}}',
+            variables_schema={'first_name': {'default': 'Friend'}}
+        )
+        db.session.add(template)
+        db.session.flush()
+        campaign = EmailCampaign(name='Promo', template_id=template.id, status='sending')
+        db.session.add(campaign)
+        db.session.commit()
+        return campaign
+
+    def _configure_mail(self, app):
+        app.config['MAIL_SEND_RATE'] = 0
+        # Mail state is captured at init, before the test config applies
+        app.extensions['mail'].suppress = True
+        app.extensions['mail'].default_sender = 'promo@example.com'
+
+    def _run_tasks(self, name):
+        import app.worker as worker
+
+        for task in Task.query.filter_by(name=name, status='pending').all():
+            worker.TASK_HANDLERS[name](task.payload)
+            task.status = 'completed'
+        db.session.commit()
+
+    def test_campaign_fans_out_into_shards(self, app, monkeypatch):
+        """The coordinator enqueues one task per shard of the audience."""
+        import app.worker as worker
+
+        monkeypatch.setattr(worker, 'CAMPAIGN_SHARD_SIZE', 2)
+        with app.app_context():
+            campaign = self._seed()
+            worker.handle_send_email_campaign({'campaign_id': campaign.id})
+
+            shards = Task.query.filter_by(name='send_email_campaign_shard').all()
+            assert len(shards) == 3
+            assert sorted(t.payload['shard'] for t in shards) == [0, 1, 2]
+            assert campaign.shard_count == 3
+            assert campaign.send_generation == 1
+
+    def test_shards_send_each_recipient_once(self, app, monkeypatch):
+        """All shards together cover the audience exactly once and finish the campaign."""
+        import app.worker as worker
+        from app.extensions import mail
+        from app.models import EmailSend
+
+        self._configure_mail(app)
+        monkeypatch.setattr(worker, 'CAMPAIGN_SHARD_SIZE', 2)
+        monkeypatch.setattr(worker, 'BATCH_SIZE', 2)
+        with app.app_context():
+            campaign = self._seed()
+            worker.handle_send_email_campaign({'campaign_id': campaign.id})
+            with mail.record_messages() as outbox:
+                self._run_tasks('send_email_campaign_shard')
+
+            recipients = sorted(m.recipients[0] for m in outbox)
+            assert recipients == [f'member{i}@example.com' for i in range(1, 7)]
+            sends = EmailSend.query.filter_by(campaign_id=campaign.id).all()
+            assert len(sends) == 6
+            assert len({s.tracking_token for s in sends}) == 6
+            assert all(s.tracking_token in m.html for s in sends for m in outbox
+                       if m.recipients[0] == s.recipient_email)
+            assert campaign.status == 'sent'
+            assert campaign.sent_count == 6
+            assert campaign.completed_at is not None
+
+    def test_rerun_shard_does_not_finish_campaign(self, app, monkeypatch):
+        """A shard that runs twice counts once; the campaign waits for every shard."""
+        import app.worker as worker
+
+        self._configure_mail(app)
+        monkeypatch.setattr(worker, 'CAMPAIGN_SHARD_SIZE', 4)
+        with app.app_context():
+            campaign = self._seed()
+            worker.handle_send_email_campaign({'campaign_id': campaign.id})
+            first, second = sorted(Task.query.filter_by(name='send_email_campaign_shard'),
+                                   key=lambda t: t.payload['shard'])
+
+            worker.handle_send_email_campaign_shard(first.payload)
+            worker.handle_send_email_campaign_shard(first.payload)
+            assert campaign.status == 'sending'
+            assert campaign.shards_completed == 0b01
+
+            worker.handle_send_email_campaign_shard(second.payload)
+            assert campaign.status == 'sent'
+            assert campaign.sent_count == 6
+
+    def test_template_rendered_per_recipient(self, app):
+        """Variables, schema defaults and tracked links are filled in."""
+        from app.modules.email_marketing import CampaignRenderer
+
+        with app.app_context():
+            campaign = self._seed(recipients=1, suppressed=0)
+            renderer = CampaignRenderer(campaign)
+
+            variant, subject, html, text = renderer.render('a@example.com', {'first_name': 'Ann'}, 'tok1')
+            assert (variant, subject, text) == ('A', 'Hi Ann', 'Hello Ann')
+            assert 'https://example.com/sale' not in html
+            assert 'tok1' in html and '__TRACKING_TOKEN__' not in html
+
+            assert renderer.render('b@example.com', {'first_name': None}, 'tok2')[1] == 'Hi Friend'
+
+            # Campaign sends and template previews substitute the same way
+            for first_name in ('', None, 'Ann'):
+                _, subject, _, text = renderer.render('c@example.com', {'first_name': first_name}, 'tok3')
+                preview_subject, _, preview_text = campaign.template.render_full({'first_name': first_name})
+                assert (subject, text) == (preview_subject, preview_text)
+
+    def test_pause_and_resume_without_duplicates(self, app, monkeypatch):
+        """Pausing stops shards; resuming sends only to the remaining recipients."""
+        import app.worker as worker
+        from app.extensions import mail
+        from app.models import EmailSend
+
+        self._configure_mail(app)
+        monkeypatch.setattr(worker, 'BATCH_SIZE', 2)
+        with app.app_context():
+            campaign = self._seed()
+            worker.handle_send_email_campaign({'campaign_id': campaign.id})
+
+            # Pause as soon as the first page has gone out
+            from app.modules import bulk_mail
+            real_deliver = bulk_mail.deliver_batch
+
+            def deliver_then_pause(messages):
+                result = real_deliver(messages)
+                campaign.status = 'paused'
+                return result
+
+            monkeypatch.setattr(bulk_mail, 'deliver_batch', deliver_then_pause)
+            with mail.record_messages() as first_run:
+                self._run_tasks('send_email_campaign_shard')
+            assert len(first_run) == 2
+            assert campaign.status == 'paused'
+            monkeypatch.setattr(bulk_mail, 'deliver_batch', real_deliver)
+
+            # Resume: send_campaign re-enqueues the coordinator
+            campaign.status = 'sending'
+            db.session.commit()
+            worker.handle_send_email_campaign({'campaign_id': campaign.id})
+            with mail.record_messages() as second_run:
+                self._run_tasks('send_email_campaign_shard')
+
+            first = {m.recipients[0] for m in first_run}
+            second = {m.recipients[0] for m in second_run}
+            assert not first & second
+            assert len(first | second) == 6
+            assert EmailSend.query.filter_by(campaign_id=campaign.id).count() == 6
+            assert campaign.status == 'sent'
+            assert campaign.send_generation == 2
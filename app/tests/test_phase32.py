@@ -0,0 +1,277 @@
+"""
+Phase 32: Analytics Performance Tests
+
+Tests for:
+- Buffered page-view ingestion and session coalescing
+- Incremental hourly/daily traffic rollups
+- HyperLogLog distinct-count sketches
+"""
+import time
+import pytest
+from datetime import datetime, timedelta
+from app.database import db
+from app.models import PageView, VisitorSession
+
+
+@pytest.fixture
+def app(file_app):
+    """Create application backed by a file database."""
+    return file_app
+
+
+def _event(token, url, is_new=False, at=None, user_id=None):
+    return {
+        'session_id': token,
+        'is_new_session': is_new,
+        'user_id': user_id,
+        'url': url,
+        'referrer': None,
+        'user_agent': 'pytest',
+        'ip_hash': 'abc',
+        'timestamp': at or datetime.utcnow(),
+        'utm_source': 'newsletter',
+        'utm_medium': None,
+        'utm_campaign': None,
+        'utm_term': None,
+        'utm_content': None,
+        'device_type': 'desktop',
+        'browser': 'other',
+        'os': 'other',
+    }
+
+
+class TestPageViewIngestion:
+    """Tests for the page-view ingestion buffer."""
+
+    def test_request_records_view_and_session(self, app):
+        """A public page hit produces a page view and a visitor session."""
+        client = app.test_client()
+
+        client.get('/services?utm_source=ads')
+        client.get('/about')
+
+        views = PageView.query.order_by(PageView.id).all()
+        assert [v.url for v in views] == ['/services', '/about']
+        assert views[0].utm_source == 'ads'
+        session = VisitorSession.query.one()
+        assert session.session_token == views[0].session_id
+        assert session.pages_viewed == 2
+        assert session.exit_page == '/about'
+        assert session.bounce is False
+
+    def test_flush_coalesces_session_updates(self, app):
+        """Views of one session in a flush become a single session write."""
+        from app.modules.analytics_ingest import PageViewBuffer
+
+        start = datetime.utcnow()
+        buffer = PageViewBuffer(app, batch_size=100)
+        buffer.record(_event('s1', '/a', is_new=True, at=start), background=False)
+        buffer.record(_event('s1', '/b', at=start + timedelta(seconds=5)), background=False)
+        buffer.record(_event('s2', '/a', is_new=True, at=start), background=False)
+        assert buffer.flush() == 3
+
+        s1 = VisitorSession.query.filter_by(session_token='s1').one()
+        s2 = VisitorSession.query.filter_by(session_token='s2').one()
+        assert (s1.pages_viewed, s1.entry_page, s1.exit_page, s1.bounce) == (2, '/a', '/b', False)
+        assert s1.duration_seconds == 5
+        assert (s2.pages_viewed, s2.bounce) == (1, True)
+
+        buffer.record(_event('s2', '/c', at=start + timedelta(seconds=30), user_id=7), background=False)
+        buffer.record(_event('s2', '/d', at=start + timedelta(seconds=40)), background=False)
+        buffer.flush()
+
+        db.session.expire_all()
+        s2 = VisitorSession.query.filter_by(session_token='s2').one()
+        assert (s2.pages_viewed, s2.exit_page, s2.bounce, s2.user_id) == (3, '/d', False, 7)
+        assert s2.duration_seconds == 40
+        assert PageView.query.count() == 5
+
+    def test_full_buffer_drops_new_events(self, app):
+        """The queue is bounded; overflow is counted, not queued."""
+        from app.modules.analytics_ingest import PageViewBuffer
+
+        buffer = PageViewBuffer(app, max_size=2)
+        assert buffer.record(_event('s1', '/a', is_new=True), background=False)
+        assert buffer.record(_event('s1', '/b'), background=False)
+        assert buffer.record(_event('s1', '/c'), background=False) is False
+        assert buffer.dropped == 1
+        assert buffer.pending() == 2
+
+    def test_background_flusher_writes_batches(self, app):
+        """Without a synchronous flush the background thread writes the events."""
+        from app.modules.analytics_ingest import PageViewBuffer
+
+        buffer = PageViewBuffer(app, batch_size=3, flush_interval_ms=50)
+        try:
+            for i in range(5):
+                buffer.record(_event(f's{i}', '/a', is_new=True))
+
+            deadline = time.time() + 5
+            while buffer.flushed < 5 and time.time() < deadline:
+                time.sleep(0.02)
+        finally:
+            buffer.stop()
+
+        assert buffer.flushed == 5
+        assert PageView.query.count() == 5
+        assert VisitorSession.query.count() == 5
+
+    def test_concurrent_first_records_start_one_flusher(self, app):
+        """Racing first requests start a single flusher, which stop() joins."""
+        import threading
+        from app.modules.analytics_ingest import PageViewBuffer
+
+        def flushers():
+            return [t for t in threading.enumerate() if t.name == 'page-view-flusher']
+
+        before = len(flushers())
+        buffer = PageViewBuffer(app, flush_interval_ms=60000)
+        barrier = threading.Barrier(8)
+
+        def hit(i):
+            barrier.wait()
+            buffer.record(_event(f's{i}', '/a', is_new=True))
+
+        threads = [threading.Thread(target=hit, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        try:
+            assert len(flushers()) == before + 1
+        finally:
+            buffer.stop()
+
+        assert len(flushers()) == before
+        assert PageView.query.count() == 8
+
+
+class TestTrafficRollups:
+    """Tests for the traffic rollup tables and rollup-backed queries."""
+
+    NOW = datetime(2026, 3, 10, 12, 45)
+
+    def _seed(self):
+        """Traffic spread over three days, including the current partial hour."""
+        stamps = [
+            datetime(2026, 3, 8, 9, 15),
+            datetime(2026, 3, 8, 23, 50),
+            datetime(2026, 3, 9, 0, 5),
+            datetime(2026, 3, 9, 14, 30),
+            datetime(2026, 3, 10, 11, 20),
+            datetime(2026, 3, 10, 12, 10),  # Not yet settled
+        ]
+        for i, at in enumerate(stamps):
+            device = 'mobile' if i % 2 else 'desktop'
+            db.session.add(VisitorSession(
+                session_token=f's{i}', entry_page='/landing', utm_source='ads' if i < 3 else None,
+                device_type=device, started_at=at, pages_viewed=2 if i % 3 else 1,
+                bounce=not i % 3, duration_seconds=60 if i % 3 else None
+            ))
+            for url in (['/landing', '/pricing'] if i % 3 else ['/landing']):
+                db.session.add(PageView(
+                    session_id=f's{i}', url=url, timestamp=at, device_type=device,
+                    utm_source='ads' if i < 3 else None
+                ))
+        db.session.commit()
+
+    def test_refresh_rolls_up_closed_hours(self, app):
+        """Closed hours become hour rows; finished days are compacted into day rows."""
+        from app.models import TrafficRollup
+        from app.modules.analytics_rollups import refresh_traffic_rollups, get_high_water
+
+        self._seed()
+        assert refresh_traffic_rollups(now=self.NOW) == 5
+        assert get_high_water() == datetime(2026, 3, 10, 12)
+
+        days = TrafficRollup.query.filter_by(granularity='day').all()
+        assert sorted({d.bucket_start.day for d in days}) == [8, 9]
+        assert sum(d.page_views for d in days) == 6
+        hours = TrafficRollup.query.filter_by(granularity='hour').all()
+        assert sum(h.page_views for h in hours) == 8
+
+        # Nothing new has closed, so a second run reads nothing
+        assert refresh_traffic_rollups(now=self.NOW) == 0
+
+    def test_rollup_queries_match_raw_counts(self, app):
+        """Day rows, hour rows and the raw tail add up to the raw totals."""
+        from app.modules.analytics_rollups import refresh_traffic_rollups, query_traffic
+
+        self._seed()
+        before = query_traffic(datetime(2026, 3, 8, 12), self.NOW + timedelta(minutes=1))
+        refresh_traffic_rollups(now=self.NOW)
+        after = query_traffic(datetime(2026, 3, 8, 12), self.NOW + timedelta(minutes=1))
+
+        assert before == after
+        assert after[0]['page_views'] == 9
+        assert after[0]['sessions'] == 5
+        assert after[0]['bounces'] == 1
+        assert after[0]['duration_sum'] == 240
+
+        by_day = {r['date']: r['page_views'] for r in query_traffic(None, self.NOW + timedelta(minutes=1), ('date',))}
+        assert by_day == {'2026-03-08': 3, '2026-03-09': 3, '2026-03-10': 4}
+
+    def test_traffic_metrics_from_rollups(self, app, monkeypatch):
+        """calculate_traffic_metrics reports from the rollups."""
+        from app.modules.analytics_rollups import refresh_traffic_rollups
+        from app.modules.reporting import calculate_traffic_metrics
+
+        self._seed()
+        refresh_traffic_rollups(now=self.NOW)
+        # Raw rows inside the rolled-up range are no longer read
+        PageView.query.filter(PageView.timestamp < datetime(2026, 3, 10)).delete()
+        db.session.commit()
+
+        metrics = calculate_traffic_metrics(datetime(2026, 3, 8), self.NOW + timedelta(minutes=1), approximate=True)
+
+        assert metrics['page_views'] == 10
+        assert metrics['unique_sessions'] == 6
+        assert metrics['bounce_rate'] == round(2 / 6 * 100, 1)
+        assert metrics['avg_session_duration'] == 60
+        assert metrics['top_pages'][0] == {'url': '/landing', 'views': 6}
+        assert metrics['utm_sources'] == [{'source': 'ads', 'views': 5}]
+
+
+class TestDistinctSketches:
+    """Tests for the HyperLogLog sketches behind approximate unique counts."""
+
+    def test_hyperloglog_accuracy_and_merge(self):
+        """Estimates stay within a few percent; merging equals counting the union."""
+        from app.modules.hyperloglog import HyperLogLog, merge_serialized
+
+        first = HyperLogLog().update(range(0, 30000))
+        second = HyperLogLog().update(range(20000, 50000))
+        assert abs(first.count() - 30000) < 30000 * 0.03
+
+        merged = merge_serialized([first.to_bytes(), second.to_bytes()])
+        expected = bytes(max(a, b) for a, b in zip(first.registers, second.registers))
+        assert bytes(merged.registers) == expected
+        assert abs(merged.count() - 50000) < 50000 * 0.03
+
+        assert HyperLogLog().update(['a', 'b', 'a']).count() == 2
+        assert merge_serialized([]).count() == 0
+
+    def test_sketches_answer_unique_counts(self, app):
+        """Refresh builds hour and day sketches that survive raw-row deletion."""
+        from app.models import TrafficSketch
+        from app.modules.analytics_rollups import refresh_traffic_rollups, estimate_unique_by_day
+        from app.modules.reporting import calculate_traffic_metrics
+
+        TestTrafficRollups()._seed()
+        db.session.add(PageView(session_id='s1', url='/again', ip_hash='other',
+                                timestamp=datetime(2026, 3, 9, 15, 5)))
+        db.session.commit()
+        refresh_traffic_rollups(now=TestTrafficRollups.NOW)
+        assert TrafficSketch.query.filter_by(granularity='day', metric='sessions').count() == 2
+
+        end = TestTrafficRollups.NOW + timedelta(minutes=1)
+        exact = calculate_traffic_metrics(datetime(2026, 3, 8), end)
+        PageView.query.filter(PageView.timestamp < datetime(2026, 3, 10)).delete()
+        db.session.commit()
+        approx = calculate_traffic_metrics(datetime(2026, 3, 8), end, approximate=True)
+
+        assert (exact['unique_sessions'], exact['unique_visitors']) == (6, 1)
+        assert (approx['unique_sessions'], approx['unique_visitors']) == (6, 1)
+        assert estimate_unique_by_day(None, end, 'sessions') == {
+            '2026-03-08': 2, '2026-03-09': 3, '2026-03-10': 2
+        }
@@ -0,0 +1,530 @@
+"""
+Phase 33: Media Delivery Performance Tests
+
+Tests for:
+- Content-addressed blob storage of uploads, post images and downloads
+- Range requests and web server offload when serving blobs
+- Batched migration of database BLOBs into the blob store
+- Conditional GET and immutable caching of image endpoints
+- Responsive image variants: background generation, on-demand path, srcset
+- Bounded-memory uploads: request size limits and resumable chunked uploads
+"""
+import os
+from io import BytesIO
+from datetime import datetime, timedelta
+import pytest
+from flask import g
+from sqlalchemy import event
+from werkzeug.datastructures import FileStorage
+from werkzeug.http import http_date
+from app.database import db
+from app.models import ChunkedUpload, ImageVariant, Media, Post, Role, Task, User
+from app.modules.blob_store import LocalBlobStore, blob_version, checksum_of, init_blob_store
+
+
+@pytest.fixture
+def app(file_app, tmp_path):
+    """Create application with a file database and a temporary blob store."""
+    file_app.config['BLOB_STORAGE_PATH'] = str(tmp_path / 'blobs')
+    file_app.config['UPLOAD_TEMP_PATH'] = str(tmp_path / 'uploads')
+    init_blob_store(file_app)
+    return file_app
+
+
+def _upload(data, filename='notes.txt', mimetype='text/plain'):
+    return FileStorage(stream=BytesIO(data), filename=filename, content_type=mimetype)
+
+
+def _png(width, height):
+    from PIL import Image
+
+    output = BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(output, format='PNG')
+    return output.getvalue()
+
+
+def _author():
+    user = User(username='blob_author', email='blob_author@example.com', password='x')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+class TestBlobStore:
+    """Uploads go to the content-addressed store, once per distinct content."""
+
+    def test_store_uses_configured_path(self, app, tmp_path):
+        store = app.extensions['blob_store']
+        assert isinstance(store, LocalBlobStore)
+        assert store.root == str(tmp_path / 'blobs')
+
+    def test_save_media_dedupes_content(self, app):
+        from app.modules.file_manager import save_media
+
+        payload = b'same bytes ' * 1000
+        first = save_media(_upload(payload, 'a.txt'))
+        second = save_media(_upload(payload, 'b.txt'))
+
+        store = app.extensions['blob_store']
+        assert first.checksum == second.checksum == checksum_of(payload)
+        assert first.size == len(payload)
+        assert db.session.query(Media.data).filter_by(id=first.id).scalar() is None
+        blob_files = [f for _, _, files in os.walk(store.root) for f in files]
+        assert blob_files == [first.checksum]
+
+    def test_delete_keeps_shared_blob(self, app):
+        from app.modules.file_manager import save_media, delete_media
+
+        first = save_media(_upload(b'shared'))
+        second = save_media(_upload(b'shared'))
+        store = app.extensions['blob_store']
+
+        assert delete_media(first.id)
+        assert store.exists(second.checksum)
+        assert delete_media(second.id)
+        assert not store.exists(second.checksum)
+
+    def test_invalid_checksum_is_rejected(self, app):
+        store = app.extensions['blob_store']
+        with pytest.raises(ValueError):
+            store.local_path('../../etc/passwd')
+        assert not store.exists('../../etc/passwd')
+
+
+class TestServingBlobs:
+    """Media is served from the store with Range, ETag and offload support."""
+
+    def test_range_request(self, app):
+        from app.modules.file_manager import save_media
+
+        payload = bytes(range(256)) * 64
+        media = save_media(_upload(payload, 'data.txt'))
+        client = app.test_client()
+
+        full = client.get(f'/media/{media.id}')
+        assert full.status_code == 200
+        assert full.data == payload
+        assert full.headers['Accept-Ranges'] == 'bytes'
+
+        partial = client.get(f'/media/{media.id}', headers={'Range': 'bytes=100-199'})
+        assert partial.status_code == 206
+        assert partial.data == payload[100:200]
+        assert partial.headers['Content-Range'] == f'bytes 100-199/{len(payload)}'
+
+        cached = client.get(f'/media/{media.id}', headers={'If-None-Match': f'"{media.checksum}"'})
+        assert cached.status_code == 304
+
+    def test_ranged_download_counts_against_limit(self, app, monkeypatch):
+        """A Range header cannot skip the download count or the log."""
+        import app.routes.public_routes.cart as cart
+        from app.models import DownloadLog, DownloadToken, Order, OrderItem, Product
+        from app.modules.file_manager import save_media
+
+        monkeypatch.setattr(cart, 'DOWNLOAD_RESUMES_PER_DOWNLOAD', 2)
+        payload = b'digital goods ' * 100
+        media = save_media(_upload(payload, 'goods.txt'))
+        product = Product(name='Ebook', price=500, is_digital=True, file_id=media.id)
+        order = Order(total_amount=500)
+        db.session.add_all([product, order])
+        db.session.flush()
+        item = OrderItem(order_id=order.id, product_id=product.id, price_at_purchase=500)
+        db.session.add(item)
+        db.session.flush()
+        token = DownloadToken(token='tok', order_item_id=item.id, max_downloads=1,
+                              expires_at=datetime.utcnow() + timedelta(days=1))
+        db.session.add(token)
+        db.session.commit()
+        client = app.test_client()
+
+        first = client.get('/shop/download/tok', headers={'Range': 'bytes=1-'})
+        assert first.status_code == 206
+        assert token.download_count == 1
+
+        # Multi-range and unsatisfiable ranges never pass as resumes
+        assert client.get('/shop/download/tok', headers={'Range': 'bytes=1-,0-0'}).status_code == 416
+        assert client.get('/shop/download/tok', headers={'Range': f'bytes={len(payload)}-'}).status_code == 302
+        # Nor does a resume from a client that had no counted download
+        other = app.test_client()
+        other.environ_base['REMOTE_ADDR'] = '10.0.0.9'
+        assert other.get('/shop/download/tok', headers={'Range': 'bytes=100-'}).status_code == 302
+
+        # The counted download may be resumed, even at the limit, but only twice
+        for start in (100, 200):
+            resumed = client.get('/shop/download/tok', headers={'Range': f'bytes={start}-'})
+            assert resumed.status_code == 206
+            assert resumed.data == payload[start:]
+        assert client.get('/shop/download/tok', headers={'Range': 'bytes=300-'}).status_code == 302
+        assert client.get('/shop/download/tok').status_code == 302
+
+        db.session.refresh(token)
+        assert token.download_count == 1
+        logs = DownloadLog.query.filter_by(download_token_id=token.id).all()
+        assert sorted(bool(log.resumed) for log in logs) == [False, True, True]
+
+    def test_accel_redirect_offload(self, app):
+        from app.modules.file_manager import save_media
+
+        media = save_media(_upload(b'offloaded content'))
+        app.config['BLOB_ACCEL_REDIRECT_PREFIX'] = '/_blobs/'
+
+        response = app.test_client().get(f'/media/{media.id}')
+        checksum = media.checksum
+        assert response.status_code == 200
+        assert response.data == b''
+        assert response.headers['X-Accel-Redirect'] == f'/_blobs/{checksum[:2]}/{checksum[2:4]}/{checksum}'
+        assert 'notes.txt' in response.headers['Content-Disposition']
+
+    def test_missing_media_404(self, app):
+        media = Media(filename='gone.txt', mimetype='text/plain', checksum='0' * 64)
+        db.session.add(media)
+        db.session.commit()
+
+        assert app.test_client().get(f'/media/{media.id}').status_code == 404
+
+
+class TestBlobMigration:
+    """Rows written before the store existed are served, then migrated in batches."""
+
+    def test_migrate_blobs_command(self, app):
+        legacy = [Media(filename=f'old{i}.txt', mimetype='text/plain', data=f'legacy {i}'.encode())
+                  for i in range(3)]
+        db.session.add_all(legacy)
+        post = Post(title='Old Post', slug='old-post', content='Body', author_id=_author().id,
+                    image=b'\x89PNG legacy', image_mime_type='image/png')
+        db.session.add(post)
+        db.session.commit()
+        media_ids = [m.id for m in legacy]
+        post_id = post.id
+        client = app.test_client()
+
+        # Served from the database before migration
+        assert client.get(f'/media/{media_ids[0]}').data == b'legacy 0'
+        assert client.get(f'/blog/image/{post_id}').data == b'\x89PNG legacy'
+
+        result = app.test_cli_runner().invoke(args=['migrate-blobs', '--batch-size', '2'])
+        assert result.exit_code == 0, result.output
+        assert 'Moved 3 media file(s) and 1 post image(s)' in result.output
+
+        db.session.expire_all()
+        assert db.session.query(Media.id).filter(Media.data.isnot(None)).count() == 0
+        post = db.session.get(Post, post_id)
+        assert post.image_checksum == checksum_of(b'\x89PNG legacy')
+        assert post.image is None and post.has_image
+
+        # Served from the store after migration, and a rerun is a no-op
+        assert client.get(f'/media/{media_ids[2]}').data == b'legacy 2'
+        assert client.get(f'/blog/image/{post_id}').data == b'\x89PNG legacy'
+        rerun = app.test_cli_runner().invoke(args=['migrate-blobs'])
+        assert 'Moved 0 media file(s) and 0 post image(s)' in rerun.output
+
+
+class TestConditionalGet:
+    """Revalidation is answered from metadata, without reading the payload."""
+
+    def _post_queries(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            if 'FROM post' in statement:
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        return statements
+
+    def test_post_image_304_skips_payload(self, app):
+        post = Post(title='Hero', slug='hero', content='Body', author_id=_author().id,
+                    image_mime_type='image/png', image_checksum=app.extensions['blob_store'].put(b'\x89PNG hero'))
+        db.session.add(post)
+        db.session.commit()
+        post_id, checksum = post.id, post.image_checksum
+        client = app.test_client()
+
+        first = client.get(f'/blog/image/{post_id}')
+        assert first.status_code == 200
+        assert first.headers['ETag'] == f'"{checksum}"'
+        assert 'no-cache' in first.headers['Cache-Control']
+
+        statements = self._post_queries()
+        revalidated = client.get(f'/blog/image/{post_id}', headers={'If-None-Match': first.headers['ETag']})
+        assert revalidated.status_code == 304
+        assert revalidated.data == b''
+        assert len(statements) == 1
+        assert 'image_checksum' in statements[0]
+
+    def test_legacy_image_revalidates_by_date(self, app):
+        post = Post(title='Legacy', slug='legacy', content='Body', author_id=_author().id,
+                    image=b'\x89PNG legacy', image_mime_type='image/png',
+                    updated_at=datetime(2024, 1, 2, 3, 4, 5, 678000))
+        db.session.add(post)
+        db.session.commit()
+        post_id = post.id
+        client = app.test_client()
+
+        first = client.get(f'/blog/image/{post_id}')
+        assert first.data == b'\x89PNG legacy'
+        assert first.headers['Last-Modified'] == http_date(datetime(2024, 1, 2, 3, 4, 5))
+
+        statements = self._post_queries()
+        revalidated = client.get(f'/blog/image/{post_id}',
+                                 headers={'If-Modified-Since': first.headers['Last-Modified']})
+        assert revalidated.status_code == 304
+        assert len(statements) == 1
+        assert 'post.image AS' not in statements[0]
+
+    def test_has_image_is_loaded_with_the_row(self, app):
+        """Listings check for an image without reading a BLOB per post."""
+        author_id = _author().id
+        db.session.add_all([
+            Post(title='Stored', slug='stored', content='Body', author_id=author_id, image_checksum=checksum_of(b'a')),
+            Post(title='Legacy', slug='legacy', content='Body', author_id=author_id, image=b'\x89PNG legacy'),
+            Post(title='Plain', slug='plain', content='Body', author_id=author_id),
+        ])
+        db.session.commit()
+        db.session.expire_all()
+
+        statements = self._post_queries()
+        assert [p.has_image for p in Post.query.order_by(Post.id)] == [True, True, False]
+        assert len(statements) == 1
+        assert 'post.image AS' not in statements[0]
+
+    def test_versioned_url_is_immutable(self, app):
+        from app.modules.file_manager import save_media
+
+        media = save_media(_upload(b'logo bytes', 'logo.png', 'image/png'))
+        client = app.test_client()
+
+        versioned = client.get(f'/media/{media.id}?v={blob_version(media.checksum)}')
+        assert versioned.status_code == 200
+        cache_control = versioned.headers['Cache-Control']
+        assert 'immutable' in cache_control and 'max-age=31536000' in cache_control
+        assert 'public' in cache_control and 'no-store' not in cache_control
+
+        stale = client.get(f'/media/{media.id}?v=0000000000000000')
+        assert 'immutable' not in stale.headers['Cache-Control']
+
+    def test_templates_link_versioned_images(self, app):
+        post = Post(title='Linked', slug='linked', content='Body', author_id=_author().id, is_published=True,
+                    image_mime_type='image/png', image_checksum=checksum_of(b'linked'))
+        db.session.add(post)
+        db.session.commit()
+
+        page = app.test_client().get('/blog/linked')
+        assert f'/blog/image/{post.id}?v={blob_version(post.image_checksum)}' in page.get_data(as_text=True)
+
+
+class TestImageVariants:
+    """Width-bucketed WebP/JPEG variants, made by the worker or on first request."""
+
+    def test_upload_queues_variants_for_worker(self, app):
+        from app.modules.file_manager import save_media
+        from app.worker import TASK_HANDLERS
+
+        media = save_media(_upload(_png(700, 350), 'photo.png', 'image/png'))
+        task = Task.query.filter_by(name='generate_image_variants').one()
+        assert task.payload == {'checksum': media.checksum}
+        assert ImageVariant.query.count() == 0
+
+        TASK_HANDLERS['generate_image_variants'](task.payload)
+        variants = {(v.width, v.format): v for v in ImageVariant.query.all()}
+        assert set(variants) == {(w, f) for w in (320, 640, 1280) for f in ('webp', 'jpeg')}
+        assert (variants[(320, 'webp')].pixel_width, variants[(320, 'webp')].pixel_height) == (320, 160)
+        assert variants[(1280, 'jpeg')].pixel_width == 700  # Never upscaled
+        assert app.extensions['blob_store'].exists(variants[(640, 'webp')].checksum)
+
+        # A duplicate task does nothing
+        TASK_HANDLERS['generate_image_variants'](task.payload)
+        assert ImageVariant.query.count() == 6
+
+    def test_non_images_are_not_queued(self, app):
+        from app.modules.file_manager import save_media
+
+        save_media(_upload(b'plain text'))
+        assert Task.query.filter_by(name='generate_image_variants').count() == 0
+
+    def test_on_demand_variant_is_created_once(self, app):
+        from PIL import Image
+
+        checksum = app.extensions['blob_store'].put(_png(1000, 500))
+        post = Post(title='Wide', slug='wide', content='Body', author_id=_author().id,
+                    image_mime_type='image/png', image_checksum=checksum)
+        db.session.add(post)
+        db.session.commit()
+        client = app.test_client()
+
+        first = client.get(f'/media/variants/{checksum}/640.webp')
+        assert first.status_code == 200
+        assert first.mimetype == 'image/webp'
+        assert 'immutable' in first.headers['Cache-Control']
+        assert Image.open(BytesIO(first.data)).size == (640, 320)
+
+        second = client.get(f'/media/variants/{checksum}/640.webp')
+        assert second.data == first.data
+        assert ImageVariant.query.filter_by(source_checksum=checksum).count() == 1
+
+    def test_on_demand_rejects_unknown_specs_and_sources(self, app):
+        from app.modules.file_manager import save_media
+
+        image = save_media(_upload(_png(100, 100), 'small.png', 'image/png'))
+        text = save_media(_upload(b'not an image'))
+        client = app.test_client()
+
+        assert client.get(f'/media/variants/{image.checksum}/500.webp').status_code == 404
+        assert client.get(f'/media/variants/{image.checksum}/320.gif').status_code == 404
+        assert client.get(f'/media/variants/{text.checksum}/320.webp').status_code == 404
+        assert client.get(f'/media/variants/{"f" * 64}/320.webp').status_code == 404
+
+    def test_released_image_drops_variants(self, app):
+        from app.modules.file_manager import save_media, delete_media
+        from app.modules.image_variants import generate_variants
+
+        media = save_media(_upload(_png(400, 400), 'square.png', 'image/png'))
+        generate_variants(media.checksum)
+        variant_checksums = [v.checksum for v in ImageVariant.query.all()]
+        assert variant_checksums
+
+        assert delete_media(media.id)
+        store = app.extensions['blob_store']
+        assert ImageVariant.query.count() == 0
+        assert not any(store.exists(c) for c in variant_checksums)
+
+    def test_release_keeps_blobs_still_referenced_or_rolled_back(self, app):
+        from app.modules.file_manager import release_blob, save_media
+        from app.modules.image_variants import generate_variants
+
+        store = app.extensions['blob_store']
+        media = save_media(_upload(_png(400, 400), 'square.png', 'image/png'))
+        generate_variants(media.checksum)
+        variant = ImageVariant.query.first()
+        # The same bytes uploaded again as a file of their own
+        db.session.add(Media(filename='copy.webp', mimetype='image/webp', size=1, checksum=variant.checksum))
+        db.session.delete(media)
+        db.session.flush()
+
+        assert release_blob(media.checksum)
+        db.session.rollback()
+        assert store.exists(media.checksum) and store.exists(variant.checksum)
+        assert ImageVariant.query.count() > 0
+
+        db.session.add(Media(filename='copy.webp', mimetype='image/webp', size=1, checksum=variant.checksum))
+        db.session.delete(Media.query.filter_by(checksum=media.checksum).one())
+        db.session.flush()
+        assert release_blob(media.checksum)
+        db.session.commit()
+        assert not store.exists(media.checksum)
+        assert store.exists(variant.checksum)
+        assert ImageVariant.query.count() == 0
+
+    def test_blog_listing_uses_srcset(self, app):
+        post = Post(title='Listed', slug='listed', content='Body', author_id=_author().id, is_published=True,
+                    image_mime_type='image/png', image_checksum=checksum_of(b'listed'))
+        db.session.add(post)
+        db.session.commit()
+
+        html = app.test_client().get('/blog').get_data(as_text=True)
+        checksum = post.image_checksum
+        assert f'<source type="image/webp" srcset="/media/variants/{checksum}/320.webp 320w' in html
+        assert f'/media/variants/{checksum}/1280.jpeg 1280w' in html
+
+
+class TestUploads:
+    """Uploads are size-checked up front and can be sent in resumable chunks."""
+
+    @pytest.fixture
+    def admin(self, app):
+        role = Role(name='admin')
+        user = User(username='media_admin', email='media_admin@example.com', password='x')
+        user.roles.append(role)
+        db.session.add_all([role, user])
+        db.session.commit()
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = user.id
+            sess['_fresh'] = True
+        return client
+
+    def test_resumable_upload(self, app, admin, tmp_path):
+        app.config['UPLOAD_CHUNK_SIZE'] = 1024
+        payload = os.urandom(2500)
+
+        started = admin.post('/admin/media/uploads', json={'filename': 'big.pdf', 'size': len(payload),
+                                                          'mimetype': 'application/pdf'})
+        assert started.status_code == 201
+        upload = started.get_json()
+        assert upload['offset'] == 0 and upload['chunk_size'] == 1024
+
+        first = admin.put(upload['url'], data=payload[:1024], headers={'Upload-Offset': '0'})
+        assert first.get_json()['offset'] == 1024
+
+        # A retried chunk is refused with the offset to resume from
+        retry = admin.put(upload['url'], data=payload[:1024], headers={'Upload-Offset': '0'})
+        assert retry.status_code == 409
+        assert retry.get_json()['offset'] == 1024
+        assert admin.get(upload['url']).get_json()['offset'] == 1024
+
+        admin.put(upload['url'], data=payload[1024:2048], headers={'Upload-Offset': '1024'})
+        done = admin.put(upload['url'], data=payload[2048:], headers={'Upload-Offset': '2048'})
+        assert done.status_code == 201
+        media = db.session.get(Media, done.get_json()['media']['id'])
+        assert (media.filename, media.size, media.checksum) == ('big.pdf', 2500, checksum_of(payload))
+        assert admin.get(f'/media/{media.id}').data == payload
+        assert ChunkedUpload.query.count() == 0
+        assert os.listdir(tmp_path / 'uploads') == []
+
+    def test_limits_are_enforced_before_buffering(self, app, admin):
+        app.config['UPLOAD_CHUNK_SIZE'] = 1024
+        app.config['CHUNKED_UPLOAD_MAX_SIZE'] = 4096
+
+        too_big = admin.post('/admin/media/uploads', json={'filename': 'huge.pdf', 'size': 5000})
+        assert too_big.status_code == 413
+        assert admin.post('/admin/media/uploads', json={'filename': 'run.exe', 'size': 10}).status_code == 400
+
+        upload = admin.post('/admin/media/uploads', json={'filename': 'ok.pdf', 'size': 4096}).get_json()
+        oversized_chunk = admin.put(upload['url'], data=b'x' * 2048, headers={'Upload-Offset': '0'})
+        assert oversized_chunk.status_code == 413
+        assert db.session.get(ChunkedUpload, upload['id']).received == 0
+
+        app.config['MAX_CONTENT_LENGTH'] = 1000
+        form_upload = admin.post('/admin/media/upload', data={'files': (BytesIO(b'x' * 2000), 'a.txt')},
+                                 content_type='multipart/form-data')
+        assert form_upload.status_code == 413
+        assert Media.query.count() == 0
+
+    def test_uploads_belong_to_their_owner(self, app, admin):
+        upload = admin.post('/admin/media/uploads', json={'filename': 'mine.pdf', 'size': 10}).get_json()
+        other = User(username='other_admin', email='other_admin@example.com', password='x')
+        other.roles.append(Role.query.filter_by(name='admin').one())
+        db.session.add(other)
+        db.session.commit()
+        other_client = app.test_client()
+        with other_client.session_transaction() as sess:
+            sess['_user_id'] = other.id
+            sess['_fresh'] = True
+
+        # Requests share the fixture's app context, so drop the cached login
+        g.pop('_login_user', None)
+        assert other_client.get(upload['url']).status_code == 404
+        assert other_client.put(upload['url'], data=b'0123456789', headers={'Upload-Offset': '0'}).status_code == 404
+
+    def test_stale_uploads_are_purged(self, app, admin, tmp_path):
+        from datetime import timedelta
+        from app.worker import TASK_HANDLERS
+
+        upload = admin.post('/admin/media/uploads', json={'filename': 'left.pdf', 'size': 10}).get_json()
+        db.session.get(ChunkedUpload, upload['id']).updated_at = datetime.utcnow() - timedelta(hours=48)
+        db.session.commit()
+
+        TASK_HANDLERS['purge_stale_uploads']({})
+        assert ChunkedUpload.query.count() == 0
+        assert os.listdir(tmp_path / 'uploads') == []
+
+    def test_large_image_is_compressed_from_the_stream(self, app):
+        from PIL import Image
+        from app.modules.file_manager import save_media
+
+        output = BytesIO()
+        Image.frombytes('RGB', (800, 800), os.urandom(800 * 800 * 3)).save(output, format='PNG')
+        assert len(output.getvalue()) > 1024 * 1024
+
+        media = save_media(_upload(output.getvalue(), 'noise.png', 'image/png'))
+        assert (media.filename, media.mimetype) == ('noise.jpg', 'image/jpeg')
+        assert media.size < len(output.getvalue())
+        assert app.extensions['blob_store'].size(media.checksum) == media.size
@@ -0,0 +1,328 @@
+"""
+Phase 34: Search Performance Tests
+
+Tests for:
+- Full-text blog search: FTS5 index sync, ranking, prefix matching, snippets
+- Message search: indexed matching, filters, SQL channel access
+- Product search: denormalized stats, facets, constant query count
+"""
+import pytest
+from datetime import datetime
+from flask import g
+from sqlalchemy import event
+from app.database import db
+from app.models import (
+    Category, Channel, Message, Order, OrderItem, Post, Product, ProductFacetValue, ProductVariant, Review,
+    Role, User
+)
+from app.modules.search_index import get_index, highlight, MARK_END, MARK_START
+
+
+@pytest.fixture
+def app(file_app):
+    """Create application backed by a file database."""
+    return file_app
+
+
+def _author():
+    user = User(username='search_author', email='search_author@example.com', password='x')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def _post(author, title, content, meta_description=None, is_published=True):
+    post = Post(title=title, slug=title.lower().replace(' ', '-'), content=content,
+                meta_description=meta_description, author_id=author.id, is_published=is_published)
+    db.session.add(post)
+    db.session.commit()
+    return post
+
+
+def _search(app, query, page=1):
+    with app.test_request_context():
+        return get_index('post').paginate(query, Post.query.filter(Post.is_published == True), page=page)
+
+
+class TestBlogSearch:
+    """Blog search runs on the full-text index."""
+
+    def test_index_follows_post_writes(self, app):
+        author = _author()
+        post = _post(author, 'Kubernetes notes', '<p>Rolling <b>deployments</b> explained</p>')
+        assert [p.id for p in _search(app, 'deployments').items] == [post.id]
+
+        post.content = '<p>Blue green releases</p>'
+        db.session.commit()
+        assert _search(app, 'deployments').total == 0
+        assert _search(app, 'releases').total == 1
+
+        db.session.delete(post)
+        db.session.commit()
+        assert _search(app, 'releases').total == 0
+
+    def test_ranks_title_hits_first_and_skips_drafts(self, app):
+        author = _author()
+        body_hit = _post(author, 'Weekly roundup', '<p>Some notes on caching layers.</p>')
+        title_hit = _post(author, 'Caching strategies', '<p>How we keep pages fast.</p>')
+        _post(author, 'Caching draft', '<p>Unfinished caching post.</p>', is_published=False)
+
+        results = _search(app, 'caching')
+        assert [p.id for p in results.items] == [title_hit.id, body_hit.id]
+        assert results.total == 2
+
+    def test_prefix_and_every_term_must_match(self, app):
+        author = _author()
+        post = _post(author, 'Deploying Flask', '<p>Gunicorn behind nginx.</p>')
+        _post(author, 'Deploying Django', '<p>uWSGI behind apache.</p>')
+
+        assert _search(app, 'deplo').total == 2
+        assert [p.id for p in _search(app, 'deplo ngin').items] == [post.id]
+        assert _search(app, '"); DROP TABLE post; --').total == 0
+
+    def test_snippets_highlight_matches_and_escape_content(self, app):
+        author = _author()
+        post = _post(author, 'Release notes', '<p>The &lt;script&gt; tag is sanitised before every release.</p>')
+
+        results = _search(app, 'sanitised')
+        snippet = str(results.snippets[post.id])
+        assert '<mark>sanitised</mark>' in snippet
+        assert '&lt;script&gt;' in snippet
+        assert '<p>' not in snippet
+        assert str(highlight(f'<b>{MARK_START}x{MARK_END}')) == '&lt;b&gt;<mark>x</mark>'
+
+    def test_search_page_does_not_scan_posts(self, app):
+        author = _author()
+        for i in range(30):
+            _post(author, f'Post number {i}', f'<p>Filler text {i}.</p>')
+        target = _post(author, 'Observability', '<p>Tracing with spans.</p>')
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = app.test_client().get('/blog/search?q=tracing')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        assert response.status_code == 200
+        assert b'<mark>Tracing</mark>' in response.data
+        assert f'/blog/{target.slug}'.encode() in response.data
+        assert not [s for s in statements if 'LIKE' in s.upper() and 'FROM post' in s]
+        assert any('post_fts MATCH' in s for s in statements)
+
+    def test_rebuild_reindexes_existing_rows(self, app):
+        author = _author()
+        post = _post(author, 'Indexed later', '<p>Backfilled content.</p>')
+        db.session.execute(db.text('DELETE FROM post_fts'))
+        db.session.commit()
+        assert _search(app, 'backfilled').total == 0
+
+        assert get_index('post').rebuild(batch_size=1) == 1
+        assert [p.id for p in _search(app, 'backfilled').items] == [post.id]
+
+
+class TestMessageSearch:
+    """Message search runs on the full-text index within the channels a user can read."""
+
+    @pytest.fixture
+    def users(self, app):
+        staff = Role(name='staff')
+        alice = User(username='alice', email='alice@example.com', password='x')
+        bob = User(username='bob', email='bob@example.com', password='x')
+        alice.roles.append(staff)
+        db.session.add_all([staff, alice, bob])
+        db.session.commit()
+        return alice, bob
+
+    def _client(self, app, user):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = user.id
+            sess['_fresh'] = True
+        # Requests share the fixture's app context, so drop the cached login
+        g.pop('_login_user', None)
+        return client
+
+    def _message(self, channel, user, content, created_at=None):
+        message = Message(channel=channel, user_id=user.id, content=content,
+                          created_at=created_at or datetime.utcnow())
+        db.session.add(message)
+        db.session.commit()
+        return message
+
+    def test_access_filter_matches_can_user_access(self, app, users):
+        alice, bob = users
+        admin = User(username='root', email='root@example.com', password='x')
+        admin.roles.append(Role(name='Admin'))
+        db.session.add(admin)
+        channels = [
+            Channel(name='general', type='public'),
+            Channel(name='staff-only', type='public', is_restricted=True, allowed_roles=['Staff']),
+            Channel(name='managers', type='public', is_restricted=True, allowed_roles=['manager']),
+            Channel(name='unlisted', type='public', is_restricted=True, allowed_roles=[]),
+            Channel(name='support', type='support'),
+            Channel(name='private', type='private', members=[alice]),
+            Channel(name='dm', type='direct', is_direct=True, members=[alice, bob]),
+        ]
+        db.session.add_all(channels)
+        db.session.commit()
+
+        for user in (alice, bob, admin):
+            expected = {c.id for c in channels if c.can_user_access(user)}
+            found = {c.id for c in Channel.query.filter(Channel.access_filter(user))}
+            assert found == expected, user.username
+
+    def test_search_respects_access_and_filters(self, app, users):
+        alice, bob = users
+        general = Channel(name='general', type='public')
+        private = Channel(name='private', type='private', members=[alice])
+        db.session.add_all([general, private])
+        db.session.commit()
+        old = self._message(general, alice, 'Invoice batch failed overnight', datetime(2024, 1, 5))
+        recent = self._message(general, bob, 'Invoices reprocessed', datetime(2024, 3, 1))
+        secret = self._message(private, alice, 'Invoice totals for the board')
+
+        def ids(client, **params):
+            response = client.get('/messaging/search', query_string=dict(q='invoice', **params))
+            return {r['id'] for r in response.get_json()['results']}
+
+        assert ids(self._client(app, bob)) == {old.id, recent.id}
+        alice_client = self._client(app, alice)
+        assert ids(alice_client) == {old.id, recent.id, secret.id}
+        assert ids(alice_client, user_id=bob.id) == {recent.id}
+        assert ids(alice_client, after='2024-02-01', before='2024-03-01') == {recent.id}
+        assert ids(alice_client, channel_id=private.id) == {secret.id}
+
+        response = alice_client.get('/messaging/search', query_string={'q': 'batch'})
+        assert response.get_json()['results'][0]['snippet'] == 'Invoice <mark>batch</mark> failed overnight'
+
+    def test_search_uses_index_and_follows_deletes(self, app, users):
+        alice, _ = users
+        channel = Channel(name='ops', type='public', created_by_id=alice.id)
+        db.session.add(channel)
+        db.session.commit()
+        message = self._message(channel, alice, 'Database failover drill at noon')
+        client = self._client(app, alice)
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            results = client.get('/messaging/search?q=failover').get_json()['results']
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        assert [r['id'] for r in results] == [message.id]
+        assert not [s for s in statements if 'message.content) LIKE' in s]
+        assert any('message_fts MATCH' in s for s in statements)
+
+        client.post(f'/messaging/channel/{channel.id}/delete')
+        count = db.session.execute(db.text('SELECT count(*) FROM message_fts')).scalar()
+        assert count == 0
+
+
+class TestProductSearch:
+    """Storefront listing runs on the product index, denormalized stats and facet rows."""
+
+    def _product(self, name, price, category=None, variants=(), description=''):
+        product = Product(name=name, price=price, description=description, category=category)
+        for sku, attributes in variants:
+            product.variants.append(ProductVariant(sku=sku, name=sku, attributes=attributes))
+        db.session.add(product)
+        db.session.commit()
+        return product
+
+    def _get(self, app, **params):
+        response = app.test_client().get('/shop/api/products', query_string=params)
+        assert response.status_code == 200
+        return response.get_json()
+
+    def test_stats_follow_reviews_and_orders(self, app):
+        buyer = User(username='buyer', email='buyer@example.com', password='x')
+        db.session.add(buyer)
+        mug = self._product('Mug', 1200)
+        lamp = self._product('Lamp', 4000)
+        db.session.add_all([
+            Review(product_id=mug.id, rating=5, status='approved'),
+            Review(product_id=mug.id, rating=2, status='approved', user_id=None),
+            Review(product_id=lamp.id, rating=1, status='pending'),
+        ])
+        order = Order(total_amount=5200, status='pending', items=[
+            OrderItem(product_id=lamp.id, quantity=3, price_at_purchase=4000),
+            OrderItem(product_id=mug.id, quantity=1, price_at_purchase=1200),
+        ])
+        db.session.add(order)
+        db.session.commit()
+
+        db.session.refresh(mug)
+        db.session.refresh(lamp)
+        assert (mug.avg_rating, mug.review_count, mug.units_sold) == (3.5, 2, 0)
+        assert (lamp.avg_rating, lamp.review_count, lamp.units_sold) == (0, 0, 0)
+
+        order.status = 'paid'
+        db.session.commit()
+        db.session.refresh(lamp)
+        assert lamp.units_sold == 3
+
+        assert [p['name'] for p in self._get(app, sort='popular')['products']] == ['Lamp', 'Mug']
+        assert [p['name'] for p in self._get(app, sort='rating')['products']] == ['Mug', 'Lamp']
+        assert self._get(app, sort='rating')['products'][0]['reviews_count'] == 2
+
+    def test_search_matches_skus_and_attributes_with_facets(self, app):
+        shirts = Category(name='Shirts', slug='shirts')
+        mugs = Category(name='Mugs', slug='mugs')
+        self._product('Linen shirt', 3000, shirts, [('LS-BLU-M', {'color': 'Blue', 'size': 'M'}),
+                                                    ('LS-RED-L', {'color': 'Red', 'size': 'L'})])
+        self._product('Oxford shirt', 6000, shirts, [('OX-BLU-L', {'color': 'Blue', 'size': 'L'})])
+        self._product('Blue mug', 1500, mugs, [('MUG-1', {'color': 'Blue'})])
+
+        assert [p['name'] for p in self._get(app, search='ls-red')['products']] == ['Linen shirt']
+        assert {p['name'] for p in self._get(app, search='blue')['products']} == {
+            'Linen shirt', 'Oxford shirt', 'Blue mug'
+        }
+
+        data = self._get(app, search='shirt', attr='size:L')
+        assert {p['name'] for p in data['products']} == {'Linen shirt', 'Oxford shirt'}
+        facets = data['facets']
+        assert facets['categories'] == [{'id': shirts.id, 'name': 'Shirts', 'count': 2}]
+        assert facets['price'] == [{'min': 2500, 'max': 5000, 'count': 1}, {'min': 5000, 'max': 10000, 'count': 1}]
+        # The size facet ignores the size filter, so other sizes stay selectable
+        assert facets['attributes']['size'] == [{'value': 'L', 'count': 2}, {'value': 'M', 'count': 1}]
+        assert facets['attributes']['color'] == [{'value': 'Blue', 'count': 2}, {'value': 'Red', 'count': 1}]
+
+        data = self._get(app, attr=['size:L', 'color:Red'])
+        assert [p['name'] for p in data['products']] == ['Linen shirt']
+
+        variant = ProductVariant.query.filter_by(sku='LS-RED-L').one()
+        variant.is_active = False
+        db.session.commit()
+        assert self._get(app, search='ls-red')['products'] == []
+        assert ProductFacetValue.query.filter_by(value='Red').count() == 0
+
+    def test_listing_cost_does_not_grow_with_catalog(self, app):
+        category = Category(name='Tools', slug='tools')
+
+        def statements_for_page():
+            statements = []
+
+            def record(conn, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                self._get(app, search='tool', per_page=50)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            return len(statements)
+
+        for i in range(5):
+            self._product(f'Tool {i}', 1000 + i, category, [(f'T-{i}', {'finish': 'steel'})])
+        statements_for_page()  # Warms per-process caches
+        small = statements_for_page()
+        for i in range(5, 40):
+            self._product(f'Tool {i}', 1000 + i, category, [(f'T-{i}', {'finish': 'steel'})])
+        assert statements_for_page() == small
@@ -9,6 +9,8 @@ Comprehensive tests for channel-based messaging functionality including:
 - Reactions
 - Read receipts
 - Channel archiving
+- Real-time fan-out through the message broker
+- Eager-loaded message serialization
 """
 
 import pytest
@@ -408,3 +410,211 @@ class TestMessagingHelpers:
             assert public_channel.type == 'public'
 
             db.session.rollback()
+
+
+class TestMessageBroker:
+    """Tests for the real-time message fan-out."""
+
+    def _payload(self, message_id, user_id):
+        return {'id': message_id, 'user_id': user_id, 'content': f'message {message_id}'}
+
+    def test_publish_fans_out_one_serialization(self):
+        """Every subscriber gets the same frame; only is_me differs per viewer."""
+        from app.modules.message_broker import MessageBroker
+
+        broker = MessageBroker()
+        first, second, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+        broker.publish(1, [self._payload(10, user_id=5)])
+
+        event = first.get(timeout=1)
+        assert second.get(timeout=1) is event
+        assert other.get(timeout=0.01) is None
+        assert event.last_id == 10
+        assert '"is_me": true' in event.frame_for(5)
+        assert '"is_me": false' in event.frame_for(6)
+
+        first.close()
+        assert broker.subscriber_count(1) == 1
+
+    def test_full_queue_marks_subscriber_for_resync(self):
+        """A slow subscriber is flagged instead of blocking the publisher."""
+        from app.modules.message_broker import MessageBroker
+
+        broker = MessageBroker(max_pending=2)
+        with broker.subscribe(1) as subscription:
+            for message_id in range(3):
+                broker.publish(1, [self._payload(message_id, user_id=5)])
+            assert subscription.lagged
+            subscription.reset()
+            assert not subscription.lagged
+            assert subscription.get(timeout=0.01) is None
+        assert broker.subscriber_count() == 0
+
+    def test_notify_backend_delivers_remote_publishes(self, monkeypatch):
+        """Notifications from other processes are delivered; our own are skipped."""
+        import json
+        from app.modules.message_broker import MessageBroker, PostgresNotifyBackend
+
+        backend = PostgresNotifyBackend(app=None)
+        monkeypatch.setattr(backend, 'ensure_listening', lambda: None)
+        broker = MessageBroker(backend)
+        subscription = broker.subscribe(1)
+
+        backend.receive(json.dumps({'origin': broker.node_id, 'channel_id': 1, 'messages': [self._payload(1, 5)]}))
+        assert subscription.get(timeout=0.01) is None
+
+        backend.receive(json.dumps({'origin': 'other', 'channel_id': 1, 'messages': [self._payload(2, 5)]}))
+        assert subscription.get(timeout=1).last_id == 2
+
+        # Oversized publishes arrive without messages and make streams resync
+        backend.receive(json.dumps({'origin': 'other', 'channel_id': 1, 'messages': None}))
+        assert subscription.get(timeout=1).resync
+
+    def test_stream_relays_published_messages(self, authenticated_client, regular_user, app):
+        """Sent messages reach a connected stream exactly once."""
+        import threading
+        import time
+        from app.models import Channel, Message
+
+        with app.app_context():
+            channel = Channel(name='Stream Test', type='public')
+            db.session.add(channel)
+            db.session.commit()
+            channel_id = channel.id
+        user_id = regular_user.id
+        broker = app.extensions['message_broker']
+        chunks = []
+
+        def listen():
+            # A streaming response must be consumed on one thread, as a server would
+            listener = app.test_client()
+            with listener.session_transaction() as sess:
+                sess['_user_id'] = user_id
+                sess['_fresh'] = True
+            response = listener.get(f'/messaging/channel/{channel_id}/stream?last_id=0', buffered=False)
+            for chunk in response.response:
+                chunks.append(chunk.decode() if isinstance(chunk, bytes) else chunk)
+                if sum(c.count('"raw_content"') for c in chunks) >= 2:
+                    break
+            response.close()
+
+        thread = threading.Thread(target=listen)
+        thread.start()
+        deadline = time.time() + 5
+        while broker.subscriber_count(channel_id) == 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        authenticated_client.post(f'/messaging/channel/{channel_id}/send', data={'content': 'hello stream'})
+        authenticated_client.post(f'/messaging/channel/{channel_id}/send', data={'content': 'second'})
+        thread.join(timeout=10)
+
+        assert not thread.is_alive()
+        assert 'event: connected' in chunks[0]
+        stream = ''.join(chunks)
+        assert stream.count('"raw_content": "hello stream"') == 1
+        assert stream.count('"raw_content": "second"') == 1
+        assert '"is_me": true' in stream
+        assert broker.subscriber_count(channel_id) == 0
+
+        with app.app_context():
+            Message.query.filter_by(channel_id=channel_id).delete()
+            db.session.delete(db.session.get(Channel, channel_id))
+            db.session.commit()
+
+
+class TestMessageSerialization:
+    """Tests for the shared, eager-loaded message serialization."""
+
+    def _seed(self, channel_id, authors, count):
+        from app.models import Message, MessageReaction, Media
+
+        media = Media(filename='notes.txt', mimetype='text/plain', data=b'x' * 1024, size=1024)
+        db.session.add(media)
+        db.session.flush()
+        for i in range(count):
+            message = Message(channel_id=channel_id, user_id=authors[i % len(authors)].id,
+                              content=f'hello @{authors[0].username} {i}',
+                              attachment_id=media.id if i % 5 == 0 else None)
+            db.session.add(message)
+            db.session.flush()
+            for author in authors[:1 + i % len(authors)]:
+                db.session.add(MessageReaction(message_id=message.id, user_id=author.id, emoji='👍'))
+        db.session.commit()
+
+    def test_poll_query_count_is_constant(self, authenticated_client, regular_user, app):
+        """A 50-message page costs the same number of queries as a 5-message page."""
+        from sqlalchemy import event
+        from app.models import Channel, Message, MessageReaction, User
+
+        with app.app_context():
+            others = [User(username=f'serial_{i}', email=f'serial_{i}@test.com', password='Test123!')
+                      for i in range(3)]
+            db.session.add_all(others)
+            small = Channel(name='Serial Small', type='public')
+            large = Channel(name='Serial Large', type='public')
+            db.session.add_all([small, large])
+            db.session.commit()
+            authors = [db.session.get(User, regular_user.id)] + others
+            self._seed(small.id, authors, 5)
+            self._seed(large.id, authors, 50)
+            small_id, large_id = small.id, large.id
+
+            statements = []
+
+            def count(*args):
+                statements.append(args[2])
+
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                small_page = authenticated_client.get(f'/messaging/channel/{small_id}/poll').get_json()
+                small_queries = len(statements)
+                del statements[:]
+                large_page = authenticated_client.get(f'/messaging/channel/{large_id}/poll').get_json()
+                large_queries = len(statements)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+
+            assert len(small_page) == 5 and len(large_page) == 50
+            assert large_queries == small_queries
+            assert not any('media.data' in s for s in statements)
+
+            first = large_page[0]
+            assert first['is_me'] is True
+            assert first['attachment']['name'] == 'notes.txt'
+            assert first['reactions']['👍'] == {'count': 1, 'user_reacted': True, 'users': ['test_user_p6']}
+            assert large_page[1]['reactions']['👍']['count'] == 2
+            assert '<span class="mention">@test_user_p6</span>' in first['content']
+
+            for channel_id in (small_id, large_id):
+                ids = [m.id for m in Message.query.filter_by(channel_id=channel_id)]
+                MessageReaction.query.filter(MessageReaction.message_id.in_(ids)).delete()
+                Message.query.filter_by(channel_id=channel_id).delete()
+                db.session.delete(db.session.get(Channel, channel_id))
+            for other in others:
+                db.session.delete(other)
+            db.session.commit()
+
+    def test_rendered_content_is_cached_per_version(self, app, monkeypatch):
+        """Rendering is cached by message id and content."""
+        from flask_caching.backends import SimpleCache
+        from app.models import Message
+        from app.modules import message_serialization
+        from app.modules.message_serialization import rendered_contents
+
+        # This app runs with NullCache; give the renderer a real one
+        renders = []
+        original = message_serialization.render_message_content
+        monkeypatch.setattr(message_serialization, 'cache', SimpleCache())
+        monkeypatch.setattr(message_serialization, 'render_message_content',
+                            lambda m: renders.append(m.content) or original(m))
+        with app.test_request_context():
+            message = Message(id=987654, content='first', channel_id=1, user_id=1)
+            assert rendered_contents([message]) == {987654: 'first'}
+            assert rendered_contents([message]) == {987654: 'first'}
+            assert renders == ['first']
+
+            # Edits within the same second, and ids reused after a delete
+            message.content = 'second'
+            assert rendered_contents([message]) == {987654: 'second'}
+            reused = Message(id=987654, content='another channel', channel_id=2, user_id=1)
+            assert rendered_contents([reused]) == {987654: 'another channel'}
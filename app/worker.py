@@ -5,9 +5,14 @@ import os
 import socket
 import uuid
 import logging
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, case, select
 from app.models import Task, CronTask, WorkerHeartbeat
 from app.database import db
+from app.modules.task_wakeup import create_wakeup
 from flask import current_app
 
 # Configure logging based on environment
@@ -41,8 +46,20 @@ else:
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 TASK_HANDLERS = {}
-BATCH_SIZE = 50  # For newsletter batching
-BATCH_PAUSE_SECONDS = 2
+BATCH_SIZE = 50  # Recipients per newsletter page / SMTP connection
+CAMPAIGN_SHARD_SIZE = 1000  # Target recipients per email campaign shard task
+CAMPAIGN_MAX_SHARDS = 32  # At most 63: finished shards are tracked as bits of a BigInteger
+
+# Task claiming
+TASK_LEASE_SECONDS = int(os.environ.get('WORKER_TASK_LEASE_SECONDS', 600))  # Visibility timeout for 'processing' tasks
+PREFETCH_SIZE = int(os.environ.get('WORKER_PREFETCH', 10))  # Tasks claimed per round-trip into the local buffer
+RESULT_FLUSH_SIZE = 20  # Write back task outcomes after this many...
+RESULT_FLUSH_SECONDS = 2  # ...or this long, whichever comes first
+HEARTBEAT_INTERVAL_SECONDS = 60
+CRON_CHECK_INTERVAL_SECONDS = 60
+IDLE_SLEEP_SECONDS = 5  # Back-off after loop errors
+IDLE_POLL_MIN_SECONDS = 1  # Safety-net polling while idle: starts here...
+IDLE_POLL_MAX_SECONDS = 30  # ...and doubles up to here between wakeups
 
 def register_task_handler(name):
     def decorator(f):
@@ -58,25 +75,30 @@ def get_worker_id():
     return f"{hostname}-{short_uuid}"
 
 
+def _apply_heartbeat(worker_id, tasks_processed=0, tasks_failed=0):
+    """Stage a heartbeat update on the session without committing."""
+    heartbeat = WorkerHeartbeat.query.filter_by(worker_id=worker_id).first()
+    if heartbeat:
+        heartbeat.last_heartbeat = datetime.utcnow()
+        heartbeat.status = 'running'
+        heartbeat.tasks_processed += tasks_processed
+        heartbeat.tasks_failed += tasks_failed
+    else:
+        heartbeat = WorkerHeartbeat(
+            worker_id=worker_id,
+            last_heartbeat=datetime.utcnow(),
+            status='running',
+            tasks_processed=tasks_processed,
+            tasks_failed=tasks_failed,
+            hostname=socket.gethostname()
+        )
+        db.session.add(heartbeat)
+
+
 def update_heartbeat(worker_id, tasks_processed=0, tasks_failed=0):
     """Update or create worker heartbeat record."""
     try:
-        heartbeat = WorkerHeartbeat.query.filter_by(worker_id=worker_id).first()
-        if heartbeat:
-            heartbeat.last_heartbeat = datetime.utcnow()
-            heartbeat.status = 'running'
-            heartbeat.tasks_processed += tasks_processed
-            heartbeat.tasks_failed += tasks_failed
-        else:
-            heartbeat = WorkerHeartbeat(
-                worker_id=worker_id,
-                last_heartbeat=datetime.utcnow(),
-                status='running',
-                tasks_processed=0,
-                tasks_failed=0,
-                hostname=socket.gethostname()
-            )
-            db.session.add(heartbeat)
+        _apply_heartbeat(worker_id, tasks_processed, tasks_failed)
         db.session.commit()
     except Exception as e:
         logger.warning(f"Failed to update heartbeat: {e}")
@@ -129,18 +151,38 @@ def process_due_cron_tasks():
         db.session.rollback()
 
 
+def _claimable_filter(now):
+    """
+    Tasks a worker may claim: pending tasks whose retry time has come, plus
+    'processing' tasks whose lease expired (their worker died mid-task).
+    """
+    return or_(
+        and_(
+            Task.status == 'pending',
+            (Task.next_retry_at == None) | (Task.next_retry_at <= now)
+        ),
+        and_(
+            Task.status == 'processing',
+            Task.locked_until != None,
+            Task.locked_until < now
+        )
+    )
+
+
 def get_next_task():
     """
     Get the next task to process, respecting priority and retry timing.
     
     Order: priority DESC, created_at ASC
-    Filter: status='pending' AND (next_retry_at IS NULL OR next_retry_at <= now)
+    Filter: status='pending' AND (next_retry_at IS NULL OR next_retry_at <= now),
+            or status='processing' with an expired lease
+    
+    This is a read-only peek; use claim_next_task() to take ownership.
     """
     now = datetime.utcnow()
     
     task = Task.query.filter(
-        Task.status == 'pending',
-        (Task.next_retry_at == None) | (Task.next_retry_at <= now)
+        _claimable_filter(now)
     ).order_by(
         Task.priority.desc(),
         Task.created_at.asc()
@@ -149,6 +191,150 @@ def get_next_task():
     return task
 
 
+# Lightweight snapshot of a claimed task; safe to hand across threads and commits
+ClaimedTask = namedtuple('ClaimedTask', ['id', 'name', 'payload', 'priority', 'retry_count'])
+
+
+def _supports_skip_locked():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def claim_tasks(worker_id, limit=1, lease_seconds=None):
+    """
+    Atomically claim up to `limit` tasks for this worker in one statement.
+    
+    The UPDATE picks its rows through a subquery ordered by priority; on
+    Postgres that subquery takes FOR UPDATE SKIP LOCKED so concurrent
+    workers split the queue head between them. Elsewhere the outer WHERE
+    re-checks the claimable condition, acting as a compare-and-set: a row
+    another worker flipped first simply doesn't match.
+    
+    Claimed tasks are marked 'processing' with a lease; if the worker dies,
+    another worker reclaims them once the lease passes (counted as a retry).
+    """
+    now = datetime.utcnow()
+    lease_until = now + timedelta(seconds=lease_seconds or TASK_LEASE_SECONDS)
+    
+    candidates = select(Task.id).where(
+        _claimable_filter(now)
+    ).order_by(
+        Task.priority.desc(),
+        Task.created_at.asc()
+    ).limit(limit)
+    if _supports_skip_locked():
+        candidates = candidates.with_for_update(skip_locked=True)
+    
+    claimed = Task.query.filter(
+        Task.id.in_(candidates),
+        _claimable_filter(now)
+    ).update({
+        # SET expressions see pre-update values: only reclaimed tasks count a retry
+        'retry_count': case((Task.status == 'processing', Task.retry_count + 1), else_=Task.retry_count),
+        'status': 'processing',
+        'started_at': now,
+        'locked_by': worker_id,
+        'locked_until': lease_until,
+    }, synchronize_session=False)
+    db.session.commit()
+    
+    if not claimed:
+        return []
+    
+    # This worker's id plus the exact lease timestamp identify the rows just claimed
+    return Task.query.filter(
+        Task.locked_by == worker_id,
+        Task.locked_until == lease_until,
+        Task.status == 'processing'
+    ).order_by(
+        Task.priority.desc(),
+        Task.created_at.asc()
+    ).all()
+
+
+def renew_leases(worker_id, task_ids, lease_seconds=None):
+    """
+    Push back the lease of tasks this worker still holds.
+    
+    Tasks another worker has already reclaimed are left alone. Returns the
+    number of leases renewed.
+    """
+    if not task_ids:
+        return 0
+    lease_until = datetime.utcnow() + timedelta(seconds=lease_seconds or TASK_LEASE_SECONDS)
+    renewed = Task.query.filter(
+        Task.id.in_(list(task_ids)),
+        Task.locked_by == worker_id,
+        Task.status == 'processing'
+    ).update({'locked_until': lease_until}, synchronize_session=False)
+    db.session.commit()
+    return renewed
+
+
+class LeaseKeeper:
+    """
+    Background thread that keeps this worker's leases alive.
+    
+    Handlers may run far longer than the lease (a large newsletter at
+    MAIL_SEND_RATE), and a serial handler blocks the worker loop, so
+    renewal runs beside it: every third of the lease, every task the
+    worker holds (buffered, running, or finished but not yet recorded)
+    gets a fresh lease. Only a worker that dies stops renewing.
+    """
+    
+    def __init__(self, app, worker_id, lease_seconds=None):
+        self.app = app
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds or TASK_LEASE_SECONDS
+        self.interval = self.lease_seconds / 3
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+    
+    def hold(self, task_ids):
+        with self._lock:
+            self._held.update(task_ids)
+    
+    def release(self, task_ids):
+        with self._lock:
+            self._held.difference_update(task_ids)
+    
+    def renew(self):
+        with self._lock:
+            task_ids = list(self._held)
+        if not task_ids:
+            return 0
+        with self.app.app_context():
+            try:
+                return renew_leases(self.worker_id, task_ids, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"Failed to renew {len(task_ids)} task leases: {e}")
+                db.session.rollback()
+                return 0
+            finally:
+                db.session.remove()
+    
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.renew()
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='verso-lease-keeper', daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def claim_next_task(worker_id, lease_seconds=None):
+    """Atomically claim the single next task for this worker, or None."""
+    tasks = claim_tasks(worker_id, limit=1, lease_seconds=lease_seconds)
+    return tasks[0] if tasks else None
+
+
 def handle_task_failure(task, error_message):
     """
     Handle task failure with retry logic.
@@ -159,6 +345,7 @@ def handle_task_failure(task, error_message):
     """
     task.retry_count += 1
     task.error = error_message
+    task.release_lease()
     
     if task.should_move_to_dead_letter():
         task.status = 'dead_letter'
@@ -171,86 +358,228 @@ def handle_task_failure(task, error_message):
         logger.info(f"Task {task.id} will retry at {task.next_retry_at} (attempt {task.retry_count + 1}/{task.max_retries})")
 
 
-def run_worker():
+def run_task_handler(task):
+    """
+    Run the handler for a claimed task without recording its status.
+    
+    Accepts a Task or ClaimedTask. Returns (task_id, error) where error is
+    None on success; feed the results to record_task_results().
+    """
+    logger.info(f"Processing task {task.id}: {task.name} (priority: {task.priority}, retry: {task.retry_count})")
+    
+    handler = TASK_HANDLERS.get(task.name)
+    if not handler:
+        return task.id, f"No handler for task: {task.name}"
+    
+    try:
+        handler(task.payload or {})
+        logger.info(f"Task {task.id} completed successfully")
+        return task.id, None
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error processing task {task.id}: {e}")
+        return task.id, str(e) + "\n" + traceback.format_exc()
+
+
+def record_task_results(results, worker_id=None):
+    """
+    Write back a batch of task outcomes in a single commit.
+    
+    Completed tasks are flipped with one bulk UPDATE; failures go through
+    the retry/dead-letter logic. When worker_id is given, only tasks this
+    worker still owns are updated (a task whose lease expired may already
+    belong to someone else) and the heartbeat counters ride along in the
+    same transaction.
+    
+    Returns (tasks_processed, tasks_failed).
+    """
+    completed_ids = [task_id for task_id, error in results if error is None]
+    failures = {task_id: error for task_id, error in results if error is not None}
+    
+    if completed_ids:
+        query = Task.query.filter(Task.id.in_(completed_ids))
+        if worker_id:
+            query = query.filter(Task.locked_by == worker_id)
+        query.update({
+            'status': 'completed',
+            'completed_at': datetime.utcnow(),
+            'locked_by': None,
+            'locked_until': None,
+        }, synchronize_session=False)
+    
+    if failures:
+        query = Task.query.filter(Task.id.in_(list(failures)))
+        if worker_id:
+            query = query.filter(Task.locked_by == worker_id)
+        for task in query.all():
+            handle_task_failure(task, failures[task.id])
+    
+    if worker_id:
+        _apply_heartbeat(worker_id, len(completed_ids), len(failures))
+    
+    db.session.commit()
+    return len(completed_ids), len(failures)
+
+
+def execute_task(task):
+    """
+    Run a claimed task and record its outcome immediately.
+    
+    Returns (tasks_processed, tasks_failed) for heartbeat accounting.
+    """
+    return record_task_results([run_task_handler(task)])
+
+
+def _snapshot(task):
+    return ClaimedTask(task.id, task.name, task.payload, task.priority, task.retry_count)
+
+
+def _run_task_in_thread(app, claimed):
+    """Pool entry point: each thread gets its own app context and DB session."""
+    with app.app_context():
+        try:
+            return run_task_handler(claimed)
+        finally:
+            db.session.remove()
+
+
+def _collect_finished(futures, results):
+    """Move the outcomes of completed pool futures into `results`."""
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error(f"Worker thread error: {e}")
+
+
+def _flush_results(worker_id, results, leases=None):
+    if not results:
+        return
+    try:
+        record_task_results(results, worker_id)
+    except Exception as e:
+        logger.error(f"Failed to record {len(results)} task results: {e}")
+        db.session.rollback()
+    if leases:
+        leases.release(task_id for task_id, _ in results)
+    results.clear()
+
+
+def run_worker(concurrency=1, prefetch=None):
     """
     Enhanced main worker loop with:
     - Priority-based task processing
+    - Atomic batch claiming into a local prefetch buffer, safe with many
+      worker processes
+    - Lease-based recovery of tasks abandoned by crashed workers, with
+      leases renewed in the background while this worker holds them
+    - Optional thread pool running up to `concurrency` handlers at once
+    - Batched write-back of task outcomes and heartbeat counters
+    - Immediate wakeup on enqueue (LISTEN/NOTIFY or local socket), with
+      exponential-backoff polling only as a safety net
     - Retry logic with exponential backoff
     - Dead letter queue for failed tasks
     - Cron task scheduling
     - Worker heartbeat for observability
     """
+    app = current_app._get_current_object()
     worker_id = get_worker_id()
-    logger.info(f"Worker started with ID: {worker_id}")
+    concurrency = max(1, int(concurrency or 1))
+    prefetch = max(concurrency, int(prefetch or PREFETCH_SIZE))
+    logger.info(f"Worker started with ID: {worker_id} (concurrency: {concurrency}, prefetch: {prefetch})")
     
-    heartbeat_interval = 0  # Counter for heartbeat updates
-    cron_check_interval = 0  # Counter for cron task checks
+    executor = None
+    if concurrency > 1:
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='verso-worker')
+    in_flight = set()
+    buffer = deque()  # ClaimedTask snapshots waiting for a handler
+    results = []  # (task_id, error) outcomes waiting to be written back
+    
+    wakeup = create_wakeup(app, worker_id)
+    leases = LeaseKeeper(app, worker_id).start()
+    idle_poll = IDLE_POLL_MIN_SECONDS
+    
+    last_heartbeat = 0.0
+    last_cron_check = 0.0
+    last_flush = time.monotonic()
     
     try:
         while True:
             try:
-                # Update heartbeat every 12 iterations (~1 minute at 5s interval)
-                heartbeat_interval += 1
-                if heartbeat_interval >= 12:
-                    update_heartbeat(worker_id)
-                    heartbeat_interval = 0
+                now = time.monotonic()
+                
+                if now - last_heartbeat >= HEARTBEAT_INTERVAL_SECONDS:
+                    if not results:
+                        update_heartbeat(worker_id)
+                    last_heartbeat = now
                 
-                # Check cron tasks every 12 iterations (~1 minute)
-                cron_check_interval += 1
-                if cron_check_interval >= 12:
+                if now - last_cron_check >= CRON_CHECK_INTERVAL_SECONDS:
                     process_due_cron_tasks()
-                    cron_check_interval = 0
+                    last_cron_check = now
                 
-                # Get the next task (priority-based, respecting retry timing)
-                task = get_next_task()
+                # Top up the prefetch buffer with one claim statement
+                if len(buffer) < concurrency:
+                    claimed = claim_tasks(worker_id, limit=prefetch - len(buffer))
+                    leases.hold(task.id for task in claimed)
+                    buffer.extend(_snapshot(task) for task in claimed)
                 
-                if task:
-                    logger.info(f"Processing task {task.id}: {task.name} (priority: {task.priority}, retry: {task.retry_count})")
-                    task.status = 'processing'
-                    task.started_at = datetime.utcnow()
-                    db.session.commit()
-                    
-                    tasks_processed = 0
-                    tasks_failed = 0
-                    
-                    try:
-                        handler = TASK_HANDLERS.get(task.name)
-                        if handler:
-                            payload = task.payload or {}
-                            # Run the handler
-                            handler(payload)
-                            task.status = 'completed'
-                            task.completed_at = datetime.utcnow()
-                            tasks_processed = 1
-                            logger.info(f"Task {task.id} completed successfully")
-                        else:
-                            error_msg = f"No handler for task: {task.name}"
-                            handle_task_failure(task, error_msg)
-                            tasks_failed = 1
-                    except Exception as e:
-                        error_msg = str(e) + "\n" + traceback.format_exc()
-                        logger.error(f"Error processing task {task.id}: {e}")
-                        handle_task_failure(task, error_msg)
-                        tasks_failed = 1
-                    
-                    db.session.commit()
-                    
-                    # Update heartbeat with task counts
-                    update_heartbeat(worker_id, tasks_processed, tasks_failed)
-                else:
-                    # No tasks to process
+                # Nothing claimed and nothing running means the queue is drained
+                idle = not buffer and not in_flight
+                
+                if executor:
+                    done = {f for f in in_flight if f.done()}
+                    in_flight -= done
+                    _collect_finished(done, results)
+                    while buffer and len(in_flight) < concurrency:
+                        in_flight.add(executor.submit(_run_task_in_thread, app, buffer.popleft()))
+                elif buffer:
+                    results.append(run_task_handler(buffer.popleft()))
+                
+                if results and (
+                    idle
+                    or len(results) >= RESULT_FLUSH_SIZE
+                    or time.monotonic() - last_flush >= RESULT_FLUSH_SECONDS
+                ):
+                    _flush_results(worker_id, results, leases)
+                    last_flush = time.monotonic()
+                
+                if idle:
+                    # No tasks to process: block until an enqueue wakes us,
+                    # polling less often the longer the queue stays empty
                     db.session.remove()
-                    time.sleep(5)
+                    timeout = min(idle_poll, CRON_CHECK_INTERVAL_SECONDS - (time.monotonic() - last_cron_check))
+                    if wakeup.wait(max(timeout, 0)):
+                        idle_poll = IDLE_POLL_MIN_SECONDS
+                    else:
+                        idle_poll = min(idle_poll * 2, IDLE_POLL_MAX_SECONDS)
+                    continue
+                
+                idle_poll = IDLE_POLL_MIN_SECONDS
+                if executor and in_flight and (len(in_flight) >= concurrency or not buffer):
+                    wait(in_flight, timeout=RESULT_FLUSH_SECONDS, return_when=FIRST_COMPLETED)
                     
             except Exception as e:
                 logger.error(f"Worker loop error: {e}")
                 if "server has gone away" in str(e).lower() or "operationalerror" in str(e).lower():
                     db.session.rollback()
                     db.session.remove()
-                time.sleep(5)
+                time.sleep(IDLE_SLEEP_SECONDS)
                 
     except KeyboardInterrupt:
         logger.info("Worker shutting down...")
+        if executor:
+            executor.shutdown(wait=True)
+            _collect_finished(in_flight, results)
+        _flush_results(worker_id, results, leases)
+        leases.stop()
+        # Buffered tasks never started: hand them back to the queue
+        if buffer:
+            Task.query.filter(
+                Task.id.in_([claimed.id for claimed in buffer]),
+                Task.locked_by == worker_id
+            ).update({'status': 'pending', 'locked_by': None, 'locked_until': None}, synchronize_session=False)
+            db.session.commit()
+        wakeup.close()
         mark_worker_stopped(worker_id)
 
 # --- Define Default Tasks Here ---
@@ -317,56 +646,64 @@ def handle_new_lead_notification(payload):
 def handle_send_newsletter_broadcast(payload):
     """
     Payload: {'newsletter_id': int}
+    
+    Streams recipients in BATCH_SIZE pages, sends each page over one SMTP
+    connection at MAIL_SEND_RATE messages/second, and checkpoints the last
+    delivered address on the newsletter. If the task dies mid-broadcast, the
+    retry resumes after the checkpoint instead of re-sending.
     """
-    from app.models import Newsletter, ContactFormSubmission, UnsubscribedEmail, User
+    from app.models import Newsletter
+    from app.modules.bulk_mail import (
+        RateLimiter, deliver_batch, iter_email_pages, newsletter_recipients_query
+    )
     from flask_mail import Message
-    from app import mail
     from flask import url_for
+    from urllib.parse import quote
     
     newsletter_id = payload.get('newsletter_id')
     newsletter = Newsletter.query.get(newsletter_id)
     if not newsletter:
         print(f"Newsletter {newsletter_id} not found.")
         return
-
-    # Gather recipients
-    recipients = set()
+    if newsletter.status == 'sent':
+        print(f"Newsletter {newsletter_id} already sent.")
+        return
     
-    # 1. Contacts
-    contacts = ContactFormSubmission.query.all()
-    for c in contacts:
-        recipients.add(c.email)
-        
-    # 2. Users (if desired, maybe filter by role or opt-in?)
-    users = User.query.all()
-    for u in users:
-        recipients.add(u.email)
-        
-    # Filter unsubscribed
-    unsub_list = {u.email for u in UnsubscribedEmail.query.all()}
-    final_recipients = recipients - unsub_list
+    if newsletter.delivery_cursor:
+        print(f"Resuming newsletter {newsletter_id} after {newsletter.delivered_count} deliveries.")
+    else:
+        print(f"Broadcasting newsletter {newsletter_id}.")
+    newsletter.status = 'sending'
+    db.session.commit()
     
-    print(f"Broadcasting newsletter {newsletter_id} to {len(final_recipients)} recipients.")
+    # Render everything recipient-independent once
+    subject = newsletter.subject
+    text_body = newsletter.content
+    html_body = newsletter.full_html or newsletter.content
+    unsub_template = url_for('main_routes.unsubscribe', email='__EMAIL__', _external=True)
+    
+    def build_message(email):
+        # Add unsubscribe link to body (simple append)
+        unsub_link = unsub_template.replace('__EMAIL__', quote(email, safe=''))
+        return Message(subject,
+                       recipients=[email],
+                       body=text_body + f"\n\n---\nTo unsubscribe, visit: {unsub_link}",
+                       html=html_body + f"<br><br><small><a href='{unsub_link}'>Unsubscribe</a></small>")
+    
+    limiter = RateLimiter(current_app.config.get('MAIL_SEND_RATE'))
+    failed_count = 0
+    
+    for batch in iter_email_pages(newsletter_recipients_query(), after=newsletter.delivery_cursor, page_size=BATCH_SIZE):
+        limiter.acquire(len(batch))
+        sent, failures = deliver_batch([build_message(email) for email in batch])
+        failed_count += len(failures)
+        
+        # Checkpoint: a retry picks up after this batch
+        newsletter.delivery_cursor = batch[-1]
+        newsletter.delivered_count = (newsletter.delivered_count or 0) + sent
+        db.session.commit()
     
-    # Send loop (batching might be needed for large lists, but simple loop for now)
-    success_count = 0
-    with current_app.app_context(): # Ensure we are in context
-        for email in final_recipients:
-            try:
-                # Add unsubscribe link to body (simple append)
-                unsub_link = url_for('main_routes.unsubscribe', email=email, _external=True)
-                footer = f"\n\n---\nTo unsubscribe, visit: {unsub_link}"
-                
-                msg = Message(newsletter.subject,
-                              recipients=[email],
-                              body=newsletter.content + footer,
-                              html=(newsletter.full_html or newsletter.content) + f"<br><br><small><a href='{unsub_link}'>Unsubscribe</a></small>")
-                mail.send(msg)
-                success_count += 1
-            except Exception as e:
-                print(f"Failed to send to {email}: {e}")
-                
-    print(f"Broadcast complete. Sent {success_count} emails.")
+    print(f"Broadcast complete. Sent {newsletter.delivered_count} emails ({failed_count} failed this run).")
     newsletter.status = 'sent'
     newsletter.sent_at = datetime.utcnow()
     db.session.commit()
@@ -1446,3 +1783,227 @@ def handle_send_webhook(payload):
                     webhook.is_active = False
                 db.session.commit()
         raise Exception(f"Webhook request failed: {e}")
+
+
+# ============================================================================
+# Phase 14: Analytics Tasks
+# ============================================================================
+
+@register_task_handler('refresh_analytics_rollups')
+def handle_refresh_analytics_rollups(payload):
+    """
+    Aggregates closed hours of page views and sessions into TrafficRollup,
+    continuing from the stored high-water mark.
+    Payload: {}
+    """
+    from app.modules.analytics_rollups import refresh_traffic_rollups
+    
+    hours = refresh_traffic_rollups()
+    print(f"Traffic rollups refreshed ({hours} hours aggregated).")
+
+
+# ============================================================================
+# Phase 15: Email Marketing Tasks
+# ============================================================================
+
+def _pending_campaign_recipients(campaign):
+    """Audience recipients of a campaign who have no EmailSend row yet."""
+    from app.models import EmailSend
+    from app.modules.email_marketing import audience_recipients_query
+    
+    query, key = audience_recipients_query(campaign.audience)
+    already_sent = select(EmailSend.id).where(
+        EmailSend.campaign_id == campaign.id,
+        EmailSend.recipient_email == query.selected_columns.email
+    ).exists()
+    return query.where(~already_sent), key
+
+
+@register_task_handler('send_email_campaign')
+def handle_send_email_campaign(payload):
+    """
+    Payload: {'campaign_id': int}
+    
+    Fans a campaign out into shard tasks (recipient key modulo shard count)
+    so delivery spreads across every running worker. Each send or resume
+    starts a new generation; shard tasks from an earlier generation exit
+    without sending.
+    """
+    from app.models import EmailCampaign
+    from sqlalchemy import func
+    
+    campaign_id = payload.get('campaign_id')
+    campaign = EmailCampaign.query.get(campaign_id)
+    if not campaign:
+        print(f"Campaign {campaign_id} not found.")
+        return
+    if campaign.status != 'sending':
+        print(f"Campaign {campaign_id} is {campaign.status}, not sending.")
+        return
+    
+    query, _ = _pending_campaign_recipients(campaign)
+    remaining = db.session.execute(select(func.count()).select_from(query.subquery())).scalar()
+    shards = max(1, min(CAMPAIGN_MAX_SHARDS, -(-remaining // CAMPAIGN_SHARD_SIZE)))
+    
+    campaign.send_generation = (campaign.send_generation or 0) + 1
+    campaign.shard_count = shards
+    campaign.shards_completed = 0
+    db.session.add_all([
+        Task(
+            name='send_email_campaign_shard',
+            payload={
+                'campaign_id': campaign.id,
+                'shard': shard,
+                'shards': shards,
+                'generation': campaign.send_generation,
+            },
+            priority=5
+        )
+        for shard in range(shards)
+    ])
+    db.session.commit()
+    
+    print(f"Campaign {campaign_id}: {remaining} recipients across {shards} shards.")
+
+
+@register_task_handler('send_email_campaign_shard')
+def handle_send_email_campaign_shard(payload):
+    """
+    Payload: {'campaign_id': int, 'shard': int, 'shards': int, 'generation': int}
+    
+    Sends one shard of a campaign in BATCH_SIZE pages over one SMTP
+    connection each, bulk-inserting the EmailSend rows per page. Recipients
+    with an EmailSend row are skipped, so retries and resumes never
+    double-send. The campaign status is re-read before every page: pausing
+    stops the shard after the page in flight.
+    """
+    from app.models import EmailCampaign, EmailSend
+    from app.modules.bulk_mail import RateLimiter, deliver_batch, iter_keyset_pages
+    from app.modules.email_marketing import CampaignRenderer, classify_bounce, generate_tracking_token
+    from flask_mail import Message
+    from sqlalchemy import func, insert, update
+    
+    campaign_id = payload.get('campaign_id')
+    shard = payload.get('shard', 0)
+    shards = payload.get('shards', 1)
+    generation = payload.get('generation')
+    
+    campaign = EmailCampaign.query.get(campaign_id)
+    if not campaign:
+        print(f"Campaign {campaign_id} not found.")
+        return
+    
+    def superseded():
+        # Attributes expire on commit, so this reads the current row
+        return campaign.status != 'sending' or campaign.send_generation != generation
+    
+    if superseded():
+        print(f"Campaign {campaign_id} shard {shard} skipped ({campaign.status}, generation {campaign.send_generation}).")
+        return
+    
+    renderer = CampaignRenderer(campaign)
+    query, key = _pending_campaign_recipients(campaign)
+    query = query.where(key % shards == shard)
+    limiter = RateLimiter(current_app.config.get('MAIL_SEND_RATE'))
+    
+    for batch in iter_keyset_pages(query, key, page_size=BATCH_SIZE):
+        if superseded():
+            print(f"Campaign {campaign_id} shard {shard} stopped: campaign is {campaign.status}.")
+            return
+        
+        rows = []
+        messages = []
+        for recipient in batch:
+            token = generate_tracking_token()
+            context = {
+                'first_name': recipient.first_name,
+                'last_name': recipient.last_name,
+                'email': recipient.email,
+            }
+            variant, subject, html, text = renderer.render(recipient.email, context, token)
+            messages.append(Message(subject, recipients=[recipient.email], body=text, html=html))
+            rows.append({
+                'campaign_id': campaign_id,
+                'template_id': campaign.template_id,
+                'recipient_email': recipient.email,
+                'recipient_id': recipient.user_id,
+                'tracking_token': token,
+                'variant': variant,
+                'sent_at': datetime.utcnow(),
+                'bounced': False,
+            })
+        
+        limiter.acquire(len(messages))
+        sent, failures = deliver_batch(messages)
+        
+        failed = {msg.recipients[0]: str(error) for msg, error in failures}
+        for row in rows:
+            error = failed.get(row['recipient_email'])
+            if error:
+                row.update(bounced=True, bounce_type=classify_bounce(error), bounce_reason=error)
+        
+        db.session.execute(insert(EmailSend), rows)
+        db.session.execute(
+            update(EmailCampaign)
+            .where(EmailCampaign.id == campaign_id)
+            .values(
+                sent_count=func.coalesce(EmailCampaign.sent_count, 0) + sent,
+                bounce_count=func.coalesce(EmailCampaign.bounce_count, 0) + len(failed)
+            )
+        )
+        db.session.commit()
+    
+    # Record this shard's bit; a re-run shard (reclaimed lease, retry) sets
+    # the same bit again. Once every bit is set the campaign is sent.
+    db.session.execute(
+        update(EmailCampaign)
+        .where(EmailCampaign.id == campaign_id, EmailCampaign.send_generation == generation)
+        .values(shards_completed=func.coalesce(EmailCampaign.shards_completed, 0).op('|')(1 << shard))
+    )
+    db.session.execute(
+        update(EmailCampaign)
+        .where(
+            EmailCampaign.id == campaign_id,
+            EmailCampaign.send_generation == generation,
+            EmailCampaign.status == 'sending',
+            EmailCampaign.shards_completed == (1 << shards) - 1
+        )
+        .values(status='sent', completed_at=datetime.utcnow())
+    )
+    db.session.commit()
+    
+    print(f"Campaign {campaign_id} shard {shard + 1}/{shards} complete.")
+
+
+# ============================================================================
+# Media Tasks
+# ============================================================================
+
+@register_task_handler('generate_image_variants')
+def handle_generate_image_variants(payload):
+    """
+    Payload: {'checksum': str}
+    
+    Creates the missing responsive variants (width buckets x formats) of
+    an uploaded image. Variants that already exist are skipped, so
+    duplicate tasks for the same content are cheap.
+    """
+    from app.modules.image_variants import generate_variants
+    
+    checksum = payload.get('checksum')
+    created = generate_variants(checksum)
+    print(f"Image {checksum}: {created} variant(s) created.")
+
+
+@register_task_handler('purge_stale_uploads')
+def handle_purge_stale_uploads(payload):
+    """
+    Payload: {'max_age_hours': int} (optional, defaults to UPLOAD_EXPIRY_HOURS)
+    
+    Discards resumable uploads that have not received a chunk within the
+    expiry window, with their part files.
+    """
+    from app.modules.uploads import purge_stale_uploads
+    
+    removed = purge_stale_uploads(payload.get('max_age_hours'))
+    print(f"Purged {removed} stale upload(s).")